@@ -7,13 +7,18 @@
  */
 
 const DEFAULT_AGENT_BASE_URL = "http://127.0.0.1:8080";
+const NATIVE_HOST_NAME = "com.ai_cost_observer.agent";
+const NATIVE_REQUEST_TIMEOUT_MS = 10000;
+const MAX_EVENTS_PER_MESSAGE = 100; // the agent's limit per JSON document
 const EXPORT_INTERVAL_SECONDS = 60;
 const CONFIG_REFRESH_MINUTES = 5;
 const ALARM_NAME = "export-metrics";
 const CONFIG_ALARM_NAME = "refresh-config";
 const STORAGE_PENDING_DELTAS_KEY = "pendingDeltas";
 const STORAGE_PENDING_TOKEN_EVENTS_KEY = "pendingTokenEvents";
+const STORAGE_INFLIGHT_METRICS_KEY = "inflightMetrics";
 const STORAGE_EXTENSION_CONFIG_KEY = "extensionConfig";
+const STORAGE_EXTENSION_CONFIG_ETAG_KEY = "extensionConfigEtag";
 
 // --- Hardcoded fallback defaults (used when agent is offline and no cache) ---
 
@@ -79,17 +84,117 @@ async function getAgentBaseUrl() {
   return agentBaseUrl;
 }
 
+/**
+ * Read how to reach the agent from chrome.storage.sync: "http" (default) or "native".
+ */
+async function getAgentTransport() {
+  const { agentTransport } = await chrome.storage.sync.get({ agentTransport: "http" });
+  return agentTransport;
+}
+
+// --- Native messaging transport (no TCP port: Chrome talks to the host over stdio) ---
+
+// One persistent port to the host; requests awaiting a reply, by id
+let nativePort = null;
+let nextNativeRequestId = 1;
+const nativeRequests = new Map();
+
+function getNativePort() {
+  if (nativePort) return nativePort;
+  const port = chrome.runtime.connectNative(NATIVE_HOST_NAME);
+  port.onMessage.addListener((reply) => {
+    const pending = nativeRequests.get(reply.id);
+    if (pending) {
+      nativeRequests.delete(reply.id);
+      clearTimeout(pending.timer);
+      pending.resolve(reply);
+    }
+  });
+  port.onDisconnect.addListener(() => {
+    const reason = chrome.runtime.lastError ? chrome.runtime.lastError.message : "disconnected";
+    if (nativePort === port) nativePort = null;
+    for (const pending of nativeRequests.values()) {
+      clearTimeout(pending.timer);
+      pending.reject(new Error("Native host " + reason));
+    }
+    nativeRequests.clear();
+  });
+  nativePort = port;
+  return port;
+}
+
+/**
+ * Send a request to the agent through the native messaging host. Resolves
+ * to a Response (status, JSON body, ETag / Retry-After headers), so callers
+ * handle both transports alike.
+ */
+async function nativeFetch(path, { body, ifNoneMatch } = {}) {
+  const reply = await new Promise((resolve, reject) => {
+    const id = nextNativeRequestId++;
+    const timer = setTimeout(() => {
+      nativeRequests.delete(id);
+      reject(new Error("Native host did not reply"));
+    }, NATIVE_REQUEST_TIMEOUT_MS);
+    nativeRequests.set(id, { resolve, reject, timer });
+    const message = { id, path };
+    if (body !== undefined) message.body = body;
+    if (ifNoneMatch) message.if_none_match = ifNoneMatch;
+    try {
+      getNativePort().postMessage(message);
+    } catch (error) {
+      nativeRequests.delete(id);
+      clearTimeout(timer);
+      reject(error);
+    }
+  });
+  const responseBody = reply.body == null ? null : JSON.stringify(reply.body);
+  return new Response(responseBody, { status: reply.status, headers: reply.headers || {} });
+}
+
+// --- Backoff (agent asks to slow down with 429 + Retry-After) ---
+
+// Earliest time (ms since epoch) each agent endpoint may be called again
+const retryNotBefore = {};
+
+function isBackingOff(path) {
+  return Date.now() < (retryNotBefore[path] || 0);
+}
+
+/**
+ * Remember the Retry-After of a rejected response so the next export waits for it.
+ */
+function noteRetryAfter(path, response) {
+  const seconds = Number(response.headers.get("Retry-After"));
+  if (seconds > 0) {
+    retryNotBefore[path] = Date.now() + seconds * 1000;
+  }
+}
+
 /**
  * Fetch extension config from the agent, cache it, and update active lists.
- * Falls back to cached config if agent is unreachable, then to hardcoded defaults.
+ * The request carries the cached config's ETag; 304 Not Modified means the
+ * cached copy is current. Falls back to cached config if agent is
+ * unreachable, then to hardcoded defaults.
  */
 async function loadExtensionConfig() {
   try {
     const baseUrl = await getAgentBaseUrl();
-    const response = await fetch(baseUrl + "/api/extension-config", {
-      signal: AbortSignal.timeout(5000),
-    });
-    if (response.ok) {
+    const stored = await chrome.storage.local.get([
+      STORAGE_EXTENSION_CONFIG_KEY,
+      STORAGE_EXTENSION_CONFIG_ETAG_KEY,
+    ]);
+    const etag = stored[STORAGE_EXTENSION_CONFIG_KEY] ? stored[STORAGE_EXTENSION_CONFIG_ETAG_KEY] : null;
+    const response =
+      (await getAgentTransport()) === "native"
+        ? await nativeFetch("/api/extension-config", { ifNoneMatch: etag })
+        : await fetch(baseUrl + "/api/extension-config", {
+            headers: etag ? { "If-None-Match": etag } : {},
+            cache: "no-store",
+            signal: AbortSignal.timeout(5000),
+          });
+    if (response.status === 304) {
+      // Unchanged — the cached copy below is current
+    } else if (response.ok) {
       const config = await response.json();
       // Validate the response has expected shape
       if (Array.isArray(config.domains) && config.domains.length > 0) {
@@ -98,8 +203,11 @@ async function loadExtensionConfig() {
       if (Array.isArray(config.api_patterns) && config.api_patterns.length > 0) {
         activeApiPatterns = config.api_patterns;
       }
-      // Cache the config for offline use
-      await chrome.storage.local.set({ [STORAGE_EXTENSION_CONFIG_KEY]: config });
+      // Cache the config (and its version) for offline use and revalidation
+      await chrome.storage.local.set({
+        [STORAGE_EXTENSION_CONFIG_KEY]: config,
+        [STORAGE_EXTENSION_CONFIG_ETAG_KEY]: response.headers.get("ETag") || "",
+      });
       console.log("Extension config loaded from agent:", activeDomains.length, "domains,", activeApiPatterns.length, "API patterns");
       return;
     }
@@ -141,7 +249,8 @@ async function ensurePendingTokenEventsLoaded() {
     const stored = await chrome.storage.local.get([STORAGE_PENDING_TOKEN_EVENTS_KEY]);
     const raw = stored[STORAGE_PENDING_TOKEN_EVENTS_KEY];
     if (Array.isArray(raw)) {
-      pendingTokenEvents = raw;
+      // Events stored before ids were introduced get one now, before their first send
+      pendingTokenEvents = raw.map((event) => (event.id ? event : { ...event, id: crypto.randomUUID() }));
     }
   } catch {
     // Storage read failed — start with empty array
@@ -373,6 +482,7 @@ chrome.webRequest.onCompleted.addListener(
       const prefix = api.url_prefix;
       if (details.url.startsWith(prefix)) {
         pendingTokenEvents.push({
+          id: crypto.randomUUID(),
           type: "api_intercept",
           tool: api.tool,
           url: details.url,
@@ -388,26 +498,72 @@ chrome.webRequest.onCompleted.addListener(
   { urls: DEFAULT_AI_API_PATTERNS.map((p) => p.url_prefix + (p.url_prefix.endsWith("/") ? "*" : "/*")) }
 );
 
+/**
+ * Encode events as NDJSON (one event per line), gzip-compressed when supported.
+ */
+async function encodeEventStream(events) {
+  const ndjson = events.map((event) => JSON.stringify(event)).join("\n") + "\n";
+  if (typeof CompressionStream === "undefined") {
+    return { body: ndjson, headers: { "Content-Type": "application/x-ndjson" } };
+  }
+  const compressed = new Blob([ndjson]).stream().pipeThrough(new CompressionStream("gzip"));
+  return {
+    body: await new Response(compressed).arrayBuffer(),
+    headers: { "Content-Type": "application/x-ndjson", "Content-Encoding": "gzip" },
+  };
+}
+
+/**
+ * Send token events through the native host, one JSON document per
+ * MAX_EVENTS_PER_MESSAGE events. A failure carries `consumed`: the events
+ * in the documents the agent already took.
+ */
+async function sendTokenEventsNative(events) {
+  let sent = 0;
+  try {
+    for (; sent < events.length; sent += MAX_EVENTS_PER_MESSAGE) {
+      const chunk = events.slice(sent, sent + MAX_EVENTS_PER_MESSAGE);
+      const response = await nativeFetch("/api/tokens", { body: { events: chunk } });
+      if (!response.ok) {
+        noteRetryAfter("/api/tokens", response);
+        throw new Error(`Agent rejected token events: HTTP ${response.status}`);
+      }
+    }
+  } catch (error) {
+    error.consumed = sent;
+    throw error;
+  }
+}
+
 /**
  * Export intercepted token events to the local agent.
+ *
+ * Over HTTP, the whole backlog goes in one NDJSON request. If the agent
+ * stops part-way (queue full, 503), its `consumed` count says how many
+ * leading events it kept; only the rest is re-queued.
  */
 async function exportTokenEvents() {
   await ensurePendingTokenEventsLoaded();
 
-  if (pendingTokenEvents.length === 0) return;
+  if (pendingTokenEvents.length === 0 || isBackingOff("/api/tokens")) return;
 
   const events = pendingTokenEvents;
   pendingTokenEvents = [];
 
   try {
-    const baseUrl = await getAgentBaseUrl();
-    const response = await fetch(baseUrl + "/api/tokens", {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ events }),
-    });
-    if (!response.ok) {
-      throw new Error(`Agent rejected token events: HTTP ${response.status}`);
+    if ((await getAgentTransport()) === "native") {
+      await sendTokenEventsNative(events);
+    } else {
+      const baseUrl = await getAgentBaseUrl();
+      const { body, headers } = await encodeEventStream(events);
+      const response = await fetch(baseUrl + "/api/tokens", { method: "POST", headers, body });
+      if (!response.ok) {
+        noteRetryAfter("/api/tokens", response);
+        const result = await response.json().catch(() => ({}));
+        const error = new Error(`Agent rejected token events: HTTP ${response.status}`);
+        error.consumed = Number.isInteger(result.consumed) ? result.consumed : 0;
+        throw error;
+      }
     }
     // Successfully sent — clear from storage
     await persistPendingTokenEvents();
@@ -416,13 +572,49 @@ async function exportTokenEvents() {
     if (error.message && error.message.includes("Failed to fetch")) {
       console.warn("Agent not reachable for token export. Will retry next cycle.");
     }
-    pendingTokenEvents = events.concat(pendingTokenEvents);
+    pendingTokenEvents = events.slice(error.consumed || 0).concat(pendingTokenEvents);
     await persistPendingTokenEvents();
   }
 }
 
+/**
+ * Send one browser metrics batch. Returns true once the agent has acknowledged it.
+ */
+async function sendMetricsBatch(batch) {
+  try {
+    let response;
+    if ((await getAgentTransport()) === "native") {
+      response = await nativeFetch("/metrics/browser", { body: batch });
+    } else {
+      const baseUrl = await getAgentBaseUrl();
+      response = await fetch(baseUrl + "/metrics/browser", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify(batch),
+      });
+    }
+    if (!response.ok) {
+      noteRetryAfter("/metrics/browser", response);
+      throw new Error(`Agent rejected metrics: HTTP ${response.status}`);
+    }
+    return true;
+  } catch (error) {
+    if (error.message && error.message.includes("Failed to fetch")) {
+      console.warn("Agent not reachable (connection refused). Is it running? Will retry next cycle.");
+    } else {
+      console.warn("Failed to export metrics, will retry on next cycle:", error.message);
+    }
+    return false;
+  }
+}
+
 /**
  * Export accumulated deltas to the local agent.
+ *
+ * Deltas are moved into an in-flight batch with a batch_id before sending.
+ * Until the agent acknowledges it, the same batch is resent unchanged, so a
+ * batch whose response was lost is recognised as a duplicate rather than
+ * counted twice. Deltas accumulated meanwhile go into the next batch.
  */
 async function exportMetrics() {
   await withStateLock(async () => {
@@ -438,36 +630,29 @@ async function exportMetrics() {
       sessionStart = Date.now();
     }
 
-    const events = buildEventsFromPendingDeltas();
-    if (events.length === 0) {
-      await persistPendingDeltas();
-      return;
-    }
-
-    try {
-      const baseUrl = await getAgentBaseUrl();
-      const response = await fetch(baseUrl + "/metrics/browser", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ events }),
-      });
-      if (!response.ok) {
-        throw new Error(`Agent rejected metrics: HTTP ${response.status}`);
-      }
-    } catch (error) {
-      if (error.message && error.message.includes("Failed to fetch")) {
-        console.warn("Agent not reachable (connection refused). Is it running? Will retry next cycle.");
-      } else {
-        console.warn("Failed to export metrics, will retry on next cycle:", error.message);
+    const stored = await chrome.storage.local.get([STORAGE_INFLIGHT_METRICS_KEY]);
+    let batch = stored[STORAGE_INFLIGHT_METRICS_KEY] || null;
+    while (!isBackingOff("/metrics/browser")) {
+      const resending = batch !== null;
+      if (!resending) {
+        const events = buildEventsFromPendingDeltas();
+        if (events.length === 0) break;
+        batch = { batch_id: crypto.randomUUID(), events };
+        pendingDeltas = {};
+        await chrome.storage.local.set({
+          [STORAGE_INFLIGHT_METRICS_KEY]: batch,
+          [STORAGE_PENDING_DELTAS_KEY]: pendingDeltas,
+        });
       }
-      await persistPendingDeltas();
-      return;
-    }
+      if (!(await sendMetricsBatch(batch))) break;
 
-    // Only mark as exported after successful agent ack.
-    pendingDeltas = {};
+      // Only mark as exported after successful agent ack.
+      await chrome.storage.local.remove(STORAGE_INFLIGHT_METRICS_KEY);
+      await updateDailyTotals(batch.events);
+      batch = null;
+      if (!resending) break;
+    }
     await persistPendingDeltas();
-    await updateDailyTotals(events);
   });
 }
 
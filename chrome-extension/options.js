@@ -1,11 +1,13 @@
 /**
  * AI Cost Observer — Options Page
- * Manages the agent base URL configuration.
+ * Manages the agent base URL and transport configuration.
  */
 
 const DEFAULT_AGENT_BASE_URL = "http://127.0.0.1:8080";
+const NATIVE_HOST_NAME = "com.ai_cost_observer.agent";
 
 const agentUrlInput = document.getElementById("agentUrl");
+const agentTransportSelect = document.getElementById("agentTransport");
 const saveBtn = document.getElementById("saveBtn");
 const statusEl = document.getElementById("status");
 const statusText = document.getElementById("statusText");
@@ -14,10 +16,12 @@ const statusText = document.getElementById("statusText");
  * Load saved settings from chrome.storage.sync.
  */
 async function loadSettings() {
-  const { agentBaseUrl } = await chrome.storage.sync.get({
+  const { agentBaseUrl, agentTransport } = await chrome.storage.sync.get({
     agentBaseUrl: DEFAULT_AGENT_BASE_URL,
+    agentTransport: "http",
   });
   agentUrlInput.value = agentBaseUrl;
+  agentTransportSelect.value = agentTransport;
 }
 
 /**
@@ -61,11 +65,26 @@ async function saveSettings() {
   }
 
   agentUrlInput.value = url;
+  const transport = agentTransportSelect.value;
 
-  await chrome.storage.sync.set({ agentBaseUrl: url });
+  await chrome.storage.sync.set({ agentBaseUrl: url, agentTransport: transport });
 
   showStatus("Saved. Testing connection...", "success");
 
+  if (transport === "native") {
+    try {
+      const reply = await chrome.runtime.sendNativeMessage(NATIVE_HOST_NAME, { id: 0, path: "/health" });
+      if (reply && reply.status === 200) {
+        showStatus("Saved. Agent connected (native messaging).", "success");
+      } else {
+        showStatus("Saved. Native host could not reach the agent.", "error");
+      }
+    } catch {
+      showStatus("Saved. Native host not installed (run ai-cost-observer-native-host --install).", "error");
+    }
+    return;
+  }
+
   try {
     const healthUrl = url + "/health";
     const response = await fetch(healthUrl, {
@@ -84,6 +103,7 @@ async function saveSettings() {
 saveBtn.addEventListener("click", saveSettings);
 
 agentUrlInput.addEventListener("input", hideStatus);
+agentTransportSelect.addEventListener("change", hideStatus);
 
 agentUrlInput.addEventListener("keydown", (e) => {
   if (e.key === "Enter") {
@@ -6,6 +6,7 @@
  */
 
 const DEFAULT_AGENT_BASE_URL = "http://127.0.0.1:8080";
+const NATIVE_HOST_NAME = "com.ai_cost_observer.agent";
 
 /**
  * Read the agent base URL from chrome.storage.sync (falls back to default).
@@ -139,6 +140,19 @@ async function render() {
 async function checkAgentStatus() {
   const dot = document.getElementById("statusDot");
   const text = document.getElementById("statusText");
+  const { agentTransport } = await chrome.storage.sync.get({ agentTransport: "http" });
+  if (agentTransport === "native") {
+    try {
+      const reply = await chrome.runtime.sendNativeMessage(NATIVE_HOST_NAME, { id: 0, path: "/health" });
+      const ok = reply && reply.status === 200;
+      dot.className = "status-dot " + (ok ? "connected" : "disconnected");
+      text.textContent = ok ? "Agent connected (native)" : "Agent not running";
+    } catch {
+      dot.className = "status-dot disconnected";
+      text.textContent = "Native host not installed";
+    }
+    return;
+  }
   try {
     const baseUrl = await getAgentBaseUrl();
     const res = await fetch(baseUrl + "/health", { signal: AbortSignal.timeout(3000) });
@@ -161,6 +175,55 @@ async function checkAgentStatus() {
   }
 }
 
+/**
+ * Apply a delta from the agent's usage stream: numbers are increments,
+ * nested objects are merged, anything else (running tool lists) is replaced.
+ */
+function applyUsageDelta(usage, delta) {
+  for (const [key, value] of Object.entries(delta)) {
+    if (value && typeof value === "object" && !Array.isArray(value)) {
+      usage[key] = usage[key] || {};
+      applyUsageDelta(usage[key], value);
+    } else if (typeof value === "number") {
+      usage[key] = (usage[key] || 0) + value;
+    } else {
+      usage[key] = value;
+    }
+  }
+}
+
+function renderAgentUsage(usage) {
+  const el = document.getElementById("agentUsage");
+  const tokens = usage.totals.input_tokens + usage.totals.output_tokens;
+  const running = [...usage.running.apps, ...usage.running.cli];
+  let text = `Agent: $${usage.totals.cost_usd.toFixed(2)} · ${tokens.toLocaleString()} tokens today`;
+  if (running.length > 0) {
+    text += ` · Running: ${running.join(", ")}`;
+  }
+  el.textContent = text;
+  el.hidden = false;
+}
+
+/**
+ * Follow the agent's live usage stream while the popup is open (HTTP transport only).
+ */
+async function followAgentUsage() {
+  const { agentTransport } = await chrome.storage.sync.get({ agentTransport: "http" });
+  if (agentTransport !== "http") return;
+  const baseUrl = await getAgentBaseUrl();
+  const source = new EventSource(baseUrl + "/api/usage/stream");
+  let usage = null;
+  source.addEventListener("snapshot", (event) => {
+    usage = JSON.parse(event.data);
+    renderAgentUsage(usage);
+  });
+  source.addEventListener("usage", (event) => {
+    if (!usage) return;
+    applyUsageDelta(usage, JSON.parse(event.data));
+    renderAgentUsage(usage);
+  });
+}
+
 // Open settings page
 document.getElementById("openSettings").addEventListener("click", (e) => {
   e.preventDefault();
@@ -170,3 +233,4 @@ document.getElementById("openSettings").addEventListener("click", (e) => {
 // Initialize
 render();
 checkAgentStatus();
+followAgentUsage();
@@ -35,6 +35,23 @@ class AppConfig:
     browser_history_interval_seconds: int = 60
     shell_history_interval_seconds: int = 3600
     http_receiver_port: int = 8080
+    # "asyncio" (keep-alive server, worker pool for blocking sinks) or "flask"
+    http_receiver_mode: str = "asyncio"
+    http_receiver_workers: int = 4
+    # Events buffered between the HTTP handlers and telemetry/storage; 0 records inline
+    ingest_queue_size: int = 10000
+    # How long event ids are remembered to drop retried duplicates; 0 disables
+    ingest_dedup_window_seconds: int = 7 * 24 * 3600
+    # Unix socket for local reporters (NDJSON events): "auto" = state_dir/ingest.sock, "" = off
+    ingest_socket_path: str = "auto"
+    # Shells whose preexec hook reports commands live; their history is no longer counted
+    shell_hooks: list[str] = field(default_factory=list)
+    # Days of hourly usage kept in memory for the /api/usage endpoints
+    usage_cache_days: int = 7
+    # Token-bucket limits for POST endpoints, per client: "default" or a path
+    http_rate_limits: dict = field(
+        default_factory=lambda: {"default": {"requests": 60, "window_seconds": 60}}
+    )
     host_name: str = field(default_factory=socket.gethostname)
     config_dir: Path = field(default_factory=_default_config_dir)
     state_dir: Path = field(default_factory=_default_state_dir)
@@ -42,15 +59,24 @@ class AppConfig:
     ai_domains: list[dict] = field(default_factory=list)
     ai_cli_tools: list[dict] = field(default_factory=list)
     api_intercept_patterns: list[dict] = field(default_factory=list)
+    model_pricing: list[dict] = field(default_factory=list)
     token_tracking: dict = field(
         default_factory=lambda: {
             "enabled": True,
             "storage_path": "auto",
             "api_polling_interval_seconds": 300,
             "retention_days": 90,
+            "retention_interval_seconds": 3600,
+            "vacuum_on_start": False,
             "encrypt_prompts": True,
             "capture_prompt_text": True,
             "capture_response_text": True,
+            "write_behind": True,
+            "write_queue_size": 10000,
+            "write_batch_size": 500,
+            "write_flush_interval_seconds": 1.0,
+            "compression": "auto",
+            "compression_dictionary": False,
             "sources": {
                 "claude_code": True,
                 "codex": True,
@@ -109,6 +135,22 @@ def load_config() -> AppConfig:
         config.host_name = user["host_name"]
     if "scan_interval_seconds" in user:
         config.scan_interval_seconds = user["scan_interval_seconds"]
+    if "http_receiver_mode" in user:
+        config.http_receiver_mode = user["http_receiver_mode"]
+    if "http_receiver_workers" in user:
+        config.http_receiver_workers = user["http_receiver_workers"]
+    if "ingest_queue_size" in user:
+        config.ingest_queue_size = user["ingest_queue_size"]
+    if "ingest_dedup_window_seconds" in user:
+        config.ingest_dedup_window_seconds = user["ingest_dedup_window_seconds"]
+    if "ingest_socket_path" in user:
+        config.ingest_socket_path = user["ingest_socket_path"] or ""
+    if isinstance(user.get("shell_hooks"), list):
+        config.shell_hooks = user["shell_hooks"]
+    if "usage_cache_days" in user:
+        config.usage_cache_days = user["usage_cache_days"]
+    if isinstance(user.get("http_rate_limits"), dict):
+        _deep_merge(config.http_rate_limits, user["http_rate_limits"])
 
     # Environment variable overrides (highest priority)
     if env_endpoint := os.environ.get("OTEL_ENDPOINT"):
@@ -123,6 +165,7 @@ def load_config() -> AppConfig:
     config.ai_domains = builtin.get("ai_domains", [])
     config.ai_cli_tools = builtin.get("ai_cli_tools", [])
     config.api_intercept_patterns = builtin.get("api_intercept_patterns", [])
+    config.model_pricing = builtin.get("model_pricing", []) or []
 
     # Load token tracking config from built-in, deep-merge user overrides
     builtin_tt = builtin.get("token_tracking", {})
@@ -140,6 +183,8 @@ def load_config() -> AppConfig:
         config.ai_cli_tools.extend(user["extra_ai_cli_tools"])
     if "extra_api_intercept_patterns" in user:
         config.api_intercept_patterns.extend(user["extra_api_intercept_patterns"])
+    if "extra_model_pricing" in user:
+        config.model_pricing.extend(user["extra_model_pricing"])
 
     # Ensure state directory exists
     config.state_dir.mkdir(parents=True, exist_ok=True)
@@ -15,6 +15,7 @@ from urllib.parse import urlparse
 from loguru import logger
 
 from ai_cost_observer.config import AppConfig
+from ai_cost_observer.storage.checkpoints import CheckpointStore
 from ai_cost_observer.telemetry import TelemetryManager
 
 # Chrome uses a custom epoch: microseconds since 1601-01-01
@@ -56,7 +57,13 @@ class BrowserHistoryParser:
         self.config = config
         self.telemetry = telemetry
         self._default_since: float = time.time()
-        self._last_scan_time: dict[str, float] = {}
+        # Per-browser scan checkpoints survive restarts
+        self._checkpoints = CheckpointStore(config.state_dir, "browser_history")
+        self._last_scan_time: dict[str, float] = {
+            browser: float(ts)
+            for browser, ts in self._checkpoints.values().items()
+            if isinstance(ts, (int, float))
+        }
         self._domain_lookup = {d["domain"]: d for d in config.ai_domains}
 
     def scan(self) -> None:
@@ -71,8 +78,10 @@ class BrowserHistoryParser:
                 if visits:
                     self._process_visits(visits, browser_name)
                 self._last_scan_time[browser_name] = scan_started_at
+                self._checkpoints.set(browser_name, scan_started_at)
             except Exception:
                 logger.opt(exception=True).warning("Error parsing {} history", browser_name)
+        self._checkpoints.commit()
 
     def _get_browsers(self) -> list[tuple[str, Path, Callable[[Path, float], list[dict] | None]]]:
         """Return available browsers with their history paths and parsers."""
@@ -249,6 +258,7 @@ class BrowserHistoryParser:
                     }
                     cost = cost_per_hour * (total_duration / 3600)
                     self.telemetry.browser_domain_estimated_cost.add(cost, cost_labels)
+                    self.telemetry.usage.add_cost("browser", domain, cost)
 
             logger.debug(
                 "Browser history: {} — {} visits, {:.0f}s estimated duration ({})",
@@ -192,6 +192,7 @@ class CLIDetector:
                 if cost_per_hour > 0:
                     cost = cost_per_hour * (elapsed / 3600)
                     self.telemetry.cli_estimated_cost.add(cost, labels)
+                    self.telemetry.usage.add_cost("cli", tool_name, cost)
 
             state.pids = found.get(tool_name, set())
             state.was_running = is_running
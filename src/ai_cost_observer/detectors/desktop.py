@@ -194,6 +194,7 @@ class DesktopDetector:
                 if cost_per_hour > 0:
                     cost = cost_per_hour * (elapsed / 3600)
                     self.telemetry.app_estimated_cost.add(cost, labels)
+                    self.telemetry.usage.add_cost("apps", app_name, cost)
 
             # Resource usage gauges
             if app_name in cpu_by_app:
@@ -5,32 +5,67 @@ from __future__ import annotations
 import os
 import platform
 import re
+from collections.abc import Iterable
 from pathlib import Path
 
 from loguru import logger
 
 from ai_cost_observer.config import AppConfig
+from ai_cost_observer.storage.checkpoints import CheckpointStore
 from ai_cost_observer.telemetry import TelemetryManager
 
 
+def compile_command_patterns(ai_cli_tools: list[dict]) -> list[tuple[re.Pattern, dict]]:
+    """Build (regex, tool config) pairs from the tools' `command_patterns`."""
+    patterns = []
+    for tool in ai_cli_tools:
+        for pattern_str in tool.get("command_patterns", []):
+            pattern = re.compile(r"(?:^|;|\||\s)" + re.escape(pattern_str) + r"(?:\s|$)")
+            patterns.append((pattern, tool))
+    return patterns
+
+
+def match_command(command: str, patterns: list[tuple[re.Pattern, dict]]) -> dict | None:
+    """Return the config of the first AI CLI tool whose pattern matches `command`."""
+    for pattern, tool_cfg in patterns:
+        if pattern.search(command):
+            return tool_cfg
+    return None
+
+
+def count_commands(commands: Iterable[str], patterns: list[tuple[re.Pattern, dict]]) -> dict:
+    """Count AI-related commands per tool: {tool name: (count, tool config)}."""
+    counts: dict[str, tuple[int, dict]] = {}
+    for cmd in commands:
+        tool_cfg = match_command(cmd, patterns)
+        if tool_cfg is None:
+            continue
+        tool_name = tool_cfg["name"]
+        count = counts[tool_name][0] if tool_name in counts else 0
+        counts[tool_name] = (count + 1, tool_cfg)  # one match per command
+    return counts
+
+
 class ShellHistoryParser:
-    """Parses shell history files incrementally, counting AI tool commands."""
+    """Parses shell history files incrementally, counting AI tool commands.
+
+    Shells listed in `config.shell_hooks` report each command live over the
+    ingest socket; their history is still read, so offsets stay current,
+    but not counted again.
+    """
 
     def __init__(self, config: AppConfig, telemetry: TelemetryManager) -> None:
         self.config = config
         self.telemetry = telemetry
-        self._offsets: dict[str, int] = {}
 
         # Build command pattern → tool name lookup
-        self._patterns: list[tuple[re.Pattern, dict]] = []
-        for tool in config.ai_cli_tools:
-            for pattern_str in tool.get("command_patterns", []):
-                pattern = re.compile(r"(?:^|;|\||\s)" + re.escape(pattern_str) + r"(?:\s|$)")
-                self._patterns.append((pattern, tool))
+        self._patterns = compile_command_patterns(config.ai_cli_tools)
+        self._live_shells = set(config.shell_hooks)
 
-        # Load persisted offsets
-        self._offset_file = config.state_dir / "shell_history_offsets.txt"
-        self._load_offsets()
+        # Persisted byte offsets per history file
+        self._checkpoints = CheckpointStore(config.state_dir, "shell_history")
+        self._legacy_offset_file = config.state_dir / "shell_history_offsets.txt"
+        self._import_legacy_offsets()
 
     def scan(self) -> None:
         """Parse new history entries and update command count metrics."""
@@ -43,14 +78,14 @@ class ShellHistoryParser:
 
             try:
                 new_commands = self._read_new_lines(path, shell_name)
-                if new_commands:
+                if new_commands and shell_name not in self._live_shells:
                     self._count_and_report(new_commands)
             except PermissionError:
                 logger.warning("Permission denied reading {}", path)
             except Exception:
                 logger.opt(exception=True).warning("Error parsing {}", path)
 
-        self._save_offsets()
+        self._checkpoints.commit()
 
     def _get_history_files(self) -> list[tuple[str, str]]:
         """Return list of (path, shell_name) for history files on this OS."""
@@ -72,26 +107,21 @@ class ShellHistoryParser:
 
     def _read_new_lines(self, path: Path, shell_name: str) -> list[str]:
         """Read only new lines since last offset."""
-        key = str(path)
-        offset = self._offsets.get(key, 0)
-
         try:
-            file_size = path.stat().st_size
+            st = path.stat()
         except OSError:
             return []
 
-        if file_size < offset:
-            # File was truncated or rotated — reset
-            offset = 0
-
-        if file_size == offset:
+        # Truncated, rotated or rewritten files resume from 0
+        offset = self._checkpoints.file_offset(path, st)
+        if st.st_size == offset:
             return []
 
         lines = []
         with open(path, "rb") as f:
             f.seek(offset)
             raw = f.read()
-            self._offsets[key] = f.tell()
+            self._checkpoints.set_file_offset(path, f.tell(), st)
 
         text = raw.decode("utf-8", errors="replace")
 
@@ -114,17 +144,7 @@ class ShellHistoryParser:
 
     def _count_and_report(self, commands: list[str]) -> None:
         """Count AI-related commands and report to telemetry."""
-        counts: dict[str, tuple[int, dict]] = {}  # tool_name -> (count, tool_cfg)
-
-        for cmd in commands:
-            for pattern, tool_cfg in self._patterns:
-                if pattern.search(cmd):
-                    tool_name = tool_cfg["name"]
-                    if tool_name in counts:
-                        counts[tool_name] = (counts[tool_name][0] + 1, tool_cfg)
-                    else:
-                        counts[tool_name] = (1, tool_cfg)
-                    break  # one match per command
+        counts = count_commands(commands, self._patterns)  # tool_name -> (count, tool_cfg)
 
         for tool_name, (count, tool_cfg) in counts.items():
             labels = {
@@ -134,22 +154,18 @@ class ShellHistoryParser:
             self.telemetry.cli_command_count.add(count, labels)
             logger.debug("Shell history: {} new commands for {}", count, tool_name)
 
-    def _load_offsets(self) -> None:
-        """Load byte offsets from state file."""
-        if self._offset_file.exists():
-            try:
-                for line in self._offset_file.read_text(encoding="utf-8").splitlines():
-                    if "=" in line:
-                        path_part, offset_str = line.rsplit("=", 1)
-                        self._offsets[path_part] = int(offset_str)
-            except Exception:
-                logger.opt(exception=True).debug("Failed to load shell history offsets")
-
-    def _save_offsets(self) -> None:
-        """Persist byte offsets to state file."""
+    def _import_legacy_offsets(self) -> None:
+        """Import byte offsets from the old shell_history_offsets.txt once, then remove it."""
+        if not self._checkpoints.is_empty() or not self._legacy_offset_file.exists():
+            return
         try:
-            self._offset_file.parent.mkdir(parents=True, exist_ok=True)
-            lines = [f"{path}={offset}" for path, offset in self._offsets.items()]
-            self._offset_file.write_text("\n".join(lines) + "\n", encoding="utf-8")
+            offsets = {}
+            for line in self._legacy_offset_file.read_text(encoding="utf-8").splitlines():
+                if "=" in line:
+                    path_part, offset_str = line.rsplit("=", 1)
+                    offsets[path_part] = int(offset_str)
+            self._checkpoints.import_file_offsets(offsets)
+            self._checkpoints.commit()
+            self._legacy_offset_file.unlink()
         except Exception:
-            logger.opt(exception=True).debug("Failed to save shell history offsets")
+            logger.opt(exception=True).debug("Failed to import legacy shell history offsets")
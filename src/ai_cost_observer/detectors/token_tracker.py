@@ -4,79 +4,138 @@ from __future__ import annotations
 
 import json
 import sqlite3
+import threading
 import time
 from pathlib import Path
 
 from loguru import logger
 
 from ai_cost_observer.config import AppConfig
+from ai_cost_observer.pricing import estimate_cost
+from ai_cost_observer.storage.checkpoints import CheckpointStore
 from ai_cost_observer.telemetry import TelemetryManager
 
-# Known pricing per 1M tokens (input/output) — updated as of 2025
-MODEL_PRICING: dict[str, tuple[float, float]] = {
-    # Anthropic
-    "claude-opus-4": (15.0, 75.0),
-    "claude-opus-4-6": (15.0, 75.0),
-    "claude-sonnet-4": (3.0, 15.0),
-    "claude-sonnet-4-5": (3.0, 15.0),
-    "claude-haiku-3-5": (0.80, 4.0),
-    # OpenAI
-    "gpt-4o": (2.50, 10.0),
-    "gpt-4o-mini": (0.15, 0.60),
-    "gpt-4-turbo": (10.0, 30.0),
-    "gpt-4.1": (2.0, 8.0),
-    "gpt-4.1-mini": (0.40, 1.60),
-    "gpt-4.1-nano": (0.10, 0.40),
-    "o1": (15.0, 60.0),
-    "o1-mini": (3.0, 12.0),
-    "o3": (10.0, 40.0),
-    "o3-mini": (1.10, 4.40),
-    "o4-mini": (1.10, 4.40),
-    # Google
-    "gemini-2.5-pro": (1.25, 10.0),
-    "gemini-2.5-flash": (0.15, 0.60),
-    "gemini-2.0-flash": (0.10, 0.40),
-    "gemini-2.0-pro": (1.25, 10.0),
-    "gemini-1.5-pro": (1.25, 5.0),
-    "gemini-1.5-flash": (0.075, 0.30),
-    # DeepSeek
-    "deepseek-v3": (0.27, 1.10),
-    "deepseek-r1": (0.55, 2.19),
-}
-
-
-def estimate_cost(
-    model: str,
-    input_tokens: int,
-    output_tokens: int,
-    cache_creation_input_tokens: int = 0,
-    cache_read_input_tokens: int = 0,
-) -> float:
-    """Estimate cost in USD from model name and token counts.
-
-    Cache token pricing follows Anthropic conventions:
-    - cache_creation_input_tokens: 1.25x the input price
-    - cache_read_input_tokens: 0.1x the input price
+# Flush buffered prompt records early when a scan (e.g. first run over a large
+# transcript history) accumulates this many, to bound memory use
+_MAX_PENDING_PROMPTS = 5000
+
+# A file stat signature is only trusted for skipping reads once the file has
+# been quiet for this long (mtime granularity is coarse on some filesystems)
+_STAT_SETTLE_SECONDS = 2.0
+
+
+def _stat_signature(path: Path) -> tuple[int, int] | None:
+    """Return (mtime_ns, size) for path, or None if it does not exist."""
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class _CodexReader:
+    """Long-lived read-only reader for the Codex CLI sessions database.
+
+    Keeps one connection open across scans and caches the detected `sessions`
+    schema until `PRAGMA schema_version` or the file identity (device, inode)
+    changes. When neither the DB nor its WAL has changed since the last read
+    at the same rowid checkpoint, `read_new` returns without running any SQL.
     """
-    # Try exact match first, then prefix match
-    pricing = MODEL_PRICING.get(model)
-    if not pricing:
-        for key, val in MODEL_PRICING.items():
-            if model and model.startswith(key):
-                pricing = val
-                break
-    if not pricing:
-        # Default fallback: mid-range pricing
-        pricing = (3.0, 15.0)
-
-    input_price = pricing[0]
-    output_price = pricing[1]
-
-    input_cost = (input_tokens / 1_000_000) * input_price
-    output_cost = (output_tokens / 1_000_000) * output_price
-    cache_creation_cost = (cache_creation_input_tokens / 1_000_000) * input_price * 1.25
-    cache_read_cost = (cache_read_input_tokens / 1_000_000) * input_price * 0.1
-    return input_cost + output_cost + cache_creation_cost + cache_read_cost
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.columns: set[str] = set()
+        self._conn: sqlite3.Connection | None = None
+        self._identity: tuple[int, int] | None = None
+        self._schema_version: int | None = None
+        self._readable = False  # sessions table with input_tokens present
+        self._signature: tuple | None = None
+        self._signature_rowid: int | None = None
+
+    def read_new(self, after_rowid: int) -> list[sqlite3.Row]:
+        """Return sessions rows with tokens and rowid > after_rowid."""
+        try:
+            st = self.path.stat()
+        except OSError:
+            self.close()
+            return []
+
+        signature = (
+            (st.st_mtime_ns, st.st_size),
+            _stat_signature(self.path.with_name(self.path.name + "-wal")),
+        )
+        identity = (st.st_dev, st.st_ino)
+        if identity == self._identity and self._signature_rowid == after_rowid:
+            if signature == self._signature:
+                return []
+
+        if identity != self._identity:
+            self.close()
+        if self._conn is None:
+            try:
+                self._conn = sqlite3.connect(
+                    f"file:{self.path}?mode=ro", uri=True, check_same_thread=False
+                )
+                self._conn.row_factory = sqlite3.Row
+            except sqlite3.Error:
+                logger.opt(exception=True).debug("Cannot open Codex DB")
+                self._conn = None
+                return []
+            self._identity = identity
+
+        try:
+            self._refresh_schema()
+            rows = []
+            if self._readable:
+                rows = self._conn.execute(
+                    "SELECT rowid, * FROM sessions "
+                    "WHERE input_tokens > 0 AND rowid > ? ORDER BY rowid",
+                    (after_rowid,),
+                ).fetchall()
+        except sqlite3.Error:
+            logger.opt(exception=True).debug("Error reading Codex DB")
+            self.close()
+            return []
+
+        newest_mtime = max(sig[0] for sig in signature if sig) / 1e9
+        if time.time() - newest_mtime >= _STAT_SETTLE_SECONDS:
+            self._signature = signature
+            self._signature_rowid = rows[-1]["rowid"] if rows else after_rowid
+        else:
+            self._signature = None
+        return rows
+
+    def _refresh_schema(self) -> None:
+        """Re-detect the sessions columns if the schema changed since last time."""
+        version = self._conn.execute("PRAGMA schema_version").fetchone()[0]
+        if version == self._schema_version:
+            return
+        self._schema_version = version
+        tables = {
+            row["name"]
+            for row in self._conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        }
+        self.columns = set()
+        if "sessions" in tables:
+            self.columns = {
+                row["name"] for row in self._conn.execute("PRAGMA table_info(sessions)")
+            }
+        self._readable = "input_tokens" in self.columns
+
+    def close(self) -> None:
+        """Close the connection and drop all cached state."""
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except sqlite3.Error:
+                pass
+        self._conn = None
+        self._identity = None
+        self._schema_version = None
+        self._signature = None
+        self._signature_rowid = None
+        self._readable = False
+        self.columns = set()
 
 
 class TokenTracker:
@@ -97,39 +156,42 @@ class TokenTracker:
         self.telemetry = telemetry
         self.prompt_db = prompt_db
 
-        # Track file positions for incremental reading
-        self._file_offsets: dict[str, int] = {}
+        # Incremental read state (file offsets, codex rowid)
         self._codex_last_rowid: int = 0
+        self._codex_reader: _CodexReader | None = None
         self._last_scan_time: float = 0.0
 
-        # State file for persisting offsets across restarts
-        self._state_file = config.state_dir / "token_tracker_state.json"
+        # Prompt records buffered until the end of a scan / HTTP batch
+        self._pending_prompts: list[dict] = []
+        self._requeued_prompts = 0  # leading records already put back by a failed flush
+        self._pending_lock = threading.Lock()
+
+        # Crash-safe checkpoint store for persisting state across restarts
+        self._checkpoints = CheckpointStore(config.state_dir, "token_tracker")
+        self._legacy_state_file = config.state_dir / "token_tracker_state.json"
         self._load_state()
 
         # Token tracking config from ai_config
         self._tt_config = getattr(config, "token_tracking", {}) or {}
 
     def _load_state(self) -> None:
-        """Load persisted state (file offsets, codex rowid) from disk."""
-        if self._state_file.exists():
+        """Load persisted state, importing the legacy JSON state file once if present."""
+        if self._checkpoints.is_empty() and self._legacy_state_file.exists():
             try:
-                data = json.loads(self._state_file.read_text(encoding="utf-8"))
-                self._file_offsets = {k: int(v) for k, v in data.get("file_offsets", {}).items()}
-                self._codex_last_rowid = int(data.get("codex_last_rowid", 0))
+                data = json.loads(self._legacy_state_file.read_text(encoding="utf-8"))
+                self._checkpoints.import_file_offsets(data.get("file_offsets", {}))
+                self._checkpoints.set("codex_last_rowid", int(data.get("codex_last_rowid", 0)))
+                if self._checkpoints.commit():
+                    self._legacy_state_file.unlink()
+                    logger.debug("Migrated {} into checkpoint store", self._legacy_state_file)
             except Exception:
-                logger.opt(exception=True).debug("Failed to load token tracker state")
+                logger.opt(exception=True).debug("Failed to import legacy token tracker state")
+        self._codex_last_rowid = int(self._checkpoints.get("codex_last_rowid", 0))
 
     def _save_state(self) -> None:
-        """Persist state (file offsets, codex rowid) to disk."""
-        try:
-            self._state_file.parent.mkdir(parents=True, exist_ok=True)
-            data = {
-                "file_offsets": self._file_offsets,
-                "codex_last_rowid": self._codex_last_rowid,
-            }
-            self._state_file.write_text(json.dumps(data), encoding="utf-8")
-        except Exception:
-            logger.opt(exception=True).debug("Failed to save token tracker state")
+        """Persist changed state (file offsets, codex rowid) in one transaction."""
+        self._checkpoints.set("codex_last_rowid", self._codex_last_rowid)
+        self._checkpoints.commit()
 
     def scan(self) -> None:
         """Run one scan cycle: read local files, extract tokens, emit metrics."""
@@ -143,6 +205,7 @@ class TokenTracker:
         except Exception:
             logger.opt(exception=True).error("Error scanning Codex data")
 
+        self.flush_prompts()
         self._save_state()
         self._last_scan_time = time.monotonic()
 
@@ -157,23 +220,22 @@ class TokenTracker:
 
     def _process_claude_jsonl(self, path: Path) -> None:
         """Process a single Claude Code JSONL file incrementally."""
-        path_str = str(path)
         try:
-            file_size = path.stat().st_size
+            st = path.stat()
         except OSError:
             return
 
-        offset = self._file_offsets.get(path_str, 0)
-        if file_size <= offset:
+        offset = self._checkpoints.file_offset(path, st)
+        if st.st_size <= offset:
             return  # No new data
 
         try:
             with open(path, encoding="utf-8", errors="replace") as f:
                 f.seek(offset)
                 new_data = f.read()
-                self._file_offsets[path_str] = f.tell()
+                self._checkpoints.set_file_offset(path, f.tell(), st)
         except OSError:
-            logger.debug("Cannot read {}", path_str)
+            logger.debug("Cannot read {}", path)
             return
 
         # Parse each new line
@@ -226,6 +288,9 @@ class TokenTracker:
         if cost > 0:
             self.telemetry.tokens_cost_usd_total.add(cost, labels)
         self.telemetry.prompt_count_total.add(1, {"tool.name": "claude-code", "source": "cli"})
+        self.telemetry.usage.add_tokens(
+            "claude-code", model, "cli", input_tokens, output_tokens, cost
+        )
 
         # Store in prompt DB if available
         if self.prompt_db:
@@ -243,78 +308,98 @@ class TokenTracker:
 
             role = entry.get("role") or entry.get("message", {}).get("role", "")
 
-            try:
-                self.prompt_db.insert_prompt(
-                    tool_name="claude-code",
-                    model_name=model,
-                    source="cli",
-                    input_tokens=input_tokens,
-                    output_tokens=output_tokens,
-                    cache_creation_tokens=cache_creation,
-                    cache_read_tokens=cache_read,
-                    estimated_cost_usd=cost,
-                    prompt_text=prompt_text if role == "user" else None,
-                    response_text=prompt_text if role == "assistant" else None,
-                    project_path=str(source_path.parent.name),
-                )
-            except Exception:
-                logger.opt(exception=True).debug("Failed to store prompt")
+            self._queue_prompt(
+                {
+                    "tool_name": "claude-code",
+                    "model_name": model,
+                    "source": "cli",
+                    "input_tokens": input_tokens,
+                    "output_tokens": output_tokens,
+                    "cache_creation_tokens": cache_creation,
+                    "cache_read_tokens": cache_read,
+                    "estimated_cost_usd": cost,
+                    "prompt_text": prompt_text if role == "user" else None,
+                    "response_text": prompt_text if role == "assistant" else None,
+                    "project_path": str(source_path.parent.name),
+                    # Transcripts are named after their session
+                    "session_id": entry.get("sessionId") or source_path.stem,
+                }
+            )
+
+    def _queue_prompt(self, record: dict) -> None:
+        """Buffer a prompt record for the next `flush_prompts` call."""
+        with self._pending_lock:
+            self._pending_prompts.append(record)
+            full = len(self._pending_prompts) >= _MAX_PENDING_PROMPTS
+        if full:
+            self.flush_prompts()
+
+    def flush_prompts(self) -> int:
+        """Write all buffered prompt records to the prompt DB in one batch.
+
+        Called at the end of every scan and after each HTTP token batch.
+        Returns the number of records written. If the write fails, the batch
+        goes back to the front of the buffer for the next flush, which keeps
+        at most _MAX_PENDING_PROMPTS records; records that already failed
+        once are dropped rather than retried forever.
+        """
+        with self._pending_lock:
+            pending, self._pending_prompts = self._pending_prompts, []
+            retried, self._requeued_prompts = self._requeued_prompts, 0
+        if not pending or not self.prompt_db:
+            return 0
+        try:
+            return self.prompt_db.insert_prompts_bulk(pending, parallel=True)
+        except Exception:
+            retry = pending[retried:]
+            with self._pending_lock:
+                self._pending_prompts[:0] = retry
+                overflow = max(0, len(self._pending_prompts) - _MAX_PENDING_PROMPTS)
+                del self._pending_prompts[:overflow]
+                kept = self._requeued_prompts = max(0, len(retry) - overflow)
+            logger.opt(exception=True).warning(
+                "Failed to store {} prompts ({} kept for the next flush, {} dropped)",
+                len(pending),
+                kept,
+                retried + overflow,
+            )
+            return 0
 
     def _scan_codex(self) -> None:
         """Read Codex CLI SQLite database for session/token data."""
         codex_db = Path.home() / ".codex" / "sqlite" / "codex-dev.db"
-        if not codex_db.exists():
-            return
-
-        try:
-            conn = sqlite3.connect(f"file:{codex_db}?mode=ro", uri=True)
-            conn.row_factory = sqlite3.Row
-        except sqlite3.Error:
-            logger.opt(exception=True).debug("Cannot open Codex DB")
-            return
-
-        try:
-            # Read sessions with token data (schema may vary)
-            cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
-            tables = {row["name"] for row in cursor}
-
-            if "sessions" not in tables:
-                return
-
-            # Get column names to adapt query
-            cursor = conn.execute("PRAGMA table_info(sessions)")
-            columns = {row["name"] for row in cursor}
-
-            if "input_tokens" not in columns:
-                return
-
-            # Read only new sessions since last processed rowid
-            cursor = conn.execute(
-                "SELECT rowid, * FROM sessions WHERE input_tokens > 0 AND rowid > ? ORDER BY rowid",
-                (self._codex_last_rowid,),
+        if self._codex_reader is None or self._codex_reader.path != codex_db:
+            if self._codex_reader is not None:
+                self._codex_reader.close()
+            self._codex_reader = _CodexReader(codex_db)
+
+        rows = self._codex_reader.read_new(self._codex_last_rowid)
+        columns = self._codex_reader.columns
+        for row in rows:
+            self._codex_last_rowid = row["rowid"]
+            input_tokens = row["input_tokens"] or 0
+            output_tokens = row["output_tokens"] if "output_tokens" in columns else 0
+            model = row["model"] if "model" in columns else "unknown"
+
+            cost = estimate_cost(model, input_tokens, output_tokens)
+            labels = {"tool.name": "codex-cli", "model.name": model}
+
+            self.telemetry.tokens_input_total.add(input_tokens, labels)
+            self.telemetry.tokens_output_total.add(output_tokens, labels)
+            if cost > 0:
+                self.telemetry.tokens_cost_usd_total.add(cost, labels)
+            self.telemetry.prompt_count_total.add(1, {"tool.name": "codex-cli", "source": "cli"})
+            self.telemetry.usage.add_tokens(
+                "codex-cli", model, "cli", input_tokens, output_tokens, cost
             )
 
-            for row in cursor:
-                self._codex_last_rowid = row["rowid"]
-                input_tokens = row["input_tokens"] or 0
-                output_tokens = row["output_tokens"] if "output_tokens" in columns else 0
-                model = row["model"] if "model" in columns else "unknown"
-
-                cost = estimate_cost(model, input_tokens, output_tokens)
-                labels = {"tool.name": "codex-cli", "model.name": model}
-
-                self.telemetry.tokens_input_total.add(input_tokens, labels)
-                self.telemetry.tokens_output_total.add(output_tokens, labels)
-                if cost > 0:
-                    self.telemetry.tokens_cost_usd_total.add(cost, labels)
-                self.telemetry.prompt_count_total.add(
-                    1, {"tool.name": "codex-cli", "source": "cli"}
-                )
-
-        except sqlite3.Error:
-            logger.opt(exception=True).debug("Error reading Codex DB")
-        finally:
-            conn.close()
+    def close(self) -> None:
+        """Release the persistent Codex DB connection and the checkpoint store."""
+        if self._codex_reader is not None:
+            self._codex_reader.close()
+            self._codex_reader = None
+        self._save_state()
+        self._checkpoints.close()
 
     def record_api_intercept(
         self,
@@ -325,7 +410,11 @@ class TokenTracker:
         prompt_text: str | None = None,
         response_text: str | None = None,
     ) -> None:
-        """Record token usage from an API intercept (e.g., Chrome extension)."""
+        """Record token usage from an API intercept (e.g., Chrome extension).
+
+        The prompt record is buffered; callers flush it with `flush_prompts`
+        once per request batch.
+        """
         cost = estimate_cost(model, input_tokens, output_tokens)
         labels = {"tool.name": tool_name, "model.name": model}
 
@@ -334,18 +423,20 @@ class TokenTracker:
         if cost > 0:
             self.telemetry.tokens_cost_usd_total.add(cost, labels)
         self.telemetry.prompt_count_total.add(1, {"tool.name": tool_name, "source": "browser"})
+        self.telemetry.usage.add_tokens(
+            tool_name, model, "browser", input_tokens, output_tokens, cost
+        )
 
         if self.prompt_db:
-            try:
-                self.prompt_db.insert_prompt(
-                    tool_name=tool_name,
-                    model_name=model,
-                    source="browser",
-                    input_tokens=input_tokens,
-                    output_tokens=output_tokens,
-                    estimated_cost_usd=cost,
-                    prompt_text=prompt_text,
-                    response_text=response_text,
-                )
-            except Exception:
-                logger.opt(exception=True).debug("Failed to store browser prompt")
+            self._queue_prompt(
+                {
+                    "tool_name": tool_name,
+                    "model_name": model,
+                    "source": "browser",
+                    "input_tokens": input_tokens,
+                    "output_tokens": output_tokens,
+                    "estimated_cost_usd": cost,
+                    "prompt_text": prompt_text,
+                    "response_text": response_text,
+                }
+            )
@@ -11,6 +11,7 @@ from threading import Event
 from loguru import logger
 
 from ai_cost_observer.config import load_config
+from ai_cost_observer.pricing import load_pricing
 from ai_cost_observer.telemetry import TelemetryManager
 
 
@@ -102,6 +103,7 @@ def run() -> None:
 
     try:
         config = load_config()
+        load_pricing(config)
         telemetry = TelemetryManager(config)
 
         from ai_cost_observer.detectors.browser_history import BrowserHistoryParser
@@ -110,7 +112,11 @@ def run() -> None:
         from ai_cost_observer.detectors.shell_history import ShellHistoryParser
         from ai_cost_observer.detectors.token_tracker import TokenTracker
         from ai_cost_observer.detectors.wsl import WSLDetector
-        from ai_cost_observer.server.http_receiver import set_token_tracker, start_http_receiver
+        from ai_cost_observer.server.http_receiver import (
+            set_token_tracker,
+            start_http_receiver,
+            stop_http_receiver,
+        )
 
         # Initialize prompt storage if token tracking is enabled
         tt_config = config.token_tracking
@@ -123,11 +129,32 @@ def run() -> None:
                     db_path=None if db_path == "auto" else db_path,
                     encrypt=tt_config.get("encrypt_prompts", True),
                     retention_days=tt_config.get("retention_days", 90),
+                    write_behind=tt_config.get("write_behind", True),
+                    queue_size=tt_config.get("write_queue_size", 10000),
+                    batch_size=tt_config.get("write_batch_size", 500),
+                    flush_interval=tt_config.get("write_flush_interval_seconds", 1.0),
+                    compression=tt_config.get("compression", "auto"),
                 )
+                if (
+                    tt_config.get("compression_dictionary", False)
+                    and not prompt_db.compression_dictionary_id
+                ):
+                    prompt_db.train_compression_dict()
+                telemetry.watch_prompt_queue(prompt_db.queue_stats)
                 logger.debug("Prompt storage initialized at {}", prompt_db.db_path)
             except Exception:
                 logger.opt(exception=True).warning("Failed to initialize prompt storage")
 
+        # Recent usage for /api/usage, loaded before any detector records more
+        if prompt_db is not None:
+            try:
+                rows = telemetry.usage.warm(prompt_db)
+                logger.debug("Usage aggregate warmed from {} hourly rollups", rows)
+            except Exception:
+                logger.opt(exception=True).warning(
+                    "Failed to load recent usage from prompt storage"
+                )
+
         token_tracker = TokenTracker(config, telemetry, prompt_db=prompt_db)
         set_token_tracker(token_tracker)
 
@@ -174,6 +201,25 @@ def run() -> None:
                 name="token-tracker",
             ),
         ]
+        if prompt_db:
+            background_threads.append(
+                threading.Thread(
+                    target=_run_periodic,
+                    args=(
+                        "prompt_retention",
+                        prompt_db.cleanup,
+                        tt_config.get("retention_interval_seconds", 3600),
+                        stop_event,
+                    ),
+                    daemon=True,
+                    name="prompt-retention",
+                )
+            )
+            if tt_config.get("vacuum_on_start", False):
+                # One full rewrite of an older file; runs beside the agent, not before it
+                background_threads.append(
+                    threading.Thread(target=prompt_db.vacuum, daemon=True, name="prompt-vacuum")
+                )
         # http_thread is already started by start_http_receiver(), don't re-start it
 
         for t in background_threads:
@@ -193,14 +239,39 @@ def run() -> None:
         for t in background_threads:
             if t.is_alive():
                 t.join(timeout=2)
+        # Each step is guarded on its own: a failure must not skip the ones that
+        # commit queued prompts and export the last metrics
+        if "stop_http_receiver" in locals():
+            try:
+                # Record events the receiver accepted but has not handed to the sinks yet
+                stop_http_receiver()
+            except Exception:
+                logger.opt(exception=True).warning("Error stopping the HTTP receiver")
+        if "token_tracker" in locals():
+            try:
+                token_tracker.flush_prompts()
+            except Exception:
+                logger.opt(exception=True).warning("Error flushing tracked prompts")
+            try:
+                token_tracker.close()
+            except Exception:
+                logger.opt(exception=True).debug("Error closing the token tracker")
         if prompt_db:
             try:
+                # Commit everything still queued for write-behind before cleanup
+                prompt_db.flush()
                 prompt_db.cleanup()
-                prompt_db.close()
             except Exception:
                 logger.opt(exception=True).debug("Error during prompt DB cleanup")
+            try:
+                prompt_db.close()
+            except Exception:
+                logger.opt(exception=True).warning("Error closing the prompt DB")
         if "telemetry" in locals():
-            telemetry.shutdown()
+            try:
+                telemetry.shutdown()
+            except Exception:
+                logger.opt(exception=True).warning("Error shutting down telemetry")
         logger.info("Agent stopped.")
 
 
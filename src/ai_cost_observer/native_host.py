@@ -0,0 +1,226 @@
+"""Chrome native messaging host — relays extension messages to the agent's ingest socket.
+
+Chrome starts the host when the extension calls `chrome.runtime.connectNative`
+and talks to it over stdio: each message is a 32-bit length in native byte
+order followed by that many bytes of UTF-8 JSON. The host passes each
+message to the agent's Unix socket as one request line and writes the reply
+line back the same way, without decoding either. It imports only the
+standard library, like the reporter, so Chrome gets a channel quickly.
+
+    ai-cost-observer-native-host --install EXTENSION_ID   # register with Chrome
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import platform
+import shutil
+import socket
+import struct
+import sys
+from pathlib import Path
+from typing import BinaryIO
+
+from ai_cost_observer.reporter import default_socket_path
+
+HOST_NAME = "com.ai_cost_observer.agent"
+
+# Chrome refuses host messages over 1 MB; requests are held to the same bound
+MAX_MESSAGE_BYTES = 1_048_576
+
+# How long a request may wait for the agent's reply
+REPLY_TIMEOUT_SECONDS = 10.0
+
+# Suggested back-off when the agent cannot be reached
+UNAVAILABLE_RETRY_AFTER_SECONDS = 5
+
+_LENGTH = struct.Struct("=I")  # native byte order, as Chrome writes it
+
+
+class MessageError(Exception):
+    """A message that violates the native messaging framing."""
+
+
+def read_message(stream: BinaryIO) -> bytes | None:
+    """Read one length-prefixed message. Returns None at end of input."""
+    header = stream.read(_LENGTH.size)
+    if not header:
+        return None
+    if len(header) < _LENGTH.size:
+        raise MessageError("Truncated message length")
+    (length,) = _LENGTH.unpack(header)
+    if length > MAX_MESSAGE_BYTES:
+        raise MessageError(f"Message of {length} bytes exceeds {MAX_MESSAGE_BYTES}")
+    data = stream.read(length)
+    if len(data) < length:
+        raise MessageError("Truncated message")
+    return data
+
+
+def write_message(stream: BinaryIO, data: bytes) -> None:
+    """Write one length-prefixed message and flush it."""
+    stream.write(_LENGTH.pack(len(data)) + data)
+    stream.flush()
+
+
+def _error_reply(message: bytes, status: int, error: str, retry_after: int | None = None) -> bytes:
+    """A reply produced by the host itself, echoing the request id when there is one."""
+    try:
+        request = json.loads(message)
+    except ValueError:
+        request = None
+    body: dict = {"error": error}
+    headers = {}
+    if retry_after is not None:
+        body["retry_after"] = retry_after
+        headers["Retry-After"] = str(retry_after)
+    reply = {"status": status, "body": body, "headers": headers}
+    if isinstance(request, dict) and "id" in request:
+        reply["id"] = request["id"]
+    return json.dumps(reply, separators=(",", ":")).encode("utf-8")
+
+
+class Relay:
+    """One connection to the agent's socket, reopened when the agent restarts."""
+
+    def __init__(self, path: str | None = None) -> None:
+        self.path = path or default_socket_path()
+        self._sock: socket.socket | None = None
+        self._replies: BinaryIO | None = None
+
+    def _connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(REPLY_TIMEOUT_SECONDS)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+        self._replies = sock.makefile("rb")
+
+    def close(self) -> None:
+        if self._sock is not None:
+            self._replies.close()
+            self._sock.close()
+        self._sock = self._replies = None
+
+    def request(self, message: bytes) -> bytes:
+        """Send one request and return the agent's reply (503 if the agent is unreachable).
+
+        A message without a `path` is answered with 400 here: the agent would
+        take it for a one-way event and never reply.
+        """
+        try:
+            request = json.loads(message)
+        except ValueError:
+            request = None
+        if not isinstance(request, dict) or "path" not in request:
+            return _error_reply(message, 400, "Message must be a JSON object with a path")
+        # JSON text never contains a raw newline, so a message is one request line as is
+        if b"\n" in message:
+            message = message.replace(b"\r", b"").replace(b"\n", b"")
+        for _ in range(2):
+            try:
+                if self._sock is None:
+                    self._connect()
+                self._sock.sendall(message + b"\n")
+                reply = self._replies.readline(MAX_MESSAGE_BYTES + 1)
+                if reply.endswith(b"\n"):
+                    return reply[:-1]
+                if len(reply) > MAX_MESSAGE_BYTES:
+                    self.close()
+                    return _error_reply(message, 502, "Agent reply too large")
+            except TimeoutError:
+                self.close()
+                return _error_reply(message, 504, "Agent did not reply in time")
+            except OSError:
+                pass
+            # Connection refused or closed (agent restarted): reconnect once
+            self.close()
+        return _error_reply(
+            message, 503, "Agent not reachable", retry_after=UNAVAILABLE_RETRY_AFTER_SECONDS
+        )
+
+
+def serve(stdin: BinaryIO, stdout: BinaryIO, relay: Relay) -> None:
+    """Relay messages until Chrome closes stdin."""
+    try:
+        while (message := read_message(stdin)) is not None:
+            write_message(stdout, relay.request(message))
+    finally:
+        relay.close()
+
+
+# --- Registration with the browser ---
+
+
+def manifest(extension_id: str, executable: str) -> dict:
+    """The host manifest Chrome reads to find and authorize the host."""
+    return {
+        "name": HOST_NAME,
+        "description": "AI Cost Observer agent",
+        "path": executable,
+        "type": "stdio",
+        "allowed_origins": [f"chrome-extension://{extension_id}/"],
+    }
+
+
+def manifest_dir() -> Path | None:
+    """Per-user NativeMessagingHosts directory of Google Chrome (None on Windows)."""
+    system = platform.system()
+    if system == "Darwin":
+        return (
+            Path.home()
+            / "Library"
+            / "Application Support"
+            / "Google"
+            / "Chrome"
+            / "NativeMessagingHosts"
+        )
+    if system == "Linux":
+        return Path.home() / ".config" / "google-chrome" / "NativeMessagingHosts"
+    return None
+
+
+def install(extension_id: str, directory: Path | None = None) -> Path:
+    """Write the host manifest for `extension_id`. Returns its path."""
+    directory = directory or manifest_dir()
+    if directory is None:
+        raise OSError("Native messaging needs the agent's Unix socket (macOS and Linux only)")
+    executable = shutil.which("ai-cost-observer-native-host") or os.path.abspath(sys.argv[0])
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{HOST_NAME}.json"
+    path.write_text(json.dumps(manifest(extension_id, executable), indent=2) + "\n")
+    return path
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Entry point of `ai-cost-observer-native-host`."""
+    args = list(sys.argv[1:] if argv is None else argv)
+    if args[:1] == ["--install"]:
+        if len(args) != 2:
+            print("usage: ai-cost-observer-native-host --install EXTENSION_ID", file=sys.stderr)
+            return 2
+        try:
+            path = install(args[1])
+        except OSError as exc:
+            print(f"Install failed: {exc}", file=sys.stderr)
+            return 1
+        print(f"Native messaging host registered: {path}")
+        return 0
+
+    # Started by Chrome (arguments: the caller's origin, and a window handle on Windows)
+    try:
+        serve(sys.stdin.buffer, sys.stdout.buffer, Relay())
+    except MessageError as exc:
+        print(f"ai-cost-observer-native-host: {exc}", file=sys.stderr)
+        return 1
+    except BrokenPipeError:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
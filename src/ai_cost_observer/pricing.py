@@ -0,0 +1,327 @@
+"""Model pricing — longest-prefix price index with versioned tables and memoized lookups."""
+
+from __future__ import annotations
+
+import time
+from bisect import bisect_right
+from datetime import date, datetime, timezone
+
+from loguru import logger
+
+try:
+    import numpy as np
+except ImportError:  # optional: pip install ai-cost-observer[perf]
+    np = None
+
+# Known pricing per 1M tokens (input/output) — updated as of 2025
+MODEL_PRICING: dict[str, tuple[float, float]] = {
+    # Anthropic
+    "claude-opus-4": (15.0, 75.0),
+    "claude-opus-4-6": (15.0, 75.0),
+    "claude-sonnet-4": (3.0, 15.0),
+    "claude-sonnet-4-5": (3.0, 15.0),
+    "claude-haiku-3-5": (0.80, 4.0),
+    # OpenAI
+    "gpt-4o": (2.50, 10.0),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-4.1": (2.0, 8.0),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "o1": (15.0, 60.0),
+    "o1-mini": (3.0, 12.0),
+    "o3": (10.0, 40.0),
+    "o3-mini": (1.10, 4.40),
+    "o4-mini": (1.10, 4.40),
+    # Google
+    "gemini-2.5-pro": (1.25, 10.0),
+    "gemini-2.5-flash": (0.15, 0.60),
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-2.0-pro": (1.25, 10.0),
+    "gemini-1.5-pro": (1.25, 5.0),
+    "gemini-1.5-flash": (0.075, 0.30),
+    # DeepSeek
+    "deepseek-v3": (0.27, 1.10),
+    "deepseek-r1": (0.55, 2.19),
+}
+
+# Default fallback for unknown models: mid-range pricing
+DEFAULT_PRICING: tuple[float, float] = (3.0, 15.0)
+
+# Cache token multipliers (Anthropic conventions), applied to the input price
+CACHE_CREATION_MULTIPLIER = 1.25
+CACHE_READ_MULTIPLIER = 0.1
+
+# Max distinct (model, table version) pairs kept in the resolution memo
+MEMO_MAX_ENTRIES = 4096
+
+_ROW = ""  # trie key holding the pricing row of the prefix ending at this node
+
+
+class _PrefixTrie:
+    """Character trie mapping model-name prefixes to pricing rows."""
+
+    __slots__ = ("_root",)
+
+    def __init__(self, table: dict[str, tuple[float, float]]) -> None:
+        self._root: dict = {}
+        for key, row in table.items():
+            if not key:
+                continue
+            node = self._root
+            for ch in key:
+                node = node.setdefault(ch, {})
+            node[_ROW] = row
+
+    def longest_prefix(self, model: str) -> tuple[float, float] | None:
+        """Return the row of the longest table key that prefixes `model`, if any."""
+        node = self._root
+        best = None
+        for ch in model:
+            node = node.get(ch)
+            if node is None:
+                break
+            best = node.get(_ROW, best)
+        return best
+
+
+def _parse_effective_from(value) -> float | None:
+    """Convert a YAML `effective_from` value (date, datetime or ISO string) to epoch seconds."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day, tzinfo=timezone.utc).timestamp()
+    return None
+
+
+def _parse_row(value) -> tuple[float, float] | None:
+    """Accept `{input: x, output: y}` or `[x, y]` and return an (input, output) tuple."""
+    try:
+        if isinstance(value, dict):
+            return (float(value["input"]), float(value["output"]))
+        if isinstance(value, (list, tuple)) and len(value) == 2:
+            return (float(value[0]), float(value[1]))
+    except (KeyError, TypeError, ValueError):
+        pass
+    return None
+
+
+class PricingIndex:
+    """Compiled model pricing: versioned longest-prefix tries plus a bounded memo.
+
+    The base table is in effect from the beginning of time. Each version from
+    `model_pricing` layers its rows on top of the previous table starting at its
+    `effective_from` date, so a price change only needs to list the models it
+    touches. Lookups resolve the longest matching key, so `gpt-4o-mini-2024-07-18`
+    prices as `gpt-4o-mini` regardless of table ordering.
+    """
+
+    def __init__(
+        self,
+        base: dict[str, tuple[float, float]] | None = None,
+        versions: list[dict] | None = None,
+        memo_size: int = MEMO_MAX_ENTRIES,
+    ) -> None:
+        table = dict(MODEL_PRICING if base is None else base)
+        self._starts: list[float] = [float("-inf")]
+        self._tables: list[dict[str, tuple[float, float]]] = [table]
+
+        parsed: list[tuple[float, dict[str, tuple[float, float]]]] = []
+        for version in versions or []:
+            start = _parse_effective_from(version.get("effective_from"))
+            if start is None:
+                logger.warning(
+                    "Ignoring model_pricing entry with invalid effective_from: {!r}",
+                    version.get("effective_from"),
+                )
+                continue
+            rows = {}
+            for model, raw in (version.get("models") or {}).items():
+                row = _parse_row(raw)
+                if row is None:
+                    logger.warning("Ignoring invalid price row for {}: {!r}", model, raw)
+                    continue
+                rows[str(model)] = row
+            parsed.append((start, rows))
+
+        for start, rows in sorted(parsed, key=lambda item: item[0]):
+            table = {**table, **rows}
+            if start == self._starts[-1]:
+                self._tables[-1] = table
+            else:
+                self._starts.append(start)
+                self._tables.append(table)
+
+        self._tries = [_PrefixTrie(t) for t in self._tables]
+        self._memo: dict[tuple[str, int], tuple[float, float]] = {}
+        self._memo_size = memo_size
+
+    @property
+    def version_count(self) -> int:
+        """Number of price table versions (the base table counts as one)."""
+        return len(self._tables)
+
+    def version_at(self, at: datetime | float | None = None) -> int:
+        """Return the index of the price table version in effect at `at` (default: now)."""
+        if at is None:
+            ts = time.time()
+        elif isinstance(at, datetime):
+            ts = (at if at.tzinfo else at.replace(tzinfo=timezone.utc)).timestamp()
+        else:
+            ts = float(at)
+        return bisect_right(self._starts, ts) - 1
+
+    def resolve(self, model: str | None, at: datetime | float | None = None) -> tuple[float, float]:
+        """Return the (input, output) price per 1M tokens for `model` at time `at`."""
+        return self.resolve_version(model or "", self.version_at(at))
+
+    def versions_at(self, timestamps) -> list[int]:
+        """Return `version_at` for each of a sequence of datetimes or epoch seconds."""
+        if len(self._starts) == 1:
+            return [0] * len(timestamps)
+        return [self.version_at(ts) for ts in timestamps]
+
+    def resolve_version(self, model: str, version: int) -> tuple[float, float]:
+        """Resolve `model` against a specific table version, memoizing the result."""
+        key = (model, version)
+        row = self._memo.get(key)
+        if row is None:
+            row = self._tries[version].longest_prefix(model) or DEFAULT_PRICING
+            if len(self._memo) >= self._memo_size:
+                self._memo.clear()
+            self._memo[key] = row
+        return row
+
+
+_index = PricingIndex()
+
+
+def get_pricing_index() -> PricingIndex:
+    """Return the active pricing index."""
+    return _index
+
+
+def load_pricing(config) -> PricingIndex:
+    """(Re)build the active pricing index from `config.model_pricing`.
+
+    Called at startup and whenever the configuration is reloaded. The memo is
+    discarded together with the old index.
+    """
+    global _index
+    _index = PricingIndex(versions=getattr(config, "model_pricing", None) or [])
+    logger.debug("Pricing index built with {} table version(s)", _index.version_count)
+    return _index
+
+
+def estimate_cost(
+    model: str,
+    input_tokens: int,
+    output_tokens: int,
+    cache_creation_input_tokens: int = 0,
+    cache_read_input_tokens: int = 0,
+    at: datetime | float | None = None,
+) -> float:
+    """Estimate cost in USD from model name and token counts.
+
+    Cache token pricing follows Anthropic conventions:
+    - cache_creation_input_tokens: 1.25x the input price
+    - cache_read_input_tokens: 0.1x the input price
+
+    `at` selects the price table version in effect at that time (default: now).
+    """
+    input_price, output_price = _index.resolve(model, at)
+
+    input_cost = (input_tokens / 1_000_000) * input_price
+    output_cost = (output_tokens / 1_000_000) * output_price
+    cache_creation_cost = (
+        (cache_creation_input_tokens / 1_000_000) * input_price * CACHE_CREATION_MULTIPLIER
+    )
+    cache_read_cost = (cache_read_input_tokens / 1_000_000) * input_price * CACHE_READ_MULTIPLIER
+    return input_cost + output_cost + cache_creation_cost + cache_read_cost
+
+
+def _column(values, n: int):
+    """Coerce a token-count column to float64 (NumPy) or a list of numbers, mapping None to 0."""
+    if values is None:
+        return np.zeros(n) if np is not None else [0] * n
+    if len(values) != n:
+        raise ValueError(f"column length {len(values)} does not match {n} models")
+    if np is None:
+        return [v or 0 for v in values]
+    column = np.asarray(values, dtype=np.float64)
+    # NULL counts from SQLite rows come through as NaN. asarray does not copy a
+    # float64 input, so the NaNs are replaced in a new array, never the caller's
+    return np.where(np.isnan(column), 0.0, column)
+
+
+def estimate_costs(
+    models,
+    input_tokens,
+    output_tokens,
+    cache_creation_input_tokens=None,
+    cache_read_input_tokens=None,
+    at=None,
+) -> list[float]:
+    """Columnar `estimate_cost`: one cost per row of the given equal-length arrays.
+
+    Rows are grouped by resolved price row, so each distinct (model, table
+    version) pair is resolved once, and the arithmetic runs vectorized over the
+    whole batch. `at` is either a single time (applied to every row) or a
+    sequence of per-row times, for backfills that span price changes.
+
+    Returns a list of floats, with or without NumPy. The inputs are not modified.
+    """
+    n = len(models)
+    if at is None or isinstance(at, (datetime, int, float)):
+        version = _index.version_at(at)
+        versions = None
+    else:
+        if len(at) != n:
+            raise ValueError(f"at has length {len(at)}, expected {n}")
+        versions = _index.versions_at(at)
+
+    # Factorize rows into price-row codes: resolve each distinct key once
+    row_codes: dict[tuple[float, float], int] = {}
+    keys = models if versions is None else list(zip(models, versions))
+    key_codes = dict.fromkeys(keys)
+    for key in key_codes:
+        model, key_version = (key, version) if versions is None else key
+        row = _index.resolve_version(model or "", key_version)
+        key_codes[key] = row_codes.setdefault(row, len(row_codes))
+    codes = list(map(key_codes.__getitem__, keys))
+    rows = list(row_codes)
+
+    inp = _column(input_tokens, n)
+    out = _column(output_tokens, n)
+    cache_creation = _column(cache_creation_input_tokens, n)
+    cache_read = _column(cache_read_input_tokens, n)
+
+    if np is None:
+        costs = []
+        for i, code in enumerate(codes):
+            input_price, output_price = rows[code]
+            costs.append(
+                (inp[i] / 1_000_000) * input_price
+                + (out[i] / 1_000_000) * output_price
+                + (cache_creation[i] / 1_000_000) * input_price * CACHE_CREATION_MULTIPLIER
+                + (cache_read[i] / 1_000_000) * input_price * CACHE_READ_MULTIPLIER
+            )
+        return costs
+
+    prices = np.array(rows, dtype=np.float64).reshape(-1, 2)
+    code_arr = np.fromiter(codes, dtype=np.intp, count=n)
+    input_price = prices[code_arr, 0]
+    output_price = prices[code_arr, 1]
+    return (
+        (inp / 1_000_000) * input_price
+        + (out / 1_000_000) * output_price
+        + (cache_creation / 1_000_000) * input_price * CACHE_CREATION_MULTIPLIER
+        + (cache_read / 1_000_000) * input_price * CACHE_READ_MULTIPLIER
+    ).tolist()
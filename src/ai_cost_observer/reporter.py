@@ -0,0 +1,88 @@
+"""Lightweight reporter — sends events to the agent's ingest socket.
+
+For shell preexec hooks and CLI wrappers. It imports only the standard
+library (not the agent's config, which pulls in YAML) so it starts fast,
+never waits for a reply and never fails: when the agent is not running,
+the event is dropped.
+
+    ai-cost-observer-report [--shell NAME] [--socket PATH] -- COMMAND LINE
+    ai-cost-observer-report [--socket PATH] --event '{"type": "api_intercept", ...}'
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import socket
+import sys
+import time
+
+SOCKET_NAME = "ingest.sock"
+
+# Overrides the socket location (otherwise state_dir/ingest.sock)
+SOCKET_ENV = "AI_COST_OBSERVER_SOCKET"
+
+# The agent accepts connections on its event loop; give up quickly if it is stuck
+TIMEOUT_SECONDS = 0.1
+
+
+def default_socket_path() -> str:
+    """The agent's default socket: `config.state_dir` / SOCKET_NAME, or $AI_COST_OBSERVER_SOCKET."""
+    if path := os.environ.get(SOCKET_ENV):
+        return path
+    # Mirrors config._default_state_dir (POSIX only: there is no ingest socket on Windows)
+    return os.path.join(os.path.expanduser("~"), ".local", "state", "ai-cost-observer", SOCKET_NAME)
+
+
+def command_event(command: str, shell: str | None = None) -> dict:
+    """A `cli_command` event for one command line."""
+    event = {"type": "cli_command", "command": command, "timestamp": round(time.time(), 3)}
+    if shell:
+        event["shell"] = shell
+    return event
+
+
+def send(events: list[dict], path: str | None = None) -> bool:
+    """Write events to the socket, one JSON line each. Returns False if the agent is unreachable."""
+    data = b"".join(json.dumps(e, separators=(",", ":")).encode("utf-8") + b"\n" for e in events)
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(TIMEOUT_SECONDS)
+            sock.connect(path or default_socket_path())
+            sock.sendall(data)
+    except (OSError, AttributeError):  # AttributeError: no AF_UNIX on this platform
+        return False
+    return True
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Entry point of `ai-cost-observer-report`. Always exits 0, so a hook never fails."""
+    args = list(sys.argv[1:] if argv is None else argv)
+    shell = path = event = None
+    while args and args[0] in ("--shell", "--socket", "--event"):
+        if len(args) < 2:
+            return 0
+        option, value = args.pop(0), args.pop(0)
+        if option == "--shell":
+            shell = value
+        elif option == "--socket":
+            path = value
+        else:
+            event = value
+    if args and args[0] == "--":
+        args.pop(0)
+
+    if event is not None:
+        try:
+            data = json.loads(event)
+        except ValueError:
+            return 0
+        if isinstance(data, dict):
+            send([data], path)
+    elif command := " ".join(args).strip():
+        send([command_event(command, shell)], path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,511 @@
+"""Asyncio HTTP receiver — keep-alive HTTP/1.1 front end for the ingest endpoints."""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import json
+import threading
+from collections.abc import AsyncIterator, Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+from ai_cost_observer.server.ingest import (
+    EXTENSION_CONFIG_CACHE_CONTROL,
+    HEALTH_PAYLOAD,
+    MAX_PAYLOAD_BYTES,
+    MAX_STREAM_BYTES,
+    POST_ENDPOINTS,
+    READ_CHUNK_BYTES,
+    ROOT_PAYLOAD,
+    BodyError,
+    EndpointRateLimiter,
+    IngestHandler,
+    etag_matches,
+    is_ndjson,
+    rate_limited_body,
+    response_headers,
+    retry_after,
+)
+from ai_cost_observer.server.usage import (
+    KEEPALIVE_EVENT,
+    USAGE_QUERY_HEADERS,
+    USAGE_QUERY_PATHS,
+    USAGE_STREAM_KEEPALIVE_SECONDS,
+    USAGE_STREAM_PATH,
+    UsageFeed,
+    usage_query,
+)
+
+# Request line plus headers; longer heads are rejected with 431
+MAX_HEADER_BYTES = 16 * 1024
+
+# Idle keep-alive connections are closed after this long
+KEEPALIVE_TIMEOUT_SECONDS = 15.0
+
+# Requests handed to the worker pool at once, per worker; more wait on the socket
+_PENDING_PER_WORKER = 4
+
+_REASONS = {
+    100: "Continue",
+    200: "OK",
+    202: "Accepted",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    415: "Unsupported Media Type",
+    429: "Too Many Requests",
+    431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+    501: "Not Implemented",
+    503: "Service Unavailable",
+}
+
+_CONTINUE = b"HTTP/1.1 100 Continue\r\n\r\n"
+
+_STREAM_HEAD = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: text/event-stream\r\n"
+    b"Cache-Control: no-cache\r\n"
+    b"Connection: close\r\n\r\n"
+)
+
+# Unsent bytes a usage stream may buffer; past this, its updates are coalesced
+_STREAM_BUFFER_BYTES = 16 * 1024
+
+
+def _json_response(
+    status: int, payload, keep_alive: bool = True, headers: dict[str, str] | None = None
+) -> bytes:
+    """Serialize a complete HTTP/1.1 response with a JSON body."""
+    body = payload if isinstance(payload, bytes) else json.dumps(payload, separators=(",", ":"))
+    return _response(status, body, keep_alive, headers)
+
+
+def _response(
+    status: int,
+    body: bytes | str | None,
+    keep_alive: bool = True,
+    headers: dict[str, str] | None = None,
+) -> bytes:
+    """Serialize a complete HTTP/1.1 response; a None body sends no entity (e.g. 304)."""
+    head = f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+    if body is not None:
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        head += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+    for name, value in (headers or {}).items():
+        head += f"{name}: {value}\r\n"
+    if not keep_alive:
+        head += "Connection: close\r\n"
+    return head.encode("ascii") + b"\r\n" + (body or b"")
+
+
+@functools.lru_cache(maxsize=64)
+def _error_response(status: int, message: str, keep_alive: bool = True) -> bytes:
+    return _json_response(status, {"error": message}, keep_alive)
+
+
+def _parse_head(head: bytes) -> tuple[str, str, str, dict[str, str]] | None:
+    """Parse a request line and headers. Returns None if malformed."""
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ", 2)
+    except ValueError:
+        return None
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, sep, value = line.partition(":")
+        if not sep:
+            return None
+        headers[name.strip().lower()] = value.strip()
+    return method, target, version, headers
+
+
+class _BodyStream:
+    """Iterates, on a worker thread, a request body that is read on the event loop."""
+
+    def __init__(self, chunks: AsyncIterator[bytes], loop: asyncio.AbstractEventLoop) -> None:
+        self._chunks = chunks
+        self._loop = loop
+        self.exhausted = False
+
+    async def _next(self) -> bytes:
+        return await self._chunks.__anext__()
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            future = asyncio.run_coroutine_threadsafe(self._next(), self._loop)
+            try:
+                chunk = future.result(KEEPALIVE_TIMEOUT_SECONDS * 2)
+            except StopAsyncIteration:
+                self.exhausted = True
+                return
+            yield chunk
+
+    async def aclose(self) -> None:
+        await self._chunks.aclose()
+
+
+async def _body_chunks(
+    reader: asyncio.StreamReader, length: int | None, limit: int
+) -> AsyncIterator[bytes]:
+    """Yield a request body, delimited by Content-Length (`length`) or chunked coding."""
+    if length is not None:
+        while length:
+            chunk = await asyncio.wait_for(
+                reader.read(min(length, READ_CHUNK_BYTES)), KEEPALIVE_TIMEOUT_SECONDS
+            )
+            if not chunk:
+                raise asyncio.IncompleteReadError(b"", length)
+            length -= len(chunk)
+            yield chunk
+        return
+    received = 0
+    while True:
+        line = await asyncio.wait_for(reader.readuntil(b"\r\n"), KEEPALIVE_TIMEOUT_SECONDS)
+        try:
+            size = int(line.split(b";", 1)[0], 16)
+        except ValueError:
+            size = -1
+        if size < 0:
+            raise BodyError(400, "Malformed chunked body")
+        if size == 0:
+            break
+        received += size
+        if received > limit:
+            raise BodyError(413, "Payload too large")
+        while size:
+            chunk = await asyncio.wait_for(
+                reader.read(min(size, READ_CHUNK_BYTES)), KEEPALIVE_TIMEOUT_SECONDS
+            )
+            if not chunk:
+                raise asyncio.IncompleteReadError(b"", size)
+            size -= len(chunk)
+            yield chunk
+        if await asyncio.wait_for(reader.readexactly(2), KEEPALIVE_TIMEOUT_SECONDS) != b"\r\n":
+            raise BodyError(400, "Malformed chunked body")
+    # Trailer fields, up to the blank line
+    while await asyncio.wait_for(reader.readuntil(b"\r\n"), KEEPALIVE_TIMEOUT_SECONDS) != b"\r\n":
+        pass
+
+
+class AsyncReceiver:
+    """Serves the ingest endpoints from one asyncio event loop.
+
+    Connections are kept alive between requests, so an extension flushing
+    every few seconds reuses one socket. GET responses are serialized once
+    at startup. POST bodies are decoded and handled on a bounded thread
+    pool, because the sinks behind them (token tracker, prompt database)
+    block; when every worker is busy, further requests wait in their
+    connection instead of piling up in memory. Bodies up to
+    MAX_PAYLOAD_BYTES with a Content-Length are read before dispatch;
+    larger NDJSON streams and chunked bodies are passed to the worker as
+    they arrive.
+
+    With a `usage` feed, GET /api/usage/stream is a Server-Sent Events
+    stream: a `snapshot` event, then `usage` deltas. One task polls the
+    feed while anyone is subscribed and wakes the subscribers on a change.
+    The usage queries (USAGE_QUERY_PATHS) are answered on the event loop,
+    from memory.
+    """
+
+    def __init__(
+        self,
+        handler: IngestHandler,
+        host: str = "127.0.0.1",
+        port: int = 8080,
+        workers: int = 4,
+        rate_limiter: EndpointRateLimiter | None = None,
+        usage: UsageFeed | None = None,
+    ) -> None:
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self._workers = max(1, workers)
+        self._rate_limiter = rate_limiter or EndpointRateLimiter()
+        self._get_routes = {
+            path: (_json_response(200, payload), _json_response(200, payload, keep_alive=False))
+            for path, payload in (("/", ROOT_PAYLOAD), ("/health", HEALTH_PAYLOAD))
+        }
+        # Validated by ETag: path -> (etag, 304 keep-alive, 304 close)
+        self._not_modified: dict[str, tuple[str, bytes, bytes]] = {}
+        self._add_validated_route(
+            "/api/extension-config",
+            handler.extension_config_body,
+            handler.extension_config_etag,
+            EXTENSION_CONFIG_CACHE_CONTROL,
+        )
+        self._post_paths = frozenset(POST_ENDPOINTS)
+        self._usage = usage
+        self._usage_task: asyncio.Task | None = None
+        # One wake-up event per usage stream subscriber
+        self._subscribers: set[asyncio.Event] = set()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stop_event: asyncio.Event | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._connections: set[asyncio.StreamWriter] = set()
+        self._ready = threading.Event()
+        self._error: BaseException | None = None
+        self._thread: threading.Thread | None = None
+
+    def _add_validated_route(self, path: str, body: bytes, etag: str, cache_control: str) -> None:
+        headers = {"ETag": etag, "Cache-Control": cache_control}
+        self._get_routes[path] = (
+            _json_response(200, body, headers=headers),
+            _json_response(200, body, keep_alive=False, headers=headers),
+        )
+        self._not_modified[path] = (
+            etag,
+            _response(304, None, headers=headers),
+            _response(304, None, keep_alive=False, headers=headers),
+        )
+
+    # --- Lifecycle ---
+
+    def start(self) -> threading.Thread:
+        """Bind and serve in a daemon thread. Raises OSError if the port cannot be bound."""
+        self._thread = threading.Thread(target=self._run, daemon=True, name="http-receiver")
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        return self._thread
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop accepting requests, close open connections and wait for the thread."""
+        if self._loop is not None and self._stop_event is not None:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        try:
+            asyncio.run(self._serve())
+        except BaseException as exc:
+            if not self._ready.is_set():
+                self._error = exc
+                self._ready.set()
+            else:
+                logger.opt(exception=True).error("HTTP receiver stopped unexpectedly")
+
+    async def _serve(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        self._slots = asyncio.Semaphore(self._workers * _PENDING_PER_WORKER)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._workers, thread_name_prefix="http-ingest"
+        )
+        try:
+            server = await asyncio.start_server(
+                self._handle_connection,
+                self.host,
+                self.port,
+                limit=MAX_HEADER_BYTES,
+                reuse_address=True,
+            )
+            self.port = server.sockets[0].getsockname()[1]
+            self._ready.set()
+            await self._stop_event.wait()
+            server.close()
+            for wake in self._subscribers:
+                wake.set()
+            for writer in list(self._connections):
+                writer.close()
+            await server.wait_closed()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    # --- Connections ---
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        peer = writer.get_extra_info("peername")
+        client_ip = peer[0] if peer else "unknown"
+        self._connections.add(writer)
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(
+                        reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT_SECONDS
+                    )
+                except asyncio.LimitOverrunError:
+                    writer.write(_error_response(431, "Headers too large", keep_alive=False))
+                    return
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    return
+                request = _parse_head(head)
+                if request is None:
+                    writer.write(_error_response(400, "Malformed request", keep_alive=False))
+                    return
+                method, target = request[0], request[1]
+                if (
+                    self._usage is not None
+                    and method == "GET"
+                    and target.split("?", 1)[0] == USAGE_STREAM_PATH
+                ):
+                    await self._stream_usage(reader, writer)
+                    return
+                response, keep_alive = await self._respond(request, reader, writer, client_ip)
+                writer.write(response)
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _stream_usage(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Send usage events until the client goes away or the receiver stops."""
+        writer.transport.set_write_buffer_limits(high=_STREAM_BUFFER_BYTES)
+        seq, snapshot, opening = await self._loop.run_in_executor(None, self._usage.opening)
+        writer.write(_STREAM_HEAD + opening)
+        await writer.drain()
+        wake = asyncio.Event()
+        # The client sends nothing more: end of input means it went away
+        gone = asyncio.ensure_future(reader.read(1))
+        gone.add_done_callback(lambda _: wake.set())
+        self._subscribers.add(wake)
+        if self._usage_task is None:
+            self._usage_task = asyncio.create_task(self._poll_usage())
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(wake.wait(), USAGE_STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                wake.clear()
+                if gone.done() or self._stop_event.is_set():
+                    return
+                # While drain() waits on a slow client, later changes coalesce into one event
+                seq, snapshot, message = self._usage.update(seq, snapshot)
+                writer.write(message or KEEPALIVE_EVENT)
+                await writer.drain()
+        finally:
+            self._subscribers.discard(wake)
+            gone.cancel()
+
+    async def _poll_usage(self) -> None:
+        """Poll the usage feed while anyone is subscribed; wake subscribers on a change."""
+        seq = self._usage.seq
+        try:
+            while self._subscribers and not self._stop_event.is_set():
+                current = await self._loop.run_in_executor(None, self._usage.poll)
+                if current != seq:
+                    seq = current
+                    for wake in self._subscribers:
+                        wake.set()
+                await asyncio.sleep(self._usage.interval)
+        except Exception:
+            logger.opt(exception=True).error("Usage stream polling failed")
+        finally:
+            self._usage_task = None
+
+    async def _respond(
+        self,
+        request: tuple[str, str, str, dict[str, str]],
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        client_ip: str,
+    ) -> tuple[bytes, bool]:
+        """Return (response bytes, keep connection open) for one request."""
+        method, target, version, headers = request
+        path, _, query = target.partition("?")
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+        if method == "GET":
+            validated = self._not_modified.get(path)
+            if validated is not None and etag_matches(headers.get("if-none-match"), validated[0]):
+                return validated[1 if keep_alive else 2], keep_alive
+            responses = self._get_routes.get(path)
+            if responses is not None:
+                return responses[0 if keep_alive else 1], keep_alive
+            if self._usage is not None and path in USAGE_QUERY_PATHS:
+                status, body = usage_query(self.handler.telemetry, path, query)
+                return _json_response(status, body, keep_alive, USAGE_QUERY_HEADERS), keep_alive
+            if path in self._post_paths:
+                return _error_response(405, "Method not allowed", keep_alive), keep_alive
+            return _error_response(404, "Not found", keep_alive), keep_alive
+
+        if method != "POST":
+            # A body we don't read would be taken for the next request
+            return _error_response(405, "Method not allowed", False), False
+
+        length = None
+        if "transfer-encoding" in headers:
+            if headers["transfer-encoding"].lower() != "chunked":
+                return _error_response(501, "Unsupported Transfer-Encoding", False), False
+        else:
+            try:
+                length = int(headers.get("content-length", "0"))
+            except ValueError:
+                return _error_response(400, "Invalid Content-Length", False), False
+            if length < 0:
+                return _error_response(400, "Invalid Content-Length", False), False
+        limit = MAX_STREAM_BYTES if is_ndjson(headers.get("content-type")) else MAX_PAYLOAD_BYTES
+        if length is not None and length > limit:
+            return _error_response(413, "Payload too large", False), False
+        expect_continue = headers.get("expect", "").lower() == "100-continue"
+
+        # Small bodies are read up front, so a rejected request keeps its connection
+        buffered = length is not None and length <= MAX_PAYLOAD_BYTES
+        if buffered:
+            if expect_continue:
+                writer.write(_CONTINUE)
+            body = await asyncio.wait_for(reader.readexactly(length), KEEPALIVE_TIMEOUT_SECONDS)
+        rejection = self._reject(path, client_ip, keep_alive and buffered)
+        if rejection is not None:
+            return rejection
+
+        if buffered:
+            chunks = (body,)
+        else:
+            if expect_continue:
+                writer.write(_CONTINUE)
+            chunks = _BodyStream(_body_chunks(reader, length, limit), self._loop)
+        async with self._slots:
+            status, payload = await self._loop.run_in_executor(
+                self._executor, self._dispatch, path, chunks, headers
+            )
+        if not buffered and not chunks.exhausted:
+            # The rest of the body is still on the socket
+            await chunks.aclose()
+            keep_alive = False
+        return _json_response(status, payload, keep_alive, response_headers(payload)), keep_alive
+
+    def _reject(self, path: str, client_ip: str, keep_alive: bool) -> tuple[bytes, bool] | None:
+        """Response for a POST that must not reach the handler, or None."""
+        if path not in self._post_paths:
+            status = 405 if path in self._get_routes else 404
+            message = "Method not allowed" if status == 405 else "Not found"
+            return _error_response(status, message, keep_alive), keep_alive
+        wait = self._rate_limiter.acquire(path, client_ip)
+        if wait:
+            logger.warning("Rate limit exceeded for {} on {}", client_ip, path)
+            response = _json_response(
+                429, rate_limited_body(wait), keep_alive, {"Retry-After": retry_after(wait)}
+            )
+            return response, keep_alive
+        return None
+
+    def _dispatch(self, path: str, chunks, headers: dict[str, str]) -> tuple[int, dict]:
+        """Run the handler for a POST body (on a worker thread)."""
+        try:
+            return self.handler.post(
+                path, chunks, headers.get("content-type"), headers.get("content-encoding")
+            )
+        except Exception:
+            logger.opt(exception=True).error("Error handling ingest request")
+            return 500, {"error": "Internal server error"}
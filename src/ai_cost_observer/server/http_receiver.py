@@ -1,27 +1,56 @@
-"""HTTP receiver — Flask endpoint for Chrome extension browser metrics and token intercepts."""
+"""HTTP receiver — endpoints for Chrome extension browser metrics and token intercepts.
+
+Two front ends serve the same endpoints through `ingest.IngestHandler`: an
+asyncio server (the default, see `async_receiver`) and the Flask app below,
+kept for `http_receiver_mode: flask` and for tests.
+"""
 
 from __future__ import annotations
 
+import functools
 import logging
 import threading
 import time
-from collections import defaultdict
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from loguru import logger
 
 from ai_cost_observer.config import AppConfig
-from ai_cost_observer.detectors.token_tracker import estimate_cost
+from ai_cost_observer.server.ingest import (
+    EXTENSION_CONFIG_CACHE_CONTROL,
+    HEALTH_PAYLOAD,
+    MAX_EVENTS_PER_REQUEST,  # noqa: F401 — re-exported for callers and tests
+    MAX_STREAM_BYTES,
+    READ_CHUNK_BYTES,
+    ROOT_PAYLOAD,
+    EndpointRateLimiter,
+    IngestHandler,
+    etag_matches,
+    rate_limited_body,
+    response_headers,
+    retry_after,
+)
+from ai_cost_observer.server.usage import (
+    KEEPALIVE_EVENT,
+    USAGE_QUERY_HEADERS,
+    USAGE_QUERY_PATHS,
+    USAGE_STREAM_KEEPALIVE_SECONDS,
+    USAGE_STREAM_PATH,
+    UsageFeed,
+    UsageRollup,
+    usage_query,
+)
+from ai_cost_observer.storage.dedup import DedupIndex
 from ai_cost_observer.telemetry import TelemetryManager
 
 # Token tracker reference (set after initialization in main.py)
 _token_tracker = None
 
-# --- Rate limiting and payload size constants ---
-MAX_PAYLOAD_BYTES = 1_048_576  # 1 MB max request body
-RATE_LIMIT_REQUESTS = 60  # max requests per window
-RATE_LIMIT_WINDOW_SECONDS = 60  # window duration
-MAX_EVENTS_PER_REQUEST = 100  # max events in a single batch
+# Handler of the running receiver, so shutdown can drain its ingest queue
+_ingest_handler: IngestHandler | None = None
+
+# Unix socket for local reporters, served alongside the HTTP receiver
+_socket_receiver = None
 
 
 def set_token_tracker(tracker) -> None:
@@ -30,43 +59,37 @@ def set_token_tracker(tracker) -> None:
     _token_tracker = tracker
 
 
-class _RateLimiter:
-    """Simple in-memory per-IP sliding window rate limiter."""
-
-    def __init__(
-        self,
-        max_requests: int = RATE_LIMIT_REQUESTS,
-        window_seconds: int = RATE_LIMIT_WINDOW_SECONDS,
-    ) -> None:
-        self._max_requests = max_requests
-        self._window_seconds = window_seconds
-        self._requests: dict[str, list[float]] = defaultdict(list)
-        self._lock = threading.Lock()
-
-    def is_allowed(self, client_ip: str) -> bool:
-        """Check if a request from client_ip is allowed under the rate limit."""
-        now = time.monotonic()
-        cutoff = now - self._window_seconds
-
-        with self._lock:
-            timestamps = self._requests[client_ip]
-            # Remove old entries
-            self._requests[client_ip] = [t for t in timestamps if t > cutoff]
-            if len(self._requests[client_ip]) >= self._max_requests:
-                return False
-            self._requests[client_ip].append(now)
-            return True
-
-
-def create_app(config: AppConfig, telemetry: TelemetryManager) -> Flask:
-    """Create the Flask app for receiving browser extension metrics."""
+def _current_token_tracker():
+    return _token_tracker
+
+
+def _reply(status: int, body: dict):
+    response = jsonify(body)
+    response.headers.update(response_headers(body))
+    return response, status
+
+
+def create_app(
+    config: AppConfig,
+    telemetry: TelemetryManager,
+    handler: IngestHandler | None = None,
+    usage: UsageFeed | None = None,
+) -> Flask:
+    """Create the Flask app for receiving browser extension metrics.
+
+    Without a `handler`, events are recorded inline (no ingest queue).
+    With a `usage` feed, GET /api/usage/stream serves live usage events
+    (one Werkzeug thread per subscriber), and the usage queries are
+    answered from `telemetry.usage`.
+    """
     app = Flask(__name__)
     app.config["TESTING"] = False
-    app.config["MAX_CONTENT_LENGTH"] = MAX_PAYLOAD_BYTES
+    # NDJSON streams may be this large; IngestHandler.post applies the per-format limits
+    app.config["MAX_CONTENT_LENGTH"] = MAX_STREAM_BYTES
 
-    domain_lookup = {d["domain"]: d for d in config.ai_domains}
-    _extension_connected = False
-    _rate_limiter = _RateLimiter()
+    if handler is None:
+        handler = IngestHandler(config, telemetry, _current_token_tracker)
+    _rate_limiter = EndpointRateLimiter(config.http_rate_limits)
 
     @app.before_request
     def check_rate_limit_and_size():
@@ -76,188 +99,207 @@ def create_app(config: AppConfig, telemetry: TelemetryManager) -> Flask:
         if request.method == "POST":
             # Rate limiting (localhost only, but protects against runaway extensions)
             client_ip = request.remote_addr or "unknown"
-            if not _rate_limiter.is_allowed(client_ip):
-                logger.warning("Rate limit exceeded for {}", client_ip)
-                return jsonify({"error": "Rate limit exceeded"}), 429
+            wait = _rate_limiter.acquire(request.path, client_ip)
+            if wait:
+                logger.warning("Rate limit exceeded for {} on {}", client_ip, request.path)
+                response = jsonify(rate_limited_body(wait))
+                response.headers["Retry-After"] = retry_after(wait)
+                return response, 429
 
     @app.route("/", methods=["GET"])
     def root():
         logger.debug("Browser visited root endpoint")
-        return jsonify(
-            {
-                "service": "ai-cost-observer",
-                "status": "running",
-                "endpoints": [
-                    "/health",
-                    "/metrics/browser",
-                    "/api/tokens",
-                    "/api/extension-config",
-                ],
-            }
-        )
+        return jsonify(ROOT_PAYLOAD)
 
     @app.route("/health", methods=["GET"])
     def health():
-        return jsonify({"status": "healthy"})
+        return jsonify(HEALTH_PAYLOAD)
 
     @app.route("/api/extension-config", methods=["GET"])
     def extension_config():
-        """Serve config for the Chrome extension (domains + API patterns)."""
-        domains = [d["domain"] for d in config.ai_domains]
-        api_patterns = config.api_intercept_patterns
-        cost_rates = {d["domain"]: d.get("cost_per_hour", 0) for d in config.ai_domains}
-        return jsonify(
-            {
-                "domains": domains,
-                "api_patterns": api_patterns,
-                "cost_rates": cost_rates,
-            }
+        """Serve config for the Chrome extension (domains + API patterns).
+
+        The body is precomputed; a matching If-None-Match gets 304 Not Modified.
+        """
+        etag = handler.extension_config_etag
+        headers = {"ETag": etag, "Cache-Control": EXTENSION_CONFIG_CACHE_CONTROL}
+        if etag_matches(request.headers.get("If-None-Match"), etag):
+            return Response(status=304, headers=headers)
+        return Response(handler.extension_config_body, mimetype="application/json", headers=headers)
+
+    def receive_post():
+        """Pass the body to the handler as it is read (JSON or NDJSON, optionally gzip)."""
+        chunks = iter(functools.partial(request.stream.read, READ_CHUNK_BYTES), b"")
+        return _reply(
+            *handler.post(
+                request.path,
+                chunks,
+                request.headers.get("Content-Type"),
+                request.headers.get("Content-Encoding"),
+            )
         )
 
-    @app.route("/metrics/browser", methods=["POST"])
-    def receive_browser_metrics():
-        nonlocal _extension_connected
-        if not _extension_connected:
-            _extension_connected = True
-            logger.info("Chrome extension connected.")
-
-        data = request.get_json(silent=True)
-        if not data:
-            return jsonify({"error": "Invalid JSON"}), 400
-
-        events = data.get("events", [])
-        if not isinstance(events, list):
-            return jsonify({"error": "events must be a list"}), 400
-        if len(events) > MAX_EVENTS_PER_REQUEST:
-            return jsonify({"error": f"Too many events (max {MAX_EVENTS_PER_REQUEST})"}), 400
-
-        for event in events:
-            domain = event.get("domain", "")
-            duration_seconds = event.get("duration_seconds", 0)
-            visit_count = event.get("visit_count", 0)
-
-            if not domain or not isinstance(duration_seconds, (int, float)):
-                continue
-
-            domain_cfg = domain_lookup.get(domain)
-            if not domain_cfg:
-                # Not a tracked AI domain — ignore
-                continue
-
-            labels = {
-                "ai.domain": domain,
-                "ai.category": domain_cfg.get("category", "unknown"),
-                "browser.name": event.get("browser", "chrome"),
-                "usage.source": "extension",
-            }
-
-            if duration_seconds > 0:
-                telemetry.browser_domain_active_duration.add(duration_seconds, labels)
-
-            if visit_count > 0:
-                telemetry.browser_domain_visit_count.add(visit_count, labels)
-
-            cost_per_hour = domain_cfg.get("cost_per_hour", 0)
-            if cost_per_hour > 0 and duration_seconds > 0:
-                cost_labels = {
-                    "ai.domain": domain,
-                    "ai.category": domain_cfg.get("category", "unknown"),
-                }
-                cost = cost_per_hour * (duration_seconds / 3600)
-                telemetry.browser_domain_estimated_cost.add(cost, cost_labels)
-
-            logger.debug(
-                "Extension: {} — {:.0f}s, {} visits",
-                domain,
-                duration_seconds,
-                visit_count,
+    if usage is not None:
+
+        @app.route(USAGE_STREAM_PATH, methods=["GET"])
+        def usage_stream():
+            """Server-Sent Events: a `snapshot`, then `usage` deltas as they happen."""
+
+            def events():
+                seq, snapshot, opening = usage.opening()
+                yield opening
+                idle = 0.0
+                while True:
+                    time.sleep(usage.interval)
+                    usage.poll()
+                    seq, snapshot, message = usage.update(seq, snapshot)
+                    if message:
+                        idle = 0.0
+                        yield message
+                        continue
+                    idle += usage.interval
+                    if idle >= USAGE_STREAM_KEEPALIVE_SECONDS:
+                        idle = 0.0
+                        yield KEEPALIVE_EVENT
+
+            return Response(
+                events(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"}
+            )
+
+        def usage_endpoint():
+            status, body = usage_query(
+                telemetry, request.path, request.query_string.decode("latin-1")
             )
+            response = jsonify(body)
+            response.headers.update(USAGE_QUERY_HEADERS)
+            return response, status
 
-        return jsonify({"status": "ok", "processed": len(events)})
+        for path in sorted(USAGE_QUERY_PATHS):
+            app.add_url_rule(path, endpoint=path, view_func=usage_endpoint, methods=["GET"])
+
+    @app.route("/metrics/browser", methods=["POST"])
+    def receive_browser_metrics():
+        return receive_post()
 
     @app.route("/api/tokens", methods=["POST"])
     def receive_token_events():
-        data = request.get_json(silent=True)
-        if not data:
-            return jsonify({"error": "Invalid JSON"}), 400
-
-        events = data.get("events", [])
-        if not isinstance(events, list):
-            return jsonify({"error": "events must be a list"}), 400
-        if len(events) > MAX_EVENTS_PER_REQUEST:
-            return jsonify({"error": f"Too many events (max {MAX_EVENTS_PER_REQUEST})"}), 400
-
-        processed = 0
-        for event in events:
-            event_type = event.get("type", "")
-            tool = event.get("tool", "unknown")
-            model = event.get("model", "unknown")
-            input_tokens = event.get("input_tokens", 0)
-            output_tokens = event.get("output_tokens", 0)
-            prompt_text = event.get("prompt_text")
-            response_text = event.get("response_text")
-
-            if event_type == "api_intercept":
-                if _token_tracker:
-                    _token_tracker.record_api_intercept(
-                        tool_name=tool,
-                        model=model,
-                        input_tokens=input_tokens,
-                        output_tokens=output_tokens,
-                        prompt_text=prompt_text,
-                        response_text=response_text,
-                    )
-                else:
-                    # No token tracker — record OTel metrics directly including cost
-                    labels = {"tool.name": tool, "model.name": model}
-                    if input_tokens > 0:
-                        telemetry.tokens_input_total.add(input_tokens, labels)
-                    if output_tokens > 0:
-                        telemetry.tokens_output_total.add(output_tokens, labels)
-                    cost = estimate_cost(model, input_tokens, output_tokens)
-                    if cost > 0:
-                        telemetry.tokens_cost_usd_total.add(cost, labels)
-                    telemetry.prompt_count_total.add(1, {"tool.name": tool, "source": "browser"})
-
-                processed += 1
-                logger.debug(
-                    "Token intercept: {} model={} in={} out={}",
-                    tool,
-                    model,
-                    input_tokens,
-                    output_tokens,
-                )
-
-        return jsonify({"status": "ok", "processed": processed})
+        return receive_post()
 
     return app
 
 
-def start_http_receiver(config: AppConfig, telemetry: TelemetryManager) -> threading.Thread | None:
-    """Start the Flask HTTP receiver in a daemon thread. Returns the thread, or None on failure."""
+def _start_flask_receiver(config: AppConfig, handler: IngestHandler) -> threading.Thread:
+    # Suppress noisy werkzeug request logs and Flask startup banner
+    # ("* Serving Flask app ..." / "* Debug mode: off" use click.echo, not logging)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    import flask.cli
+
+    flask.cli.show_server_banner = lambda *_a, **_kw: None
+
+    app = create_app(config, handler.telemetry, handler, _usage_feed(handler.telemetry))
+
+    thread = threading.Thread(
+        target=lambda: app.run(
+            host="127.0.0.1",
+            port=config.http_receiver_port,
+            use_reloader=False,
+            threaded=True,
+        ),
+        daemon=True,
+        name="http-receiver",
+    )
+    thread.start()
+    return thread
+
+
+def _open_dedup_index(config: AppConfig) -> DedupIndex | None:
+    if config.ingest_dedup_window_seconds <= 0:
+        return None
     try:
-        # Suppress noisy werkzeug request logs and Flask startup banner
-        # ("* Serving Flask app ..." / "* Debug mode: off" use click.echo, not logging)
-        logging.getLogger("werkzeug").setLevel(logging.WARNING)
-        import flask.cli
+        return DedupIndex(config.state_dir, window_seconds=config.ingest_dedup_window_seconds)
+    except Exception:
+        logger.opt(exception=True).warning(
+            "Failed to open ingest dedup index — retries may double count"
+        )
+        return None
+
 
-        flask.cli.show_server_banner = lambda *_a, **_kw: None
+def _usage_feed(telemetry: TelemetryManager) -> UsageFeed | None:
+    if not isinstance(telemetry, TelemetryManager):
+        return None
+    return UsageFeed(UsageRollup(telemetry))
 
-        app = create_app(config, telemetry)
 
-        thread = threading.Thread(
-            target=lambda: app.run(
-                host="127.0.0.1",
+def _start_socket_receiver(config: AppConfig, handler: IngestHandler) -> None:
+    global _socket_receiver
+    from ai_cost_observer.server.socket_receiver import SocketReceiver, socket_path
+
+    path = socket_path(config)
+    if path is None:
+        return
+    receiver = SocketReceiver(handler, path)
+    try:
+        receiver.start()
+    except Exception:
+        logger.opt(exception=True).warning("Failed to open ingest socket {}", path)
+        return
+    _socket_receiver = receiver
+    logger.debug("Ingest socket listening on {}", path)
+
+
+def start_http_receiver(config: AppConfig, telemetry: TelemetryManager) -> threading.Thread | None:
+    """Start the HTTP receiver in a daemon thread. Returns the thread, or None on failure.
+
+    `config.http_receiver_mode` picks the front end: "asyncio" (default) or
+    "flask" (Werkzeug's threaded development server). Both answer POSTs once
+    events are queued; `stop_http_receiver` drains the queue at shutdown.
+    The ingest socket for local reporters (`ingest_socket_path`) shares the
+    same handler and queue. Both front ends serve the live usage stream
+    and the usage queries (`server.usage`) from the telemetry's in-memory
+    reader and aggregate.
+    """
+    global _ingest_handler
+    try:
+        handler = IngestHandler(
+            config,
+            telemetry,
+            _current_token_tracker,
+            queue_size=config.ingest_queue_size,
+            dedup=_open_dedup_index(config),
+        )
+        _ingest_handler = handler
+        telemetry.watch_ingest_queue(handler.queue_stats)
+        if config.http_receiver_mode == "flask":
+            thread = _start_flask_receiver(config, handler)
+        else:
+            from ai_cost_observer.server.async_receiver import AsyncReceiver
+
+            receiver = AsyncReceiver(
+                handler,
                 port=config.http_receiver_port,
-                use_reloader=False,
-                threaded=True,
-            ),
-            daemon=True,
-            name="http-receiver",
+                workers=config.http_receiver_workers,
+                rate_limiter=EndpointRateLimiter(config.http_rate_limits),
+                usage=_usage_feed(telemetry),
+            )
+            thread = receiver.start()
+        _start_socket_receiver(config, handler)
+        logger.debug(
+            "HTTP receiver ({}) started on 127.0.0.1:{}",
+            config.http_receiver_mode,
+            config.http_receiver_port,
         )
-        thread.start()
-        logger.debug("HTTP receiver started on 127.0.0.1:{}", config.http_receiver_port)
         return thread
     except Exception:
         logger.opt(exception=True).error("Failed to start HTTP receiver")
         return None
+
+
+def stop_http_receiver() -> None:
+    """Close the ingest socket, record the events still in the ingest queue and stop its worker."""
+    global _ingest_handler, _socket_receiver
+    if _socket_receiver is not None:
+        _socket_receiver.stop()
+        _socket_receiver = None
+    if _ingest_handler is not None:
+        _ingest_handler.close()
+        _ingest_handler = None
@@ -0,0 +1,827 @@
+"""Ingest logic shared by the HTTP receivers — validates and records extension payloads."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from collections.abc import Callable, Iterable, Iterator
+
+from loguru import logger
+
+from ai_cost_observer.config import AppConfig
+from ai_cost_observer.detectors.shell_history import compile_command_patterns, count_commands
+from ai_cost_observer.pricing import estimate_cost
+from ai_cost_observer.storage.dedup import DedupIndex
+from ai_cost_observer.telemetry import TelemetryManager
+
+# --- Rate limiting and payload size constants ---
+MAX_PAYLOAD_BYTES = 1_048_576  # 1 MB max request body
+RATE_LIMIT_REQUESTS = 60  # burst size; refills over the window
+RATE_LIMIT_WINDOW_SECONDS = 60  # window duration
+MAX_EVENTS_PER_REQUEST = 100  # max events in a single batch
+MAX_STREAM_BYTES = 32 * 1_048_576  # NDJSON body, before and after decompression
+MAX_REPORTED_ERRORS = 100  # per-event errors listed in an NDJSON response
+READ_CHUNK_BYTES = 65_536  # body bytes read (and inflated) at a time
+MAX_EVENT_ID_LENGTH = 128  # longer (or non-scalar) ids are ignored
+NDJSON_TYPES = frozenset({"application/x-ndjson", "application/ndjson", "application/jsonl"})
+RATE_LIMIT_MAX_CLIENTS = 1024  # clients tracked at once (least recently seen evicted)
+
+# --- Ingest queue constants ---
+INGEST_QUEUE_SIZE = 10_000  # events buffered between the handlers and the sinks
+INGEST_BATCH_SIZE = 500  # events handed to the sinks per drain
+INGEST_RETRY_AFTER_SECONDS = 5  # suggested back-off when the queue is full
+
+# Event types local reporters may send over the ingest socket, and their ingest kind
+LOCAL_EVENT_KINDS = {"cli_command": "cli", "api_intercept": "tokens"}
+
+# api_intercept fields coerced to non-negative ints when an event is accepted
+TOKEN_COUNT_FIELDS = ("input_tokens", "output_tokens")
+
+ENDPOINTS = ["/health", "/metrics/browser", "/api/tokens", "/api/extension-config"]
+POST_ENDPOINTS = ("/metrics/browser", "/api/tokens")
+
+# Clients may keep the extension config but must revalidate it (If-None-Match) before use
+EXTENSION_CONFIG_CACHE_CONTROL = "no-cache"
+
+ROOT_PAYLOAD = {"service": "ai-cost-observer", "status": "running", "endpoints": ENDPOINTS}
+HEALTH_PAYLOAD = {"status": "healthy"}
+
+
+class RateLimiter:
+    """Per-client token bucket rate limiter.
+
+    Each client may burst up to `max_requests` requests, and its bucket
+    refills at `max_requests / window_seconds` tokens per second, so the
+    long-run rate stays at `max_requests` per window. A client costs one
+    (tokens, timestamp) pair. The table keeps at most `max_clients`
+    entries, evicting the least recently seen; an evicted client comes back
+    with a full bucket.
+    """
+
+    def __init__(
+        self,
+        max_requests: int = RATE_LIMIT_REQUESTS,
+        window_seconds: float = RATE_LIMIT_WINDOW_SECONDS,
+        max_clients: int = RATE_LIMIT_MAX_CLIENTS,
+    ) -> None:
+        self._capacity = float(max(1, max_requests))
+        self._rate = self._capacity / max(window_seconds, 1e-3)
+        self._max_clients = max(1, max_clients)
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, client_ip: str) -> float:
+        """Take a token for client_ip. Returns 0.0 if allowed, else seconds until the next one."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.pop(client_ip, None)
+            if bucket is None:
+                tokens = self._capacity
+                if len(self._buckets) >= self._max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                tokens, last = bucket
+                tokens = min(self._capacity, tokens + (now - last) * self._rate)
+            if tokens >= 1.0:
+                self._buckets[client_ip] = (tokens - 1.0, now)
+                return 0.0
+            self._buckets[client_ip] = (tokens, now)
+            return (1.0 - tokens) / self._rate
+
+    def is_allowed(self, client_ip: str) -> bool:
+        """Check if a request from client_ip is allowed under the rate limit."""
+        return self.acquire(client_ip) == 0.0
+
+
+class EndpointRateLimiter:
+    """One RateLimiter per endpoint path, configured from `http_rate_limits`.
+
+    `limits` maps a path to {"requests": N, "window_seconds": S}; missing
+    keys come from the "default" entry. Every POST endpoint has its own
+    buckets, and unknown paths share one more.
+    """
+
+    def __init__(self, limits: dict | None = None) -> None:
+        limits = limits or {}
+        default = limits.get("default", {})
+        self._default = self._limiter(default, {})
+        paths = set(POST_ENDPOINTS) | {p for p, cfg in limits.items() if isinstance(cfg, dict)}
+        paths.discard("default")
+        self._by_path = {path: self._limiter(limits.get(path, {}), default) for path in paths}
+
+    @staticmethod
+    def _limiter(cfg: dict, fallback: dict) -> RateLimiter:
+        return RateLimiter(
+            max_requests=cfg.get("requests", fallback.get("requests", RATE_LIMIT_REQUESTS)),
+            window_seconds=cfg.get(
+                "window_seconds", fallback.get("window_seconds", RATE_LIMIT_WINDOW_SECONDS)
+            ),
+        )
+
+    def acquire(self, path: str, client_ip: str) -> float:
+        """Take a token from the bucket for (path, client). Returns 0.0 or seconds to wait."""
+        return self._by_path.get(path, self._default).acquire(client_ip)
+
+
+def retry_after(seconds: float) -> str:
+    """Retry-After header value (whole seconds, at least 1) for a wait in seconds."""
+    return str(max(1, math.ceil(seconds)))
+
+
+def rate_limited_body(seconds: float) -> dict:
+    """JSON body of a 429 response; `retry_after` gives the exact wait."""
+    return {"error": "Rate limit exceeded", "retry_after": round(seconds, 3)}
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """True if an If-None-Match header value matches `etag` (weak comparison, or "*")."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def overloaded_body() -> dict:
+    """JSON body of a 503 response when the ingest queue is full."""
+    return {"error": "Ingest queue full", "retry_after": INGEST_RETRY_AFTER_SECONDS}
+
+
+def record_failed_body() -> dict:
+    """JSON body of a 500 response when recording inline failed; the events can be resent."""
+    return {"error": "Failed to record events"}
+
+
+def response_headers(body: dict) -> dict[str, str]:
+    """Extra headers for a handler response: Retry-After when the body asks for a back-off."""
+    if "retry_after" in body:
+        return {"Retry-After": retry_after(body["retry_after"])}
+    return {}
+
+
+class IngestQueue:
+    """Bounded FIFO of validated event batches, drained by one worker thread.
+
+    Capacity counts events, not requests. `offer` is all-or-nothing: a batch
+    that does not fit is refused and its events counted as dropped, so the
+    receiver can answer 503 and the client keeps the batch for a retry. The
+    worker passes up to `batch_size` events at a time to `sink` as a list of
+    (kind, events) pairs. Depth includes the batch being recorded, so
+    `flush()` returns once everything offered has reached the sinks.
+    """
+
+    def __init__(
+        self,
+        sink: Callable[[list[tuple[str, list]]], None],
+        maxsize: int = INGEST_QUEUE_SIZE,
+        batch_size: int = INGEST_BATCH_SIZE,
+    ) -> None:
+        self._sink = sink
+        self._maxsize = max(1, maxsize)
+        self._batch_size = max(1, batch_size)
+        self._items: deque[tuple[str, list]] = deque()
+        self._depth = 0
+        self._dropped = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="ingest-worker")
+        self._thread.start()
+
+    def offer(self, kind: str, events: list) -> bool:
+        """Queue a batch. Returns False (and counts the events as dropped) if it does not fit."""
+        with self._cond:
+            if self._closed or self._depth + len(events) > self._maxsize:
+                self._dropped += len(events)
+                return False
+            self._items.append((kind, events))
+            self._depth += len(events)
+            self._cond.notify()
+            return True
+
+    def stats(self) -> dict:
+        """Events waiting or being recorded, and events refused since startup."""
+        with self._cond:
+            return {"depth": self._depth, "dropped": self._dropped}
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Wait until every queued event has been recorded. Returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._depth == 0, timeout)
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Refuse new batches, record the ones already queued and stop the worker."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._items and not self._closed:
+                    self._cond.wait()
+                if not self._items:
+                    return
+                batch: list[tuple[str, list]] = []
+                size = 0
+                while self._items and (
+                    not batch or size + len(self._items[0][1]) <= self._batch_size
+                ):
+                    kind, events = self._items.popleft()
+                    batch.append((kind, events))
+                    size += len(events)
+            try:
+                self._sink(batch)
+            except Exception:
+                logger.opt(exception=True).error("Error recording ingested events")
+            finally:
+                with self._cond:
+                    self._depth -= size
+                    self._cond.notify_all()
+
+
+class BodyError(Exception):
+    """A request body that cannot be read: bad encoding, or over its size limit."""
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def is_ndjson(content_type: str | None) -> bool:
+    """True for the media types of a newline-delimited JSON event stream."""
+    return (content_type or "").split(";", 1)[0].strip().lower() in NDJSON_TYPES
+
+
+def _decoded(chunks: Iterable[bytes], gzip: bool, limit: int) -> Iterator[bytes]:
+    """Yield body bytes, inflating gzip as they arrive.
+
+    Raises BodyError once more than `limit` bytes are received or produced,
+    so a small compressed body cannot expand without bound.
+    """
+    inflater = zlib.decompressobj(wbits=31) if gzip else None
+    received = produced = 0
+    for chunk in chunks:
+        received += len(chunk)
+        if received > limit:
+            raise BodyError(413, "Payload too large")
+        if inflater is None:
+            if chunk:
+                yield chunk
+            continue
+        data = chunk
+        while data and not inflater.eof:
+            try:
+                piece = inflater.decompress(data, READ_CHUNK_BYTES)
+            except zlib.error:
+                raise BodyError(400, "Invalid gzip body") from None
+            produced += len(piece)
+            if produced > limit:
+                raise BodyError(413, "Payload too large")
+            if piece:
+                yield piece
+            data = inflater.unconsumed_tail
+    if inflater is not None and received and not inflater.eof:
+        raise BodyError(400, "Truncated gzip body")
+
+
+def _lines(data: Iterable[bytes]) -> Iterator[bytes]:
+    """Split a byte stream into lines, holding at most one partial line."""
+    pending = b""
+    for piece in data:
+        pending += piece
+        start = 0
+        while (end := pending.find(b"\n", start)) >= 0:
+            yield pending[start:end]
+            start = end + 1
+        pending = pending[start:]
+        if len(pending) > MAX_PAYLOAD_BYTES:
+            raise BodyError(413, "NDJSON line too long")
+    if pending:
+        yield pending
+
+
+def _event_list(data) -> tuple[list | None, dict | None]:
+    """Return (events, None) for a valid batch payload, or (None, error body)."""
+    if not data or not isinstance(data, dict):
+        return None, {"error": "Invalid JSON"}
+    events = data.get("events", [])
+    if not isinstance(events, list):
+        return None, {"error": "events must be a list"}
+    if len(events) > MAX_EVENTS_PER_REQUEST:
+        return None, {"error": f"Too many events (max {MAX_EVENTS_PER_REQUEST})"}
+    batch_id = _event_id(data.get("batch_id"))
+    if batch_id is not None:
+        # Events without their own id are identified by their place in the batch
+        for index, event in enumerate(events):
+            if isinstance(event, dict) and "id" not in event:
+                event["id"] = f"{batch_id}:{index}"
+    return events, None
+
+
+def _token_count(value) -> int | None:
+    """A token count as an int (whole numbers, numeric strings included), else None."""
+    if isinstance(value, str):
+        value = value.strip()
+        return int(value) if value.isascii() and value.isdigit() else None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    if isinstance(value, float) and not value.is_integer():
+        return None
+    return int(value) if value >= 0 else None
+
+
+def _intercept_error(event: dict) -> str | None:
+    """Why an api_intercept event cannot be recorded, or None.
+
+    Token counts are coerced to ints in place (absent counts to 0), so the
+    sinks never see a value that `estimate_cost` or the counters reject.
+    """
+    for field in ("tool", "model"):
+        if not isinstance(event.get(field, ""), str):
+            return f"{field} must be a string"
+    for field in ("prompt_text", "response_text"):
+        if not isinstance(event.get(field) or "", str):
+            return f"{field} must be a string"
+    for field in TOKEN_COUNT_FIELDS:
+        count = _token_count(event.get(field, 0))
+        if count is None:
+            return f"{field} must be a non-negative integer"
+        event[field] = count
+    return None
+
+
+def _event_id(value) -> str | None:
+    """An event or batch id as a string, or None if absent or unusable."""
+    if isinstance(value, bool) or not isinstance(value, (str, int)):
+        return None
+    value = str(value)
+    return value if 0 < len(value) <= MAX_EVENT_ID_LENGTH else None
+
+
+class IngestHandler:
+    """Records browser metrics and token intercepts posted by the Chrome extension.
+
+    Handlers take the decoded JSON body and return (HTTP status, JSON body),
+    so any server front end can use them. `token_tracker` returns the current
+    TokenTracker (or None); it is looked up when events are recorded because
+    main.py sets it after the receiver is created.
+
+    With `queue_size` > 0, handlers only validate: events go to an
+    IngestQueue and the request is answered 202, or 503 with a `retry_after`
+    when the queue is full. Otherwise events are recorded before returning.
+
+    Events may carry an `id` (or a JSON batch a `batch_id`, which numbers
+    its events). Responses then list the `accepted` ids and the
+    `duplicates` skipped; with a `dedup` index, an id is only ever recorded
+    once within its window, so a client can retry a batch whose response it
+    lost.
+
+    Local reporters (shell hooks, CLI wrappers) send `cli_command` and
+    `api_intercept` events over the ingest socket; see `local_events`.
+    """
+
+    def __init__(
+        self,
+        config: AppConfig,
+        telemetry: TelemetryManager,
+        token_tracker: Callable[[], object | None] = lambda: None,
+        queue_size: int = 0,
+        dedup: DedupIndex | None = None,
+    ) -> None:
+        self.config = config
+        self.telemetry = telemetry
+        self._token_tracker = token_tracker
+        self._domain_lookup = {d["domain"]: d for d in config.ai_domains}
+        self._command_patterns = compile_command_patterns(config.ai_cli_tools)
+        self._extension_connected = False
+        self._queue = IngestQueue(self._record, queue_size) if queue_size > 0 else None
+        self._dedup = dedup
+        self._documents = {
+            "/metrics/browser": self.browser_metrics,
+            "/api/tokens": self.token_events,
+        }
+        self._stream_kinds = {"/metrics/browser": "browser", "/api/tokens": "tokens"}
+
+        # The config is fixed for the handler's lifetime: serialize it once.
+        # The ETag hashes the content, so it survives restarts with the same config.
+        self.extension_config_body = json.dumps(
+            self.extension_config(), separators=(",", ":"), sort_keys=True
+        ).encode("utf-8")
+        digest = hashlib.blake2b(self.extension_config_body, digest_size=16).hexdigest()
+        self.extension_config_etag = f'"{digest}"'
+
+    def extension_config(self) -> dict:
+        """Config for the Chrome extension (domains + API patterns)."""
+        return {
+            "domains": [d["domain"] for d in self.config.ai_domains],
+            "api_patterns": self.config.api_intercept_patterns,
+            "cost_rates": {d["domain"]: d.get("cost_per_hour", 0) for d in self.config.ai_domains},
+        }
+
+    # --- Queue ---
+
+    def queue_stats(self) -> dict:
+        """Ingest queue depth and dropped event count (zeros when recording inline)."""
+        if self._queue is None:
+            return {"depth": 0, "dropped": 0}
+        return self._queue.stats()
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Wait until queued events have been recorded. Returns False on timeout."""
+        return self._queue is None or self._queue.flush(timeout)
+
+    def close(self) -> None:
+        """Record whatever is still queued and stop the ingest worker."""
+        if self._queue is not None:
+            self._queue.close()
+        if self._dedup is not None:
+            self._dedup.close()
+
+    def _accept(self, kind: str, events: list, ack: dict) -> tuple[int, int]:
+        """Record or queue the events not seen before; add their ids to `ack`.
+
+        Returns (status, events taken): 200 (recorded, or nothing new),
+        202 (queued), 503 (queue full, nothing taken) or 500 (recording
+        inline failed, nothing taken).
+        """
+        ids = [_event_id(e.get("id")) for e in events]
+        keys = [f"{kind}:{i}" for i in ids if i is not None]
+        if not keys:
+            fresh, accepted, duplicates = events, [], []
+        else:
+            claimed = iter(
+                self._dedup.claim(keys) if self._dedup is not None else [True] * len(keys)
+            )
+            fresh, accepted, duplicates = [], [], []
+            for event, event_id in zip(events, ids):
+                if event_id is None:
+                    fresh.append(event)
+                elif next(claimed):
+                    fresh.append(event)
+                    accepted.append(event_id)
+                else:
+                    duplicates.append(event_id)
+        status = 200
+        if fresh:
+            # Ids of events that are not taken are released, so a retry is accepted
+            if self._queue is None:
+                # _record has already released the ids of events it failed to record
+                if self._record([(kind, fresh)]) < len(fresh):
+                    return 500, 0
+            elif self._queue.offer(kind, fresh):
+                status = 202
+            else:
+                logger.warning("Ingest queue full — refusing {} {} events", len(fresh), kind)
+                self._release(kind, accepted)
+                return 503, 0
+        if keys:
+            ack.setdefault("accepted", []).extend(accepted)
+            ack.setdefault("duplicates", []).extend(duplicates)
+        return status, len(fresh)
+
+    def _release(self, kind: str, event_ids: list[str]) -> None:
+        if self._dedup is not None and event_ids:
+            self._dedup.release(f"{kind}:{i}" for i in event_ids)
+
+    def _submit(self, kind: str, events: list, errors: list | None = None) -> tuple[int, dict]:
+        ack: dict = {"errors": errors} if errors else {}
+        if not events:
+            return 200, {"status": "ok", "processed": 0, **ack}
+        status, taken = self._accept(kind, events, ack)
+        if status == 503:
+            return 503, overloaded_body()
+        if status == 500:
+            return 500, {"consumed": 0, **record_failed_body(), **ack}
+        if status == 202:
+            return 202, {"status": "accepted", "queued": taken, **ack}
+        return 200, {"status": "ok", "processed": taken, **ack}
+
+    def _note_extension(self) -> None:
+        if not self._extension_connected:
+            self._extension_connected = True
+            logger.info("Chrome extension connected.")
+
+    # --- Handlers ---
+
+    def post(
+        self,
+        path: str,
+        chunks: Iterable[bytes],
+        content_type: str | None = "",
+        content_encoding: str | None = "",
+    ) -> tuple[int, dict]:
+        """Handle the body of a POST to one of POST_ENDPOINTS.
+
+        `chunks` yields the raw body. It is either one JSON document
+        ({"events": [...]}, at most MAX_PAYLOAD_BYTES once inflated) or, for
+        an NDJSON content type, one event per line, parsed as it arrives.
+        `Content-Encoding: gzip` is supported for both.
+        """
+        coding = (content_encoding or "").strip().lower()
+        if coding not in ("", "identity", "gzip"):
+            return 415, {"error": f"Unsupported Content-Encoding: {content_encoding}"}
+        gzip = coding == "gzip"
+        if is_ndjson(content_type):
+            return self._stream(self._stream_kinds[path], chunks, gzip)
+        try:
+            body = b"".join(_decoded(chunks, gzip, MAX_PAYLOAD_BYTES))
+        except BodyError as exc:
+            return exc.status, {"error": str(exc)}
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            data = None
+        return self.document(path, data)
+
+    def document(self, path: str, data) -> tuple[int, dict]:
+        """Handle an already decoded JSON document posted to one of POST_ENDPOINTS."""
+        return self._documents[path](data)
+
+    def _stream(self, kind: str, chunks: Iterable[bytes], gzip: bool) -> tuple[int, dict]:
+        """Accept an NDJSON event stream, MAX_EVENTS_PER_REQUEST events at a time.
+
+        Lines that are not JSON objects are reported by line number and
+        skipped. If the queue fills, recording fails or the body turns out to
+        be unreadable, the response carries `consumed`: the lines before it
+        were accepted, and the client should resend from the line after.
+        """
+        if kind == "browser":
+            self._note_extension()
+        group: list[dict] = []
+        consumed = received = accepted = error_count = 0
+        errors: list[dict] = []
+        statuses = set()
+        ack: dict = {}
+
+        def result(status: int, **extra) -> tuple[int, dict]:
+            queued = 202 in statuses
+            body = {
+                "status": "accepted" if queued else "ok",
+                "received": received,
+                "queued" if queued else "processed": accepted,
+                "errors": errors,
+                "error_count": error_count,
+                **ack,
+                **extra,
+            }
+            return status, body
+
+        try:
+            for line_no, line in enumerate(_lines(_decoded(chunks, gzip, MAX_STREAM_BYTES)), 1):
+                if not line.strip():
+                    continue
+                received += 1
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    event = None
+                    message = "Invalid JSON"
+                else:
+                    message = "Event must be a JSON object"
+                if isinstance(event, dict):
+                    if kind == "browser":
+                        message = None
+                    elif event.get("type", "") != "api_intercept":
+                        continue
+                    else:
+                        message = _intercept_error(event)
+                if message is not None:
+                    error_count += 1
+                    if len(errors) < MAX_REPORTED_ERRORS:
+                        errors.append({"line": line_no, "error": message})
+                    continue
+                group.append(event)
+                if len(group) >= MAX_EVENTS_PER_REQUEST:
+                    status, taken = self._accept(kind, group, ack)
+                    if status == 503:
+                        return result(503, consumed=consumed, **overloaded_body())
+                    if status == 500:
+                        return result(500, consumed=consumed, **record_failed_body())
+                    statuses.add(status)
+                    accepted += taken
+                    group = []
+                    consumed = line_no
+        except BodyError as exc:
+            return result(exc.status, consumed=consumed, error=str(exc))
+
+        if group:
+            status, taken = self._accept(kind, group, ack)
+            if status == 503:
+                return result(503, consumed=consumed, **overloaded_body())
+            if status == 500:
+                return result(500, consumed=consumed, **record_failed_body())
+            statuses.add(status)
+            accepted += taken
+        if received and error_count == received:
+            return result(400, error="No valid events")
+        return result(202 if 202 in statuses else 200)
+
+    def browser_metrics(self, data) -> tuple[int, dict]:
+        """Accept a batch of browser domain usage events."""
+        self._note_extension()
+
+        events, error = _event_list(data)
+        if error:
+            return 400, error
+        return self._submit("browser", [e for e in events if isinstance(e, dict)])
+
+    def token_events(self, data) -> tuple[int, dict]:
+        """Accept a batch of intercepted API calls (token counts and optional texts).
+
+        Intercepts with unusable fields are skipped and listed under `errors`
+        by their index in the batch.
+        """
+        events, error = _event_list(data)
+        if error:
+            return 400, error
+        intercepts, errors = [], []
+        for index, event in enumerate(events):
+            if isinstance(event, dict) and event.get("type", "") == "api_intercept":
+                message = _intercept_error(event)
+                if message is None:
+                    intercepts.append(event)
+                else:
+                    errors.append({"index": index, "error": message})
+        return self._submit("tokens", intercepts, errors)
+
+    def local_events(self, events: list) -> tuple[int, dict]:
+        """Accept events from a local reporter: shell commands and API intercepts.
+
+        Events of other types are ignored, and intercepts with unusable
+        fields are listed under `errors` by index. Returns 503 if the queue
+        is full, and 500 if recording failed; `accepted` then lists the ids of
+        the events that were recorded before it.
+        """
+        groups: dict[str, list] = {}
+        errors = []
+        for index, event in enumerate(events):
+            if isinstance(event, dict):
+                kind = LOCAL_EVENT_KINDS.get(event.get("type"))
+                message = _intercept_error(event) if kind == "tokens" else None
+                if message is not None:
+                    errors.append({"index": index, "error": message})
+                elif kind is not None:
+                    groups.setdefault(kind, []).append(event)
+        ack: dict = {"errors": errors} if errors else {}
+        statuses = set()
+        taken = 0
+        for kind, group in groups.items():
+            status, count = self._accept(kind, group, ack)
+            if status == 503:
+                return 503, overloaded_body()
+            if status == 500:
+                return 500, {**record_failed_body(), **ack}
+            statuses.add(status)
+            taken += count
+        if 202 in statuses:
+            return 202, {"status": "accepted", "queued": taken, **ack}
+        return 200, {"status": "ok", "processed": taken, **ack}
+
+    # --- Sinks ---
+
+    def _record(self, batch: list[tuple[str, list]]) -> int:
+        """Record (kind, events) pairs. Returns the number of events recorded.
+
+        Each pair is recorded on its own: one that fails is logged and
+        skipped, and the rest of a merged queue batch is still recorded.
+        The dedup ids of recorded events are committed; those of failed
+        ones are released, so a retry is accepted.
+        """
+        tracker = self._token_tracker()
+        processed = tokens = 0
+        recorded: list[str] = []
+        failed: list[str] = []
+        for kind, events in batch:
+            keys = [
+                f"{kind}:{event_id}"
+                for event_id in (_event_id(e.get("id")) for e in events)
+                if event_id is not None
+            ]
+            try:
+                if kind == "browser":
+                    self._record_browser(events)
+                elif kind == "cli":
+                    self._record_commands(events)
+                else:
+                    self._record_tokens(events, tracker)
+                    tokens += len(events)
+            except Exception:
+                logger.opt(exception=True).error("Error recording {} {} events", len(events), kind)
+                failed.extend(keys)
+                continue
+            processed += len(events)
+            recorded.extend(keys)
+        if tracker and tokens:
+            try:
+                tracker.flush_prompts()
+            except Exception:
+                logger.opt(exception=True).error("Error flushing ingested prompts")
+        if self._dedup is not None:
+            self._dedup.commit(recorded)
+            self._dedup.release(failed)
+        return processed
+
+    def _record_browser(self, events: list[dict]) -> None:
+        telemetry = self.telemetry
+        for event in events:
+            domain = event.get("domain", "")
+            duration_seconds = event.get("duration_seconds", 0)
+            visit_count = event.get("visit_count", 0)
+
+            if not domain or not isinstance(duration_seconds, (int, float)):
+                continue
+
+            domain_cfg = self._domain_lookup.get(domain)
+            if not domain_cfg:
+                # Not a tracked AI domain — ignore
+                continue
+
+            labels = {
+                "ai.domain": domain,
+                "ai.category": domain_cfg.get("category", "unknown"),
+                "browser.name": event.get("browser", "chrome"),
+                "usage.source": "extension",
+            }
+
+            if duration_seconds > 0:
+                telemetry.browser_domain_active_duration.add(duration_seconds, labels)
+
+            if visit_count > 0:
+                telemetry.browser_domain_visit_count.add(visit_count, labels)
+
+            cost_per_hour = domain_cfg.get("cost_per_hour", 0)
+            if cost_per_hour > 0 and duration_seconds > 0:
+                cost_labels = {
+                    "ai.domain": domain,
+                    "ai.category": domain_cfg.get("category", "unknown"),
+                }
+                cost = cost_per_hour * (duration_seconds / 3600)
+                telemetry.browser_domain_estimated_cost.add(cost, cost_labels)
+                telemetry.usage.add_cost("browser", domain, cost)
+
+            logger.debug(
+                "Extension: {} — {:.0f}s, {} visits",
+                domain,
+                duration_seconds,
+                visit_count,
+            )
+
+    def _record_commands(self, events: list[dict]) -> None:
+        commands = [e["command"] for e in events if isinstance(e.get("command"), str)]
+        for tool_name, (count, tool_cfg) in count_commands(
+            commands, self._command_patterns
+        ).items():
+            labels = {
+                "cli.name": tool_name,
+                "cli.category": tool_cfg.get("category", "unknown"),
+            }
+            self.telemetry.cli_command_count.add(count, labels)
+            logger.debug("Reporter: {} commands for {}", count, tool_name)
+
+    def _record_tokens(self, events: list[dict], tracker) -> None:
+        telemetry = self.telemetry
+        for event in events:
+            tool = event.get("tool", "unknown")
+            model = event.get("model", "unknown")
+            input_tokens = event.get("input_tokens", 0)
+            output_tokens = event.get("output_tokens", 0)
+
+            if tracker:
+                tracker.record_api_intercept(
+                    tool_name=tool,
+                    model=model,
+                    input_tokens=input_tokens,
+                    output_tokens=output_tokens,
+                    prompt_text=event.get("prompt_text"),
+                    response_text=event.get("response_text"),
+                )
+            else:
+                # No token tracker — record OTel metrics directly including cost
+                labels = {"tool.name": tool, "model.name": model}
+                if input_tokens > 0:
+                    telemetry.tokens_input_total.add(input_tokens, labels)
+                if output_tokens > 0:
+                    telemetry.tokens_output_total.add(output_tokens, labels)
+                cost = estimate_cost(model, input_tokens, output_tokens)
+                if cost > 0:
+                    telemetry.tokens_cost_usd_total.add(cost, labels)
+                telemetry.prompt_count_total.add(1, {"tool.name": tool, "source": "browser"})
+                telemetry.usage.add_tokens(
+                    tool, model, "browser", input_tokens, output_tokens, cost
+                )
+
+            logger.debug(
+                "Token intercept: {} model={} in={} out={}",
+                tool,
+                model,
+                input_tokens,
+                output_tokens,
+            )
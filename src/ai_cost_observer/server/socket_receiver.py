@@ -0,0 +1,218 @@
+"""Unix socket receiver — NDJSON events from local reporters (shell hooks, CLI wrappers)."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import socket
+import stat
+import threading
+from pathlib import Path
+
+from loguru import logger
+
+from ai_cost_observer.config import AppConfig
+from ai_cost_observer.reporter import SOCKET_NAME
+from ai_cost_observer.server.ingest import (
+    EXTENSION_CONFIG_CACHE_CONTROL,
+    HEALTH_PAYLOAD,
+    MAX_EVENTS_PER_REQUEST,
+    MAX_PAYLOAD_BYTES,
+    POST_ENDPOINTS,
+    ROOT_PAYLOAD,
+    IngestHandler,
+    etag_matches,
+    response_headers,
+)
+
+# Events read from a connection are handed over once it pauses for this long
+FLUSH_DELAY_SECONDS = 0.05
+
+# At shutdown, clients get this long to finish writing before their connection is closed
+STOP_GRACE_SECONDS = 1.0
+
+
+def socket_path(config: AppConfig) -> Path | None:
+    """Path of the ingest socket from `ingest_socket_path`, or None when it is disabled."""
+    if not config.ingest_socket_path or not hasattr(socket, "AF_UNIX") or os.name == "nt":
+        return None
+    if config.ingest_socket_path == "auto":
+        return Path(config.state_dir) / SOCKET_NAME
+    return Path(config.ingest_socket_path).expanduser()
+
+
+class SocketReceiver:
+    """Accepts newline-delimited JSON events on a Unix domain socket.
+
+    Events are one-way: a client connects, writes one event per line and
+    closes without waiting for a reply, so a shell hook costs a connect and
+    a write. Lines are passed to `IngestHandler.local_events` in groups of
+    up to MAX_EVENTS_PER_REQUEST, at the end of the connection or when it
+    pauses, on the loop's default executor. Invalid lines are skipped.
+
+    A line with a `path` is a request instead, mirroring the HTTP endpoints
+    for clients that need an answer (the native messaging host):
+    {"id", "path", "body", "if_none_match"} gets one reply line
+    {"id", "status", "body", "headers"}. Events sent before a request are
+    handed over before it is answered.
+
+    The socket is only accessible to the current user (mode 0600).
+    """
+
+    def __init__(self, handler: IngestHandler, path: Path | str) -> None:
+        self.handler = handler
+        self.path = Path(path)
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stop_event: asyncio.Event | None = None
+        self._connections: dict[asyncio.StreamWriter, asyncio.Task] = {}
+        self._ready = threading.Event()
+        self._error: BaseException | None = None
+        self._thread: threading.Thread | None = None
+
+    # --- Lifecycle ---
+
+    def start(self) -> threading.Thread:
+        """Bind and serve in a daemon thread. Raises OSError if the socket cannot be bound."""
+        self._thread = threading.Thread(target=self._run, daemon=True, name="ingest-socket")
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        return self._thread
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop accepting events, hand over those already read and remove the socket."""
+        if self._loop is not None and self._stop_event is not None:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        try:
+            asyncio.run(self._serve())
+        except BaseException as exc:
+            if not self._ready.is_set():
+                self._error = exc
+                self._ready.set()
+            else:
+                logger.opt(exception=True).error("Ingest socket stopped unexpectedly")
+
+    def _remove_stale_socket(self) -> None:
+        """Unlink a socket left by an agent that did not shut down cleanly."""
+        try:
+            if not stat.S_ISSOCK(self.path.lstat().st_mode):
+                raise FileExistsError(f"{self.path} exists and is not a socket")
+        except FileNotFoundError:
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(str(self.path))
+            except OSError:
+                self.path.unlink(missing_ok=True)
+                return
+        raise OSError(f"Another agent is listening on {self.path}")
+
+    async def _serve(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._remove_stale_socket()
+        server = await asyncio.start_unix_server(
+            self._handle_connection, str(self.path), limit=MAX_PAYLOAD_BYTES
+        )
+        try:
+            os.chmod(self.path, 0o600)
+            self._ready.set()
+            await self._stop_event.wait()
+            # Accept connections still in the listen backlog, then stop listening.
+            # Events already sent are handed over before the handler's queue is closed.
+            await asyncio.sleep(FLUSH_DELAY_SECONDS)
+            server.close()
+            if self._connections:
+                await asyncio.wait(list(self._connections.values()), timeout=STOP_GRACE_SECONDS)
+            for writer in list(self._connections):
+                writer.close()
+            if self._connections:
+                await asyncio.wait(list(self._connections.values()), timeout=STOP_GRACE_SECONDS)
+            await server.wait_closed()
+        finally:
+            self.path.unlink(missing_ok=True)
+
+    # --- Connections ---
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self._connections[writer] = asyncio.current_task()
+        events: list = []
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), FLUSH_DELAY_SECONDS)
+                except asyncio.TimeoutError:
+                    # The client paused: hand over what it sent so far. (asyncio.TimeoutError
+                    # is not the builtin TimeoutError before Python 3.11)
+                    events = await self._flush(events)
+                    continue
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    logger.debug("Ingest socket: skipping invalid line")
+                    continue
+                if isinstance(message, dict) and "path" in message:
+                    events = await self._flush(events)
+                    reply = await self._loop.run_in_executor(None, self._request, message)
+                    writer.write(json.dumps(reply, separators=(",", ":")).encode("utf-8") + b"\n")
+                    await writer.drain()
+                    continue
+                events.append(message)
+                if len(events) >= MAX_EVENTS_PER_REQUEST:
+                    events = await self._flush(events)
+        except ValueError:
+            logger.warning("Ingest socket: line over {} bytes, closing", MAX_PAYLOAD_BYTES)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            await self._flush(events)
+            self._connections.pop(writer, None)
+            writer.close()
+
+    def _request(self, message: dict) -> dict:
+        """Answer a request line like the HTTP receiver answers the same path."""
+        path = message["path"]
+        headers: dict[str, str] = {}
+        try:
+            if path in POST_ENDPOINTS:
+                status, body = self.handler.document(path, message.get("body"))
+                headers = response_headers(body)
+            elif path == "/api/extension-config":
+                etag = self.handler.extension_config_etag
+                headers = {"ETag": etag, "Cache-Control": EXTENSION_CONFIG_CACHE_CONTROL}
+                if etag_matches(message.get("if_none_match"), etag):
+                    status, body = 304, None
+                else:
+                    status, body = 200, self.handler.extension_config()
+            elif path == "/health":
+                status, body = 200, HEALTH_PAYLOAD
+            elif path == "/":
+                status, body = 200, ROOT_PAYLOAD
+            else:
+                status, body = 404, {"error": "Not found"}
+        except Exception:
+            logger.opt(exception=True).error("Error handling socket request for {}", path)
+            status, body = 500, {"error": "Internal server error"}
+        reply = {"status": status, "body": body, "headers": headers}
+        if "id" in message:
+            reply["id"] = message["id"]
+        return reply
+
+    async def _flush(self, events: list) -> list:
+        if events:
+            try:
+                await self._loop.run_in_executor(None, self.handler.local_events, events)
+            except Exception:
+                logger.opt(exception=True).error("Error recording {} socket events", len(events))
+        return []
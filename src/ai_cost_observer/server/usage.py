@@ -0,0 +1,198 @@
+"""Usage endpoints — recent usage queries and the live usage stream."""
+
+from __future__ import annotations
+
+import json
+import re
+import threading
+import time
+from datetime import datetime
+from urllib.parse import parse_qs
+
+from ai_cost_observer.telemetry import TelemetryManager
+
+USAGE_STREAM_PATH = "/api/usage/stream"
+
+# Answered from TelemetryManager.usage (hourly buckets) and the running-tool snapshots
+USAGE_QUERY_PATHS = frozenset({"/api/usage", "/api/usage/by-model", "/api/running"})
+
+# Query results change with every event; clients must not reuse them
+USAGE_QUERY_HEADERS = {"Cache-Control": "no-store"}
+
+# A new snapshot is taken at most this often, however many subscribers there are
+USAGE_STREAM_INTERVAL_SECONDS = 1.0
+
+# Idle streams get a comment this often, so dead clients are noticed and proxies keep them open
+USAGE_STREAM_KEEPALIVE_SECONDS = 15.0
+
+# EventSource reconnect delay sent to clients
+USAGE_STREAM_RETRY_MS = 5000
+
+# Window the live stream reports, as accepted by /api/usage
+USAGE_STREAM_WINDOW = "today"
+
+# Fields of a per-model entry in stream snapshots
+_MODEL_FIELDS = ("input_tokens", "output_tokens", "cost_usd", "prompts")
+
+KEEPALIVE_EVENT = b": keepalive\n\n"
+
+
+def _round(value: float | int) -> float | int:
+    return round(value, 6) if isinstance(value, float) else value
+
+
+def usage_delta(old: dict, new: dict) -> dict:
+    """What changed from `old` to `new`: numbers as increments, other values whole.
+
+    Nested dicts are compared key by key and unchanged entries are left out,
+    so a client applies a delta by adding numbers and replacing the rest.
+    """
+    delta = {}
+    for key, value in new.items():
+        before = old.get(key)
+        if isinstance(value, dict):
+            changed = usage_delta(before if isinstance(before, dict) else {}, value)
+            if changed:
+                delta[key] = changed
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            change = _round(value - (before or 0))
+            if change:
+                delta[key] = change
+        elif value != before:
+            delta[key] = value
+    return delta
+
+
+def window_start(window: str, now: float, days: int) -> float:
+    """Start of a query window: "today" (local midnight), "<N>h" or "<N>d". Raises ValueError."""
+    if window == "today":
+        midnight = datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0)
+        return midnight.timestamp()
+    match = re.fullmatch(r"([1-9][0-9]{0,4})([hd])", window)
+    if match is None:
+        raise ValueError(f"Invalid window {window!r} (today, <N>h or <N>d)")
+    seconds = int(match[1]) * (3600 if match[2] == "h" else 86400)
+    if seconds > days * 86400:
+        raise ValueError(f"Window {window!r} exceeds the {days} days kept in memory")
+    return now - seconds
+
+
+def usage_query(telemetry: TelemetryManager, path: str, query: str = "") -> tuple[int, dict]:
+    """Answer GET /api/usage, /api/usage/by-model (?window=today|<N>h|<N>d) or /api/running."""
+    if path == "/api/running":
+        return 200, telemetry.running_tools()
+    window = parse_qs(query).get("window", ["today"])[-1]
+    try:
+        since = window_start(window, time.time(), telemetry.usage.days)
+    except ValueError as exc:
+        return 400, {"error": str(exc)}
+    if path == "/api/usage":
+        body = telemetry.usage.usage(since)
+    else:
+        body = telemetry.usage.by_model(since)
+    return 200, {"window": window, **body}
+
+
+def sse_event(event: str, seq: int, data: dict, retry_ms: int | None = None) -> bytes:
+    """Serialize one Server-Sent Event."""
+    head = f"retry: {retry_ms}\n" if retry_ms is not None else ""
+    body = json.dumps(data, separators=(",", ":"))
+    return f"{head}id: {seq}\nevent: {event}\ndata: {body}\n\n".encode("utf-8")
+
+
+def _change_event(seq: int, old: dict, new: dict) -> bytes | None:
+    """The event taking a subscriber from `old` to `new`, or None if nothing changed."""
+    if old.get("since") != new.get("since"):
+        return sse_event("snapshot", seq, new)
+    delta = usage_delta(old, new)
+    return sse_event("usage", seq, delta) if delta else None
+
+
+class UsageRollup:
+    """Usage of the current window, read from TelemetryManager.usage.
+
+    The same hourly buckets answer /api/usage, so the stream and the query
+    endpoints report the same totals for a window.
+    """
+
+    def __init__(self, telemetry: TelemetryManager, window: str = USAGE_STREAM_WINDOW) -> None:
+        self.telemetry = telemetry
+        self.window = window
+
+    def snapshot(self) -> dict:
+        """Current totals, spend per source, tokens per tool and model, running tools."""
+        usage = self.telemetry.usage
+        since = window_start(self.window, time.time(), usage.days)
+        current = usage.usage(since)
+        models: dict[str, dict[str, dict]] = {}
+        for entry in usage.by_model(since)["models"]:
+            models.setdefault(entry["tool"], {})[entry["model"]] = {
+                field: entry[field] for field in _MODEL_FIELDS
+            }
+        return {
+            "window": self.window,
+            "since": current["since"],
+            "totals": current["totals"],
+            "cost_usd": current["cost_usd"],
+            "estimated_since": current["estimated_since"],
+            "models": models,
+            "running": self.telemetry.running_tools(),
+        }
+
+
+class UsageFeed:
+    """Shares one usage snapshot per interval among all stream subscribers.
+
+    `poll` takes at most one snapshot per `interval`, however many callers
+    there are; each change gets a sequence number and its delta is
+    serialized once. A subscriber that kept up is sent that shared message.
+    One that fell behind (its socket was slow to drain) is sent a single
+    delta from the last snapshot it got to the current one, so updates never
+    queue up for a slow consumer. When the window moves on (a new day), the
+    change is sent as a new `snapshot` event for clients to start over from.
+    """
+
+    def __init__(self, rollup: UsageRollup, interval: float = USAGE_STREAM_INTERVAL_SECONDS):
+        self.rollup = rollup
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._polled = 0.0
+        # (sequence number, snapshot, event taking seq - 1 to seq); replaced whole,
+        # so readers on the event loop never wait for the lock
+        self._state: tuple[int, dict, bytes] | None = None
+
+    @property
+    def seq(self) -> int:
+        state = self._state
+        return state[0] if state is not None else 0
+
+    def poll(self) -> int:
+        """Take a new snapshot unless one was taken less than `interval` ago. Returns seq."""
+        with self._lock:
+            now = time.monotonic()
+            if self._state is None or now - self._polled >= self.interval:
+                self._polled = now
+                snapshot = self.rollup.snapshot()
+                if self._state is None:
+                    self._state = (1, snapshot, b"")
+                else:
+                    seq, previous, _ = self._state
+                    message = _change_event(seq + 1, previous, snapshot)
+                    if message is not None:
+                        self._state = (seq + 1, snapshot, message)
+            return self._state[0]
+
+    def opening(self) -> tuple[int, dict, bytes]:
+        """(seq, snapshot, first event) for a new subscriber."""
+        self.poll()
+        seq, snapshot, _ = self._state
+        return seq, snapshot, sse_event("snapshot", seq, snapshot, USAGE_STREAM_RETRY_MS)
+
+    def update(self, seq: int, snapshot: dict) -> tuple[int, dict, bytes | None]:
+        """Bring a subscriber at (seq, snapshot) up to date: (seq, snapshot, event or None)."""
+        current_seq, current, message = self._state
+        if current_seq == seq:
+            return seq, snapshot, None
+        if current_seq == seq + 1:
+            return current_seq, current, message
+        return current_seq, current, _change_event(current_seq, snapshot, current)
@@ -0,0 +1,281 @@
+"""Checkpoint store — crash-safe incremental reader state in a single SQLite (WAL) file."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from loguru import logger
+
+CHECKPOINT_DB_NAME = "checkpoints.db"
+
+# Number of leading bytes hashed to fingerprint a file's identity
+FINGERPRINT_BYTES = 4096
+
+_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS file_checkpoints (
+    namespace TEXT NOT NULL,
+    dev INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    fp_len INTEGER NOT NULL,
+    fingerprint BLOB,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (namespace, dev, inode)
+);
+
+CREATE INDEX IF NOT EXISTS idx_file_checkpoints_path ON file_checkpoints(namespace, path);
+
+CREATE TABLE IF NOT EXISTS checkpoints (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+"""
+
+
+@dataclass
+class FileCheckpoint:
+    """Read position in one file, identified by (dev, inode) and a head fingerprint."""
+
+    dev: int
+    inode: int
+    path: str
+    offset: int
+    fp_len: int
+    fingerprint: bytes | None
+
+
+def _fingerprint(path: Path, length: int) -> bytes | None:
+    """Hash the first `length` bytes of path, or None if it cannot be read."""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(length)
+    except OSError:
+        return None
+    if len(head) < length:
+        return None
+    return hashlib.blake2b(head, digest_size=16).digest()
+
+
+class CheckpointStore:
+    """Transactional checkpoint store shared by all incremental readers.
+
+    Each reader uses its own namespace. Two kinds of state are kept:
+
+    - File checkpoints: byte offsets keyed by (dev, inode), so a renamed file
+      keeps its position and a rotated one (new inode at the same path) starts
+      over. A fingerprint of the first bytes already consumed detects inode
+      reuse and in-place rewrites; a same-path file with a new inode but the
+      same head (e.g. zsh rewriting its history via rename) resumes too.
+    - Values: small JSON-serializable scalars such as a rowid or timestamp.
+
+    Changes are staged in memory and `commit()` writes only the dirty entries
+    in one transaction, so a crash leaves either the old or the new state.
+    """
+
+    def __init__(self, state_dir: Path | str, namespace: str) -> None:
+        self.namespace = namespace
+        self.db_path = Path(state_dir) / CHECKPOINT_DB_NAME
+        self._lock = threading.Lock()
+        self._by_inode: dict[tuple[int, int], FileCheckpoint] = {}
+        self._by_path: dict[str, FileCheckpoint] = {}
+        self._values: dict[str, object] = {}
+        self._dirty_files: dict[tuple[int, int], FileCheckpoint] = {}
+        self._deleted_files: set[tuple[int, int]] = set()
+        self._dirty_values: set[str] = set()
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), timeout=10, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA_SQL)
+        self._load()
+
+    def _load(self) -> None:
+        rows = self._conn.execute(
+            "SELECT dev, inode, path, offset, fp_len, fingerprint FROM file_checkpoints "
+            "WHERE namespace = ?",
+            (self.namespace,),
+        )
+        for dev, inode, path, offset, fp_len, fingerprint in rows:
+            cp = FileCheckpoint(dev, inode, path, offset, fp_len, fingerprint)
+            self._by_inode[(dev, inode)] = cp
+            self._by_path[path] = cp
+        for key, value in self._conn.execute(
+            "SELECT key, value FROM checkpoints WHERE namespace = ?", (self.namespace,)
+        ):
+            try:
+                self._values[key] = json.loads(value)
+            except ValueError:
+                logger.debug("Ignoring corrupt checkpoint value {}/{}", self.namespace, key)
+
+    # --- File offsets ---
+
+    def is_empty(self) -> bool:
+        """True if this namespace has no persisted state (e.g. before a legacy import)."""
+        return not self._by_inode and not self._values
+
+    def file_offset(self, path: Path, st: os.stat_result | None = None) -> int:
+        """Return the byte offset to resume reading `path` from (0 if unknown or rotated)."""
+        if st is None:
+            try:
+                st = path.stat()
+            except OSError:
+                return 0
+        key = (st.st_dev, st.st_ino)
+        with self._lock:
+            cp = self._by_inode.get(key)
+            same_inode = cp is not None
+            if cp is None:
+                cp = self._by_path.get(str(path))
+        if cp is None:
+            return 0
+        if st.st_size < cp.offset:
+            return 0  # truncated
+        if same_inode and st.st_size == cp.offset:
+            return cp.offset  # nothing new — skip the fingerprint read
+        if cp.fingerprint is not None and _fingerprint(path, cp.fp_len) != cp.fingerprint:
+            return 0  # inode reused or rewritten in place
+        if not same_inode and cp.fingerprint is None:
+            return 0  # different file at the same path, nothing to match it against
+        return cp.offset
+
+    def set_file_offset(self, path: Path, offset: int, st: os.stat_result | None = None) -> None:
+        """Stage a new offset for `path` (persisted on the next `commit`)."""
+        if st is None:
+            try:
+                st = path.stat()
+            except OSError:
+                return
+        key = (st.st_dev, st.st_ino)
+        path_str = str(path)
+        with self._lock:
+            old = self._by_inode.get(key)
+            fp_len = min(offset, FINGERPRINT_BYTES)
+            if old is not None and old.fp_len == fp_len and old.fingerprint is not None:
+                fingerprint = old.fingerprint
+            else:
+                fingerprint = _fingerprint(path, fp_len) if fp_len else None
+            cp = FileCheckpoint(st.st_dev, st.st_ino, path_str, offset, fp_len, fingerprint)
+
+            # A different inode previously seen at this path was rotated away
+            previous = self._by_path.get(path_str)
+            if previous is not None and (previous.dev, previous.inode) != key:
+                self._forget(previous)
+            if old is not None and old.path != path_str:
+                self._by_path.pop(old.path, None)  # renamed
+
+            self._by_inode[key] = cp
+            self._by_path[path_str] = cp
+            self._dirty_files[key] = cp
+            self._deleted_files.discard(key)
+
+    def import_file_offsets(self, offsets: dict[str, int]) -> int:
+        """Stage offsets from a legacy path-keyed state file. Returns how many were kept.
+
+        Files that no longer exist or are now shorter than their offset are dropped.
+        """
+        imported = 0
+        for path_str, offset in offsets.items():
+            path = Path(path_str)
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            if st.st_size >= int(offset):
+                self.set_file_offset(path, int(offset), st)
+                imported += 1
+        return imported
+
+    def _forget(self, cp: FileCheckpoint) -> None:
+        key = (cp.dev, cp.inode)
+        self._by_inode.pop(key, None)
+        if self._by_path.get(cp.path) is cp:
+            self._by_path.pop(cp.path, None)
+        self._dirty_files.pop(key, None)
+        self._deleted_files.add(key)
+
+    # --- Values ---
+
+    def get(self, key: str, default=None):
+        """Return a stored value, or default."""
+        with self._lock:
+            return self._values.get(key, default)
+
+    def values(self) -> dict[str, object]:
+        """Return a copy of all stored values in this namespace."""
+        with self._lock:
+            return dict(self._values)
+
+    def set(self, key: str, value) -> None:
+        """Stage a JSON-serializable value (persisted on the next `commit`)."""
+        with self._lock:
+            if self._values.get(key, object()) == value:
+                return
+            self._values[key] = value
+            self._dirty_values.add(key)
+
+    # --- Persistence ---
+
+    def commit(self) -> int:
+        """Write staged changes in a single transaction. Returns the number of rows written."""
+        with self._lock:
+            files = list(self._dirty_files.values())
+            deleted = list(self._deleted_files)
+            values = [(k, json.dumps(self._values[k])) for k in self._dirty_values]
+            if not files and not deleted and not values:
+                return 0
+            now = time.time()
+            try:
+                with self._conn:
+                    self._conn.executemany(
+                        "DELETE FROM file_checkpoints "
+                        "WHERE namespace = ? AND dev = ? AND inode = ?",
+                        [(self.namespace, dev, inode) for dev, inode in deleted],
+                    )
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO file_checkpoints "
+                        "(namespace, dev, inode, path, offset, fp_len, fingerprint, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        [
+                            (
+                                self.namespace,
+                                cp.dev,
+                                cp.inode,
+                                cp.path,
+                                cp.offset,
+                                cp.fp_len,
+                                cp.fingerprint,
+                                now,
+                            )
+                            for cp in files
+                        ],
+                    )
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO checkpoints (namespace, key, value, updated_at) "
+                        "VALUES (?, ?, ?, ?)",
+                        [(self.namespace, k, v, now) for k, v in values],
+                    )
+            except sqlite3.Error:
+                logger.opt(exception=True).debug("Failed to commit {} checkpoints", self.namespace)
+                return 0
+            self._dirty_files.clear()
+            self._deleted_files.clear()
+            self._dirty_values.clear()
+            return len(files) + len(deleted) + len(values)
+
+    def close(self) -> None:
+        """Commit pending changes and close the connection."""
+        self.commit()
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,126 @@
+"""Text compression for prompt storage — zstd (optionally dictionary-trained) or zlib."""
+
+from __future__ import annotations
+
+import threading
+import zlib
+
+from loguru import logger
+
+try:
+    import zstandard as zstd
+except ImportError:  # optional: pip install ai-cost-observer[perf]
+    zstd = None
+
+# Codec ids, stored in the header byte of each compressed value
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+
+# Shorter texts are stored as-is: the codec overhead outweighs the savings
+COMPRESS_MIN_BYTES = 256
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+DICT_SIZE_BYTES = 64 * 1024
+
+
+class TextCompressor:
+    """Compresses text payloads and decompresses any codec it knows about.
+
+    `codec` is "auto" (zstd when installed, else zlib), "zstd", "zlib" or
+    "none". Decompression always accepts every codec, so changing the setting
+    never makes old rows unreadable. zstd frames carry the id of the trained
+    dictionary they were compressed with, if any; dictionaries registered with
+    `add_dictionary` are looked up by that id.
+    """
+
+    def __init__(self, codec: str = "auto") -> None:
+        if codec == "auto":
+            codec = "zstd" if zstd is not None else "zlib"
+        if codec == "zstd" and zstd is None:
+            logger.warning("zstandard not installed — compressing prompt text with zlib")
+            codec = "zlib"
+        if codec not in ("zstd", "zlib", "none"):
+            logger.warning("Unknown prompt compression codec {!r} — using zlib", codec)
+            codec = "zlib"
+        self.codec = codec
+        self._dicts: dict[int, object] = {}
+        self._active_dict_id = 0
+        # zstd (de)compressor objects are not thread-safe: keep one set per thread
+        self._local = threading.local()
+
+    @property
+    def active_dictionary_id(self) -> int:
+        """Id of the dictionary new values are compressed with (0 if none)."""
+        return self._active_dict_id
+
+    def add_dictionary(self, data: bytes, activate: bool = True) -> int:
+        """Register a trained zstd dictionary. Returns its id (0 if zstd is unavailable)."""
+        if zstd is None:
+            return 0
+        dictionary = zstd.ZstdCompressionDict(data)
+        dict_id = dictionary.dict_id()
+        self._dicts[dict_id] = dictionary
+        if activate and self.codec == "zstd":
+            self._active_dict_id = dict_id
+        return dict_id
+
+    @staticmethod
+    def train_dictionary(samples: list[bytes], dict_size: int = DICT_SIZE_BYTES) -> bytes | None:
+        """Train a zstd dictionary from sample payloads, or None if not possible."""
+        if zstd is None or not samples:
+            return None
+        try:
+            return zstd.train_dictionary(dict_size, samples).as_bytes()
+        except zstd.ZstdError:
+            logger.opt(exception=True).debug("zstd dictionary training failed")
+            return None
+
+    def compress(self, data: bytes) -> tuple[int, bytes]:
+        """Return (codec id, payload); CODEC_NONE when compression would not help."""
+        if self.codec == "none" or len(data) < COMPRESS_MIN_BYTES:
+            return CODEC_NONE, data
+        if self.codec == "zstd":
+            codec, payload = CODEC_ZSTD, self._zstd_compressor().compress(data)
+        else:
+            codec, payload = CODEC_ZLIB, zlib.compress(data, ZLIB_LEVEL)
+        if len(payload) >= len(data):
+            return CODEC_NONE, data
+        return codec, payload
+
+    def decompress(self, codec: int, payload: bytes) -> bytes:
+        """Invert `compress`. Raises ValueError for an unknown or unavailable codec."""
+        if codec == CODEC_NONE:
+            return payload
+        if codec == CODEC_ZLIB:
+            return zlib.decompress(payload)
+        if codec == CODEC_ZSTD:
+            if zstd is None:
+                raise ValueError("zstd-compressed text but zstandard is not installed")
+            dict_id = zstd.get_frame_parameters(payload).dict_id
+            return self._zstd_decompressor(dict_id).decompress(payload)
+        raise ValueError(f"unknown compression codec {codec}")
+
+    def _zstd_compressor(self):
+        cached = getattr(self._local, "compressor", None)
+        if cached is None or cached[0] != self._active_dict_id:
+            dictionary = self._dicts.get(self._active_dict_id)
+            cached = (
+                self._active_dict_id,
+                zstd.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dictionary),
+            )
+            self._local.compressor = cached
+        return cached[1]
+
+    def _zstd_decompressor(self, dict_id: int):
+        decompressors = getattr(self._local, "decompressors", None)
+        if decompressors is None:
+            decompressors = self._local.decompressors = {}
+        decompressor = decompressors.get(dict_id)
+        if decompressor is None:
+            if dict_id and dict_id not in self._dicts:
+                raise ValueError(f"zstd dictionary {dict_id} is not available")
+            decompressor = zstd.ZstdDecompressor(dict_data=self._dicts.get(dict_id))
+            decompressors[dict_id] = decompressor
+        return decompressor
@@ -0,0 +1,132 @@
+"""Ingest dedup index — ids of recently ingested events, in memory and in SQLite (WAL)."""
+
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterable
+from pathlib import Path
+
+from loguru import logger
+
+DEDUP_DB_NAME = "ingest_dedup.db"
+
+# How long an id is remembered; retries later than this are counted again
+DEDUP_WINDOW_SECONDS = 7 * 24 * 3600
+
+# Ids kept in memory at most (oldest forgotten first)
+DEDUP_MAX_IDS = 200_000
+
+# Expired rows are deleted from the database at most this often
+_PRUNE_INTERVAL_SECONDS = 3600
+
+_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS seen_ids (
+    key TEXT PRIMARY KEY,
+    seen_at REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_seen_ids_seen_at ON seen_ids(seen_at);
+"""
+
+
+class DedupIndex:
+    """Time-bounded set of ids of events that have already been ingested.
+
+    `claim` marks ids in memory as soon as their events are accepted, so a
+    retry that arrives while they are still queued is recognised. `commit`
+    persists ids once their events have been recorded: after a crash, ids
+    that were only claimed are forgotten and a retry records the events
+    again, so every event is counted exactly once. Ids older than
+    `window_seconds` are forgotten; beyond `max_ids`, the oldest go first.
+    """
+
+    def __init__(
+        self,
+        state_dir: Path | str,
+        window_seconds: float = DEDUP_WINDOW_SECONDS,
+        max_ids: int = DEDUP_MAX_IDS,
+    ) -> None:
+        self.db_path = Path(state_dir) / DEDUP_DB_NAME
+        self._window = window_seconds
+        self._max_ids = max(1, max_ids)
+        self._ids: OrderedDict[str, float] = OrderedDict()  # key -> first seen, oldest first
+        self._lock = threading.Lock()
+        self._pruned_at = 0.0
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), timeout=10, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA_SQL)
+        self._load()
+
+    def _load(self) -> None:
+        now = time.time()
+        rows = self._conn.execute(
+            "SELECT key, seen_at FROM seen_ids WHERE seen_at >= ? ORDER BY seen_at",
+            (now - self._window,),
+        )
+        for key, seen_at in rows:
+            self._ids[key] = seen_at
+        self._expire(now)
+        logger.debug("Loaded {} ingest ids from {}", len(self._ids), self.db_path)
+
+    def _expire(self, now: float) -> None:
+        cutoff = now - self._window
+        ids = self._ids
+        while ids:
+            seen_at = ids[next(iter(ids))]
+            if seen_at >= cutoff and len(ids) <= self._max_ids:
+                break
+            ids.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def claim(self, keys: Iterable[str]) -> list[bool]:
+        """Mark keys as seen. Returns, per key, True if it was not seen before."""
+        now = time.time()
+        fresh = []
+        with self._lock:
+            self._expire(now)
+            for key in keys:
+                if key in self._ids:
+                    fresh.append(False)
+                else:
+                    self._ids[key] = now
+                    fresh.append(True)
+        return fresh
+
+    def release(self, keys: Iterable[str]) -> None:
+        """Forget claimed keys whose events were refused, so a retry is accepted."""
+        with self._lock:
+            for key in keys:
+                self._ids.pop(key, None)
+
+    def commit(self, keys: Iterable[str]) -> None:
+        """Persist keys whose events have been recorded."""
+        now = time.time()
+        with self._lock:
+            rows = [(key, self._ids.get(key, now)) for key in keys]
+            if not rows:
+                return
+            try:
+                with self._conn:
+                    self._conn.executemany(
+                        "INSERT OR IGNORE INTO seen_ids (key, seen_at) VALUES (?, ?)", rows
+                    )
+                    if now - self._pruned_at >= _PRUNE_INTERVAL_SECONDS:
+                        self._conn.execute(
+                            "DELETE FROM seen_ids WHERE seen_at < ?", (now - self._window,)
+                        )
+                        self._pruned_at = now
+            except sqlite3.Error:
+                logger.opt(exception=True).debug("Failed to persist {} ingest ids", len(rows))
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
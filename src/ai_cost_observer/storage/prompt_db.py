@@ -1,25 +1,38 @@
-"""SQLite prompt storage — stores prompts/responses with optional Fernet encryption."""
+"""SQLite prompt storage — stores compressed prompts/responses with optional AES-GCM encryption."""
 
 from __future__ import annotations
 
 import base64
 import hashlib
+import hmac
+import json
 import os
 import platform
+import queue
+import re
 import socket
 import sqlite3
 import threading
+import time
+import unicodedata
+from collections import Counter
+from collections.abc import Callable, Iterable, Iterator, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
 from loguru import logger
 
-_SCHEMA_VERSION = 1
+from ai_cost_observer.storage.compression import CODEC_NONE, TextCompressor
+
+_SCHEMA_VERSION = 7
 
 _SCHEMA_SQL = """
 CREATE TABLE IF NOT EXISTS prompts (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     timestamp TEXT NOT NULL,
+    ts_us INTEGER,
     tool_name TEXT NOT NULL,
     model_name TEXT,
     source TEXT NOT NULL,
@@ -32,9 +45,29 @@ CREATE TABLE IF NOT EXISTS prompts (
     prompt_text TEXT,
     response_text TEXT,
     project_path TEXT,
-    host_name TEXT
+    host_name TEXT,
+    prompt_blob BLOB,
+    response_blob BLOB
+);
+
+-- Large texts, stored once per distinct content and referenced from
+-- prompts.prompt_blob / prompts.response_blob by keyed hash
+CREATE TABLE IF NOT EXISTS prompt_blobs (
+    hash BLOB PRIMARY KEY,
+    refcount INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    data
 );
 
+CREATE TRIGGER IF NOT EXISTS prompts_release_blobs AFTER DELETE ON prompts
+WHEN OLD.prompt_blob IS NOT NULL OR OLD.response_blob IS NOT NULL
+BEGIN
+    UPDATE prompt_blobs SET refcount = refcount - 1 WHERE hash = OLD.prompt_blob;
+    UPDATE prompt_blobs SET refcount = refcount - 1 WHERE hash = OLD.response_blob;
+    DELETE FROM prompt_blobs
+    WHERE hash IN (OLD.prompt_blob, OLD.response_blob) AND refcount <= 0;
+END;
+
 CREATE TABLE IF NOT EXISTS sessions (
     id TEXT PRIMARY KEY,
     tool_name TEXT NOT NULL,
@@ -45,15 +78,271 @@ CREATE TABLE IF NOT EXISTS sessions (
     total_cost_usd REAL DEFAULT 0
 );
 
-CREATE INDEX IF NOT EXISTS idx_prompts_timestamp ON prompts(timestamp);
-CREATE INDEX IF NOT EXISTS idx_prompts_tool ON prompts(tool_name);
+-- Time filters use ts_us (epoch microseconds); the tool and model indexes
+-- also cover the token/cost columns so per-tool and per-model usage over a
+-- time range is answered from the index alone
+CREATE INDEX IF NOT EXISTS idx_prompts_ts ON prompts(ts_us);
+CREATE INDEX IF NOT EXISTS idx_prompts_tool_ts ON prompts(
+    tool_name, ts_us, input_tokens, output_tokens, estimated_cost_usd
+);
+CREATE INDEX IF NOT EXISTS idx_prompts_model_ts ON prompts(
+    model_name, ts_us, input_tokens, output_tokens, estimated_cost_usd
+);
 CREATE INDEX IF NOT EXISTS idx_prompts_session ON prompts(session_id);
 
+-- Rows inserted without ts_us (e.g. by an older version sharing the file)
+-- get it from the ISO timestamp, to millisecond precision
+CREATE TRIGGER IF NOT EXISTS prompts_fill_ts_us AFTER INSERT ON prompts
+WHEN NEW.ts_us IS NULL
+BEGIN
+    UPDATE prompts SET ts_us =
+        CAST(strftime('%s', NEW.timestamp) AS INTEGER) * 1000000
+        + CAST(substr(strftime('%f', NEW.timestamp), 4) AS INTEGER) * 1000
+    WHERE id = NEW.id;
+END;
+
 CREATE TABLE IF NOT EXISTS schema_version (
     version INTEGER PRIMARY KEY
 );
+
+CREATE TABLE IF NOT EXISTS compression_dicts (
+    dict_id INTEGER PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+
+-- Rows up to until_id predate the search index and still need indexing
+CREATE TABLE IF NOT EXISTS search_backfill (
+    until_id INTEGER NOT NULL
+);
+
+-- Rows up to until_id predate ts_us, or the usage rollups, and still need
+-- converting, or rolling up (see PromptDB.migrate_pending)
+CREATE TABLE IF NOT EXISTS timestamp_backfill (
+    until_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rollup_backfill (
+    until_id INTEGER NOT NULL
+);
+"""
+
+# Keyword index, rowid = prompts.id. Encrypted databases index blind tokens
+# (keyed hashes of normalized terms), plaintext ones the text itself. The table
+# is contentless: only the index is stored, not a second copy of the terms.
+# Removing an entry by rowid alone needs contentless_delete (SQLite 3.43+).
+_SEARCH_CONTENTLESS_DELETE = sqlite3.sqlite_version_info >= (3, 43, 0)
+
+_SEARCH_TABLE_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS prompt_search USING fts5(terms, content=''{})".format(
+        ", contentless_delete=1" if _SEARCH_CONTENTLESS_DELETE else ""
+    )
+)
+
+_TEXTS = ("prompt", "response")
+
+_SEARCH_UNINDEX_SQL = """
+CREATE TRIGGER IF NOT EXISTS prompts_unindex AFTER DELETE ON prompts
+BEGIN
+    DELETE FROM prompt_search WHERE rowid = OLD.id;
+END
 """
 
+# Usage rollups: table name -> bucket width in seconds. Buckets start on UTC
+# hour/day boundaries (epoch seconds); NULL model/project are stored as ''.
+_ROLLUPS = {"usage_hourly": 3600, "usage_daily": 86400}
+_ROLLUP_KEYS = ("bucket", "tool_name", "model_name", "source", "project_path")
+_ROLLUP_SUMS = (
+    "prompts",
+    "input_tokens",
+    "output_tokens",
+    "cache_creation_tokens",
+    "cache_read_tokens",
+    "cost_usd",
+)
+
+_ROLLUP_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    bucket INTEGER NOT NULL,
+    tool_name TEXT NOT NULL,
+    model_name TEXT NOT NULL,
+    source TEXT NOT NULL,
+    project_path TEXT NOT NULL,
+    prompts INTEGER NOT NULL,
+    input_tokens INTEGER NOT NULL,
+    output_tokens INTEGER NOT NULL,
+    cache_creation_tokens INTEGER NOT NULL,
+    cache_read_tokens INTEGER NOT NULL,
+    cost_usd REAL NOT NULL,
+    PRIMARY KEY (bucket, tool_name, model_name, source, project_path)
+) WITHOUT ROWID;
+"""
+
+_ROLLUP_CONFLICT_SQL = f" ON CONFLICT({', '.join(_ROLLUP_KEYS)}) DO UPDATE SET " + ", ".join(
+    f"{c} = {c} + excluded.{c}" for c in _ROLLUP_SUMS
+)
+
+_UPSERT_ROLLUP_SQL = (
+    "INSERT INTO {table} ("
+    + ", ".join(_ROLLUP_KEYS + _ROLLUP_SUMS)
+    + ") VALUES ("
+    + ", ".join("?" * (len(_ROLLUP_KEYS) + len(_ROLLUP_SUMS)))
+    + ")"
+    + _ROLLUP_CONFLICT_SQL
+)
+
+# Rebuilds rollup rows from raw prompts in an id range (migration backfill)
+_BACKFILL_ROLLUP_SQL = (
+    "INSERT INTO {table} ("
+    + ", ".join(_ROLLUP_KEYS + _ROLLUP_SUMS)
+    + ") SELECT ts_us / 1000000 / {width} * {width}, tool_name, COALESCE(model_name, ''), "
+    "source, COALESCE(project_path, ''), COUNT(*), COALESCE(SUM(input_tokens), 0), "
+    "COALESCE(SUM(output_tokens), 0), COALESCE(SUM(cache_creation_tokens), 0), "
+    "COALESCE(SUM(cache_read_tokens), 0), COALESCE(SUM(estimated_cost_usd), 0) "
+    "FROM prompts WHERE id > ? AND id <= ? AND ts_us IS NOT NULL GROUP BY 1, 2, 3, 4, 5"
+    + _ROLLUP_CONFLICT_SQL
+)
+
+# Rebuilds sessions from raw prompts in an id range, merging with earlier batches
+_BACKFILL_SESSIONS_SQL = """INSERT INTO sessions (id, tool_name, start_time, end_time,
+    total_input_tokens, total_output_tokens, total_cost_usd)
+SELECT session_id, MIN(tool_name), MIN(timestamp), MAX(timestamp),
+    COALESCE(SUM(input_tokens), 0), COALESCE(SUM(output_tokens), 0),
+    COALESCE(SUM(estimated_cost_usd), 0)
+FROM prompts WHERE id > ? AND id <= ? AND session_id IS NOT NULL GROUP BY session_id
+ON CONFLICT(id) DO UPDATE SET
+    start_time = MIN(COALESCE(start_time, excluded.start_time), excluded.start_time),
+    end_time = MAX(COALESCE(end_time, excluded.end_time), excluded.end_time),
+    total_input_tokens = total_input_tokens + excluded.total_input_tokens,
+    total_output_tokens = total_output_tokens + excluded.total_output_tokens,
+    total_cost_usd = total_cost_usd + excluded.total_cost_usd"""
+
+# Sessions accumulate across batches: the time span widens and totals add up
+_ACCUMULATE_SESSION_SQL = """INSERT INTO sessions (id, tool_name, start_time, end_time,
+    total_input_tokens, total_output_tokens, total_cost_usd)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(id) DO UPDATE SET
+    start_time = MIN(COALESCE(start_time, excluded.start_time), excluded.start_time),
+    end_time = MAX(COALESCE(end_time, excluded.end_time), excluded.end_time),
+    total_input_tokens = total_input_tokens + excluded.total_input_tokens,
+    total_output_tokens = total_output_tokens + excluded.total_output_tokens,
+    total_cost_usd = total_cost_usd + excluded.total_cost_usd"""
+
+_SCHEMA_SQL += "".join(_ROLLUP_TABLE_SQL.format(table=table) for table in _ROLLUPS)
+
+_INSERT_PROMPT_SQL = """INSERT INTO prompts (
+    timestamp, ts_us, tool_name, model_name, source, session_id,
+    input_tokens, output_tokens, cache_creation_tokens, cache_read_tokens,
+    estimated_cost_usd, prompt_text, response_text,
+    project_path, host_name, prompt_blob, response_blob
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+
+_SELECT_PROMPTS_SQL = """SELECT p.*, pb.data AS prompt_blob_data, rb.data AS response_blob_data
+FROM prompts p
+LEFT JOIN prompt_blobs pb ON pb.hash = p.prompt_blob
+LEFT JOIN prompt_blobs rb ON rb.hash = p.response_blob"""
+
+# Columns iter_prompts can project; the text columns are decrypted lazily
+_PROMPT_COLUMNS = (
+    "id",
+    "timestamp",
+    "ts_us",
+    "tool_name",
+    "model_name",
+    "source",
+    "session_id",
+    "input_tokens",
+    "output_tokens",
+    "cache_creation_tokens",
+    "cache_read_tokens",
+    "estimated_cost_usd",
+    "prompt_text",
+    "response_text",
+    "project_path",
+    "host_name",
+)
+_TEXT_COLUMNS = ("prompt_text", "response_text")
+
+# Rows fetched per page (one short read transaction each) by iter_prompts
+_ITER_PAGE_ROWS = 500
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Rows converted or rolled up per transaction by the migration backfills
+# (see PromptDB.migrate_pending)
+_MIGRATION_BATCH_ROWS = 5000
+
+# Retention: expired rows deleted per transaction, and free pages returned to
+# the filesystem per incremental_vacuum step; the writer lock is released
+# between batches so inserts are never held up for long
+_RETENTION_BATCH_ROWS = 2000
+_VACUUM_STEP_PAGES = 512
+
+# Batches smaller than this are encrypted inline even when parallel=True
+_PARALLEL_ENCRYPT_MIN_ROWS = 64
+
+# Connection tuning applied to the writer and every pooled reader
+_CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",  # WAL: fsync on checkpoint, not on every commit
+    "PRAGMA cache_size=-8192",  # 8 MiB page cache per connection
+    "PRAGMA mmap_size=67108864",  # 64 MiB memory-mapped reads
+    "PRAGMA temp_store=MEMORY",
+)
+_BUSY_TIMEOUT_SECONDS = 10.0
+_STATEMENT_CACHE_SIZE = 64
+_READER_POOL_SIZE = 4
+
+# Stored text formats (first byte of a BLOB value):
+#   1: AES-GCM — nonce(12) + ciphertext/tag
+#   2: AES-GCM over compressed text — codec byte + nonce(12) + ciphertext/tag,
+#      with the two header bytes authenticated as associated data
+#   3: compressed plaintext — codec byte + payload
+# TEXT values are either plaintext or legacy Fernet tokens.
+_FORMAT_AESGCM = 1
+_FORMAT_AESGCM_COMPRESSED = 2
+_FORMAT_COMPRESSED = 3
+_NONCE_BYTES = 12
+_AEAD_KEY_INFO = b"ai-cost-observer prompt-db aes-256-gcm v1"
+_BLOB_KEY_INFO = b"ai-cost-observer prompt-db blob-hash v1"
+_SEARCH_KEY_INFO = b"ai-cost-observer prompt-db search-token v1"
+
+# Texts at least this long (UTF-8 bytes) are stored in prompt_blobs, once per
+# distinct content; shorter ones stay inline in the prompts row
+_BLOB_MIN_BYTES = 1024
+
+# Host parameters per `IN (...)` lookup of blob hashes
+_BLOB_LOOKUP_CHUNK = 500
+
+# Blind search tokens: truncated keyed hash of a term, hex-encoded. Longer
+# terms (base64 payloads, hashes) are not indexed in encrypted databases.
+_SEARCH_TOKEN_BYTES = 10
+_SEARCH_MAX_TERM_CHARS = 64
+_SEARCH_TERM_RE = re.compile(r"[^\W_]+")
+
+# Rows decrypted and indexed per transaction when backfilling the search index
+_SEARCH_BACKFILL_ROWS = 500
+
+# Rows sampled from the database to train a zstd dictionary
+_DICT_TRAINING_ROWS = 2000
+
+# Write-behind defaults: a batch is committed once it reaches
+# _WRITE_BATCH_SIZE records or _WRITE_FLUSH_INTERVAL seconds after its first one
+_WRITE_QUEUE_SIZE = 10_000
+_WRITE_BATCH_SIZE = 500
+_WRITE_FLUSH_INTERVAL = 1.0
+
+# A queued batch that fails to commit is retried this many times, waiting
+# _WRITE_RETRY_DELAY seconds and doubling, before its records are written one by one
+_WRITE_RETRIES = 3
+_WRITE_RETRY_DELAY = 0.1
+
+# Rows past the retention cutoff (epoch microseconds, ISO text). Rows whose
+# timestamp could not be converted have no ts_us and go by the text instead
+_EXPIRED_SQL = "({p}ts_us < ? OR ({p}ts_us IS NULL AND {p}timestamp < ?))"
+
+# Control items for the write-behind queue
+_FLUSH = object()
+_STOP = object()
+
 
 def _default_db_path() -> Path:
     if platform.system() == "Windows":
@@ -68,21 +357,393 @@ def _derive_key(password: str) -> bytes:
     return base64.urlsafe_b64encode(dk)
 
 
+def _aead_key(key: bytes) -> bytes:
+    """Derive the AES-256-GCM key from the Fernet key, keeping the two independent."""
+    return hmac.new(base64.urlsafe_b64decode(key), _AEAD_KEY_INFO, hashlib.sha256).digest()
+
+
+def _blob_hash_key(key: bytes) -> bytes:
+    """Derive the key used to hash blob contents, so hashes reveal nothing without it."""
+    return hmac.new(base64.urlsafe_b64decode(key), _BLOB_KEY_INFO, hashlib.sha256).digest()
+
+
+def _search_token_key(key: bytes) -> bytes:
+    """Derive the key used to blind search terms."""
+    return hmac.new(base64.urlsafe_b64decode(key), _SEARCH_KEY_INFO, hashlib.sha256).digest()
+
+
+def _search_terms(text: str) -> list[str]:
+    """Split text into search terms: case-folded, accents removed, split on non-alphanumerics.
+
+    Mirrors FTS5's default unicode61 tokenizer, so blind tokens and plaintext
+    indexes match the same words.
+    """
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return _SEARCH_TERM_RE.findall(unicodedata.normalize("NFC", stripped).casefold())
+
+
+# Values of PROMPT_DB_CACHE_KEY that opt in to caching a PROMPT_DB_KEY-derived key
+_TRUE_VALUES = frozenset({"1", "true", "yes", "on"})
+
+
+def _key_cache_path(db_path: Path) -> Path:
+    return db_path.with_name(db_path.name + ".key")
+
+
+def _read_key_cache(path: Path, password: str) -> bytes | None:
+    """Return the cached derived key for `password`, or None if missing or unusable.
+
+    The cache holds the key itself, so it is only trusted when no other user
+    can read it. A check tag ties it to the password it was derived from, so a
+    changed PROMPT_DB_KEY is detected without running PBKDF2.
+    """
+    try:
+        if os.name == "posix" and path.stat().st_mode & 0o077:
+            logger.warning("Ignoring prompt key cache {} — readable by other users", path)
+            return None
+        data = json.loads(path.read_text(encoding="utf-8"))
+        key = data["key"].encode("ascii")
+        check = hmac.new(key, password.encode(), hashlib.sha256).hexdigest()
+        if data.get("version") == 1 and hmac.compare_digest(check, data["check"]):
+            return key
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.opt(exception=True).debug("Ignoring unreadable prompt key cache {}", path)
+    return None
+
+
+def _write_key_cache(path: Path, password: str, key: bytes) -> None:
+    """Persist the derived key with owner-only permissions (written atomically)."""
+    data = {
+        "version": 1,
+        "key": key.decode("ascii"),
+        "check": hmac.new(key, password.encode(), hashlib.sha256).hexdigest(),
+    }
+    tmp = path.with_name(path.name + ".tmp")
+    try:
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        if os.name == "posix":
+            os.chmod(tmp, 0o600)  # O_CREAT mode does not apply to an existing file
+        os.replace(tmp, path)
+    except OSError:
+        logger.opt(exception=True).debug("Failed to write prompt key cache {}", path)
+
+
+def _to_us(dt: datetime) -> int:
+    """Epoch microseconds of a datetime (naive values are taken as UTC)."""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt - _EPOCH) // timedelta(microseconds=1)
+
+
+def _iso_to_us(value: str | None) -> int | None:
+    """Epoch microseconds of an ISO-8601 timestamp, or None if it cannot be parsed."""
+    try:
+        return _to_us(datetime.fromisoformat(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> set[str]:
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _search_table_sql(conn: sqlite3.Connection) -> str | None:
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'prompt_search'").fetchone()
+    return row[0] if row else None
+
+
+def _create_search_index(conn: sqlite3.Connection) -> None:
+    """Create prompt_search and, if the table supports deletes, the trigger that unindexes rows."""
+    conn.execute(_SEARCH_TABLE_SQL)
+    if "contentless_delete" in _search_table_sql(conn):
+        conn.execute(_SEARCH_UNINDEX_SQL)
+
+
+def _migrate_blob_refs(conn: sqlite3.Connection) -> None:
+    """v2: prompts reference large texts in prompt_blobs."""
+    existing = _columns(conn, "prompts")
+    for column in ("prompt_blob", "response_blob"):
+        if column not in existing:
+            conn.execute(f"ALTER TABLE prompts ADD COLUMN {column} BLOB")
+
+
+def _migrate_integer_timestamps(conn: sqlite3.Connection) -> None:
+    """v3: add ts_us (epoch microseconds) and mark existing rows for backfill.
+
+    Converting the ISO timestamps is not done here: PromptDB fills ts_us in
+    batches up to the recorded id (see `migrate_pending`). Until then, the
+    remaining rows are missing from time-filtered queries.
+    """
+    if "ts_us" not in _columns(conn, "prompts"):
+        conn.execute("ALTER TABLE prompts ADD COLUMN ts_us INTEGER")
+    conn.execute("DROP INDEX IF EXISTS idx_prompts_timestamp")
+    conn.execute("DROP INDEX IF EXISTS idx_prompts_tool")
+    conn.execute("CREATE TABLE IF NOT EXISTS timestamp_backfill (until_id INTEGER NOT NULL)")
+    with conn:
+        conn.execute(
+            "INSERT INTO timestamp_backfill (until_id) SELECT MAX(id) FROM prompts "
+            "WHERE NOT EXISTS (SELECT 1 FROM timestamp_backfill) HAVING MAX(id) IS NOT NULL"
+        )
+
+
+def _migrate_usage_rollups(conn: sqlite3.Connection) -> None:
+    """v4: create the hourly/daily usage rollups and mark existing prompts for backfill.
+
+    Rollups and sessions are rebuilt from scratch by `migrate_pending`, in
+    id-range batches committed with the watermark. They are only emptied when
+    no backfill is recorded yet, so re-running this keeps its progress.
+    """
+    for table in _ROLLUPS:
+        conn.execute(_ROLLUP_TABLE_SQL.format(table=table))
+    conn.execute("CREATE TABLE IF NOT EXISTS rollup_backfill (until_id INTEGER NOT NULL)")
+    if conn.execute("SELECT 1 FROM rollup_backfill").fetchone():
+        return
+    with conn:
+        for table in (*_ROLLUPS, "sessions"):
+            conn.execute(f"DELETE FROM {table}")
+        conn.execute(
+            "INSERT INTO rollup_backfill (until_id) SELECT MAX(id) FROM prompts "
+            "HAVING MAX(id) IS NOT NULL"
+        )
+
+
+def _accumulate_usage(rows: list[tuple]) -> tuple[dict, dict]:
+    """Aggregate prompt rows (as passed to _INSERT_PROMPT_SQL) into rollup and session deltas.
+
+    Returns ({table: {key: sums}}, {session_id: row}) ready for the upserts.
+    """
+    rollups: dict[str, dict[tuple, list]] = {table: {} for table in _ROLLUPS}
+    sessions: dict[str, list] = {}
+    for row in rows:
+        ts, ts_us, tool, model, source, session_id = row[:6]
+        tokens_in, tokens_out, cache_creation, cache_read, cost = (v or 0 for v in row[6:11])
+        project = row[13] or ""
+        seconds = ts_us // 1_000_000
+        for table, width in _ROLLUPS.items():
+            key = (seconds // width * width, tool, model or "", source, project)
+            sums = rollups[table].get(key)
+            if sums is None:
+                sums = rollups[table][key] = [0, 0, 0, 0, 0, 0.0]
+            sums[0] += 1
+            sums[1] += tokens_in
+            sums[2] += tokens_out
+            sums[3] += cache_creation
+            sums[4] += cache_read
+            sums[5] += cost
+        if session_id:
+            session = sessions.get(session_id)
+            if session is None:
+                sessions[session_id] = [session_id, tool, ts, ts, tokens_in, tokens_out, cost]
+            else:
+                session[2] = min(session[2], ts)
+                session[3] = max(session[3], ts)
+                session[4] += tokens_in
+                session[5] += tokens_out
+                session[6] += cost
+    return rollups, sessions
+
+
+def _migrate_incremental_vacuum(conn: sqlite3.Connection) -> None:
+    """v5: incremental auto-vacuum, so retention can free space in steps.
+
+    Switching an existing file needs one full VACUUM, which rewrites the whole
+    database; it is not run at startup but on request (see `PromptDB.vacuum`).
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        logger.info(
+            "Prompt database predates incremental vacuum; set "
+            "token_tracking.vacuum_on_start to rebuild it once"
+        )
+
+
+def _migrate_search_index(conn: sqlite3.Connection) -> None:
+    """v6: create the keyword index and mark existing prompts for backfill.
+
+    Indexing needs the decryption key, so it is not done here: PromptDB
+    indexes rows up to the recorded id in batches (see `index_pending`).
+    """
+    _create_search_index(conn)
+    conn.execute("CREATE TABLE IF NOT EXISTS search_backfill (until_id INTEGER NOT NULL)")
+    with conn:
+        conn.execute(
+            "INSERT INTO search_backfill (until_id) SELECT MAX(id) FROM prompts "
+            "WHERE NOT EXISTS (SELECT 1 FROM search_backfill) HAVING MAX(id) IS NOT NULL"
+        )
+
+
+def _migrate_contentless_search(conn: sqlite3.Connection) -> None:
+    """v7: rebuild prompt_search as a contentless index and re-index every prompt.
+
+    The v6 table kept a full copy of every indexed text beside the index. The
+    backfill watermark is reset before the table is replaced, so a crash in
+    between re-runs the rebuild.
+    """
+    if "content=''" in (_search_table_sql(conn) or ""):
+        return
+    with conn:
+        conn.execute("DELETE FROM search_backfill")
+        conn.execute(
+            "INSERT INTO search_backfill (until_id) SELECT MAX(id) FROM prompts "
+            "HAVING MAX(id) IS NOT NULL"
+        )
+    conn.execute("DROP TRIGGER IF EXISTS prompts_unindex")
+    conn.execute("DROP TABLE IF EXISTS prompt_search")
+    _create_search_index(conn)
+
+
+# Schema migrations, applied in order to databases older than their version.
+# Each one must be idempotent: a crash before the version bump re-runs it.
+_MIGRATIONS = (
+    (2, _migrate_blob_refs),
+    (3, _migrate_integer_timestamps),
+    (4, _migrate_usage_rollups),
+    (5, _migrate_incremental_vacuum),
+    (6, _migrate_search_index),
+    (7, _migrate_contentless_search),
+)
+
+
+def _prompt_filters(
+    tool_name: str | None = None,
+    model_name: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    prefix: str = "",
+) -> tuple[list[str], list]:
+    """Build WHERE conditions and parameters for the common prompt filters."""
+    conditions: list[str] = []
+    params: list = []
+    if tool_name:
+        conditions.append(f"{prefix}tool_name = ?")
+        params.append(tool_name)
+    if model_name:
+        conditions.append(f"{prefix}model_name = ?")
+        params.append(model_name)
+    if since:
+        conditions.append(f"{prefix}ts_us >= ?")
+        params.append(_to_us(since))
+    if until:
+        conditions.append(f"{prefix}ts_us < ?")
+        params.append(_to_us(until))
+    return conditions, params
+
+
+def _existing_blobs(conn: sqlite3.Connection, hashes) -> set[bytes]:
+    """Return the subset of `hashes` already stored in prompt_blobs."""
+    hashes = list(hashes)
+    found = set()
+    for i in range(0, len(hashes), _BLOB_LOOKUP_CHUNK):
+        chunk = hashes[i : i + _BLOB_LOOKUP_CHUNK]
+        placeholders = ",".join("?" * len(chunk))
+        found.update(
+            row[0]
+            for row in conn.execute(
+                f"SELECT hash FROM prompt_blobs WHERE hash IN ({placeholders})", chunk
+            )
+        )
+    return found
+
+
+class PromptRecord(Mapping):
+    """One prompts row from `PromptDB.iter_prompts`.
+
+    Behaves like a read-only dict of the projected columns. Text columns are
+    decrypted the first time they are read, so callers that only look at
+    token counts never pay for decryption. `cursor` is the keyset position
+    to pass as `after=` to resume listing after this row.
+    """
+
+    __slots__ = ("_keys", "_values", "_pending", "_decode", "cursor")
+
+    def __init__(
+        self,
+        keys: tuple[str, ...],
+        values: dict,
+        pending: dict,
+        decode: Callable,
+        cursor: tuple[int, int],
+    ) -> None:
+        self._keys = keys
+        self._values = values
+        self._pending = pending
+        self._decode = decode
+        self.cursor = cursor
+
+    def __getitem__(self, key: str):
+        if key in self._pending:
+            self._values[key] = self._decode(self._pending.pop(key))
+        return self._values[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __repr__(self) -> str:
+        shown = {k: self._values.get(k, "<encrypted>") for k in self._keys}
+        return f"PromptRecord({shown})"
+
+    def to_dict(self) -> dict:
+        """Return a plain dict with every text column decrypted."""
+        return {key: self[key] for key in self._keys}
+
+
 class PromptDB:
-    """Thread-safe SQLite database for prompt/response storage with optional encryption."""
+    """Thread-safe SQLite database for prompt/response storage with optional encryption.
+
+    Text fields are compressed (zstd or zlib) and then encrypted before they
+    are stored. The file runs in WAL mode. All writes go through one long-lived writer
+    connection guarded by a lock; queries borrow connections from a small
+    reader pool, so they don't wait for the token tracker or HTTP threads.
+
+    With `write_behind=True`, inserts are queued in memory and committed in
+    groups by a background writer thread, so callers never wait on the disk.
+    Queued rows become visible to queries once committed; call `flush()` to
+    wait for that.
+    """
 
     def __init__(
         self,
         db_path: Path | str | None = None,
         encrypt: bool = True,
         retention_days: int = 90,
+        write_behind: bool = False,
+        queue_size: int = _WRITE_QUEUE_SIZE,
+        batch_size: int = _WRITE_BATCH_SIZE,
+        flush_interval: float = _WRITE_FLUSH_INTERVAL,
+        compression: str = "auto",
     ) -> None:
         self.db_path = Path(db_path) if db_path else _default_db_path()
         self.encrypt = encrypt
         self.retention_days = retention_days
-        self._lock = threading.Lock()
-        self._fernet = None
+        self._lock = threading.Lock()  # serializes use of the writer connection
+        self._writer: sqlite3.Connection | None = None
+        self._readers: list[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+        self._fernet = None  # reads legacy Fernet rows
+        self._aead = None
+        # Plaintext databases store the text itself, so a fixed hash key is enough
+        self._blob_key = _BLOB_KEY_INFO
+        self._search_key: bytes | None = None  # set with encryption: blind search tokens
+        self._compressor = TextCompressor(compression)
         self._host_name = socket.gethostname()
+        self._executor: ThreadPoolExecutor | None = None
+
+        # Write-behind state (see _start_write_behind)
+        self._batch_size = max(1, batch_size)
+        self._flush_interval = flush_interval
+        self._queue: queue.Queue | None = None
+        self._write_thread: threading.Thread | None = None
+        self._overflow_count = 0
+        self._committed_count = 0
+        self._failed_count = 0
+        self._state_lock = threading.Lock()
 
         # Ensure directory exists
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
@@ -93,9 +754,13 @@ class PromptDB:
 
         # Initialize database
         self._init_db()
+        self._load_compression_dicts()
+
+        if write_behind:
+            self._start_write_behind(queue_size)
 
     def _init_encryption(self) -> None:
-        """Initialize Fernet encryption with a derived key.
+        """Initialize AES-GCM encryption with a derived key.
 
         Key derivation priority:
           1. PROMPT_DB_KEY environment variable (most secure — user-controlled secret)
@@ -106,23 +771,51 @@ class PromptDB:
         boundary): it prevents casual snooping of the SQLite file but does NOT
         protect against a determined attacker with file-system access.  For
         stronger protection, set PROMPT_DB_KEY to a random secret.
+
+        The PBKDF2 result of the fallback is cached next to the database in
+        an owner-only `<db>.key` file so later starts skip the derivation. A
+        key from PROMPT_DB_KEY is only cached with PROMPT_DB_CACHE_KEY=1:
+        otherwise anyone who can read the state directory could decrypt the
+        database without the secret.
         """
         try:
             from cryptography.fernet import Fernet
+            from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
             env_key = os.environ.get("PROMPT_DB_KEY")
             if env_key:
-                key = _derive_key(env_key)
-                logger.debug("Prompt encryption initialized (from PROMPT_DB_KEY env var)")
+                password = env_key
+                source = "from PROMPT_DB_KEY env var"
             else:
                 # Fallback: derive from machine identity (stable but predictable)
-                identity = f"{socket.gethostname()}:{os.getlogin()}"
-                key = _derive_key(identity)
+                password = f"{socket.gethostname()}:{os.getlogin()}"
+                source = "machine identity fallback"
+
+            cache_path = _key_cache_path(self.db_path)
+            if env_key and os.environ.get("PROMPT_DB_CACHE_KEY", "").lower() not in _TRUE_VALUES:
+                # Drop a cache written for this secret by an earlier run
+                cache_path.unlink(missing_ok=True)
+                key = _derive_key(password)
+            else:
+                key = _read_key_cache(cache_path, password)
+                if key is None:
+                    key = _derive_key(password)
+                    _write_key_cache(cache_path, password, key)
+                else:
+                    source += ", cached key"
+
+            self._fernet = Fernet(key)
+            self._aead = AESGCM(_aead_key(key))
+            self._blob_key = _blob_hash_key(key)
+            self._search_key = _search_token_key(key)
+            if env_key:
+                logger.debug("Prompt encryption initialized ({})", source)
+            else:
                 logger.debug(
-                    "Prompt encryption initialized (machine identity fallback). "
-                    "Set PROMPT_DB_KEY env var for stronger protection."
+                    "Prompt encryption initialized ({}). "
+                    "Set PROMPT_DB_KEY env var for stronger protection.",
+                    source,
                 )
-            self._fernet = Fernet(key)
         except ImportError:
             logger.warning(
                 "cryptography package not installed — prompt text will be stored in plaintext. "
@@ -135,46 +828,192 @@ class PromptDB:
             )
             self.encrypt = False
 
+    def _connect(self, readonly: bool = False) -> sqlite3.Connection:
+        """Open a tuned connection shared across threads (callers serialize use)."""
+        conn = sqlite3.connect(
+            str(self.db_path),
+            timeout=_BUSY_TIMEOUT_SECONDS,
+            check_same_thread=False,
+            cached_statements=_STATEMENT_CACHE_SIZE,
+        )
+        for pragma in _CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        if readonly:
+            conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    def _writer_conn(self) -> sqlite3.Connection:
+        """Return the long-lived writer connection. Caller must hold self._lock."""
+        if self._writer is None:
+            self._writer = self._connect()
+        return self._writer
+
+    @contextmanager
+    def _reader(self):
+        """Borrow a pooled read-only connection; WAL lets it run alongside the writer."""
+        with self._readers_lock:
+            conn = self._readers.pop() if self._readers else None
+        if conn is None:
+            conn = self._connect(readonly=True)
+        try:
+            yield conn
+        finally:
+            with self._readers_lock:
+                if len(self._readers) < _READER_POOL_SIZE:
+                    self._readers.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
     def _init_db(self) -> None:
-        """Create tables if they don't exist."""
+        """Switch the file to WAL, migrate an older schema and create missing tables."""
         with self._lock:
-            conn = sqlite3.connect(str(self.db_path))
-            try:
-                conn.executescript(_SCHEMA_SQL)
-
-                # Set schema version
-                cursor = conn.execute("SELECT version FROM schema_version LIMIT 1")
-                row = cursor.fetchone()
-                if not row:
+            conn = self._writer_conn()
+            fresh = not _columns(conn, "prompts")
+            if fresh:
+                # Only takes effect before the first table (and the WAL switch)
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            # Persistent: stored in the file, so readers open straight into WAL
+            conn.execute("PRAGMA journal_mode=WAL")
+            if not fresh:
+                self._migrate(conn)
+            conn.executescript(_SCHEMA_SQL)
+            _create_search_index(conn)
+            # Otherwise cleanup() removes index entries itself (see _expiring_entries)
+            self._search_deletes = "contentless_delete" in _search_table_sql(conn)
+            if fresh:
+                with conn:
                     conn.execute(
-                        "INSERT INTO schema_version (version) VALUES (?)",
-                        (_SCHEMA_VERSION,),
+                        "INSERT INTO schema_version (version) VALUES (?)", (_SCHEMA_VERSION,)
                     )
-                conn.commit()
-            finally:
-                conn.close()
 
         logger.debug("PromptDB initialized at {}", self.db_path)
 
-    def _encrypt_text(self, text: str | None) -> str | None:
-        """Encrypt text if encryption is enabled."""
+    def _migrate(self, conn: sqlite3.Connection) -> None:
+        """Apply pending migrations to an existing database, recording each version."""
+        conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY)")
+        row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+        current = row[0] or 1
+        if current > _SCHEMA_VERSION:
+            logger.warning(
+                "Prompt database schema v{} is newer than this version supports (v{})",
+                current,
+                _SCHEMA_VERSION,
+            )
+            return
+        for version, migration in _MIGRATIONS:
+            if version <= current:
+                continue
+            logger.debug("Migrating prompt database to schema v{}", version)
+            migration(conn)
+            with conn:
+                conn.execute("DELETE FROM schema_version")
+                conn.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+
+    def _encrypt_text(self, text: str | None) -> bytes | str | None:
+        """Compress and encrypt text for storage.
+
+        With encryption enabled this is always an AES-GCM BLOB with a fresh
+        nonce. Without it, text that compresses well is stored as a compressed
+        BLOB and anything else stays plain TEXT.
+        """
         if text is None:
             return None
-        if self._fernet:
-            return self._fernet.encrypt(text.encode("utf-8")).decode("ascii")
-        return text
+        codec, payload = self._compressor.compress(text.encode("utf-8"))
+        if self._aead:
+            header = bytes((_FORMAT_AESGCM_COMPRESSED, codec))
+            nonce = os.urandom(_NONCE_BYTES)
+            return header + nonce + self._aead.encrypt(nonce, payload, header)
+        if codec == CODEC_NONE:
+            return text
+        return bytes((_FORMAT_COMPRESSED, codec)) + payload
 
-    def _decrypt_text(self, text: str | None) -> str | None:
-        """Decrypt text if encryption is enabled."""
-        if text is None:
+    def _decrypt_text(self, value: bytes | str | None) -> str | None:
+        """Decrypt a stored value: AES-GCM or compressed BLOB, legacy Fernet token, or plaintext."""
+        if value is None:
             return None
+        if isinstance(value, bytes):
+            try:
+                return self._decode_blob(value)
+            except Exception:
+                logger.debug("Failed to decrypt text — returning None")
+                return None
         if self._fernet:
             try:
-                return self._fernet.decrypt(text.encode("ascii")).decode("utf-8")
+                return self._fernet.decrypt(value.encode("ascii")).decode("utf-8")
             except Exception:
                 logger.debug("Failed to decrypt text — returning as-is")
-                return text
-        return text
+                return value
+        return value
+
+    def _decode_blob(self, value: bytes) -> str:
+        fmt = value[0]
+        if fmt == _FORMAT_COMPRESSED:
+            return self._compressor.decompress(value[1], value[2:]).decode("utf-8")
+        if not self._aead:
+            raise ValueError("encrypted text but encryption is not initialized")
+        if fmt == _FORMAT_AESGCM:
+            nonce = value[1 : 1 + _NONCE_BYTES]
+            return self._aead.decrypt(nonce, value[1 + _NONCE_BYTES :], None).decode("utf-8")
+        if fmt == _FORMAT_AESGCM_COMPRESSED:
+            header, nonce = value[:2], value[2 : 2 + _NONCE_BYTES]
+            payload = self._aead.decrypt(nonce, value[2 + _NONCE_BYTES :], header)
+            return self._compressor.decompress(value[1], payload).decode("utf-8")
+        raise ValueError(f"unknown stored text format {fmt}")
+
+    # --- Compression dictionaries ---
+
+    def _load_compression_dicts(self) -> None:
+        """Register stored zstd dictionaries; the newest one compresses new rows."""
+        with self._reader() as conn:
+            rows = conn.execute(
+                "SELECT data FROM compression_dicts ORDER BY created_at, rowid"
+            ).fetchall()
+        for (data,) in rows:
+            self._compressor.add_dictionary(data)
+
+    @property
+    def compression_dictionary_id(self) -> int:
+        """Id of the zstd dictionary used for new rows (0 if none)."""
+        return self._compressor.active_dictionary_id
+
+    def train_compression_dict(self, sample_rows: int = _DICT_TRAINING_ROWS) -> int:
+        """Train a zstd dictionary on recent prompt/response text and use it for new rows.
+
+        Transcript-style text shares a lot of boilerplate (system prompts, tool
+        output framing), which a trained dictionary compresses far better than
+        zstd can from a single short record. The dictionary is stored in the
+        database, so older rows stay readable after retraining. Returns the new
+        dictionary id, or 0 if zstd is unavailable or there is too little data.
+        """
+        if self._compressor.codec != "zstd":
+            return 0
+        with self._reader() as conn:
+            rows = conn.execute(
+                "SELECT prompt_text, response_text FROM prompts ORDER BY id DESC LIMIT ?",
+                (sample_rows,),
+            ).fetchall()
+            rows += conn.execute(
+                "SELECT data FROM prompt_blobs ORDER BY rowid DESC LIMIT ?", (sample_rows,)
+            ).fetchall()
+        values = [v for row in rows for v in row if v is not None]
+        samples = [t.encode("utf-8") for t in self._decrypt_many(values, parallel=True) if t]
+        data = TextCompressor.train_dictionary(samples)
+        if data is None:
+            return 0
+        with self._lock:
+            conn = self._writer_conn()
+            with conn:
+                dict_id = self._compressor.add_dictionary(data)
+                conn.execute(
+                    "INSERT OR REPLACE INTO compression_dicts (dict_id, created_at, data) "
+                    "VALUES (?, ?, ?)",
+                    (dict_id, datetime.now(timezone.utc).isoformat(), data),
+                )
+        logger.info(
+            "Trained prompt compression dictionary {} from {} samples", dict_id, len(samples)
+        )
+        return dict_id
 
     def insert_prompt(
         self,
@@ -191,44 +1030,316 @@ class PromptDB:
         response_text: str | None = None,
         project_path: str | None = None,
     ) -> int:
-        """Insert a prompt record. Returns the row ID."""
-        now = datetime.now(timezone.utc).isoformat()
+        """Insert a prompt record. Returns the row ID, or 0 if it was queued (write-behind)."""
+        record = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "tool_name": tool_name,
+            "source": source,
+            "model_name": model_name,
+            "session_id": session_id,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cache_creation_tokens": cache_creation_tokens,
+            "cache_read_tokens": cache_read_tokens,
+            "estimated_cost_usd": estimated_cost_usd,
+            "prompt_text": prompt_text,
+            "response_text": response_text,
+            "project_path": project_path,
+        }
+        if self._queue is not None:
+            self._enqueue([record])
+            return 0
+        return self._write_records([record])
+
+    def insert_prompts_bulk(self, records: list[dict], parallel: bool = False) -> int:
+        """Insert many prompt records in a single transaction. Returns the row count.
+
+        Each record takes the same keys as `insert_prompt`. Text fields are
+        encrypted before the lock is taken (on a thread pool when `parallel` is
+        set and the batch is large enough), then all rows are written with one
+        `executemany` and one commit. In write-behind mode the records are
+        queued instead and the call returns without touching the database.
+        """
+        if not records:
+            return 0
+        if self._queue is not None:
+            now = datetime.now(timezone.utc).isoformat()
+            self._enqueue([{"timestamp": now, **record} for record in records])
+            return len(records)
+        self._write_records(records, parallel=parallel)
+        return len(records)
+
+    def _write_records(self, records: list[dict], parallel: bool = False) -> int:
+        """Encrypt and insert records in one transaction. Returns the id of the last row.
 
-        # Encrypt sensitive text fields
-        enc_prompt = self._encrypt_text(prompt_text)
-        enc_response = self._encrypt_text(response_text)
+        Large texts go to `prompt_blobs`: each distinct one is encrypted and
+        stored once, and content that is already stored only gains references.
+        """
+        now = datetime.now(timezone.utc)
+        now_iso, now_us = now.isoformat(), _to_us(now)
+
+        texts = []
+        for record in records:
+            texts.append(record.get("prompt_text"))
+            texts.append(record.get("response_text"))
+        hashes = [self._blob_hash(t) for t in texts]
+        refs = Counter(h for h in hashes if h is not None)
+        with self._reader() as conn:
+            stored = _existing_blobs(conn, refs)
+        blob_texts = {}
+        for text, h in zip(texts, hashes):
+            if h is not None and h not in stored:
+                blob_texts.setdefault(h, text)
+        inline = [None if h is not None else t for t, h in zip(texts, hashes)]
+        encrypted = self._encrypt_many(inline + list(blob_texts.values()), parallel=parallel)
+        new_blobs = {
+            h: (len(text.encode("utf-8")), data)
+            for (h, text), data in zip(blob_texts.items(), encrypted[len(inline) :])
+        }
+
+        rows = [
+            (
+                record.get("timestamp") or now_iso,
+                _iso_to_us(record.get("timestamp")) or now_us,
+                record["tool_name"],
+                record.get("model_name"),
+                record["source"],
+                record.get("session_id"),
+                record.get("input_tokens"),
+                record.get("output_tokens"),
+                record.get("cache_creation_tokens"),
+                record.get("cache_read_tokens"),
+                record.get("estimated_cost_usd"),
+                encrypted[2 * i],
+                encrypted[2 * i + 1],
+                record.get("project_path"),
+                self._host_name,
+                hashes[2 * i],
+                hashes[2 * i + 1],
+            )
+            for i, record in enumerate(records)
+        ]
+
+        rollups, sessions = _accumulate_usage(rows)
+        index_terms = [
+            self._index_terms(record.get("prompt_text"), record.get("response_text"))
+            for record in records
+        ]
 
         with self._lock:
-            conn = sqlite3.connect(str(self.db_path))
-            try:
-                cursor = conn.execute(
-                    """INSERT INTO prompts (
-                        timestamp, tool_name, model_name, source, session_id,
-                        input_tokens, output_tokens, cache_creation_tokens, cache_read_tokens,
-                        estimated_cost_usd, prompt_text, response_text,
-                        project_path, host_name
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                    (
-                        now,
-                        tool_name,
-                        model_name,
-                        source,
-                        session_id,
-                        input_tokens,
-                        output_tokens,
-                        cache_creation_tokens,
-                        cache_read_tokens,
-                        estimated_cost_usd,
-                        enc_prompt,
-                        enc_response,
-                        project_path,
-                        self._host_name,
-                    ),
+            conn = self._writer_conn()
+            with conn:
+                if refs:
+                    # A blob seen above may since have been released by cleanup()
+                    gone = set(refs) - new_blobs.keys() - _existing_blobs(conn, refs)
+                    for h in gone:
+                        text = texts[hashes.index(h)]
+                        new_blobs[h] = (len(text.encode("utf-8")), self._encrypt_text(text))
+                    conn.executemany(
+                        "INSERT INTO prompt_blobs (hash, refcount, size, data) VALUES (?, 0, ?, ?) "
+                        "ON CONFLICT(hash) DO NOTHING",
+                        [(h, size, data) for h, (size, data) in new_blobs.items()],
+                    )
+                    conn.executemany(
+                        "UPDATE prompt_blobs SET refcount = refcount + ? WHERE hash = ?",
+                        [(n, h) for h, n in refs.items()],
+                    )
+                conn.executemany(_INSERT_PROMPT_SQL, rows[:-1])
+                cursor = conn.execute(_INSERT_PROMPT_SQL, rows[-1])
+                # Ids within one write transaction are consecutive
+                first_id = cursor.lastrowid - len(rows) + 1
+                conn.executemany(
+                    "INSERT INTO prompt_search (rowid, terms) VALUES (?, ?)",
+                    [(first_id + i, t) for i, t in enumerate(index_terms) if t],
+                )
+                for table, deltas in rollups.items():
+                    conn.executemany(
+                        _UPSERT_ROLLUP_SQL.format(table=table),
+                        [(*key, *sums) for key, sums in deltas.items()],
+                    )
+                conn.executemany(_ACCUMULATE_SESSION_SQL, list(sessions.values()))
+            return cursor.lastrowid
+
+    def _index_terms(self, *texts: str | None) -> str | None:
+        """Return the prompt_search entry for a row's texts, or None if there is nothing to index.
+
+        Encrypted databases get the distinct blind tokens of the row's terms,
+        which reveal neither the words nor their order.
+        """
+        texts = [t for t in texts if t]
+        if not texts:
+            return None
+        if self._search_key is None:
+            return "\n".join(texts)
+        terms = dict.fromkeys(
+            term
+            for text in texts
+            for term in _search_terms(text)
+            if len(term) <= _SEARCH_MAX_TERM_CHARS
+        )
+        return " ".join(map(self._blind_token, terms)) or None
+
+    def _blind_token(self, term: str) -> str:
+        digest = hmac.new(self._search_key, term.encode("utf-8"), hashlib.sha256).digest()
+        return digest[:_SEARCH_TOKEN_BYTES].hex()
+
+    def _blob_hash(self, text: str | None) -> bytes | None:
+        """Keyed hash of a text that belongs in prompt_blobs, or None to store it inline."""
+        if text is None or len(text) * 4 < _BLOB_MIN_BYTES:
+            return None
+        data = text.encode("utf-8")
+        if len(data) < _BLOB_MIN_BYTES:
+            return None
+        return hmac.new(self._blob_key, data, hashlib.sha256).digest()
+
+    def _encrypt_many(
+        self, texts: list[str | None], parallel: bool = False
+    ) -> list[bytes | str | None]:
+        """Encrypt a list of texts, optionally fanning out to a thread pool."""
+        if not self._fernet or not parallel or len(texts) < _PARALLEL_ENCRYPT_MIN_ROWS:
+            return [self._encrypt_text(t) for t in texts]
+        return list(self._crypto_pool().map(self._encrypt_text, texts))
+
+    def _decrypt_many(self, values: list, parallel: bool = False) -> list[str | None]:
+        """Decrypt a list of stored values, optionally fanning out to a thread pool."""
+        if not self._fernet or not parallel or len(values) < _PARALLEL_ENCRYPT_MIN_ROWS:
+            return [self._decrypt_text(v) for v in values]
+        return list(self._crypto_pool().map(self._decrypt_text, values))
+
+    def _crypto_pool(self) -> ThreadPoolExecutor:
+        with self._state_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=min(8, os.cpu_count() or 1), thread_name_prefix="prompt-db-crypto"
                 )
-                conn.commit()
-                return cursor.lastrowid
+            return self._executor
+
+    # --- Write-behind ---
+
+    def _start_write_behind(self, queue_size: int) -> None:
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._write_thread = threading.Thread(
+            target=self._write_behind_loop, name="prompt-db-writer", daemon=True
+        )
+        self._write_thread.start()
+        logger.debug(
+            "PromptDB write-behind enabled (queue={}, batch={}, interval={}s)",
+            queue_size,
+            self._batch_size,
+            self._flush_interval,
+        )
+
+    def _enqueue(self, records: list[dict]) -> None:
+        """Queue records for the writer thread.
+
+        When the queue is full the remaining records are written on the
+        caller's thread instead: memory stays bounded, nothing is dropped, and
+        the producer is slowed down to the speed of the disk.
+        """
+        q = self._queue
+        for i, record in enumerate(records):
+            try:
+                if q is None:
+                    raise queue.Full
+                q.put_nowait(record)
+            except queue.Full:
+                overflow = records[i:]
+                if q is not None:
+                    with self._state_lock:
+                        first = self._overflow_count == 0
+                        self._overflow_count += len(overflow)
+                    if first:
+                        logger.warning(
+                            "Prompt write queue full ({} records) — writing inline", q.maxsize
+                        )
+                self._write_records(overflow)
+                return
+
+    def _write_behind_loop(self) -> None:
+        """Group-commit queued records by batch size or flush interval."""
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            batch: list[dict] = []
+            controls = [item] if item is _FLUSH or item is _STOP else []
+            if not controls:
+                batch.append(item)
+                deadline = time.monotonic() + self._flush_interval
+                while len(batch) < self._batch_size:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                    if item is _FLUSH or item is _STOP:
+                        controls.append(item)
+                        break
+                    batch.append(item)
+            stopping = _STOP in controls
+            try:
+                if batch:
+                    self._commit_batch(batch)
             finally:
-                conn.close()
+                for _ in range(len(batch) + len(controls)):
+                    self._queue.task_done()
+
+    def _commit_batch(self, batch: list[dict]) -> None:
+        """Commit a queued batch, retrying with back-off, then falling back to single records.
+
+        Busy or I/O errors usually clear on a retry. If the batch still
+        fails, each record is written in its own transaction so one bad record
+        does not discard the rest; the records that fail are counted.
+        """
+        delay = _WRITE_RETRY_DELAY
+        for attempt in range(_WRITE_RETRIES + 1):
+            try:
+                self._write_records(batch, parallel=True)
+            except Exception:
+                logger.opt(exception=True).debug(
+                    "Failed to commit {} queued prompt records (attempt {})",
+                    len(batch),
+                    attempt + 1,
+                )
+            else:
+                with self._state_lock:
+                    self._committed_count += len(batch)
+                return
+            if attempt < _WRITE_RETRIES:
+                time.sleep(delay)
+                delay *= 2
+
+        committed = 0
+        for record in batch:
+            try:
+                self._write_records([record])
+                committed += 1
+            except Exception:
+                logger.opt(exception=True).debug("Failed to commit a queued prompt record")
+        failed = len(batch) - committed
+        if failed:
+            logger.warning("Dropped {} of {} queued prompt records", failed, len(batch))
+        with self._state_lock:
+            self._committed_count += committed
+            self._failed_count += failed
+
+    def flush(self) -> None:
+        """Block until every queued record has been committed (no-op without write-behind)."""
+        if self._queue is None or not self._write_thread or not self._write_thread.is_alive():
+            return
+        self._queue.put(_FLUSH)
+        self._queue.join()
+
+    def queue_stats(self) -> dict:
+        """Write-behind queue depth, capacity and counters, for backpressure metrics."""
+        return {
+            "depth": self._queue.qsize() if self._queue is not None else 0,
+            "capacity": self._queue.maxsize if self._queue is not None else 0,
+            "overflows": self._overflow_count,
+            "committed": self._committed_count,
+            "failed": self._failed_count,
+        }
 
     def upsert_session(
         self,
@@ -242,8 +1353,8 @@ class PromptDB:
     ) -> None:
         """Insert or update a session record."""
         with self._lock:
-            conn = sqlite3.connect(str(self.db_path))
-            try:
+            conn = self._writer_conn()
+            with conn:
                 conn.execute(
                     """INSERT INTO sessions (id, tool_name, start_time, end_time,
                         total_input_tokens, total_output_tokens, total_cost_usd)
@@ -263,9 +1374,6 @@ class PromptDB:
                         total_cost_usd,
                     ),
                 )
-                conn.commit()
-            finally:
-                conn.close()
 
     def get_prompts(
         self,
@@ -274,83 +1382,512 @@ class PromptDB:
         limit: int = 100,
     ) -> list[dict]:
         """Query prompts with optional filters. Decrypts text fields."""
-        conditions = []
-        params = []
+        conditions, params = _prompt_filters(tool_name=tool_name, since=since)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
 
-        if tool_name:
-            conditions.append("tool_name = ?")
-            params.append(tool_name)
-        if since:
-            conditions.append("timestamp >= ?")
-            params.append(since.isoformat())
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            rows = cursor.execute(
+                f"{_SELECT_PROMPTS_SQL} {where} ORDER BY ts_us DESC, id DESC LIMIT ?",
+                (*params, limit),
+            ).fetchall()
+        return self._decrypt_rows(rows)
 
-        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    def search_prompts(
+        self,
+        query: str,
+        tool_name: str | None = None,
+        since: datetime | None = None,
+        until: datetime | None = None,
+        limit: int = 50,
+    ) -> list[dict]:
+        """Find prompts whose prompt or response text contains every word of `query`.
+
+        Words match whole and ignore case and accents. The lookup runs on the
+        `prompt_search` index, so only the matching rows are decrypted; results
+        are newest first. Rows written before the index existed are found once
+        `index_pending` has reached them.
+        """
+        terms = _search_terms(query)
+        if self._search_key is not None:
+            terms = [self._blind_token(t) for t in terms if len(t) <= _SEARCH_MAX_TERM_CHARS]
+        if not terms:
+            return []
+        match = " AND ".join(f'"{term}"' for term in dict.fromkeys(terms))
+        conditions, params = _prompt_filters(
+            tool_name=tool_name, since=since, until=until, prefix="p."
+        )
+        conditions.insert(
+            0, "p.id IN (SELECT rowid FROM prompt_search WHERE prompt_search MATCH ?)"
+        )
+
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            rows = cursor.execute(
+                f"{_SELECT_PROMPTS_SQL} WHERE {' AND '.join(conditions)} "
+                "ORDER BY p.ts_us DESC, p.id DESC LIMIT ?",
+                (match, *params, limit),
+            ).fetchall()
+        return self._decrypt_rows(rows)
+
+    def _decrypt_rows(self, rows: list[sqlite3.Row]) -> list[dict]:
+        """Turn _SELECT_PROMPTS_SQL rows into dicts, decrypting each distinct blob once."""
+        results = []
+        values = []
+        slots: dict = {}
+        for row in rows:
+            d = dict(row)
+            for field in ("prompt", "response"):
+                blob_hash = d.pop(f"{field}_blob")
+                blob_data = d.pop(f"{field}_blob_data")
+                if blob_hash is None:
+                    key, value = None, d[f"{field}_text"]
+                else:
+                    key, value = blob_hash, blob_data
+                if key is None or key not in slots:
+                    if key is not None:
+                        slots[key] = len(values)
+                    values.append(value)
+                d[f"{field}_text"] = slots[key] if key is not None else len(values) - 1
+            results.append(d)
+        decrypted = self._decrypt_many(values, parallel=True)
+        for d in results:
+            d["prompt_text"] = decrypted[d["prompt_text"]]
+            d["response_text"] = decrypted[d["response_text"]]
+        return results
+
+    def index_pending(self, max_rows: int | None = None) -> int:
+        """Add rows stored before the search index existed to it, newest first.
+
+        Works backwards from the id recorded by the schema migration in
+        batches of _SEARCH_BACKFILL_ROWS, each decrypted outside the write
+        lock and committed together with the new watermark, so it can stop
+        and resume at any point. Returns the number of rows examined.
+        """
+        done = 0
+        while max_rows is None or done < max_rows:
+            with self._reader() as conn:
+                row = conn.execute("SELECT until_id FROM search_backfill").fetchone()
+                if row is None:
+                    break
+                batch = _SEARCH_BACKFILL_ROWS
+                if max_rows is not None:
+                    batch = min(batch, max_rows - done)
+                cursor = conn.cursor()
+                cursor.row_factory = sqlite3.Row
+                rows = cursor.execute(
+                    f"{_SELECT_PROMPTS_SQL} WHERE p.id <= ? ORDER BY p.id DESC LIMIT ?",
+                    (row[0], batch),
+                ).fetchall()
+            entries = [
+                (d["id"], self._index_terms(d["prompt_text"], d["response_text"]))
+                for d in self._decrypt_rows(rows)
+            ]
+            with self._lock:
+                conn = self._writer_conn()
+                with conn:
+                    # Skip rows that retention deleted in the meantime
+                    conn.executemany(
+                        "INSERT INTO prompt_search (rowid, terms) SELECT ?, ? "
+                        "WHERE EXISTS (SELECT 1 FROM prompts WHERE id = ?)",
+                        [(row_id, terms, row_id) for row_id, terms in entries if terms],
+                    )
+                    if len(rows) < batch:
+                        conn.execute("DELETE FROM search_backfill")
+                    else:
+                        conn.execute(
+                            "UPDATE search_backfill SET until_id = ?", (rows[-1]["id"] - 1,)
+                        )
+            done += len(rows)
+            if len(rows) < batch:
+                break
+        if done:
+            logger.debug("Indexed {} earlier prompts for search", done)
+        return done
 
+    def migrate_pending(self, max_rows: int | None = None) -> int:
+        """Finish the data backfills of the v3 and v4 schema migrations.
+
+        Fills ts_us for rows stored before it existed, then rebuilds the usage
+        rollups and sessions from those rows. Both work backwards from the id
+        recorded by the migration in batches of _MIGRATION_BATCH_ROWS, each
+        committed together with the new watermark, so startup never waits on
+        them and they can stop and resume at any point. Rollups are only
+        rebuilt once every timestamp is converted. Returns the number of rows
+        processed.
+        """
+        done = 0
+        for table, step in (
+            ("timestamp_backfill", self._backfill_timestamps),
+            ("rollup_backfill", self._backfill_rollups),
+        ):
+            while max_rows is None or done < max_rows:
+                with self._reader() as conn:
+                    row = conn.execute(f"SELECT until_id FROM {table}").fetchone()
+                if row is None:
+                    break
+                batch = _MIGRATION_BATCH_ROWS
+                if max_rows is not None:
+                    batch = min(batch, max_rows - done)
+                done += step(row[0], batch)
+            else:
+                break
+        if done:
+            logger.debug("Migrated {} earlier prompts", done)
+        return done
+
+    def _backfill_timestamps(self, until_id: int, batch: int) -> int:
+        """Convert the ISO timestamps of up to `batch` rows at or below until_id."""
+        with self._reader() as conn:
+            rows = conn.execute(
+                "SELECT id, timestamp FROM prompts WHERE id <= ? ORDER BY id DESC LIMIT ?",
+                (until_id, batch),
+            ).fetchall()
         with self._lock:
-            conn = sqlite3.connect(str(self.db_path))
-            conn.row_factory = sqlite3.Row
-            try:
+            conn = self._writer_conn()
+            with conn:
+                conn.executemany(
+                    "UPDATE prompts SET ts_us = ? WHERE id = ? AND ts_us IS NULL",
+                    [(_iso_to_us(ts), row_id) for row_id, ts in rows],
+                )
+                if len(rows) < batch:
+                    conn.execute("DELETE FROM timestamp_backfill")
+                else:
+                    conn.execute("UPDATE timestamp_backfill SET until_id = ?", (rows[-1][0] - 1,))
+        return len(rows)
+
+    def _backfill_rollups(self, until_id: int, batch: int) -> int:
+        """Add the rows with ids in (until_id - batch, until_id] to the rollups and sessions."""
+        start = max(until_id - batch, 0)
+        with self._lock:
+            conn = self._writer_conn()
+            with conn:
+                for table, width in _ROLLUPS.items():
+                    conn.execute(
+                        _BACKFILL_ROLLUP_SQL.format(table=table, width=width), (start, until_id)
+                    )
+                conn.execute(_BACKFILL_SESSIONS_SQL, (start, until_id))
+                if start == 0:
+                    conn.execute("DELETE FROM rollup_backfill")
+                else:
+                    conn.execute("UPDATE rollup_backfill SET until_id = ?", (start,))
+        return until_id - start
+
+    def iter_prompts(
+        self,
+        columns: Iterable[str] | None = None,
+        tool_name: str | None = None,
+        model_name: str | None = None,
+        since: datetime | None = None,
+        until: datetime | None = None,
+        after: tuple[int, int] | None = None,
+        page_size: int = _ITER_PAGE_ROWS,
+    ) -> Iterator[PromptRecord]:
+        """Stream prompts newest first as lazily decrypted `PromptRecord`s.
+
+        Only the requested `columns` are read (all by default), and the blob
+        table is joined only when a text column is among them. Rows are
+        fetched in keyset-paginated pages of `page_size`, each in its own short
+        read, so exports run in constant memory and never pin an old
+        snapshot. Pass a record's `cursor` as `after` to continue a listing.
+        Rows whose timestamp could not be parsed are not listed.
+        """
+        keys = tuple(columns) if columns is not None else _PROMPT_COLUMNS
+        unknown = set(keys) - set(_PROMPT_COLUMNS)
+        if unknown:
+            raise ValueError(f"unknown prompt columns {sorted(unknown)}")
+        texts = [c for c in _TEXT_COLUMNS if c in keys]
+        plain = [c for c in keys if c not in texts and c not in ("id", "ts_us")]
+        select = ["p.id", "p.ts_us"] + [f"p.{c}" for c in plain]
+        joins = []
+        for column in texts:
+            field = column.removesuffix("_text")  # "prompt" / "response"
+            select += [f"p.{column}", f"p.{field}_blob", f"{field}_blobs.data"]
+            joins.append(
+                f"LEFT JOIN prompt_blobs {field}_blobs ON {field}_blobs.hash = p.{field}_blob"
+            )
+
+        conditions, params = _prompt_filters(
+            tool_name=tool_name, model_name=model_name, since=since, until=until, prefix="p."
+        )
+        conditions.append("p.ts_us IS NOT NULL")
+        sql = (
+            f"SELECT {', '.join(select)} FROM prompts p {' '.join(joins)} "
+            f"WHERE {' AND '.join(conditions)} {{keyset}} "
+            "ORDER BY p.ts_us DESC, p.id DESC LIMIT ?"
+        )
+
+        while True:
+            keyset, keyset_params = "", []
+            if after is not None:
+                keyset = "AND (p.ts_us < ? OR (p.ts_us = ? AND p.id < ?))"
+                keyset_params = [after[0], after[0], after[1]]
+            with self._reader() as conn:
+                # One extra row tells whether another page follows
                 rows = conn.execute(
-                    f"SELECT * FROM prompts {where} ORDER BY timestamp DESC LIMIT ?",
-                    (*params, limit),
+                    sql.format(keyset=keyset), (*params, *keyset_params, page_size + 1)
                 ).fetchall()
+            more = len(rows) > page_size
+            rows = rows[:page_size]
+            decode = self._page_decoder()
+            for row in rows:
+                values = {"id": row[0], "ts_us": row[1], **dict(zip(plain, row[2:]))}
+                pending = {}
+                offset = 2 + len(plain)
+                for column in texts:
+                    inline, blob_hash, blob_data = row[offset : offset + 3]
+                    offset += 3
+                    pending[column] = (blob_hash, inline if blob_hash is None else blob_data)
+                cursor = (row[1], row[0])
+                values = {k: values[k] for k in keys if k not in texts}
+                yield PromptRecord(keys, values, pending, decode, cursor)
+            if not more:
+                return
+            after = cursor
 
-                results = []
-                for row in rows:
-                    d = dict(row)
-                    d["prompt_text"] = self._decrypt_text(d.get("prompt_text"))
-                    d["response_text"] = self._decrypt_text(d.get("response_text"))
-                    results.append(d)
-                return results
-            finally:
-                conn.close()
+    def _page_decoder(self) -> Callable:
+        """Return a decrypt function for one page; each blob is decrypted once per page."""
+        memo: dict[bytes, str | None] = {}
+
+        def decode(stored: tuple) -> str | None:
+            blob_hash, value = stored
+            if blob_hash is None:
+                return self._decrypt_text(value)
+            if blob_hash not in memo:
+                memo[blob_hash] = self._decrypt_text(value)
+            return memo[blob_hash]
+
+        return decode
 
     def get_stats(self) -> dict:
-        """Get aggregate statistics from the database."""
-        with self._lock:
-            conn = sqlite3.connect(str(self.db_path))
-            try:
-                row = conn.execute(
-                    """SELECT
-                        COUNT(*) as total_prompts,
-                        SUM(input_tokens) as total_input_tokens,
-                        SUM(output_tokens) as total_output_tokens,
-                        SUM(estimated_cost_usd) as total_cost_usd
-                    FROM prompts"""
-                ).fetchone()
-                return {
-                    "total_prompts": row[0] or 0,
-                    "total_input_tokens": row[1] or 0,
-                    "total_output_tokens": row[2] or 0,
-                    "total_cost_usd": row[3] or 0.0,
-                }
-            finally:
-                conn.close()
+        """Get all-time aggregate statistics.
+
+        Read from the daily rollup, so the cost is proportional to the number
+        of days and tool/model combinations, and rows removed by retention
+        still count.
+        """
+        with self._reader() as conn:
+            row = conn.execute(
+                """SELECT
+                    SUM(prompts) as total_prompts,
+                    SUM(input_tokens) as total_input_tokens,
+                    SUM(output_tokens) as total_output_tokens,
+                    SUM(cost_usd) as total_cost_usd
+                FROM usage_daily"""
+            ).fetchone()
+        return {
+            "total_prompts": row[0] or 0,
+            "total_input_tokens": row[1] or 0,
+            "total_output_tokens": row[2] or 0,
+            "total_cost_usd": row[3] or 0.0,
+        }
+
+    def get_usage(
+        self,
+        group_by: tuple[str, ...] = ("tool_name",),
+        since: datetime | None = None,
+        until: datetime | None = None,
+        granularity: str = "day",
+        tool_name: str | None = None,
+    ) -> list[dict]:
+        """Usage totals from the rollups, grouped by any of the rollup key columns.
+
+        `group_by` takes "bucket" (start of the hour/day, epoch seconds),
+        "tool_name", "model_name", "source" and "project_path". The window is
+        widened to whole buckets: `since` is rounded down to the start of its
+        bucket and `until`, exclusive as everywhere else, up to the start of
+        the next one, so with daily granularity a partial day counts as a
+        whole one and adjacent windows never count a bucket twice.
+        """
+        table = {"hour": "usage_hourly", "day": "usage_daily"}.get(granularity)
+        if table is None:
+            raise ValueError(f"granularity must be 'hour' or 'day', not {granularity!r}")
+        unknown = set(group_by) - set(_ROLLUP_KEYS)
+        if unknown:
+            raise ValueError(f"cannot group usage by {sorted(unknown)}")
+        width = _ROLLUPS[table]
+
+        conditions = []
+        params: list = []
+        if since:
+            conditions.append("bucket >= ?")
+            params.append(_to_us(since) // 1_000_000 // width * width)
+        if until:
+            conditions.append("bucket < ?")
+            params.append(-(-_to_us(until) // (width * 1_000_000)) * width)
+        if tool_name:
+            conditions.append("tool_name = ?")
+            params.append(tool_name)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        columns = ", ".join(group_by)
+        sums = ", ".join(f"SUM({c}) AS {c}" for c in _ROLLUP_SUMS)
+        select = f"{columns}, {sums}" if group_by else sums
+        group = f"GROUP BY {columns} ORDER BY {columns}" if group_by else ""
+
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            rows = cursor.execute(f"SELECT {select} FROM {table} {where} {group}", params)
+            return [dict(row) for row in rows if row["prompts"]]
 
     def cleanup(self) -> int:
-        """Delete prompts older than retention_days. Returns number of rows deleted."""
+        """Delete prompts older than retention_days, then reclaim the freed space.
+
+        Rows are deleted oldest first in batches of _RETENTION_BATCH_ROWS, one
+        short transaction each, so inserts interleave with a large expiry
+        instead of waiting for it; their search index entries go with them.
+        Pending migration backfills run first, and rows still waiting for the
+        search index backfill are indexed afterwards. Rows whose timestamp
+        could not be converted (NULL ts_us) expire by their ISO timestamp
+        text. Returns the number of rows deleted.
+        """
+        # Rollups keep usage of expired rows, so roll them up before they go
+        self.migrate_pending()
         cutoff = datetime.now(timezone.utc) - timedelta(days=self.retention_days)
+        expired = (_to_us(cutoff), cutoff.isoformat())
+        deleted = 0
+        while True:
+            if not self._search_deletes:
+                ids, entries = self._expiring_entries(expired)
+            with self._lock:
+                conn = self._writer_conn()
+                with conn:
+                    if self._search_deletes:
+                        count = conn.execute(
+                            "DELETE FROM prompts WHERE id IN (SELECT id FROM prompts "
+                            f"WHERE {_EXPIRED_SQL.format(p='')} ORDER BY ts_us LIMIT ?)",
+                            (*expired, _RETENTION_BATCH_ROWS),
+                        ).rowcount
+                    else:
+                        conn.executemany(
+                            "INSERT INTO prompt_search (prompt_search, rowid, terms) "
+                            "VALUES ('delete', ?, ?)",
+                            entries,
+                        )
+                        conn.executemany("DELETE FROM prompts WHERE id = ?", [(i,) for i in ids])
+                        count = len(ids)
+            deleted += count
+            if count < _RETENTION_BATCH_ROWS:
+                break
+        pages = self.reclaim_space() if deleted else 0
+        self.index_pending()
+        logger.debug(
+            "Cleaned up {} prompts older than {} days ({} pages freed)",
+            deleted,
+            self.retention_days,
+            pages,
+        )
+        return deleted
+
+    def _expiring_entries(
+        self, expired: tuple[int, str]
+    ) -> tuple[list[int], list[tuple[int, str]]]:
+        """Ids of the next retention batch, and the search entries to remove with them.
+
+        Used when prompt_search lacks contentless_delete: FTS5 then removes an
+        entry only given the exact terms it was indexed with, so they are
+        recomputed from the stored texts. Rows the backfill has not reached
+        are not indexed, and rows whose texts no longer decrypt are skipped,
+        as wrong terms would corrupt the index.
+        """
+        with self._reader() as conn:
+            row = conn.execute("SELECT until_id FROM search_backfill").fetchone()
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            rows = cursor.execute(
+                f"{_SELECT_PROMPTS_SQL} WHERE {_EXPIRED_SQL.format(p='p.')} "
+                "ORDER BY p.ts_us LIMIT ?",
+                (*expired, _RETENTION_BATCH_ROWS),
+            ).fetchall()
+        ids = [r["id"] for r in rows]
+        indexed = [r for r in rows if r["id"] > (row[0] if row else 0)]
+        stored = [
+            [r[f"{f}_text"] if r[f"{f}_blob"] is None else r[f"{f}_blob_data"] for f in _TEXTS]
+            for r in indexed
+        ]
+        entries = []
+        for values, d in zip(stored, self._decrypt_rows(indexed)):
+            texts = [d[f"{f}_text"] for f in _TEXTS]
+            if any(v is not None and t is None for v, t in zip(values, texts)):
+                continue
+            terms = self._index_terms(*texts)
+            if terms:
+                entries.append((d["id"], terms))
+        return ids, entries
+
+    def reclaim_space(self, max_pages: int | None = None) -> int:
+        """Return free pages to the filesystem in small incremental_vacuum steps.
 
+        Returns the number of pages released. A no-op on databases that are
+        not in incremental auto-vacuum mode.
+        """
+        released = 0
+        while max_pages is None or released < max_pages:
+            with self._lock:
+                conn = self._writer_conn()
+                free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                step = min(free, _VACUUM_STEP_PAGES)
+                if max_pages is not None:
+                    step = min(step, max_pages - released)
+                if step <= 0:
+                    break
+                # executescript steps the pragma to completion; execute() frees one page
+                conn.executescript(f"PRAGMA incremental_vacuum({step})")
+                after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if after >= free:
+                break
+            released += free - after
+        return released
+
+    def vacuum(self) -> bool:
+        """Switch a database created before schema v5 to incremental auto-vacuum.
+
+        This takes one full VACUUM, which rewrites the whole file under the
+        write lock, so it only runs when asked to (token_tracking
+        vacuum_on_start) and never during startup. Returns True if the file
+        was rebuilt, False if it already was in incremental mode.
+        """
         with self._lock:
-            conn = sqlite3.connect(str(self.db_path))
-            try:
-                cursor = conn.execute(
-                    "DELETE FROM prompts WHERE timestamp < ?",
-                    (cutoff.isoformat(),),
-                )
-                deleted = cursor.rowcount
-                conn.commit()
-                if deleted > 0:
-                    conn.execute("VACUUM")
-                logger.debug(
-                    "Cleaned up {} prompts older than {} days",
-                    deleted,
-                    self.retention_days,
-                )
-                return deleted
-            finally:
-                conn.close()
+            conn = self._writer_conn()
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                return False
+            logger.info("Rebuilding prompt database once to enable incremental vacuum")
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+        return True
 
     def close(self) -> None:
-        """No persistent connection to close, but available for API consistency."""
-        pass
+        """Commit queued writes, then close connections and the encryption thread pool.
+
+        The database reopens lazily (without write-behind) if used again afterwards.
+        """
+        if self._write_thread is not None:
+            q = self._queue
+            q.put(_STOP)
+            self._write_thread.join()
+            self._write_thread = None
+            self._queue = None
+            # Records that raced in behind the stop marker are written inline
+            late = []
+            while True:
+                try:
+                    item = q.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _FLUSH and item is not _STOP:
+                    late.append(item)
+            if late:
+                self._write_records(late)
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._readers_lock:
+            readers, self._readers = self._readers, []
+        for conn in readers:
+            conn.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
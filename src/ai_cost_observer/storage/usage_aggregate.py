@@ -0,0 +1,191 @@
+"""In-memory usage aggregate — hourly token and cost buckets for the last few days."""
+
+from __future__ import annotations
+
+import threading
+import time
+from datetime import datetime, timezone
+
+BUCKET_SECONDS = 3600
+
+# Sources of estimated (time-based) cost, besides token usage
+COST_SOURCES = ("apps", "browser", "cli")
+
+
+def _usage_entry() -> dict:
+    return {"input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0, "prompts": 0}
+
+
+class UsageAggregate:
+    """Token usage and estimated cost per hour, kept for the last `days` days.
+
+    TokenTracker, the ingest handler and the detectors add to it where they
+    record the matching OTel counters, and `warm` loads the token usage of
+    the same window from the PromptDB hourly rollups at startup. Estimated
+    costs are not stored anywhere, so they only count from the aggregate's
+    creation: `usage` reports that time as `estimated_since`. Queries sum
+    the buckets of a window under one lock, without touching SQLite or the
+    metrics backend; windows start on hour boundaries.
+    """
+
+    def __init__(self, days: int = 7) -> None:
+        self.days = max(1, days)
+        self._lock = threading.Lock()
+        # bucket start -> (tool, model, source) -> [input, output, cost, prompts]
+        self._tokens: dict[int, dict[tuple[str, str, str], list]] = {}
+        # bucket start -> (cost source, app/domain/tool name) -> cost
+        self._costs: dict[int, dict[tuple[str, str], float]] = {}
+        self._newest = 0
+        # Estimated costs from before this are lost with the previous process
+        self.estimated_since = int(time.time())
+
+    @staticmethod
+    def _bucket(at: float | None = None) -> int:
+        return int(time.time() if at is None else at) // BUCKET_SECONDS * BUCKET_SECONDS
+
+    def _buckets(self, table: dict, at: float | None) -> dict | None:
+        """The bucket for `at` in `table`, created if needed (None if too old). Holds the lock."""
+        bucket = self._bucket(at)
+        entries = table.get(bucket)
+        if entries is not None:
+            return entries
+        if bucket > self._newest:
+            # A new hour: drop what fell out of the window
+            self._newest = bucket
+            oldest = bucket - self.days * 86400
+            for expiring in (self._tokens, self._costs):
+                for old in [b for b in expiring if b < oldest]:
+                    del expiring[old]
+        if bucket < self._newest - self.days * 86400:
+            return None
+        entries = table[bucket] = {}
+        return entries
+
+    def add_tokens(
+        self,
+        tool: str,
+        model: str,
+        source: str,
+        input_tokens: int,
+        output_tokens: int,
+        cost: float,
+        prompts: int = 1,
+        at: float | None = None,
+    ) -> None:
+        """Count token usage for (tool, model, source) in the hour of `at` (default now)."""
+        key = (tool, model, source)
+        with self._lock:
+            entries = self._buckets(self._tokens, at)
+            if entries is None:
+                return
+            entry = entries.get(key)
+            if entry is None:
+                entry = entries[key] = [0, 0, 0.0, 0]
+            entry[0] += input_tokens
+            entry[1] += output_tokens
+            entry[2] += cost
+            entry[3] += prompts
+
+    def add_cost(self, source: str, name: str, cost: float, at: float | None = None) -> None:
+        """Count estimated cost of an app, domain or CLI tool ("apps", "browser", "cli")."""
+        key = (source, name)
+        with self._lock:
+            entries = self._buckets(self._costs, at)
+            if entries is not None:
+                entries[key] = entries.get(key, 0.0) + cost
+
+    def warm(self, prompt_db) -> int:
+        """Load the last `days` days of token usage from PromptDB's hourly rollups.
+
+        Only token usage is reloaded: the estimated costs of apps, domains
+        and CLI tools are not in the rollups, so after a restart they start
+        from zero (see `estimated_since`) while the OTel counters keep them.
+        Call before anything is recorded, or the overlap is counted twice.
+        Returns the number of rollup rows loaded.
+        """
+        since = datetime.fromtimestamp(self._bucket() - self.days * 86400, timezone.utc)
+        rows = prompt_db.get_usage(
+            group_by=("bucket", "tool_name", "model_name", "source"),
+            since=since,
+            granularity="hour",
+        )
+        for row in rows:
+            self.add_tokens(
+                row["tool_name"] or "unknown",
+                row["model_name"] or "unknown",
+                row["source"] or "unknown",
+                row["input_tokens"] or 0,
+                row["output_tokens"] or 0,
+                row["cost_usd"] or 0.0,
+                prompts=row["prompts"] or 0,
+                at=row["bucket"],
+            )
+        return len(rows)
+
+    def _window(self, table: dict, since: float, until: float | None):
+        start = self._bucket(since)
+        for bucket, entries in table.items():
+            if bucket >= start and (until is None or bucket < until):
+                yield from entries.items()
+
+    def usage(self, since: float, until: float | None = None) -> dict:
+        """Totals, cost per source, token usage per tool and estimated cost per name.
+
+        `estimated_since` is when the estimated costs in the result start:
+        the window start, or the aggregate's creation if that is later.
+        """
+        tools: dict[str, dict] = {}
+        estimated: dict[str, dict[str, float]] = {source: {} for source in COST_SOURCES}
+        with self._lock:
+            for (tool, _model, _source), values in self._window(self._tokens, since, until):
+                entry = tools.setdefault(tool, _usage_entry())
+                entry["input_tokens"] += values[0]
+                entry["output_tokens"] += values[1]
+                entry["cost_usd"] += values[2]
+                entry["prompts"] += values[3]
+            for (source, name), cost in self._window(self._costs, since, until):
+                names = estimated.setdefault(source, {})
+                names[name] = names.get(name, 0.0) + cost
+
+        totals = _usage_entry()
+        for entry in tools.values():
+            entry["cost_usd"] = round(entry["cost_usd"], 6)
+            for field in totals:
+                totals[field] += entry[field]
+        costs = {"tokens": totals["cost_usd"]}
+        for source, names in estimated.items():
+            for name in names:
+                names[name] = round(names[name], 6)
+            costs[source] = round(sum(names.values()), 6)
+        totals["cost_usd"] = round(sum(costs.values()), 6)
+        return {
+            "since": self._bucket(since),
+            "until": int(time.time() if until is None else until),
+            "totals": totals,
+            "cost_usd": costs,
+            "tools": tools,
+            "estimated_cost_usd": estimated,
+            "estimated_since": max(self._bucket(since), self.estimated_since),
+        }
+
+    def by_model(self, since: float, until: float | None = None) -> dict:
+        """Token usage per (tool, model), most expensive first."""
+        models: dict[tuple[str, str], dict] = {}
+        with self._lock:
+            for (tool, model, _source), values in self._window(self._tokens, since, until):
+                entry = models.get((tool, model))
+                if entry is None:
+                    entry = models[(tool, model)] = {"tool": tool, "model": model, **_usage_entry()}
+                entry["input_tokens"] += values[0]
+                entry["output_tokens"] += values[1]
+                entry["cost_usd"] += values[2]
+                entry["prompts"] += values[3]
+        for entry in models.values():
+            entry["cost_usd"] = round(entry["cost_usd"], 6)
+        return {
+            "since": self._bucket(since),
+            "until": int(time.time() if until is None else until),
+            "models": sorted(
+                models.values(), key=lambda e: (-e["cost_usd"], e["tool"], e["model"])
+            ),
+        }
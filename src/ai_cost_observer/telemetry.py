@@ -4,7 +4,7 @@ from __future__ import annotations
 
 import os
 import platform
-from typing import Optional
+from typing import Callable, Optional
 
 from loguru import logger
 from opentelemetry import metrics
@@ -18,6 +18,7 @@ from opentelemetry.sdk.resources import Resource
 
 from ai_cost_observer import __version__
 from ai_cost_observer.config import AppConfig
+from ai_cost_observer.storage.usage_aggregate import UsageAggregate
 
 
 def _create_exporter(config: AppConfig) -> MetricExporter:
@@ -80,6 +81,12 @@ class TelemetryManager:
         self._running_apps: dict[str, dict] = {}
         self._running_cli: dict[str, dict] = {}
         self._running_wsl: dict[str, dict] = {}
+        # PromptDB.queue_stats, registered when write-behind storage is enabled
+        self._prompt_queue_stats: Callable[[], dict] | None = None
+        # IngestHandler.queue_stats, registered when the HTTP receiver starts
+        self._ingest_queue_stats: Callable[[], dict] | None = None
+        # Hourly token/cost buckets behind /api/usage; updated next to the cost counters
+        self.usage = UsageAggregate(config.usage_cache_days)
 
         # --- Metric Instruments ---
         self.app_running = self.meter.create_observable_gauge(
@@ -147,6 +154,33 @@ class TelemetryManager:
             unit="1",
         )
 
+        self.prompt_queue_depth = self.meter.create_observable_gauge(
+            name="ai.prompt.queue.depth",
+            unit="1",
+            callbacks=[self._observe_prompt_queue_depth],
+        )
+        self.prompt_queue_overflow = self.meter.create_observable_counter(
+            name="ai.prompt.queue.overflow",
+            unit="1",
+            callbacks=[self._observe_prompt_queue_overflow],
+        )
+        self.prompt_queue_failed = self.meter.create_observable_counter(
+            name="ai.prompt.queue.failed",
+            unit="1",
+            callbacks=[self._observe_prompt_queue_failed],
+        )
+
+        self.ingest_queue_depth = self.meter.create_observable_gauge(
+            name="ai.ingest.queue.depth",
+            unit="1",
+            callbacks=[self._observe_ingest_queue_depth],
+        )
+        self.ingest_queue_dropped = self.meter.create_observable_counter(
+            name="ai.ingest.queue.dropped",
+            unit="1",
+            callbacks=[self._observe_ingest_queue_dropped],
+        )
+
         logger.debug("TelemetryManager initialized.")
 
     def set_running_apps(self, running: dict[str, dict]) -> None:
@@ -171,6 +205,21 @@ class TelemetryManager:
         """
         self._running_wsl = dict(running)
 
+    def running_tools(self) -> dict[str, list[str]]:
+        """Names of the running desktop apps and CLI tools (WSL included)."""
+        return {
+            "apps": sorted(self._running_apps),
+            "cli": sorted({*self._running_cli, *self._running_wsl}),
+        }
+
+    def watch_prompt_queue(self, stats: Callable[[], dict]) -> None:
+        """Report the prompt storage write-behind queue (see PromptDB.queue_stats)."""
+        self._prompt_queue_stats = stats
+
+    def watch_ingest_queue(self, stats: Callable[[], dict]) -> None:
+        """Report the HTTP receiver's ingest queue (see IngestHandler.queue_stats)."""
+        self._ingest_queue_stats = stats
+
     def _observe_app_running(self, options):
         """ObservableGauge callback: yield one Observation per running app."""
         for _name, labels in self._running_apps.items():
@@ -183,6 +232,31 @@ class TelemetryManager:
         for _name, labels in self._running_wsl.items():
             yield Observation(1, labels)
 
+    def _observe_prompt_queue_depth(self, options):
+        """ObservableGauge callback: records waiting in the prompt write queue."""
+        if self._prompt_queue_stats is not None:
+            yield Observation(self._prompt_queue_stats()["depth"])
+
+    def _observe_prompt_queue_overflow(self, options):
+        """ObservableCounter callback: records written inline because the queue was full."""
+        if self._prompt_queue_stats is not None:
+            yield Observation(self._prompt_queue_stats()["overflows"])
+
+    def _observe_prompt_queue_failed(self, options):
+        """ObservableCounter callback: queued records that could not be committed."""
+        if self._prompt_queue_stats is not None:
+            yield Observation(self._prompt_queue_stats()["failed"])
+
+    def _observe_ingest_queue_depth(self, options):
+        """ObservableGauge callback: extension events waiting in the ingest queue."""
+        if self._ingest_queue_stats is not None:
+            yield Observation(self._ingest_queue_stats()["depth"])
+
+    def _observe_ingest_queue_dropped(self, options):
+        """ObservableCounter callback: extension events refused because the queue was full."""
+        if self._ingest_queue_stats is not None:
+            yield Observation(self._ingest_queue_stats()["dropped"])
+
     def shutdown(self) -> None:
         """Flush pending metrics and shut down the provider."""
         logger.info("Flushing metrics and shutting down OTel provider...")
@@ -0,0 +1,291 @@
+"""Tests for the asyncio HTTP receiver."""
+
+from __future__ import annotations
+
+import asyncio
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from unittest.mock import Mock
+
+import pytest
+
+from ai_cost_observer.config import AppConfig
+from ai_cost_observer.server import http_receiver
+from ai_cost_observer.server.async_receiver import AsyncReceiver
+from ai_cost_observer.server.http_receiver import create_app
+from ai_cost_observer.server.ingest import MAX_PAYLOAD_BYTES, EndpointRateLimiter, IngestHandler
+
+
+def _config():
+    return AppConfig(
+        ai_domains=[{"domain": "chat.example.ai", "category": "chat", "cost_per_hour": 3.6}],
+        api_intercept_patterns=[{"pattern": "api.example.ai"}],
+    )
+
+
+@pytest.fixture
+def telemetry():
+    return Mock()
+
+
+@pytest.fixture
+def tracker():
+    return Mock()
+
+
+@pytest.fixture
+def receiver(telemetry, tracker):
+    handler = IngestHandler(_config(), telemetry, lambda: tracker)
+    receiver = AsyncReceiver(handler, port=0, workers=2)
+    receiver.start()
+    yield receiver
+    receiver.stop()
+
+
+def _request(conn, method, path, body=None, headers=None):
+    conn.request(method, path, body=body, headers=headers or {})
+    resp = conn.getresponse()
+    return resp.status, json.loads(resp.read() or b"null"), resp
+
+
+class TestAsyncReceiver:
+    def test_get_endpoints_match_flask_app(self, receiver, telemetry):
+        flask_client = create_app(_config(), telemetry).test_client()
+        conn = http.client.HTTPConnection("127.0.0.1", receiver.port)
+        for path in ("/", "/health", "/api/extension-config"):
+            status, body, _ = _request(conn, "GET", path)
+            assert status == 200
+            assert body == flask_client.get(path).get_json()
+        conn.close()
+
+    def test_connection_is_kept_alive(self, receiver):
+        conn = http.client.HTTPConnection("127.0.0.1", receiver.port)
+        _request(conn, "GET", "/health")
+        sock = conn.sock
+        for _ in range(3):
+            status, _, resp = _request(conn, "POST", "/metrics/browser", b'{"events": []}')
+            assert status == 200
+            assert resp.getheader("Connection") is None
+        assert conn.sock is sock
+        conn.close()
+
+    def test_connection_close_honoured(self, receiver):
+        conn = http.client.HTTPConnection("127.0.0.1", receiver.port)
+        _, _, resp = _request(conn, "GET", "/health", headers={"Connection": "close"})
+        assert resp.getheader("Connection") == "close"
+        assert conn.sock is None
+        conn.close()
+
+    def test_browser_metrics_recorded(self, receiver, telemetry):
+        payload = {
+            "events": [{"domain": "chat.example.ai", "duration_seconds": 60, "visit_count": 2}]
+        }
+        conn = http.client.HTTPConnection("127.0.0.1", receiver.port)
+        status, body, _ = _request(conn, "POST", "/metrics/browser", json.dumps(payload))
+        conn.close()
+        assert (status, body) == (200, {"status": "ok", "processed": 1})
+        labels = telemetry.browser_domain_active_duration.add.call_args.args[1]
+        assert labels["ai.domain"] == "chat.example.ai"
+        telemetry.browser_domain_visit_count.add.assert_called_once_with(2, labels)
+        cost = telemetry.browser_domain_estimated_cost.add.call_args.args[0]
+        assert cost == pytest.approx(0.06)
+
+    def test_token_events_go_to_tracker(self, receiver, tracker):
+        payload = {
+            "events": [
+                {"type": "api_intercept", "tool": "web", "model": "m", "input_tokens": 5},
+                {"type": "other"},
+            ]
+        }
+        conn = http.client.HTTPConnection("127.0.0.1", receiver.port)
+        status, body, _ = _request(conn, "POST", "/api/tokens", json.dumps(payload))
+        conn.close()
+        assert (status, body) == (200, {"status": "ok", "processed": 1})
+        tracker.record_api_intercept.assert_called_once()
+        assert tracker.record_api_intercept.call_args.kwargs["input_tokens"] == 5
+        tracker.flush_prompts.assert_called_once()
+
+    def test_errors(self, receiver, tracker):
+        conn = http.client.HTTPConnection("127.0.0.1", receiver.port)
+        assert _request(conn, "POST", "/api/tokens", b"not json")[0] == 400
+        assert _request(conn, "POST", "/api/tokens", b'{"events": 3}')[0] == 400
+        assert _request(conn, "GET", "/nope")[0] == 404
+        assert _request(conn, "GET", "/api/tokens")[0] == 405
+        assert _request(conn, "POST", "/health", b"{}")[0] == 405
+        tracker.record_api_intercept.side_effect = RuntimeError("boom")
+        events = json.dumps({"events": [{"type": "api_intercept"}]})
+        assert _request(conn, "POST", "/api/tokens", events)[0] == 500
+        conn.close()
+
+    def test_oversized_body_rejected_without_reading_it(self, receiver):
+        with socket.create_connection(("127.0.0.1", receiver.port)) as sock:
+            sock.sendall(
+                b"POST /api/tokens HTTP/1.1\r\nHost: x\r\n"
+                + f"Content-Length: {MAX_PAYLOAD_BYTES + 1}\r\n\r\n".encode()
+            )
+            assert sock.recv(1024).startswith(b"HTTP/1.1 413 ")
+
+    def test_rate_limited_per_client(self, telemetry):
+        handler = IngestHandler(_config(), telemetry)
+        limits = EndpointRateLimiter({"default": {"requests": 2, "window_seconds": 60}})
+        receiver = AsyncReceiver(handler, port=0, rate_limiter=limits)
+        receiver.start()
+        conn = http.client.HTTPConnection("127.0.0.1", receiver.port)
+        responses = [_request(conn, "POST", "/api/tokens", b'{"events": []}') for _ in range(3)]
+        assert [r[0] for r in responses] == [200, 200, 429]
+        assert responses[2][1]["retry_after"] == pytest.approx(30, abs=1)
+        assert responses[2][2].getheader("Retry-After") == "30"
+        assert _request(conn, "POST", "/metrics/browser", b'{"events": []}')[0] == 200
+        assert _request(conn, "GET", "/health")[0] == 200
+        conn.close()
+        receiver.stop()
+
+    def test_extension_config_revalidated_by_etag(self, receiver, telemetry):
+        flask_client = create_app(_config(), telemetry).test_client()
+        conn = http.client.HTTPConnection("127.0.0.1", receiver.port)
+        _, body, resp = _request(conn, "GET", "/api/extension-config")
+        etag = resp.getheader("ETag")
+        assert etag.startswith('"') and resp.getheader("Cache-Control") == "no-cache"
+        assert flask_client.get("/api/extension-config").headers["ETag"] == etag
+
+        for header in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+            conn.request("GET", "/api/extension-config", headers={"If-None-Match": header})
+            resp = conn.getresponse()
+            assert (resp.status, resp.read()) == (304, b"")
+            assert resp.getheader("ETag") == etag
+            flask_resp = flask_client.get(
+                "/api/extension-config", headers={"If-None-Match": header}
+            )
+            assert (flask_resp.status_code, flask_resp.data) == (304, b"")
+
+        conn.request("GET", "/api/extension-config", headers={"If-None-Match": '"stale"'})
+        resp = conn.getresponse()
+        assert resp.status == 200 and json.loads(resp.read()) == body
+        conn.close()
+
+    def test_extension_config_etag_follows_content(self, telemetry):
+        config = _config()
+        etag = IngestHandler(config, telemetry).extension_config_etag
+        assert IngestHandler(_config(), telemetry).extension_config_etag == etag
+        config.ai_domains.append({"domain": "new.example.ai", "cost_per_hour": 1})
+        assert IngestHandler(config, telemetry).extension_config_etag != etag
+
+    def test_port_in_use_raises(self, receiver, telemetry):
+        other = AsyncReceiver(IngestHandler(_config(), telemetry), port=receiver.port)
+        with pytest.raises(OSError):
+            other.start()
+
+    def test_start_http_receiver_uses_asyncio_by_default(self, telemetry, tmp_path):
+        config = _config()
+        config.state_dir = tmp_path
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            config.http_receiver_port = probe.getsockname()[1]
+        assert config.http_receiver_mode == "asyncio"
+        thread = http_receiver.start_http_receiver(config, telemetry)
+        assert thread is not None and thread.is_alive()
+        conn = http.client.HTTPConnection("127.0.0.1", config.http_receiver_port)
+        assert _request(conn, "GET", "/health")[0] == 200
+        conn.close()
+
+
+# --- Load test (opt-in: AI_COST_OBSERVER_LOAD_TEST=1) ---
+
+_SERVER_SCRIPT = """
+import sys, tempfile, time
+from loguru import logger
+from ai_cost_observer.config import AppConfig
+from ai_cost_observer.server import ingest, http_receiver
+
+class Instrument:
+    def add(self, value, labels):
+        pass
+
+class Telemetry:
+    def __getattr__(self, name):
+        return Instrument()
+
+    def watch_ingest_queue(self, stats):
+        pass
+
+logger.remove()
+ingest.RateLimiter.acquire = lambda self, ip: 0.0
+config = AppConfig(
+    ai_domains=[{"domain": "chat.example.ai", "category": "chat", "cost_per_hour": 1}],
+    http_receiver_port=int(sys.argv[2]),
+    http_receiver_mode=sys.argv[1],
+    state_dir=tempfile.mkdtemp(),
+)
+http_receiver.start_http_receiver(config, Telemetry())
+while True:
+    time.sleep(60)
+"""
+
+_BODY = json.dumps(
+    {"events": [{"domain": "chat.example.ai", "duration_seconds": 5, "visit_count": 1}] * 5}
+).encode()
+
+
+async def _client(port: int, requests: int) -> None:
+    reader = writer = None
+    request = (
+        b"POST /metrics/browser HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+        b"Content-Type: application/json\r\n"
+        + f"Content-Length: {len(_BODY)}\r\n\r\n".encode()
+        + _BODY
+    )
+    for _ in range(requests):
+        if writer is None:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(request)
+        head = await reader.readuntil(b"\r\n\r\n")
+        assert head.split(b" ", 2)[1] in (b"200", b"202"), head
+        headers = head.lower()
+        length = int(headers.split(b"content-length:")[1].split(b"\r\n")[0])
+        await reader.readexactly(length)
+        if b"connection: close" in headers or head.startswith(b"HTTP/1.0"):
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+def _throughput(mode: str, clients: int = 32, requests: int = 200) -> float:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = subprocess.Popen([sys.executable, "-c", _SERVER_SCRIPT, mode, str(port)])
+    try:
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+
+        async def run() -> float:
+            start = time.perf_counter()
+            await asyncio.gather(*(_client(port, requests) for _ in range(clients)))
+            return clients * requests / (time.perf_counter() - start)
+
+        return asyncio.run(run())
+    finally:
+        server.terminate()
+        server.wait()
+
+
+@pytest.mark.skipif(
+    not os.environ.get("AI_COST_OBSERVER_LOAD_TEST"), reason="set AI_COST_OBSERVER_LOAD_TEST=1"
+)
+def test_load_asyncio_outperforms_flask():
+    """32 concurrent extension clients posting 5-event batches."""
+    flask_rps = _throughput("flask")
+    asyncio_rps = _throughput("asyncio")
+    print(f"\nflask: {flask_rps:.0f} req/s, asyncio: {asyncio_rps:.0f} req/s")
+    assert asyncio_rps > flask_rps
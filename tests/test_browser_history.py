@@ -11,14 +11,15 @@ from ai_cost_observer.detectors.browser_history import BrowserHistoryParser
 
 
 @pytest.fixture
-def parser_with_domains():
+def parser_with_domains(tmp_path):
     """Create a BrowserHistoryParser with a specific set of AI domains."""
     config = AppConfig(
         ai_domains=[
             {"domain": "chat.openai.com", "category": "chat", "cost_per_hour": 0.50},
             {"domain": "claude.ai", "category": "chat", "cost_per_hour": 0.60},
             {"domain": "github.com/copilot", "category": "code", "cost_per_hour": 0.40},
-        ]
+        ],
+        state_dir=tmp_path / "state",
     )
     telemetry = Mock()
     telemetry.browser_domain_visit_count = Mock()
@@ -13,7 +13,9 @@ class _DummyTelemetry:
 
 
 def test_checkpoint_advances_only_after_successful_scan(tmp_path: Path) -> None:
-    parser = BrowserHistoryParser(AppConfig(ai_domains=[]), _DummyTelemetry())
+    parser = BrowserHistoryParser(
+        AppConfig(ai_domains=[], state_dir=tmp_path / "state"), _DummyTelemetry()
+    )
 
     calls: list[float] = []
     should_fail = {"value": True}
@@ -35,3 +37,13 @@ def test_checkpoint_advances_only_after_successful_scan(tmp_path: Path) -> None:
 
     # The failed scan must not advance the checkpoint.
     assert calls[1] == calls[0]
+
+
+def test_checkpoint_survives_restart(tmp_path: Path) -> None:
+    config = AppConfig(ai_domains=[], state_dir=tmp_path / "state")
+    parser = BrowserHistoryParser(config, _DummyTelemetry())
+    parser._get_browsers = lambda: [("chrome", tmp_path / "History", lambda _p, _s: [])]  # type: ignore[method-assign]
+    parser.scan()
+
+    restarted = BrowserHistoryParser(config, _DummyTelemetry())
+    assert restarted._last_scan_time["chrome"] == parser._last_scan_time["chrome"]
@@ -0,0 +1,230 @@
+"""Tests for the unified checkpoint store."""
+
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+from unittest.mock import Mock
+
+from ai_cost_observer.config import AppConfig
+from ai_cost_observer.detectors.shell_history import ShellHistoryParser
+from ai_cost_observer.detectors.token_tracker import TokenTracker
+from ai_cost_observer.storage.checkpoints import (
+    CHECKPOINT_DB_NAME,
+    FINGERPRINT_BYTES,
+    CheckpointStore,
+)
+
+
+def _write(path, data: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+class TestFileOffsets:
+    def test_offset_persists_across_instances(self, tmp_path):
+        log = tmp_path / "a.log"
+        _write(log, b"line one\nline two\n")
+
+        store = CheckpointStore(tmp_path, "test")
+        assert store.file_offset(log) == 0
+        store.set_file_offset(log, 9)
+        store.commit()
+        store.close()
+
+        reopened = CheckpointStore(tmp_path, "test")
+        assert reopened.file_offset(log) == 9
+        reopened.close()
+
+    def test_namespaces_are_isolated(self, tmp_path):
+        log = tmp_path / "a.log"
+        _write(log, b"hello\n")
+        one = CheckpointStore(tmp_path, "one")
+        one.set_file_offset(log, 6)
+        one.commit()
+
+        two = CheckpointStore(tmp_path, "two")
+        assert two.file_offset(log) == 0
+        assert two.is_empty()
+        one.close()
+        two.close()
+
+    def test_commit_writes_only_dirty_entries(self, tmp_path):
+        a, b = tmp_path / "a.log", tmp_path / "b.log"
+        _write(a, b"aaaa\n")
+        _write(b, b"bbbb\n")
+        store = CheckpointStore(tmp_path, "test")
+        store.set_file_offset(a, 5)
+        store.set_file_offset(b, 5)
+        store.set("rowid", 1)
+        assert store.commit() == 3
+        assert store.commit() == 0
+
+        store.set("rowid", 1)  # unchanged value is not rewritten
+        assert store.commit() == 0
+        store.set_file_offset(a, 5)
+        assert store.commit() == 1
+        store.close()
+
+    def test_rename_keeps_offset(self, tmp_path):
+        old, new = tmp_path / "old.log", tmp_path / "new.log"
+        _write(old, b"x" * 100)
+        store = CheckpointStore(tmp_path, "test")
+        store.set_file_offset(old, 100)
+        store.commit()
+
+        old.rename(new)
+        assert store.file_offset(new) == 100
+        store.set_file_offset(new, 100)
+        assert str(old) not in store._by_path
+        store.close()
+
+    def test_rotation_starts_over(self, tmp_path):
+        log = tmp_path / "app.log"
+        _write(log, b"first generation\n")
+        store = CheckpointStore(tmp_path, "test")
+        store.set_file_offset(log, 17)
+        store.commit()
+
+        log.rename(tmp_path / "app.log.1")
+        _write(log, b"second generation, longer\n")
+        assert store.file_offset(log) == 0
+        store.close()
+
+    def test_rewrite_by_rename_with_same_head_resumes(self, tmp_path):
+        """zsh rewrites its history to a temp file and renames it over the original."""
+        history = tmp_path / ".zsh_history"
+        _write(history, b"cmd one\ncmd two\n")
+        store = CheckpointStore(tmp_path, "test")
+        store.set_file_offset(history, 16)
+        store.commit()
+
+        tmp = tmp_path / ".zsh_history.new"
+        _write(tmp, b"cmd one\ncmd two\ncmd three\n")
+        os.replace(tmp, history)
+        assert store.file_offset(history) == 16
+        store.close()
+
+    def test_truncation_resets(self, tmp_path):
+        log = tmp_path / "a.log"
+        _write(log, b"0123456789")
+        store = CheckpointStore(tmp_path, "test")
+        store.set_file_offset(log, 10)
+        _write(log, b"012")
+        assert store.file_offset(log) == 0
+        store.close()
+
+    def test_in_place_rewrite_detected_by_fingerprint(self, tmp_path):
+        log = tmp_path / "a.log"
+        _write(log, b"a" * 50)
+        store = CheckpointStore(tmp_path, "test")
+        store.set_file_offset(log, 50)
+        _write(log, b"b" * 80)
+        assert store.file_offset(log) == 0
+        store.close()
+
+    def test_fingerprint_is_bounded(self, tmp_path):
+        log = tmp_path / "big.log"
+        _write(log, b"z" * (FINGERPRINT_BYTES * 3))
+        store = CheckpointStore(tmp_path, "test")
+        store.set_file_offset(log, FINGERPRINT_BYTES * 3)
+        assert store._by_path[str(log)].fp_len == FINGERPRINT_BYTES
+        store.close()
+
+    def test_import_drops_missing_and_truncated_files(self, tmp_path):
+        ok, short = tmp_path / "ok.log", tmp_path / "short.log"
+        _write(ok, b"x" * 20)
+        _write(short, b"x" * 5)
+        store = CheckpointStore(tmp_path, "test")
+        imported = store.import_file_offsets(
+            {str(ok): 20, str(short): 10, str(tmp_path / "gone.log"): 3}
+        )
+        assert imported == 1
+        assert store.file_offset(ok) == 20
+        assert store.file_offset(short) == 0
+        store.close()
+
+
+class TestValues:
+    def test_values_round_trip(self, tmp_path):
+        store = CheckpointStore(tmp_path, "test")
+        store.set("codex_last_rowid", 42)
+        store.set("chrome", 1700000000.5)
+        store.close()
+
+        reopened = CheckpointStore(tmp_path, "test")
+        assert reopened.get("codex_last_rowid") == 42
+        assert reopened.values() == {"codex_last_rowid": 42, "chrome": 1700000000.5}
+        assert reopened.get("missing", 7) == 7
+        reopened.close()
+
+    def test_single_database_file(self, tmp_path):
+        CheckpointStore(tmp_path, "a").close()
+        CheckpointStore(tmp_path, "b").close()
+        assert (tmp_path / CHECKPOINT_DB_NAME).exists()
+        conn = sqlite3.connect(tmp_path / CHECKPOINT_DB_NAME)
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        conn.close()
+
+
+class TestShellHistoryCheckpoints:
+    def _parser(self, tmp_path):
+        config = AppConfig(
+            state_dir=tmp_path / "state",
+            ai_cli_tools=[{"name": "ollama", "command_patterns": ["ollama"], "category": "local"}],
+        )
+        telemetry = Mock()
+        return ShellHistoryParser(config, telemetry), telemetry
+
+    def test_restart_does_not_recount(self, tmp_path):
+        history = tmp_path / ".bash_history"
+        history.write_text("ollama run llama3\n", encoding="utf-8")
+
+        parser, telemetry = self._parser(tmp_path)
+        parser._get_history_files = lambda: [(str(history), "bash")]
+        parser.scan()
+        assert telemetry.cli_command_count.add.call_count == 1
+
+        restarted, telemetry = self._parser(tmp_path)
+        restarted._get_history_files = lambda: [(str(history), "bash")]
+        restarted.scan()
+        telemetry.cli_command_count.add.assert_not_called()
+
+    def test_legacy_offsets_file_imported(self, tmp_path):
+        history = tmp_path / ".bash_history"
+        history.write_text("ollama run llama3\n", encoding="utf-8")
+        state = tmp_path / "state"
+        state.mkdir()
+        legacy = state / "shell_history_offsets.txt"
+        legacy.write_text(f"{history}={history.stat().st_size}\n", encoding="utf-8")
+
+        parser, telemetry = self._parser(tmp_path)
+        assert not legacy.exists()
+        parser._get_history_files = lambda: [(str(history), "bash")]
+        parser.scan()
+        telemetry.cli_command_count.add.assert_not_called()
+
+
+def test_token_tracker_imports_legacy_state(tmp_path):
+    session = tmp_path / "session.jsonl"
+    session.write_text('{"role": "user"}\n', encoding="utf-8")
+    state = tmp_path / "state"
+    state.mkdir()
+    legacy = state / "token_tracker_state.json"
+    legacy.write_text(
+        json.dumps(
+            {
+                "file_offsets": {str(session): session.stat().st_size},
+                "codex_last_rowid": 12,
+            }
+        ),
+        encoding="utf-8",
+    )
+
+    config = AppConfig(state_dir=state)
+    tracker = TokenTracker(config, Mock())
+    assert not legacy.exists()
+    assert tracker._codex_last_rowid == 12
+    assert tracker._checkpoints.file_offset(session) == session.stat().st_size
+    tracker.close()
@@ -0,0 +1,158 @@
+"""Tests for prompt text compression."""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+
+import pytest
+
+from ai_cost_observer.storage import compression
+from ai_cost_observer.storage.compression import (
+    CODEC_NONE,
+    CODEC_ZLIB,
+    CODEC_ZSTD,
+    COMPRESS_MIN_BYTES,
+    TextCompressor,
+)
+from ai_cost_observer.storage.prompt_db import _FORMAT_COMPRESSED, PromptDB
+
+needs_zstd = pytest.mark.skipif(compression.zstd is None, reason="zstandard not installed")
+
+TRANSCRIPT = (
+    "You are a helpful coding assistant. Use the tools provided to read and edit files.\n"
+    "<tool_result>def handler(request):\n    return Response(status=200)\n</tool_result>\n"
+) * 20
+
+
+def _samples(n=300):
+    return [
+        (
+            f"You are a helpful coding assistant working in repository project-{i}. "
+            f"Use the tools provided to read and edit files. Task {i}: fix the failing "
+            f"test in module_{i % 17}.py and keep the public API unchanged."
+        ).encode("utf-8")
+        for i in range(n)
+    ]
+
+
+class TestTextCompressor:
+    def test_zlib_round_trip(self):
+        c = TextCompressor("zlib")
+        data = TRANSCRIPT.encode("utf-8")
+        codec, payload = c.compress(data)
+        assert codec == CODEC_ZLIB
+        assert len(payload) < len(data)
+        assert c.decompress(codec, payload) == data
+
+    @needs_zstd
+    def test_zstd_round_trip(self):
+        c = TextCompressor("zstd")
+        data = TRANSCRIPT.encode("utf-8")
+        codec, payload = c.compress(data)
+        assert codec == CODEC_ZSTD
+        assert c.decompress(codec, payload) == data
+
+    def test_short_text_is_left_alone(self):
+        data = b"x" * (COMPRESS_MIN_BYTES - 1)
+        assert TextCompressor("zlib").compress(data) == (CODEC_NONE, data)
+
+    def test_incompressible_text_is_left_alone(self):
+        data = os.urandom(4096)
+        assert TextCompressor("zlib").compress(data) == (CODEC_NONE, data)
+
+    def test_any_codec_decompresses_regardless_of_setting(self):
+        data = TRANSCRIPT.encode("utf-8")
+        codec, payload = TextCompressor("zlib").compress(data)
+        assert TextCompressor("none").decompress(codec, payload) == data
+
+    def test_falls_back_to_zlib_without_zstandard(self, monkeypatch):
+        monkeypatch.setattr(compression, "zstd", None)
+        assert TextCompressor("auto").codec == "zlib"
+        assert TextCompressor("zstd").codec == "zlib"
+        assert TextCompressor.train_dictionary(_samples()) is None
+
+    def test_unknown_codec_raises(self):
+        with pytest.raises(ValueError):
+            TextCompressor().decompress(99, b"")
+
+    @needs_zstd
+    def test_trained_dictionary(self):
+        data = TextCompressor.train_dictionary(_samples(), dict_size=4096)
+        assert data is not None
+        c = TextCompressor("zstd")
+        dict_id = c.add_dictionary(data)
+        assert c.active_dictionary_id == dict_id
+
+        sample = _samples(1000)[-1]
+        sample = sample + b" " * (COMPRESS_MIN_BYTES - len(sample))
+        codec, with_dict = c.compress(sample)
+        assert codec == CODEC_ZSTD
+        assert c.decompress(codec, with_dict) == sample
+        # A reader that lacks the dictionary cannot decode the frame
+        with pytest.raises(ValueError):
+            TextCompressor("zstd").decompress(codec, with_dict)
+
+
+class TestPromptDBCompression:
+    def _raw(self, db):
+        conn = sqlite3.connect(str(db.db_path))
+        rows = conn.execute(
+            "SELECT COALESCE(p.prompt_text, b.data) FROM prompts p "
+            "LEFT JOIN prompt_blobs b ON b.hash = p.prompt_blob ORDER BY p.id"
+        ).fetchall()
+        conn.close()
+        return [r[0] for r in rows]
+
+    def test_plaintext_mode_stores_compressed_blob(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False, compression="zlib")
+        db.insert_prompt(tool_name="t", source="cli", prompt_text=TRANSCRIPT)
+        db.insert_prompt(tool_name="t", source="cli", prompt_text="short")
+
+        long_raw, short_raw = self._raw(db)
+        assert isinstance(long_raw, bytes)
+        assert long_raw[:2] == bytes((_FORMAT_COMPRESSED, CODEC_ZLIB))
+        assert len(long_raw) < len(TRANSCRIPT)
+        assert short_raw == "short"
+        assert [p["prompt_text"] for p in db.get_prompts()] == ["short", TRANSCRIPT]
+        db.close()
+
+    def test_compression_none_keeps_text(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False, compression="none")
+        db.insert_prompt(tool_name="t", source="cli", prompt_text=TRANSCRIPT)
+        assert self._raw(db) == [TRANSCRIPT]
+        db.close()
+
+    def test_rows_survive_codec_change(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False, compression="zlib")
+        db.insert_prompt(tool_name="t", source="cli", prompt_text=TRANSCRIPT)
+        db.close()
+
+        reopened = PromptDB(db_path=tmp_path / "test.db", encrypt=False, compression="none")
+        assert reopened.get_prompts()[0]["prompt_text"] == TRANSCRIPT
+        reopened.close()
+
+    @needs_zstd
+    def test_trained_dictionary_persists(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False, compression="zstd")
+        assert db.compression_dictionary_id == 0
+        db.insert_prompts_bulk(
+            [
+                {"tool_name": "t", "source": "cli", "prompt_text": s.decode("utf-8")}
+                for s in _samples()
+            ]
+        )
+        dict_id = db.train_compression_dict()
+        assert dict_id and db.compression_dictionary_id == dict_id
+        db.insert_prompt(tool_name="t", source="cli", prompt_text=TRANSCRIPT)
+        db.close()
+
+        reopened = PromptDB(db_path=tmp_path / "test.db", encrypt=False, compression="zstd")
+        assert reopened.compression_dictionary_id == dict_id
+        assert reopened.get_prompts(limit=1)[0]["prompt_text"] == TRANSCRIPT
+        reopened.close()
+
+    def test_training_without_zstd_is_a_no_op(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False, compression="zlib")
+        assert db.train_compression_dict() == 0
+        db.close()
@@ -94,6 +94,13 @@ METRIC_LABEL_MAP = {
     "ai_tokens_output_total": TOKEN_LABELS,
     "ai_tokens_cost_usd_total": TOKEN_LABELS,
     "ai_prompt_count_total": PROMPT_LABELS,
+    # prompt storage write-behind queue: resource labels only
+    "ai_prompt_queue_depth": set(),
+    "ai_prompt_queue_overflow_total": set(),
+    "ai_prompt_queue_failed_total": set(),
+    # HTTP receiver ingest queue: resource labels only
+    "ai_ingest_queue_depth": set(),
+    "ai_ingest_queue_dropped_total": set(),
 }
 
 
@@ -528,6 +535,11 @@ class TestAllMetricsCoveredByDashboards:
         "ai.tokens.output_total": "ai_tokens_output_total",
         "ai.tokens.cost_usd_total": "ai_tokens_cost_usd_total",
         "ai.prompt.count_total": "ai_prompt_count_total",
+        "ai.prompt.queue.depth": "ai_prompt_queue_depth",
+        "ai.prompt.queue.overflow": "ai_prompt_queue_overflow_total",
+        "ai.prompt.queue.failed": "ai_prompt_queue_failed_total",
+        "ai.ingest.queue.depth": "ai_ingest_queue_depth",
+        "ai.ingest.queue.dropped": "ai_ingest_queue_dropped_total",
     }
 
     def test_all_metrics_queried(self):
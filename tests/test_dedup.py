@@ -0,0 +1,181 @@
+"""Tests for idempotent ingestion: the dedup index and event/batch ids."""
+
+from __future__ import annotations
+
+import json
+import threading
+import types
+from unittest.mock import Mock
+
+import pytest
+
+from ai_cost_observer.config import AppConfig
+from ai_cost_observer.server.ingest import IngestHandler
+from ai_cost_observer.storage import dedup
+from ai_cost_observer.storage.dedup import DedupIndex
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable wall clock for the dedup index."""
+    state = types.SimpleNamespace(now=1_000_000.0)
+    monkeypatch.setattr(dedup, "time", types.SimpleNamespace(time=lambda: state.now))
+    return state
+
+
+def _config():
+    return AppConfig(
+        ai_domains=[{"domain": "chat.example.ai", "category": "chat", "cost_per_hour": 3.6}],
+    )
+
+
+def _intercept(event_id):
+    return {"type": "api_intercept", "tool": "web", "model": "m", "id": event_id}
+
+
+class TestDedupIndex:
+    def test_claim_release_and_expiry(self, tmp_path, clock):
+        index = DedupIndex(tmp_path, window_seconds=60)
+        assert index.claim(["a", "b", "a"]) == [True, True, False]
+        assert index.claim(["b", "c"]) == [False, True]
+        index.release(["c"])
+        assert index.claim(["c"]) == [True]
+        clock.now += 61
+        assert index.claim(["a"]) == [True]
+        assert len(index) == 1
+        index.close()
+
+    def test_only_committed_ids_survive_restart(self, tmp_path, clock):
+        index = DedupIndex(tmp_path, window_seconds=60)
+        index.claim(["recorded", "queued"])
+        index.commit(["recorded"])
+        index.close()
+
+        index = DedupIndex(tmp_path, window_seconds=60)
+        assert index.claim(["recorded", "queued"]) == [False, True]
+        index.close()
+
+        clock.now += 61
+        index = DedupIndex(tmp_path, window_seconds=60)
+        assert len(index) == 0
+        index.close()
+
+    def test_oldest_ids_evicted_past_max(self, tmp_path, clock):
+        index = DedupIndex(tmp_path, max_ids=2)
+        for key in ("a", "b", "c"):
+            clock.now += 1
+            index.claim([key])
+        assert index.claim(["a", "c"]) == [True, False]
+        index.close()
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = DedupIndex(tmp_path)
+    yield index
+    index.close()
+
+
+class TestIdempotentHandler:
+    def test_retried_batch_counted_once(self, index):
+        tracker = Mock()
+        handler = IngestHandler(_config(), Mock(), lambda: tracker, dedup=index)
+        batch = {"events": [_intercept("e1"), _intercept("e2"), _intercept(None)]}
+        status, body = handler.token_events(json.loads(json.dumps(batch)))
+        assert (status, body["processed"]) == (200, 3)
+        assert body["accepted"] == ["e1", "e2"]
+        assert body["duplicates"] == []
+
+        status, body = handler.token_events(json.loads(json.dumps(batch)))
+        assert (status, body["processed"]) == (200, 1)  # the id-less event
+        assert body["accepted"] == []
+        assert body["duplicates"] == ["e1", "e2"]
+        assert tracker.record_api_intercept.call_count == 4
+
+    def test_batch_id_numbers_events(self, index):
+        telemetry = Mock()
+        handler = IngestHandler(_config(), telemetry, dedup=index)
+        batch = {
+            "batch_id": "b-7",
+            "events": [{"domain": "chat.example.ai", "duration_seconds": 60}, {"domain": "x"}],
+        }
+        assert handler.browser_metrics(json.loads(json.dumps(batch)))[1]["accepted"] == [
+            "b-7:0",
+            "b-7:1",
+        ]
+        status, body = handler.browser_metrics(json.loads(json.dumps(batch)))
+        assert (status, body["processed"], body["duplicates"]) == (200, 0, ["b-7:0", "b-7:1"])
+        telemetry.browser_domain_active_duration.add.assert_called_once()
+
+    def test_ids_are_scoped_per_endpoint(self, index):
+        handler = IngestHandler(_config(), Mock(), dedup=index)
+        handler.token_events({"events": [_intercept("same")]})
+        body = handler.browser_metrics({"events": [{"domain": "x", "id": "same"}]})[1]
+        assert body["accepted"] == ["same"]
+
+    def test_ndjson_acks(self, index):
+        handler = IngestHandler(_config(), Mock(), dedup=index)
+        handler.token_events({"events": [_intercept("old")]})
+        body = b"".join(json.dumps(_intercept(i)).encode() + b"\n" for i in ("old", "new", "new"))
+        status, result = handler.post("/api/tokens", [body], "application/x-ndjson")
+        assert status == 200
+        assert result["processed"] == 1
+        assert result["accepted"] == ["new"]
+        assert result["duplicates"] == ["old", "new"]
+
+    def test_refused_or_failed_events_can_be_retried(self, index):
+        release = threading.Event()
+        tracker = Mock()
+        tracker.record_api_intercept.side_effect = lambda **_: release.wait(5)
+        handler = IngestHandler(_config(), Mock(), lambda: tracker, queue_size=1, dedup=index)
+        assert handler.token_events({"events": [_intercept("a")]})[0] == 202
+        # Retry while "a" is still queued is a duplicate; "b" does not fit
+        assert handler.token_events({"events": [_intercept("a")]})[1]["duplicates"] == ["a"]
+        assert handler.token_events({"events": [_intercept("b")]})[0] == 503
+        release.set()
+        assert handler.flush(timeout=5)
+        assert handler.token_events({"events": [_intercept("b")]})[1]["accepted"] == ["b"]
+        handler.close()
+
+        failing = Mock()
+        failing.record_api_intercept.side_effect = RuntimeError("boom")
+        inline = IngestHandler(
+            _config(), Mock(), lambda: failing, dedup=DedupIndex(index.db_path.parent)
+        )
+        status, body = inline.token_events({"events": [_intercept("c")]})
+        assert status == 500
+        assert body["consumed"] == 0
+        assert "accepted" not in body
+        failing.record_api_intercept.side_effect = None
+        assert inline.token_events({"events": [_intercept("c")]})[1]["accepted"] == ["c"]
+        inline.close()
+
+    def test_ids_of_failed_queued_events_released(self, tmp_path):
+        tracker = Mock()
+        tracker.record_api_intercept.side_effect = RuntimeError("store down")
+        handler = IngestHandler(
+            _config(), Mock(), lambda: tracker, queue_size=10, dedup=DedupIndex(tmp_path)
+        )
+        assert handler.token_events({"events": [_intercept("lost")]})[0] == 202
+        assert handler.browser_metrics({"events": [{"domain": "x", "id": "kept"}]})[0] == 202
+        assert handler.flush(timeout=5)
+
+        tracker.record_api_intercept.side_effect = None
+        status, body = handler.token_events({"events": [_intercept("lost")]})
+        assert (status, body["accepted"]) == (202, ["lost"])
+        assert handler.flush(timeout=5)
+        assert handler.browser_metrics({"events": [{"domain": "x", "id": "kept"}]})[1][
+            "duplicates"
+        ] == ["kept"]
+        handler.close()
+        reopened = DedupIndex(tmp_path)
+        assert reopened.claim(["tokens:lost", "browser:kept"]) == [False, False]
+        reopened.close()
+
+    def test_queued_ids_persisted_after_recording(self, tmp_path):
+        handler = IngestHandler(_config(), Mock(), queue_size=10, dedup=DedupIndex(tmp_path))
+        handler.token_events({"events": [_intercept("a")]})
+        handler.close()
+        reopened = DedupIndex(tmp_path)
+        assert reopened.claim(["tokens:a"]) == [False]
+        reopened.close()
@@ -57,9 +57,8 @@ def test_background_export_requires_success_response_before_ack() -> None:
     src = _BACKGROUND_JS_PATH.read_text(encoding="utf-8")
 
     assert "if (!response.ok)" in src
-    assert "pendingDeltas = {};" in src
-    assert "await updateDailyTotals(events);" in src
-
-    clear_idx = src.index("pendingDeltas = {};")
-    totals_idx = src.index("await updateDailyTotals(events);")
-    assert clear_idx < totals_idx
+    # Deltas move into a persisted in-flight batch, which is only dropped once acknowledged
+    send_idx = src.index("if (!(await sendMetricsBatch(batch))) break;")
+    clear_idx = src.index("await chrome.storage.local.remove(STORAGE_INFLIGHT_METRICS_KEY);")
+    totals_idx = src.index("await updateDailyTotals(batch.events);")
+    assert send_idx < clear_idx < totals_idx
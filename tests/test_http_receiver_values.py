@@ -4,6 +4,7 @@ from __future__ import annotations
 
 from ai_cost_observer.config import AppConfig
 from ai_cost_observer.server.http_receiver import create_app
+from ai_cost_observer.storage.usage_aggregate import UsageAggregate
 
 
 class _Recorder:
@@ -19,6 +20,7 @@ class _DummyTelemetry:
         self.browser_domain_active_duration = _Recorder()
         self.browser_domain_visit_count = _Recorder()
         self.browser_domain_estimated_cost = _Recorder()
+        self.usage = UsageAggregate()
 
 
 def _build_test_app():
@@ -82,6 +84,7 @@ def test_receiver_reports_expected_duration_visit_and_cost_values() -> None:
         "ai.domain": "chatgpt.com",
         "ai.category": "chat",
     }
+    assert telemetry.usage.usage(0)["estimated_cost_usd"]["browser"] == {"chatgpt.com": 0.25}
 
 
 def test_receiver_ignores_unknown_domains() -> None:
@@ -0,0 +1,236 @@
+"""Tests for the ingest queue between the HTTP handlers and the sinks."""
+
+from __future__ import annotations
+
+import http.client
+import json
+import threading
+from unittest.mock import Mock
+
+import pytest
+
+from ai_cost_observer.config import AppConfig
+from ai_cost_observer.server import http_receiver
+from ai_cost_observer.server.async_receiver import AsyncReceiver
+from ai_cost_observer.server.http_receiver import create_app
+from ai_cost_observer.server.ingest import IngestHandler, IngestQueue
+
+
+def _config():
+    return AppConfig(
+        ai_domains=[{"domain": "chat.example.ai", "category": "chat", "cost_per_hour": 3.6}],
+    )
+
+
+def _tokens(n):
+    return {"events": [{"type": "api_intercept", "tool": "web", "model": "m"}] * n}
+
+
+class _BlockingSink:
+    """Records batches; blocks the worker until released."""
+
+    def __init__(self):
+        self.batches = []
+        self.release = threading.Event()
+
+    def __call__(self, batch):
+        self.release.wait(5)
+        self.batches.append(batch)
+
+
+class TestIngestQueue:
+    def test_batches_drained_in_order(self):
+        sink = _BlockingSink()
+        queue = IngestQueue(sink, maxsize=100, batch_size=4)
+        for i in range(4):
+            assert queue.offer("tokens", [i, i])
+        sink.release.set()
+        assert queue.flush(timeout=5)
+        drained = [events for batch in sink.batches for _, events in batch]
+        assert drained == [[0, 0], [1, 1], [2, 2], [3, 3]]
+        assert all(sum(len(e) for _, e in batch) <= 4 for batch in sink.batches)
+        queue.close()
+
+    def test_full_queue_refuses_whole_batch(self):
+        sink = _BlockingSink()
+        queue = IngestQueue(sink, maxsize=5)
+        assert queue.offer("tokens", [1, 2, 3])
+        assert not queue.offer("tokens", [4, 5, 6])
+        assert queue.offer("tokens", [4, 5])
+        assert queue.stats() == {"depth": 5, "dropped": 3}
+        sink.release.set()
+        assert queue.flush(timeout=5)
+        assert queue.stats() == {"depth": 0, "dropped": 3}
+        queue.close()
+
+    def test_sink_errors_do_not_stop_worker(self):
+        calls = []
+
+        def sink(batch):
+            calls.append(batch)
+            if len(calls) == 1:
+                raise RuntimeError("boom")
+
+        queue = IngestQueue(sink, batch_size=1)
+        queue.offer("tokens", [1])
+        queue.offer("tokens", [2])
+        assert queue.flush(timeout=5)
+        assert len(calls) == 2
+        queue.close()
+
+    def test_close_drains_then_refuses(self):
+        sink = _BlockingSink()
+        sink.release.set()
+        queue = IngestQueue(sink)
+        queue.offer("browser", [{"domain": "x"}])
+        queue.close()
+        assert sink.batches == [[("browser", [{"domain": "x"}])]]
+        assert not queue.offer("browser", [{}])
+
+
+class TestQueuedHandler:
+    def test_accepts_and_records_in_background(self):
+        tracker = Mock()
+        handler = IngestHandler(_config(), Mock(), lambda: tracker, queue_size=100)
+        assert handler.token_events(_tokens(3)) == (202, {"status": "accepted", "queued": 3})
+        assert handler.token_events(_tokens(2))[0] == 202
+        assert handler.flush(timeout=5)
+        assert tracker.record_api_intercept.call_count == 5
+        # Both requests drained together: one prompt flush per batch
+        assert 1 <= tracker.flush_prompts.call_count <= 2
+        handler.close()
+
+    def test_validation_still_synchronous(self):
+        handler = IngestHandler(_config(), Mock(), queue_size=10)
+        assert handler.token_events({"events": 3})[0] == 400
+        assert handler.token_events({"events": [{"type": "other"}]}) == (
+            200,
+            {"status": "ok", "processed": 0},
+        )
+        assert handler.queue_stats() == {"depth": 0, "dropped": 0}
+        handler.close()
+
+    def test_unusable_token_counts_rejected_on_accept(self):
+        tracker = Mock()
+        handler = IngestHandler(_config(), Mock(), lambda: tracker, queue_size=100)
+        events = [
+            {"type": "api_intercept", "model": "m", "input_tokens": 5},
+            {"type": "api_intercept", "model": "m", "input_tokens": None},
+            {"type": "api_intercept", "model": "m", "input_tokens": " 12", "output_tokens": 3.0},
+            {"type": "api_intercept", "model": "m", "output_tokens": "lots"},
+        ]
+        status, body = handler.token_events({"events": events})
+        assert (status, body["queued"]) == (202, 2)
+        assert body["errors"] == [
+            {"index": 1, "error": "input_tokens must be a non-negative integer"},
+            {"index": 3, "error": "output_tokens must be a non-negative integer"},
+        ]
+        ndjson = b'{"type": "api_intercept", "input_tokens": -1}\n'
+        status, body = handler.post("/api/tokens", [ndjson], "application/x-ndjson")
+        assert status == 400
+        assert body["errors"] == [
+            {"line": 1, "error": "input_tokens must be a non-negative integer"}
+        ]
+
+        assert handler.flush(timeout=5)
+        counts = [
+            (c.kwargs["input_tokens"], c.kwargs["output_tokens"])
+            for c in tracker.record_api_intercept.call_args_list
+        ]
+        assert counts == [(5, 0), (12, 3)]
+        handler.close()
+
+    def test_failing_group_does_not_drop_merged_batch(self):
+        release = threading.Event()
+        recorded = []
+
+        def record(**kwargs):
+            if kwargs["model"] == "boom":
+                raise RuntimeError("boom")
+            release.wait(5)
+            recorded.append(kwargs["model"])
+
+        tracker = Mock()
+        tracker.record_api_intercept.side_effect = record
+        handler = IngestHandler(_config(), Mock(), lambda: tracker, queue_size=100)
+        for model in ("first", "boom", "after"):
+            event = {"type": "api_intercept", "model": model}
+            assert handler.token_events({"events": [event]})[0] == 202
+        release.set()
+        assert handler.flush(timeout=5)
+        assert recorded == ["first", "after"]
+        handler.close()
+
+    def test_full_queue_answers_503(self):
+        tracker = Mock()
+        release = threading.Event()
+        tracker.record_api_intercept.side_effect = lambda **_: release.wait(5)
+        handler = IngestHandler(_config(), Mock(), lambda: tracker, queue_size=4)
+        assert handler.token_events(_tokens(4))[0] == 202
+        status, body = handler.token_events(_tokens(1))
+        assert status == 503
+        assert body["retry_after"] > 0
+        assert handler.queue_stats()["dropped"] == 1
+        release.set()
+        handler.close()
+
+    def test_503_carries_retry_after_on_both_front_ends(self):
+        release = threading.Event()
+        tracker = Mock()
+        tracker.record_api_intercept.side_effect = lambda **_: release.wait(5)
+        handler = IngestHandler(_config(), Mock(), lambda: tracker, queue_size=1)
+        handler.token_events(_tokens(1))
+
+        flask_resp = (
+            create_app(_config(), Mock(), handler)
+            .test_client()
+            .post("/api/tokens", json=_tokens(1))
+        )
+        assert flask_resp.status_code == 503
+        assert flask_resp.headers["Retry-After"] == "5"
+
+        receiver = AsyncReceiver(handler, port=0)
+        receiver.start()
+        conn = http.client.HTTPConnection("127.0.0.1", receiver.port)
+        conn.request("POST", "/api/tokens", body=json.dumps(_tokens(1)))
+        resp = conn.getresponse()
+        assert resp.status == 503
+        assert resp.getheader("Retry-After") == "5"
+        assert json.loads(resp.read())["error"] == "Ingest queue full"
+        conn.close()
+        receiver.stop()
+        release.set()
+        handler.close()
+
+
+def test_start_and_stop_http_receiver_drain_queue(monkeypatch, tmp_path):
+    tracker = Mock()
+    telemetry = Mock()
+    config = _config()
+    config.state_dir = tmp_path
+    config.http_receiver_port = 0
+    monkeypatch.setattr(http_receiver, "_token_tracker", tracker)
+    started = {}
+
+    class Receiver:
+        def __init__(self, handler, **kwargs):
+            started["handler"] = handler
+
+        def start(self):
+            return threading.current_thread()
+
+    monkeypatch.setattr("ai_cost_observer.server.async_receiver.AsyncReceiver", Receiver)
+    assert http_receiver.start_http_receiver(config, telemetry) is not None
+    handler = started["handler"]
+    telemetry.watch_ingest_queue.assert_called_once_with(handler.queue_stats)
+
+    assert handler.token_events(_tokens(2))[0] == 202
+    http_receiver.stop_http_receiver()
+    assert tracker.record_api_intercept.call_count == 2
+    assert handler.token_events(_tokens(1))[0] == 503
+
+
+@pytest.fixture(autouse=True)
+def _reset_receiver_globals():
+    yield
+    http_receiver.stop_http_receiver()
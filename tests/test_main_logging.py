@@ -13,6 +13,8 @@ class TestSetupLogging:
         from loguru import logger
 
         old_handlers = dict(logger._core.handlers)
+        root = logging.getLogger()
+        old_root = (root.handlers[:], root.level)
         try:
             _setup_logging(debug=False)
             # _setup_logging should have added a loguru handler to stdout
@@ -21,11 +23,16 @@ class TestSetupLogging:
             logger.remove()
             for hid, handler in old_handlers.items():
                 logger._core.handlers[hid] = handler
+            # basicConfig(force=True) replaced the root handlers; a leftover
+            # stdlib -> loguru bridge deadlocks against conftest's loguru -> stdlib one
+            root.handlers[:], root.level = old_root
 
     def test_setup_logging_debug(self):
         from loguru import logger
 
         old_handlers = dict(logger._core.handlers)
+        root = logging.getLogger()
+        old_root = (root.handlers[:], root.level)
         try:
             _setup_logging(debug=True)
             assert len(logger._core.handlers) >= 1
@@ -33,6 +40,9 @@ class TestSetupLogging:
             logger.remove()
             for hid, handler in old_handlers.items():
                 logger._core.handlers[hid] = handler
+            # basicConfig(force=True) replaced the root handlers; a leftover
+            # stdlib -> loguru bridge deadlocks against conftest's loguru -> stdlib one
+            root.handlers[:], root.level = old_root
 
 
 class TestInterceptHandler:
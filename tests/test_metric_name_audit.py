@@ -27,12 +27,13 @@ from pathlib import Path
 import pytest
 
 # ---------------------------------------------------------------------------
-# 1. Define all 16 OTel metrics from telemetry.py and compute expected
+# 1. Define all 21 OTel metrics from telemetry.py and compute expected
 #    Prometheus names.
 # ---------------------------------------------------------------------------
 
 # Each entry: (otel_name, unit, otel_type, expected_prometheus_base_name)
-# otel_type is one of: "counter", "up_down_counter", "histogram"
+# otel_type is one of: "counter", "observable_counter", "up_down_counter", "histogram",
+# "gauge", "observable_gauge"
 OTEL_METRICS = [
     ("ai.app.running", "1", "observable_gauge"),
     ("ai.app.active.duration", "s", "counter"),
@@ -50,6 +51,11 @@ OTEL_METRICS = [
     ("ai.tokens.output", "1", "counter"),
     ("ai.tokens.cost_usd", "1", "counter"),
     ("ai.prompt.count", "1", "counter"),
+    ("ai.prompt.queue.depth", "1", "observable_gauge"),
+    ("ai.prompt.queue.overflow", "1", "observable_counter"),
+    ("ai.prompt.queue.failed", "1", "observable_counter"),
+    ("ai.ingest.queue.depth", "1", "observable_gauge"),
+    ("ai.ingest.queue.dropped", "1", "observable_counter"),
 ]
 
 UNIT_SUFFIX_MAP = {
@@ -73,7 +79,7 @@ def otel_to_prometheus(name: str, unit: str, otel_type: str) -> str:
     prom += UNIT_SUFFIX_MAP[unit]
 
     # Step 3: counter -> append _total (deduplicated)
-    if otel_type == "counter":
+    if otel_type in ("counter", "observable_counter"):
         if not prom.endswith("_total"):
             prom += "_total"
 
@@ -265,10 +271,10 @@ def extract_metric_names_from_expr(expr: str) -> set[str]:
 
 
 class TestOtelToPrometheusConversion:
-    """Verify the expected Prometheus names for all 16 OTel metrics."""
+    """Verify the expected Prometheus names for all 21 OTel metrics."""
 
-    def test_all_16_metrics_defined(self):
-        assert len(OTEL_METRICS) == 16
+    def test_all_metrics_defined(self):
+        assert len(OTEL_METRICS) == 21
 
     @pytest.mark.parametrize(
         "otel_name,unit,otel_type", OTEL_METRICS, ids=[m[0] for m in OTEL_METRICS]
@@ -278,7 +284,7 @@ class TestOtelToPrometheusConversion:
         # Must not contain dots
         assert "." not in prom
         # Counter must end with _total
-        if otel_type == "counter":
+        if otel_type in ("counter", "observable_counter"):
             assert prom.endswith("_total"), f"{prom} should end with _total"
         # Gauge/ObservableGauge must NOT end with _total
         if otel_type in ("gauge", "observable_gauge"):
@@ -310,6 +316,11 @@ class TestOtelToPrometheusConversion:
             "ai.tokens.output": "ai_tokens_output_total",
             "ai.tokens.cost_usd": "ai_tokens_cost_usd_total",
             "ai.prompt.count": "ai_prompt_count_total",
+            "ai.prompt.queue.depth": "ai_prompt_queue_depth",
+            "ai.prompt.queue.overflow": "ai_prompt_queue_overflow_total",
+            "ai.prompt.queue.failed": "ai_prompt_queue_failed_total",
+            "ai.ingest.queue.depth": "ai_ingest_queue_depth",
+            "ai.ingest.queue.dropped": "ai_ingest_queue_dropped_total",
         }
         assert EXPECTED_PROMETHEUS_NAMES == expected
 
@@ -0,0 +1,233 @@
+"""Tests for the Chrome native messaging host, driven over pipes."""
+
+from __future__ import annotations
+
+import io
+import json
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+
+import ai_cost_observer
+from ai_cost_observer import native_host, reporter
+from ai_cost_observer.config import AppConfig
+from ai_cost_observer.server.ingest import IngestHandler
+from ai_cost_observer.server.socket_receiver import SocketReceiver
+from ai_cost_observer.storage.dedup import DedupIndex
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="needs Unix sockets")
+
+
+def _config(state_dir) -> AppConfig:
+    return AppConfig(
+        state_dir=Path(state_dir),
+        ai_domains=[{"domain": "chat.example.ai", "category": "chat", "cost_per_hour": 3.6}],
+        api_intercept_patterns=[{"pattern": "api.example.ai"}],
+    )
+
+
+@pytest.fixture
+def state_dir():
+    # tmp_path can exceed the ~104-byte limit of a Unix socket path
+    path = tempfile.mkdtemp(prefix="aco-", dir="/tmp")
+    yield Path(path)
+    shutil.rmtree(path, ignore_errors=True)
+
+
+@pytest.fixture
+def telemetry():
+    return Mock()
+
+
+@pytest.fixture
+def tracker():
+    return Mock()
+
+
+@pytest.fixture
+def agent(state_dir, telemetry, tracker):
+    handler = IngestHandler(
+        _config(state_dir), telemetry, lambda: tracker, dedup=DedupIndex(state_dir)
+    )
+    receiver = SocketReceiver(handler, state_dir / reporter.SOCKET_NAME)
+    receiver.start()
+    yield receiver
+    receiver.stop()
+    handler.close()
+
+
+def _frame(message) -> bytes:
+    data = json.dumps(message).encode("utf-8")
+    return struct.pack("=I", len(data)) + data
+
+
+def _replies(stream: bytes) -> list[dict]:
+    replies = []
+    source = io.BytesIO(stream)
+    while (data := native_host.read_message(source)) is not None:
+        replies.append(json.loads(data))
+    return replies
+
+
+def _run_host(socket_path: Path, messages: list[dict]) -> tuple[int, list[dict]]:
+    """Start the host as Chrome does and exchange messages over its stdio pipes."""
+    env = dict(os.environ)
+    env[reporter.SOCKET_ENV] = str(socket_path)
+    env["PYTHONPATH"] = str(Path(ai_cost_observer.__file__).parents[1])
+    proc = subprocess.run(
+        [sys.executable, "-m", "ai_cost_observer.native_host", "chrome-extension://abc/"],
+        input=b"".join(_frame(m) for m in messages),
+        capture_output=True,
+        env=env,
+        timeout=30,
+    )
+    return proc.returncode, _replies(proc.stdout)
+
+
+class TestFraming:
+    def test_round_trip(self):
+        out = io.BytesIO()
+        native_host.write_message(out, b'{"id": 1}')
+        assert out.getvalue() == struct.pack("=I", 9) + b'{"id": 1}'
+        assert native_host.read_message(io.BytesIO(out.getvalue())) == b'{"id": 1}'
+        assert native_host.read_message(io.BytesIO(b"")) is None
+
+    def test_malformed_messages_rejected(self):
+        with pytest.raises(native_host.MessageError):
+            native_host.read_message(io.BytesIO(b"\x01\x00"))
+        with pytest.raises(native_host.MessageError):
+            native_host.read_message(io.BytesIO(struct.pack("=I", 10) + b"{}"))
+        oversized = struct.pack("=I", native_host.MAX_MESSAGE_BYTES + 1)
+        with pytest.raises(native_host.MessageError):
+            native_host.read_message(io.BytesIO(oversized))
+
+
+class TestHostOverPipes:
+    def test_requests_answered_like_http(self, agent, telemetry, tracker):
+        handler = agent.handler
+        messages = [
+            {"id": 1, "path": "/health"},
+            {"id": 2, "path": "/api/extension-config"},
+            {
+                "id": 3,
+                "path": "/api/extension-config",
+                "if_none_match": handler.extension_config_etag,
+            },
+            {
+                "id": 4,
+                "path": "/api/tokens",
+                "body": {
+                    "events": [
+                        {"type": "api_intercept", "id": "t1", "model": "m", "input_tokens": 5}
+                    ]
+                },
+            },
+            {
+                "id": 5,
+                "path": "/api/tokens",
+                "body": {"events": [{"type": "api_intercept", "id": "t1"}]},
+            },
+            {
+                "id": 6,
+                "path": "/metrics/browser",
+                "body": {
+                    "events": [
+                        {"domain": "chat.example.ai", "duration_seconds": 60, "visit_count": 1}
+                    ]
+                },
+            },
+            {"id": 7, "path": "/nope"},
+        ]
+        code, replies = _run_host(agent.path, messages)
+        assert code == 0
+        assert [r["id"] for r in replies] == [1, 2, 3, 4, 5, 6, 7]
+        status = {r["id"]: r["status"] for r in replies}
+        assert status == {1: 200, 2: 200, 3: 304, 4: 200, 5: 200, 6: 200, 7: 404}
+
+        config = replies[1]
+        assert config["body"] == handler.extension_config()
+        assert config["headers"]["ETag"] == handler.extension_config_etag
+        assert replies[2]["body"] is None
+        assert replies[3]["body"]["accepted"] == ["t1"]
+        assert replies[4]["body"]["duplicates"] == ["t1"]
+        tracker.record_api_intercept.assert_called_once()
+        telemetry.browser_domain_active_duration.add.assert_called_once()
+
+    def test_agent_not_running(self, state_dir):
+        code, replies = _run_host(state_dir / "missing.sock", [{"id": "a", "path": "/health"}])
+        assert code == 0
+        assert replies == [
+            {
+                "status": 503,
+                "body": {"error": "Agent not reachable", "retry_after": 5},
+                "headers": {"Retry-After": "5"},
+                "id": "a",
+            }
+        ]
+
+
+class TestRelay:
+    def test_reconnects_after_agent_restart(self, state_dir, telemetry):
+        path = state_dir / reporter.SOCKET_NAME
+        relay = native_host.Relay(str(path))
+        health = b'{"id": 1, "path": "/health"}'
+        for _ in range(2):
+            receiver = SocketReceiver(IngestHandler(_config(state_dir), telemetry), path)
+            receiver.start()
+            assert json.loads(relay.request(health))["status"] == 200
+            receiver.stop()
+        assert json.loads(relay.request(health))["status"] == 503
+        relay.close()
+
+    def test_message_without_path_rejected_without_waiting(self, agent):
+        relay = native_host.Relay(str(agent.path))
+        started = time.monotonic()
+        for message in (b'{"id": 7, "body": {}}', b"[1]", b"not json"):
+            reply = json.loads(relay.request(message))
+            assert reply["status"] == 400
+        assert reply == {
+            "status": 400,
+            "body": {"error": "Message must be a JSON object with a path"},
+            "headers": {},
+        }
+        assert json.loads(relay.request(b'{"id": 7, "body": {}}'))["id"] == 7
+        assert time.monotonic() - started < native_host.REPLY_TIMEOUT_SECONDS
+        assert relay._sock is None  # nothing was forwarded
+        relay.close()
+
+    def test_events_before_a_request_are_handed_over_first(self, agent, telemetry):
+        relay = native_host.Relay(str(agent.path))
+        relay._connect()
+        relay._sock.sendall(b'{"type": "cli_command", "command": "claude"}\n')
+        handler = agent.handler
+        handler.local_events = Mock(wraps=handler.local_events)
+        assert json.loads(relay.request(b'{"path": "/health"}'))["status"] == 200
+        handler.local_events.assert_called_once()
+        relay.close()
+
+
+def test_install_writes_manifest(tmp_path):
+    path = native_host.install("abcdefghijklmnop", tmp_path)
+    assert path == tmp_path / "com.ai_cost_observer.agent.json"
+    manifest = json.loads(path.read_text())
+    assert manifest["name"] == native_host.HOST_NAME
+    assert manifest["type"] == "stdio"
+    assert manifest["allowed_origins"] == ["chrome-extension://abcdefghijklmnop/"]
+    assert os.path.isabs(manifest["path"])
+
+
+def test_extension_uses_same_host_name():
+    for name in ("background.js", "options.js", "popup.js"):
+        src = Path("chrome-extension", name).read_text(encoding="utf-8")
+        assert f'NATIVE_HOST_NAME = "{native_host.HOST_NAME}"' in src
+    manifest = json.loads(Path("chrome-extension/manifest.json").read_text(encoding="utf-8"))
+    assert "nativeMessaging" in manifest["permissions"]
@@ -24,13 +24,14 @@ class TestBug11SessionDurationBuffer:
     """Single-visit sessions should not get the 300s multi-visit buffer."""
 
     @pytest.fixture
-    def parser(self):
+    def parser(self, tmp_path):
         from ai_cost_observer.detectors.browser_history import BrowserHistoryParser
 
         config = AppConfig(
             ai_domains=[
                 {"domain": "test.ai", "category": "test", "cost_per_hour": 0},
             ],
+            state_dir=tmp_path / "state",
         )
         telemetry = Mock()
         telemetry.browser_domain_visit_count = Mock()
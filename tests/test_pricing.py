@@ -0,0 +1,185 @@
+"""Tests for the model pricing index."""
+
+from datetime import date, datetime, timezone
+
+import pytest
+
+from ai_cost_observer import pricing
+from ai_cost_observer.config import AppConfig
+from ai_cost_observer.pricing import DEFAULT_PRICING, PricingIndex, estimate_cost, load_pricing
+
+
+class TestLongestPrefix:
+    def test_exact_match(self):
+        index = PricingIndex()
+        assert index.resolve("gpt-4o-mini") == (0.15, 0.60)
+
+    def test_longer_key_wins_over_shorter_prefix(self):
+        """gpt-4o must not shadow gpt-4o-mini for dated model names."""
+        index = PricingIndex()
+        assert index.resolve("gpt-4o-mini-2024-07-18") == (0.15, 0.60)
+        assert index.resolve("gpt-4o-2024-08-06") == (2.50, 10.0)
+        assert index.resolve("o1-mini-2024-09-12") == (3.0, 12.0)
+
+    def test_longest_prefix_independent_of_table_order(self):
+        index = PricingIndex(base={"a": (1.0, 1.0), "abc": (3.0, 3.0), "ab": (2.0, 2.0)})
+        assert index.resolve("abcd") == (3.0, 3.0)
+        assert index.resolve("abx") == (2.0, 2.0)
+        assert index.resolve("ax") == (1.0, 1.0)
+
+    def test_unknown_and_empty_model_use_fallback(self):
+        index = PricingIndex()
+        assert index.resolve("unknown-model-xyz") == DEFAULT_PRICING
+        assert index.resolve("") == DEFAULT_PRICING
+        assert index.resolve(None) == DEFAULT_PRICING
+
+
+class TestMemo:
+    def test_resolution_is_memoized(self):
+        index = PricingIndex()
+        index.resolve("claude-sonnet-4-5-20250929")
+        assert ("claude-sonnet-4-5-20250929", 0) in index._memo
+
+    def test_memo_is_bounded(self):
+        index = PricingIndex(memo_size=8)
+        for i in range(50):
+            index.resolve(f"unknown-{i}")
+        assert len(index._memo) <= 8
+
+
+class TestVersionedTables:
+    VERSIONS = [
+        {"effective_from": date(2025, 6, 1), "models": {"gpt-4o": {"input": 2.0, "output": 8.0}}},
+        {"effective_from": "2025-01-01", "models": {"new-model": [1.0, 2.0]}},
+    ]
+
+    def test_version_selected_by_effective_date(self):
+        index = PricingIndex(versions=self.VERSIONS)
+        assert index.version_count == 3
+
+        before = datetime(2024, 12, 31, tzinfo=timezone.utc)
+        middle = datetime(2025, 3, 1, tzinfo=timezone.utc)
+        after = datetime(2025, 7, 1, tzinfo=timezone.utc)
+
+        assert index.resolve("gpt-4o", before) == (2.50, 10.0)
+        assert index.resolve("new-model", before) == DEFAULT_PRICING
+        assert index.resolve("new-model", middle) == (1.0, 2.0)
+        assert index.resolve("gpt-4o", middle) == (2.50, 10.0)
+        # Later versions layer on top of earlier ones
+        assert index.resolve("gpt-4o", after) == (2.0, 8.0)
+        assert index.resolve("new-model", after) == (1.0, 2.0)
+        # Untouched models inherit the base table
+        assert index.resolve("gpt-4o-mini", after) == (0.15, 0.60)
+
+    def test_invalid_entries_are_skipped(self):
+        index = PricingIndex(
+            versions=[
+                {"effective_from": "not-a-date", "models": {"x": [1, 1]}},
+                {"effective_from": "2025-01-01", "models": {"bad": "cheap", "ok": [1, 2]}},
+            ]
+        )
+        assert index.version_count == 2
+        assert index.resolve("bad") == DEFAULT_PRICING
+        assert index.resolve("ok") == (1.0, 2.0)
+
+    def test_estimate_cost_at(self):
+        load_pricing(AppConfig(model_pricing=self.VERSIONS))
+        try:
+            old = estimate_cost("gpt-4o", 1_000_000, 0, at=datetime(2025, 1, 15))
+            new = estimate_cost("gpt-4o", 1_000_000, 0, at=datetime(2025, 6, 2))
+            assert old == 2.50
+            assert new == 2.0
+        finally:
+            load_pricing(AppConfig())
+
+    def test_load_pricing_rebuilds_index(self):
+        first = pricing.get_pricing_index()
+        rebuilt = load_pricing(AppConfig())
+        assert rebuilt is not first
+        assert pricing.get_pricing_index() is rebuilt
+
+
+def test_config_loads_model_pricing_from_builtin_yaml():
+    from ai_cost_observer.config import _load_builtin_ai_config
+
+    assert isinstance(_load_builtin_ai_config().get("model_pricing"), list)
+
+
+class TestEstimateCosts:
+    MODELS = ["gpt-4o", "gpt-4o-mini-2024-07-18", None, "claude-sonnet-4-5", "gpt-4o"]
+    INPUT = [1000, 2000, 3000, 4000, 0]
+    OUTPUT = [500, 0, 100, 250, 10]
+    CACHE_CREATION = [0, 0, None, 1000, 0]
+    CACHE_READ = [0, 100, 0, 2000, None]
+
+    def _expected(self, at=None):
+        return [
+            estimate_cost(m or "", i, o, cc or 0, cr or 0, at=at)
+            for m, i, o, cc, cr in zip(
+                self.MODELS, self.INPUT, self.OUTPUT, self.CACHE_CREATION, self.CACHE_READ
+            )
+        ]
+
+    def test_matches_scalar_estimate_cost(self):
+        costs = pricing.estimate_costs(
+            self.MODELS, self.INPUT, self.OUTPUT, self.CACHE_CREATION, self.CACHE_READ
+        )
+        assert list(costs) == self._expected()
+
+    def test_pure_python_fallback(self, monkeypatch):
+        monkeypatch.setattr(pricing, "np", None)
+        costs = pricing.estimate_costs(
+            self.MODELS, self.INPUT, self.OUTPUT, self.CACHE_CREATION, self.CACHE_READ
+        )
+        assert isinstance(costs, list)
+        assert costs == self._expected()
+
+    def test_cache_columns_optional(self):
+        costs = pricing.estimate_costs(["gpt-4o"], [1_000_000], [1_000_000])
+        assert list(costs) == [12.5]
+
+    def test_empty_input(self):
+        assert len(pricing.estimate_costs([], [], [])) == 0
+
+    def test_length_mismatch_raises(self):
+        with pytest.raises(ValueError):
+            pricing.estimate_costs(["gpt-4o", "o3"], [1], [1, 2])
+
+    def test_per_row_effective_dates(self):
+        load_pricing(
+            AppConfig(
+                model_pricing=[{"effective_from": "2025-06-01", "models": {"gpt-4o": [2.0, 8.0]}}]
+            )
+        )
+        try:
+            at = [datetime(2025, 1, 1), datetime(2025, 7, 1)]
+            costs = pricing.estimate_costs(["gpt-4o", "gpt-4o"], [1_000_000] * 2, [0, 0], at=at)
+            assert list(costs) == [2.5, 2.0]
+        finally:
+            load_pricing(AppConfig())
+
+    def test_numpy_arrays_accepted(self):
+        np = pricing.np
+        if np is None:
+            pytest.skip("numpy not installed")
+        costs = pricing.estimate_costs(
+            np.array(["gpt-4o", "o3"], dtype=object),
+            np.array([1_000_000, 1_000_000]),
+            np.array([0, 0]),
+        )
+        assert costs == [2.5, 10.0]
+
+    def test_returns_list_with_numpy(self):
+        costs = pricing.estimate_costs(["gpt-4o"], [1_000_000], [0])
+        assert isinstance(costs, list)
+        assert costs == [2.5]
+
+    def test_inputs_not_modified(self):
+        np = pricing.np
+        if np is None:
+            pytest.skip("numpy not installed")
+        tokens = np.array([1_000_000.0, np.nan])
+        cache = np.array([np.nan, 1_000_000.0])
+        costs = pricing.estimate_costs(["gpt-4o", "gpt-4o"], tokens, tokens, cache, cache)
+        assert costs[1] == estimate_cost("gpt-4o", 0, 0, 1_000_000, 1_000_000)
+        assert np.isnan(tokens[1]) and np.isnan(cache[0])
@@ -1,10 +1,18 @@
 """Tests for the prompt database storage module."""
 
+import hashlib
+import itertools
+import os
+import queue
 import sqlite3
+import threading
+import time
 from datetime import datetime, timedelta, timezone
+from unittest.mock import Mock
 
 import pytest
 
+from ai_cost_observer.storage import prompt_db
 from ai_cost_observer.storage.prompt_db import PromptDB
 
 
@@ -176,3 +184,1068 @@ class TestPromptDB:
         prompts = db.get_prompts()
         assert prompts[0]["prompt_text"] is None
         assert prompts[0]["response_text"] is None
+
+    def test_insert_prompts_bulk(self, tmp_path):
+        """insert_prompts_bulk writes every record in one call."""
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False)
+
+        records = [
+            {"tool_name": "claude-code", "source": "cli", "input_tokens": i, "prompt_text": f"p{i}"}
+            for i in range(10)
+        ]
+        assert db.insert_prompts_bulk(records) == 10
+        assert db.insert_prompts_bulk([]) == 0
+
+        prompts = db.get_prompts(limit=100)
+        assert len(prompts) == 10
+        assert {p["prompt_text"] for p in prompts} == {f"p{i}" for i in range(10)}
+        assert db.get_stats()["total_input_tokens"] == sum(range(10))
+
+    def test_insert_prompts_bulk_parallel_encryption(self, tmp_path, monkeypatch):
+        """Parallel bulk encryption round-trips through get_prompts."""
+        monkeypatch.setenv("PROMPT_DB_KEY", "test-key")
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=True)
+        if db._fernet is None:
+            pytest.skip("cryptography not installed")
+
+        records = [
+            {"tool_name": "t", "source": "cli", "prompt_text": f"secret {i}", "response_text": None}
+            for i in range(200)
+        ]
+        try:
+            assert db.insert_prompts_bulk(records, parallel=True) == 200
+        finally:
+            db.close()
+
+        conn = sqlite3.connect(str(tmp_path / "test.db"))
+        raw = {row[0] for row in conn.execute("SELECT prompt_text FROM prompts")}
+        conn.close()
+        assert "secret 0" not in raw
+
+        prompts = db.get_prompts(limit=1000)
+        assert {p["prompt_text"] for p in prompts} == {f"secret {i}" for i in range(200)}
+        assert all(p["response_text"] is None for p in prompts)
+
+
+class TestConnections:
+    def test_database_uses_wal(self, tmp_path):
+        PromptDB(db_path=tmp_path / "test.db", encrypt=False).close()
+
+        conn = sqlite3.connect(str(tmp_path / "test.db"))
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        conn.close()
+
+    def test_writer_connection_is_reused(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False)
+        writer = db._writer
+        db.insert_prompt(tool_name="t", source="cli")
+        db.insert_prompts_bulk([{"tool_name": "t", "source": "cli"}])
+        db.upsert_session(session_id="s", tool_name="t")
+        assert db._writer is writer
+        db.close()
+
+    def test_reads_do_not_wait_for_writer(self, tmp_path):
+        """Queries use pooled readers and see the last commit while a write is open."""
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False)
+        db.insert_prompt(tool_name="t", source="cli", input_tokens=5)
+
+        results = {}
+        with db._lock:  # simulate a long-running write on another thread
+            writer = db._writer_conn()
+            writer.execute("BEGIN IMMEDIATE")
+            writer.execute(
+                "INSERT INTO prompts (timestamp, tool_name, source) VALUES ('x', 't', 'cli')"
+            )
+
+            reader = threading.Thread(
+                target=lambda: results.update(
+                    stats=db.get_stats(), prompts=db.get_prompts(tool_name="t")
+                )
+            )
+            reader.start()
+            reader.join(timeout=5)
+            assert not reader.is_alive()
+            writer.rollback()
+
+        assert results["stats"]["total_prompts"] == 1
+        assert len(results["prompts"]) == 1
+        db.close()
+
+    def test_reader_pool_is_bounded(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(prompt_db, "_READER_POOL_SIZE", 2)
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False)
+
+        with db._reader(), db._reader(), db._reader():
+            pass
+        assert len(db._readers) == 2
+
+        with db._reader() as conn:
+            with pytest.raises(sqlite3.OperationalError):
+                conn.execute("DELETE FROM prompts")
+        db.close()
+        assert db._readers == []
+
+    def test_usable_after_close(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False)
+        db.close()
+        db.insert_prompt(tool_name="t", source="cli")
+        assert db.get_stats()["total_prompts"] == 1
+        db.close()
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class TestWriteBehind:
+    def test_inserts_are_committed_on_flush(self, tmp_path):
+        db = PromptDB(
+            db_path=tmp_path / "test.db", encrypt=False, write_behind=True, flush_interval=60
+        )
+        assert db.insert_prompt(tool_name="t", source="cli", prompt_text="hello") == 0
+        assert db.insert_prompts_bulk([{"tool_name": "t", "source": "cli"}] * 2) == 2
+        assert db.get_stats()["total_prompts"] == 0
+
+        db.flush()
+        assert db.get_stats()["total_prompts"] == 3
+        assert db.queue_stats()["depth"] == 0
+        assert db.queue_stats()["committed"] == 3
+        assert "hello" in {p["prompt_text"] for p in db.get_prompts()}
+        db.close()
+
+    def test_group_commit_by_batch_size(self, tmp_path):
+        db = PromptDB(
+            db_path=tmp_path / "test.db",
+            encrypt=False,
+            write_behind=True,
+            batch_size=3,
+            flush_interval=60,
+        )
+        for i in range(7):
+            db.insert_prompt(tool_name="t", source="cli", input_tokens=i)
+
+        assert _wait_for(lambda: db.queue_stats()["committed"] == 6)
+        assert db.get_stats()["total_prompts"] == 6
+        db.flush()
+        assert db.get_stats()["total_prompts"] == 7
+        db.close()
+
+    def test_group_commit_by_interval(self, tmp_path):
+        db = PromptDB(
+            db_path=tmp_path / "test.db", encrypt=False, write_behind=True, flush_interval=0.05
+        )
+        db.insert_prompt(tool_name="t", source="cli")
+        assert _wait_for(lambda: db.get_stats()["total_prompts"] == 1)
+        db.close()
+
+    def test_full_queue_writes_inline(self, tmp_path):
+        db = PromptDB(
+            db_path=tmp_path / "test.db", encrypt=False, write_behind=True, flush_interval=60
+        )
+        # Swap in a queue nobody consumes to simulate a writer that has fallen behind
+        consumer_queue = db._queue
+        db._queue = queue.Queue(maxsize=2)
+        db.insert_prompts_bulk([{"tool_name": "t", "source": "cli"}] * 3)
+
+        assert db.queue_stats()["depth"] == 2
+        assert db.queue_stats()["overflows"] == 1
+        assert db.get_stats()["total_prompts"] == 1
+
+        stalled, db._queue = db._queue, consumer_queue
+        db._enqueue(list(stalled.queue))
+        db.close()
+        assert db.get_stats()["total_prompts"] == 3
+
+    def test_failed_batch_is_retried(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(prompt_db, "_WRITE_RETRY_DELAY", 0)
+        db = PromptDB(
+            db_path=tmp_path / "test.db", encrypt=False, write_behind=True, flush_interval=60
+        )
+        real_write = db._write_records
+        attempts = []
+
+        def flaky_write(records, parallel=False):
+            attempts.append(len(records))
+            if len(attempts) <= 2:
+                raise sqlite3.OperationalError("database is locked")
+            return real_write(records, parallel)
+
+        monkeypatch.setattr(db, "_write_records", flaky_write)
+        db.insert_prompts_bulk([{"tool_name": "t", "source": "cli"}] * 3)
+        db.flush()
+        assert attempts == [3, 3, 3]
+        assert db.get_stats()["total_prompts"] == 3
+        assert (db.queue_stats()["committed"], db.queue_stats()["failed"]) == (3, 0)
+        db.close()
+
+    def test_bad_record_does_not_discard_batch(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(prompt_db, "_WRITE_RETRY_DELAY", 0)
+        db = PromptDB(
+            db_path=tmp_path / "test.db", encrypt=False, write_behind=True, flush_interval=60
+        )
+        real_write = db._write_records
+
+        def write(records, parallel=False):
+            if any(r["tool_name"] == "bad" for r in records):
+                raise ValueError("bad record")
+            return real_write(records, parallel)
+
+        monkeypatch.setattr(db, "_write_records", write)
+        db.insert_prompts_bulk([{"tool_name": name, "source": "cli"} for name in ("a", "bad", "b")])
+        db.flush()
+        assert sorted(p["tool_name"] for p in db.get_prompts()) == ["a", "b"]
+        assert (db.queue_stats()["committed"], db.queue_stats()["failed"]) == (2, 1)
+        db.close()
+
+    def test_close_commits_pending_records(self, tmp_path):
+        db = PromptDB(
+            db_path=tmp_path / "test.db", encrypt=False, write_behind=True, flush_interval=60
+        )
+        db.insert_prompt(tool_name="t", source="cli")
+        db.close()
+
+        conn = sqlite3.connect(str(tmp_path / "test.db"))
+        assert conn.execute("SELECT COUNT(*) FROM prompts").fetchone()[0] == 1
+        conn.close()
+
+        # Inserts after close go straight to disk
+        assert db.insert_prompt(tool_name="t", source="cli") > 0
+        db.close()
+
+
+class TestEncryptionFormat:
+    @pytest.fixture
+    def db(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("PROMPT_DB_KEY", "test-key")
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=True)
+        if db._aead is None:
+            pytest.skip("cryptography not installed")
+        yield db
+        db.close()
+
+    def _raw_texts(self, db):
+        conn = sqlite3.connect(str(db.db_path))
+        rows = conn.execute("SELECT prompt_text FROM prompts ORDER BY id").fetchall()
+        conn.close()
+        return [r[0] for r in rows]
+
+    def test_stored_as_aes_gcm_blob_with_fresh_nonce(self, db):
+        db.insert_prompt(tool_name="t", source="cli", prompt_text="same text")
+        db.insert_prompt(tool_name="t", source="cli", prompt_text="same text")
+
+        first, second = self._raw_texts(db)
+        assert isinstance(first, bytes)
+        assert first[0] == prompt_db._FORMAT_AESGCM_COMPRESSED
+        assert first[2:14] != second[2:14]  # per-row nonce
+        assert b"same text" not in first
+        assert {p["prompt_text"] for p in db.get_prompts()} == {"same text"}
+
+    def test_legacy_fernet_rows_still_readable(self, db):
+        token = db._fernet.encrypt(b"old secret").decode("ascii")
+        conn = sqlite3.connect(str(db.db_path))
+        conn.execute(
+            "INSERT INTO prompts (timestamp, tool_name, source, prompt_text) VALUES (?, ?, ?, ?)",
+            (datetime.now(timezone.utc).isoformat(), "t", "cli", token),
+        )
+        conn.commit()
+        conn.close()
+        db.insert_prompt(tool_name="t", source="cli", prompt_text="new secret")
+
+        assert {p["prompt_text"] for p in db.get_prompts()} == {"old secret", "new secret"}
+
+    def test_uncompressed_aes_gcm_rows_still_readable(self, db):
+        nonce = os.urandom(prompt_db._NONCE_BYTES)
+        blob = bytes([prompt_db._FORMAT_AESGCM]) + nonce + db._aead.encrypt(nonce, b"v1", None)
+        assert db._decrypt_text(blob) == "v1"
+
+    def test_codec_header_is_authenticated(self, db):
+        blob = bytearray(db._encrypt_text("x" * 1000))
+        blob[1] = 0  # claim the payload is uncompressed
+        assert db._decrypt_text(bytes(blob)) is None
+
+    def test_tampered_blob_is_not_returned(self, db):
+        blob = bytearray(db._encrypt_text("secret"))
+        blob[-1] ^= 0xFF
+        assert db._decrypt_text(bytes(blob)) is None
+
+
+class TestKeyCache:
+    @pytest.fixture(autouse=True)
+    def _cache_env_key(self, monkeypatch):
+        monkeypatch.setenv("PROMPT_DB_CACHE_KEY", "1")
+
+    def test_env_key_not_cached_by_default(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("PROMPT_DB_KEY", "test-key")
+        PromptDB(db_path=tmp_path / "test.db", encrypt=True).close()
+        cache = tmp_path / "test.db.key"
+        if not cache.exists():
+            pytest.skip("cryptography not installed")
+
+        monkeypatch.delenv("PROMPT_DB_CACHE_KEY")
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=True)
+        db.insert_prompt(tool_name="t", source="cli", prompt_text="secret")
+        db.close()
+        # The cache written with the opt-in is removed, and no new one is written
+        assert not cache.exists()
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=True)
+        assert db.get_prompts()[0]["prompt_text"] == "secret"
+        db.close()
+        assert not cache.exists()
+
+    def test_cache_skips_key_derivation(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("PROMPT_DB_KEY", "test-key")
+        first = PromptDB(db_path=tmp_path / "test.db", encrypt=True)
+        if first._aead is None:
+            pytest.skip("cryptography not installed")
+        first.insert_prompt(tool_name="t", source="cli", prompt_text="secret")
+        first.close()
+
+        cache = tmp_path / "test.db.key"
+        assert cache.exists()
+        if os.name == "posix":
+            assert cache.stat().st_mode & 0o777 == 0o600
+
+        def _no_derive(password):
+            raise AssertionError("PBKDF2 should not run with a valid key cache")
+
+        monkeypatch.setattr(prompt_db, "_derive_key", _no_derive)
+        second = PromptDB(db_path=tmp_path / "test.db", encrypt=True)
+        assert second.get_prompts()[0]["prompt_text"] == "secret"
+        second.close()
+
+    def test_changed_password_rederives(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("PROMPT_DB_KEY", "first")
+        first = PromptDB(db_path=tmp_path / "test.db", encrypt=True)
+        if first._aead is None:
+            pytest.skip("cryptography not installed")
+        first.close()
+
+        calls = []
+        real_derive = prompt_db._derive_key
+        monkeypatch.setattr(
+            prompt_db,
+            "_derive_key",
+            lambda password: calls.append(password) or real_derive(password),
+        )
+        monkeypatch.setenv("PROMPT_DB_KEY", "second")
+        PromptDB(db_path=tmp_path / "test.db", encrypt=True).close()
+        assert calls == ["second"]
+
+    @pytest.mark.skipif(os.name != "posix", reason="POSIX permissions")
+    def test_cache_readable_by_others_is_ignored(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("PROMPT_DB_KEY", "test-key")
+        first = PromptDB(db_path=tmp_path / "test.db", encrypt=True)
+        if first._aead is None:
+            pytest.skip("cryptography not installed")
+        first.close()
+        cache = tmp_path / "test.db.key"
+        cache.chmod(0o644)
+
+        assert prompt_db._read_key_cache(cache, "test-key") is None
+        PromptDB(db_path=tmp_path / "test.db", encrypt=True).close()
+        assert cache.stat().st_mode & 0o777 == 0o600
+
+
+SYSTEM_PROMPT = "You are a careful assistant. Follow the repository conventions.\n" * 40
+
+
+def _blobs(db):
+    conn = sqlite3.connect(str(db.db_path))
+    rows = conn.execute("SELECT hash, refcount, size FROM prompt_blobs").fetchall()
+    conn.close()
+    return rows
+
+
+class TestBlobStore:
+    def test_repeated_text_is_stored_once(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False)
+        db.insert_prompt(tool_name="t", source="cli", prompt_text=SYSTEM_PROMPT)
+        db.insert_prompt(tool_name="t", source="cli", prompt_text=SYSTEM_PROMPT)
+        db.insert_prompts_bulk(
+            [{"tool_name": "t", "source": "cli", "response_text": SYSTEM_PROMPT}] * 3
+        )
+
+        [(_, refcount, size)] = _blobs(db)
+        assert refcount == 5
+        assert size == len(SYSTEM_PROMPT.encode("utf-8"))
+        prompts = db.get_prompts()
+        assert [p["prompt_text"] for p in prompts].count(SYSTEM_PROMPT) == 2
+        assert [p["response_text"] for p in prompts].count(SYSTEM_PROMPT) == 3
+        assert "prompt_blob" not in prompts[0]
+        db.close()
+
+    def test_short_text_stays_inline(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False)
+        db.insert_prompt(tool_name="t", source="cli", prompt_text="short prompt")
+        assert _blobs(db) == []
+        assert db.get_prompts()[0]["prompt_text"] == "short prompt"
+        db.close()
+
+    def test_distinct_blob_encrypted_once_per_batch(self, tmp_path, monkeypatch):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False)
+        encrypted = []
+        real = db._encrypt_text
+        monkeypatch.setattr(db, "_encrypt_text", lambda t: encrypted.append(t) or real(t))
+
+        db.insert_prompts_bulk(
+            [{"tool_name": "t", "source": "cli", "prompt_text": SYSTEM_PROMPT}] * 10
+        )
+        db.insert_prompt(tool_name="t", source="cli", prompt_text=SYSTEM_PROMPT)
+        assert encrypted.count(SYSTEM_PROMPT) == 1
+        db.close()
+
+    def test_deleting_rows_releases_blobs(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False, retention_days=1)
+        old = (datetime.now(timezone.utc) - timedelta(days=5)).isoformat()
+        other = SYSTEM_PROMPT + "different ending"
+        db.insert_prompts_bulk(
+            [
+                {"timestamp": old, "tool_name": "t", "source": "cli", "prompt_text": SYSTEM_PROMPT},
+                {"timestamp": old, "tool_name": "t", "source": "cli", "prompt_text": other},
+            ]
+        )
+        db.insert_prompt(
+            tool_name="t", source="cli", prompt_text=SYSTEM_PROMPT, response_text=SYSTEM_PROMPT
+        )
+
+        assert db.cleanup() == 2
+        [(_, refcount, _)] = _blobs(db)
+        assert refcount == 2
+        assert db.get_prompts()[0]["response_text"] == SYSTEM_PROMPT
+        db.close()
+
+    def test_blob_released_concurrently_is_stored_again(self, tmp_path, monkeypatch):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False)
+        db.insert_prompt(tool_name="t", source="cli", prompt_text=SYSTEM_PROMPT)
+        [(blob_hash, _, _)] = _blobs(db)
+
+        # The pre-check sees the blob, then the only row referencing it is deleted
+        real = prompt_db._existing_blobs
+        calls = []
+
+        def existing(conn, hashes):
+            calls.append(1)
+            if len(calls) == 1:
+                found = real(conn, hashes)
+                conn2 = sqlite3.connect(str(db.db_path))
+                conn2.execute("DELETE FROM prompts")
+                conn2.commit()
+                conn2.close()
+                return found
+            return real(conn, hashes)
+
+        monkeypatch.setattr(prompt_db, "_existing_blobs", existing)
+        db.insert_prompt(tool_name="t", source="cli", prompt_text=SYSTEM_PROMPT)
+        assert _blobs(db) == [(blob_hash, 1, len(SYSTEM_PROMPT.encode("utf-8")))]
+        assert db.get_prompts()[0]["prompt_text"] == SYSTEM_PROMPT
+        db.close()
+
+    def test_hash_is_keyed(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("PROMPT_DB_KEY", "one")
+        one = PromptDB(db_path=tmp_path / "one.db", encrypt=True)
+        if one._aead is None:
+            pytest.skip("cryptography not installed")
+        monkeypatch.setenv("PROMPT_DB_KEY", "two")
+        two = PromptDB(db_path=tmp_path / "two.db", encrypt=True)
+
+        digest = hashlib.sha256(SYSTEM_PROMPT.encode("utf-8")).digest()
+        assert one._blob_hash(SYSTEM_PROMPT) not in (two._blob_hash(SYSTEM_PROMPT), digest)
+        one.insert_prompt(tool_name="t", source="cli", prompt_text=SYSTEM_PROMPT)
+        assert one.get_prompts()[0]["prompt_text"] == SYSTEM_PROMPT
+        one.close()
+        two.close()
+
+    def test_existing_database_gains_blob_columns(self, tmp_path):
+        db_path = tmp_path / "test.db"
+        _v1_database(db_path, [datetime.now(timezone.utc).isoformat()])
+        conn = sqlite3.connect(str(db_path))
+        conn.execute("UPDATE prompts SET prompt_text = 'legacy row'")
+        conn.commit()
+        conn.close()
+
+        db = PromptDB(db_path=db_path, encrypt=False)
+        db.insert_prompt(tool_name="t", source="cli", prompt_text=SYSTEM_PROMPT)
+        assert {p["prompt_text"] for p in db.get_prompts()} == {"legacy row", SYSTEM_PROMPT}
+        db.close()
+
+
+_V1_SCHEMA = """
+CREATE TABLE prompts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL, tool_name TEXT NOT NULL,
+    model_name TEXT, source TEXT NOT NULL, session_id TEXT, input_tokens INTEGER,
+    output_tokens INTEGER, cache_creation_tokens INTEGER, cache_read_tokens INTEGER,
+    estimated_cost_usd REAL, prompt_text TEXT, response_text TEXT, project_path TEXT,
+    host_name TEXT
+);
+CREATE TABLE sessions (id TEXT PRIMARY KEY, tool_name TEXT NOT NULL, start_time TEXT,
+    end_time TEXT, total_input_tokens INTEGER DEFAULT 0, total_output_tokens INTEGER DEFAULT 0,
+    total_cost_usd REAL DEFAULT 0);
+CREATE INDEX idx_prompts_timestamp ON prompts(timestamp);
+CREATE INDEX idx_prompts_tool ON prompts(tool_name);
+CREATE INDEX idx_prompts_session ON prompts(session_id);
+CREATE TABLE schema_version (version INTEGER PRIMARY KEY);
+INSERT INTO schema_version VALUES (1);
+"""
+
+
+def _v1_database(path, timestamps):
+    conn = sqlite3.connect(str(path))
+    conn.executescript(_V1_SCHEMA)
+    conn.executemany(
+        "INSERT INTO prompts (timestamp, tool_name, source) VALUES (?, 't', 'cli')",
+        [(ts,) for ts in timestamps],
+    )
+    conn.commit()
+    conn.close()
+
+
+def _query(path, sql, params=()):
+    conn = sqlite3.connect(str(path))
+    rows = conn.execute(sql, params).fetchall()
+    conn.close()
+    return rows
+
+
+class TestMigrations:
+    def test_v1_database_is_migrated_in_batches(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(prompt_db, "_MIGRATION_BATCH_ROWS", 2)
+        db_path = tmp_path / "test.db"
+        base = datetime(2026, 3, 1, 12, 0, 0, 123456, tzinfo=timezone.utc)
+        stamps = [(base + timedelta(hours=i)).isoformat() for i in range(5)]
+        stamps.append("2026-03-01T14:30:00+02:00")  # same instant as base + 30 min, in UTC
+        stamps.append("not a timestamp")
+        _v1_database(db_path, stamps)
+
+        db = PromptDB(db_path=db_path, encrypt=False)
+        assert _query(db_path, "SELECT version FROM schema_version") == [
+            (prompt_db._SCHEMA_VERSION,)
+        ]
+        # Startup only changes the schema; the backfill runs afterwards
+        assert _query(db_path, "SELECT COUNT(*) FROM prompts WHERE ts_us IS NULL") == [(7,)]
+        assert _query(db_path, "SELECT until_id FROM timestamp_backfill") == [(7,)]
+        assert db.migrate_pending(max_rows=3) == 3  # ids 7, 6, 5
+        assert _query(db_path, "SELECT until_id FROM timestamp_backfill") == [(4,)]
+        assert db.migrate_pending() == 4 + 7  # the remaining timestamps, then the rollups
+        assert _query(db_path, "SELECT until_id FROM timestamp_backfill") == []
+        ts_us = [r[0] for r in _query(db_path, "SELECT ts_us FROM prompts ORDER BY id")]
+        expected = prompt_db._to_us(base)
+        assert ts_us[0] == expected
+        assert ts_us[4] == expected + 4 * 3600 * 1_000_000
+        assert ts_us[5] == prompt_db._to_us(datetime(2026, 3, 1, 12, 30, tzinfo=timezone.utc))
+        assert ts_us[6] is None
+
+        indexes = {
+            r[0] for r in _query(db_path, "SELECT name FROM sqlite_master WHERE type='index'")
+        }
+        assert {"idx_prompts_tool_ts", "idx_prompts_model_ts", "idx_prompts_ts"} <= indexes
+        assert "idx_prompts_timestamp" not in indexes
+
+        since = base + timedelta(hours=3)
+        assert len(db.get_prompts(since=since)) == 2
+        db.close()
+
+    def test_migration_is_idempotent(self, tmp_path):
+        db_path = tmp_path / "test.db"
+        _v1_database(db_path, [datetime.now(timezone.utc).isoformat()])
+        db = PromptDB(db_path=db_path, encrypt=False)
+        db.migrate_pending()
+        db.close()
+
+        # Simulate a crash before the version bump: v3 runs again over migrated data
+        conn = sqlite3.connect(str(db_path))
+        conn.execute("UPDATE schema_version SET version = 2")
+        conn.commit()
+        conn.close()
+        db = PromptDB(db_path=db_path, encrypt=False)
+        db.migrate_pending()
+        assert len(db.get_prompts()) == 1
+        assert db.get_stats()["total_prompts"] == 1
+        assert _query(db_path, "SELECT version FROM schema_version") == [
+            (prompt_db._SCHEMA_VERSION,)
+        ]
+        db.close()
+
+    def test_newer_schema_is_left_alone(self, tmp_path):
+        db_path = tmp_path / "test.db"
+        PromptDB(db_path=db_path, encrypt=False).close()
+        conn = sqlite3.connect(str(db_path))
+        conn.execute("UPDATE schema_version SET version = 99")
+        conn.commit()
+        conn.close()
+
+        PromptDB(db_path=db_path, encrypt=False).close()
+        assert _query(db_path, "SELECT version FROM schema_version") == [(99,)]
+
+    def test_raw_insert_gets_ts_us(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False)
+        conn = sqlite3.connect(str(db.db_path))
+        conn.execute(
+            "INSERT INTO prompts (timestamp, tool_name, source) VALUES (?, 't', 'cli')",
+            ("2026-03-01T12:00:00.123456+00:00",),
+        )
+        conn.commit()
+        conn.close()
+        [(ts_us,)] = _query(db.db_path, "SELECT ts_us FROM prompts")
+        assert ts_us == prompt_db._to_us(
+            datetime(2026, 3, 1, 12, 0, 0, 123000, tzinfo=timezone.utc)
+        )
+        db.close()
+
+    def test_insert_stores_exact_microseconds(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False)
+        db.insert_prompt(tool_name="t", source="cli")
+        [(ts, ts_us)] = _query(db.db_path, "SELECT timestamp, ts_us FROM prompts")
+        assert ts_us == prompt_db._to_us(datetime.fromisoformat(ts))
+        db.close()
+
+    def test_usage_by_tool_uses_covering_index(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False)
+        plan = _query(
+            db.db_path,
+            "EXPLAIN QUERY PLAN SELECT SUM(input_tokens), SUM(estimated_cost_usd) FROM prompts "
+            "WHERE tool_name = ? AND ts_us >= ?",
+            ("t", 0),
+        )
+        assert any("COVERING INDEX idx_prompts_tool_ts" in row[-1] for row in plan)
+        db.close()
+
+
+class TestRollups:
+    def _insert(self, db, when, tool="claude-code", model="claude-sonnet-4-5", **extra):
+        db.insert_prompts_bulk(
+            [
+                {
+                    "timestamp": when.isoformat(),
+                    "tool_name": tool,
+                    "model_name": model,
+                    "source": "cli",
+                    "input_tokens": 100,
+                    "output_tokens": 10,
+                    "estimated_cost_usd": 0.5,
+                    **extra,
+                }
+            ]
+        )
+
+    def test_usage_grouped_by_bucket_and_tool(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False)
+        t0 = datetime(2026, 3, 1, 10, 15, tzinfo=timezone.utc)
+        self._insert(db, t0)
+        self._insert(db, t0 + timedelta(minutes=30))
+        self._insert(db, t0 + timedelta(hours=1))
+        self._insert(db, t0, tool="gemini-cli", model=None)
+
+        hourly = db.get_usage(group_by=("bucket", "tool_name"), granularity="hour")
+        assert [(u["bucket"], u["tool_name"], u["prompts"]) for u in hourly] == [
+            (int(datetime(2026, 3, 1, 10, tzinfo=timezone.utc).timestamp()), "claude-code", 2),
+            (int(datetime(2026, 3, 1, 10, tzinfo=timezone.utc).timestamp()), "gemini-cli", 1),
+            (int(datetime(2026, 3, 1, 11, tzinfo=timezone.utc).timestamp()), "claude-code", 1),
+        ]
+        by_model = db.get_usage(group_by=("model_name",))
+        assert {u["model_name"]: u["input_tokens"] for u in by_model} == {
+            "": 100,
+            "claude-sonnet-4-5": 300,
+        }
+        later = db.get_usage(since=t0 + timedelta(hours=1), granularity="hour")
+        assert [(u["tool_name"], u["prompts"]) for u in later] == [("claude-code", 1)]
+        db.close()
+
+    def test_adjacent_windows_count_each_bucket_once(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False)
+        day = datetime(2026, 3, 1, tzinfo=timezone.utc)
+        for offset in (timedelta(0), timedelta(hours=23), timedelta(days=1), timedelta(days=2)):
+            self._insert(db, day + offset)
+
+        windows = [(day + timedelta(days=i), day + timedelta(days=i + 1)) for i in range(3)]
+        counts = [
+            sum(u["prompts"] for u in db.get_usage(since=since, until=until, granularity=g))
+            for g in ("day", "hour")
+            for since, until in windows
+        ]
+        assert counts == [2, 1, 1, 2, 1, 1]
+        # A partial bucket at either end still counts whole
+        partial = db.get_usage(since=day + timedelta(hours=12), until=day + timedelta(hours=36))
+        assert sum(u["prompts"] for u in partial) == 3
+        db.close()
+
+    def test_stats_survive_retention(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False, retention_days=1)
+        self._insert(db, datetime.now(timezone.utc) - timedelta(days=10))
+        self._insert(db, datetime.now(timezone.utc))
+
+        assert db.cleanup() == 1
+        stats = db.get_stats()
+        assert stats["total_prompts"] == 2
+        assert stats["total_input_tokens"] == 200
+        assert abs(stats["total_cost_usd"] - 1.0) < 1e-9
+        db.close()
+
+    def test_sessions_accumulate_across_batches(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False)
+        t0 = datetime(2026, 3, 1, 10, tzinfo=timezone.utc)
+        self._insert(db, t0 + timedelta(minutes=5), session_id="s1")
+        self._insert(db, t0, session_id="s1")
+        self._insert(db, t0 + timedelta(minutes=9), session_id="s1")
+
+        [row] = _query(
+            db.db_path,
+            "SELECT tool_name, start_time, end_time, total_input_tokens, total_cost_usd "
+            "FROM sessions WHERE id = 's1'",
+        )
+        assert row == (
+            "claude-code",
+            t0.isoformat(),
+            (t0 + timedelta(minutes=9)).isoformat(),
+            300,
+            1.5,
+        )
+        db.close()
+
+    def test_write_behind_rolls_up(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False, write_behind=True)
+        for _ in range(3):
+            db.insert_prompt(tool_name="t", source="cli", input_tokens=5)
+        db.flush()
+        assert db.get_stats()["total_input_tokens"] == 15
+        db.close()
+
+    def test_migration_backfills_rollups_and_sessions(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(prompt_db, "_MIGRATION_BATCH_ROWS", 2)
+        db_path = tmp_path / "test.db"
+        t0 = datetime(2026, 3, 1, 10, tzinfo=timezone.utc)
+        _v1_database(db_path, [(t0 + timedelta(hours=i)).isoformat() for i in range(5)])
+        conn = sqlite3.connect(str(db_path))
+        conn.execute("UPDATE prompts SET input_tokens = 7, session_id = 'legacy'")
+        conn.commit()
+        conn.close()
+
+        db = PromptDB(db_path=db_path, encrypt=False)
+        assert db.get_stats()["total_input_tokens"] == 0
+        db.insert_prompt(tool_name="t", source="cli", input_tokens=1, session_id="legacy")
+        # Past retention: rolled up by the backfill first, so their usage stays
+        assert db.cleanup() == 5
+        assert _query(db_path, "SELECT until_id FROM rollup_backfill") == []
+        assert db.get_stats()["total_input_tokens"] == 36
+        assert len(db.get_usage(group_by=("bucket",), granularity="hour")) == 6
+        assert _query(db_path, "SELECT total_input_tokens FROM sessions") == [(36,)]
+        db.close()
+
+    def test_invalid_grouping_rejected(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False)
+        with pytest.raises(ValueError):
+            db.get_usage(group_by=("prompt_text",))
+        with pytest.raises(ValueError):
+            db.get_usage(granularity="week")
+        db.close()
+
+
+class TestRetention:
+    def _fill(self, db, n, age_days):
+        when = (datetime.now(timezone.utc) - timedelta(days=age_days)).isoformat()
+        db.insert_prompts_bulk(
+            [
+                # Incompressible, below the blob threshold: stored inline
+                {
+                    "timestamp": when,
+                    "tool_name": "t",
+                    "source": "cli",
+                    "prompt_text": os.urandom(450).hex(),
+                }
+                for _ in range(n)
+            ]
+        )
+
+    def test_new_database_uses_incremental_vacuum(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False)
+        assert _query(db.db_path, "PRAGMA auto_vacuum") == [(2,)]
+        assert _query(db.db_path, "PRAGMA journal_mode") == [("wal",)]
+        db.close()
+
+    def test_existing_database_switched_once(self, tmp_path):
+        db_path = tmp_path / "test.db"
+        _v1_database(db_path, [datetime.now(timezone.utc).isoformat()])
+        assert _query(db_path, "PRAGMA auto_vacuum") == [(0,)]
+        db = PromptDB(db_path=db_path, encrypt=False)
+        # The full rewrite is opt-in, never part of startup
+        assert _query(db_path, "PRAGMA auto_vacuum") == [(0,)]
+        assert db.vacuum() is True
+        assert _query(db_path, "PRAGMA auto_vacuum") == [(2,)]
+        assert db.vacuum() is False
+        db.close()
+
+    def test_cleanup_deletes_in_batches(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(prompt_db, "_RETENTION_BATCH_ROWS", 7)
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False, retention_days=30)
+        self._fill(db, 50, age_days=60)
+        self._fill(db, 3, age_days=1)
+
+        statements = []
+        db._writer_conn().set_trace_callback(statements.append)
+        assert db.cleanup() == 50
+        assert statements.count("BEGIN ") == 8  # 7 full batches, then a short one
+        assert len(db.get_prompts()) == 3
+        db.close()
+
+    def test_rows_without_ts_us_expire_by_timestamp(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False, retention_days=30)
+        self._fill(db, 2, age_days=60)
+        self._fill(db, 1, age_days=1)
+        recent = (datetime.now(timezone.utc) - timedelta(days=1)).isoformat()
+        conn = sqlite3.connect(str(db.db_path))
+        # Legacy rows the ts_us backfill could not convert
+        conn.execute(
+            "UPDATE prompts SET ts_us = NULL, timestamp = '2020-01-01T00:00:00Z' WHERE id = 1"
+        )
+        conn.execute("UPDATE prompts SET ts_us = NULL, timestamp = ? WHERE id = 3", (recent,))
+        conn.commit()
+        conn.close()
+
+        assert db.cleanup() == 2
+        assert _query(db.db_path, "SELECT id FROM prompts") == [(3,)]
+        db.close()
+
+    def test_cleanup_releases_disk_space(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False, retention_days=30)
+        self._fill(db, 2000, age_days=60)
+        pages_before = _query(db.db_path, "PRAGMA page_count")[0][0]
+
+        db.cleanup()
+        assert _query(db.db_path, "PRAGMA freelist_count") == [(0,)]
+        assert _query(db.db_path, "PRAGMA page_count")[0][0] < pages_before / 2
+        db.close()
+
+    def test_reclaim_space_is_bounded(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(prompt_db, "_VACUUM_STEP_PAGES", 10)
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False)
+        self._fill(db, 500, age_days=0)
+        with db._lock:
+            with db._writer_conn() as conn:
+                conn.execute("DELETE FROM prompts")
+        free = _query(db.db_path, "PRAGMA freelist_count")[0][0]
+
+        assert db.reclaim_space(max_pages=25) == 25
+        assert _query(db.db_path, "PRAGMA freelist_count") == [(free - 25,)]
+        db.close()
+
+
+class TestIterPrompts:
+    @pytest.fixture
+    def db(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False)
+        t0 = datetime(2026, 3, 1, 10, tzinfo=timezone.utc)
+        db.insert_prompts_bulk(
+            [
+                {
+                    "timestamp": (t0 + timedelta(minutes=i // 2)).isoformat(),  # pairs share ts
+                    "tool_name": "a" if i % 3 else "b",
+                    "source": "cli",
+                    "input_tokens": i,
+                    "prompt_text": f"prompt {i}",
+                    "response_text": SYSTEM_PROMPT if i % 2 else None,
+                }
+                for i in range(25)
+            ]
+        )
+        yield db
+        db.close()
+
+    def test_pages_cover_every_row_once(self, db):
+        records = list(db.iter_prompts(page_size=4))
+        assert [r["input_tokens"] for r in records] == list(range(24, -1, -1))
+        assert records[0]["prompt_text"] == "prompt 24"
+        assert records[1]["response_text"] == SYSTEM_PROMPT
+        assert records[0].to_dict() == {
+            **{k: records[0][k] for k in prompt_db._PROMPT_COLUMNS},
+        }
+
+    def test_cursor_resumes_listing(self, db):
+        first = list(itertools.islice(db.iter_prompts(page_size=10), 7))
+        rest = list(db.iter_prompts(after=first[-1].cursor, page_size=10))
+        assert [r["input_tokens"] for r in first + rest] == list(range(24, -1, -1))
+
+    def test_pages_are_fetched_lazily(self, db, monkeypatch):
+        pages = []
+        real = db._reader
+
+        def counting_reader():
+            pages.append(1)
+            return real()
+
+        monkeypatch.setattr(db, "_reader", counting_reader)
+        it = db.iter_prompts(page_size=5)
+        next(it)
+        assert len(pages) == 1
+        list(it)
+        assert len(pages) == 5
+
+    def test_projection_skips_text_and_decryption(self, db, monkeypatch):
+        monkeypatch.setattr(db, "_decrypt_text", Mock(side_effect=AssertionError("decrypted")))
+        records = list(db.iter_prompts(columns=("tool_name", "input_tokens"), tool_name="b"))
+        assert [dict(r) for r in records][:2] == [
+            {"tool_name": "b", "input_tokens": 24},
+            {"tool_name": "b", "input_tokens": 21},
+        ]
+        assert "prompt_text" not in records[0]
+
+    def test_text_decrypted_on_access_and_blobs_once_per_page(self, db, monkeypatch):
+        real = db._decrypt_text
+        decrypted = []
+        monkeypatch.setattr(db, "_decrypt_text", lambda v: decrypted.append(v) or real(v))
+
+        records = list(db.iter_prompts(columns=("input_tokens", "response_text")))
+        assert decrypted == []
+        texts = [r["response_text"] for r in records]
+        assert texts.count(SYSTEM_PROMPT) == 12
+        assert len(decrypted) == 13 + 1  # inline NULLs + one shared blob
+
+    def test_time_window_and_unknown_columns(self, db):
+        t0 = datetime(2026, 3, 1, 10, tzinfo=timezone.utc)
+        window = db.iter_prompts(
+            columns=("input_tokens",),
+            since=t0 + timedelta(minutes=2),
+            until=t0 + timedelta(minutes=4),
+        )
+        assert [r["input_tokens"] for r in window] == [7, 6, 5, 4]
+        with pytest.raises(ValueError):
+            list(db.iter_prompts(columns=("prompt_blob",)))
+
+
+class TestSearch:
+    @pytest.fixture(params=["encrypted", "plaintext"])
+    def db(self, request, tmp_path, monkeypatch):
+        monkeypatch.setenv("PROMPT_DB_KEY", "test-key")
+        encrypted = request.param == "encrypted"
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=encrypted)
+        if encrypted and db._aead is None:
+            pytest.skip("cryptography not installed")
+        yield db
+        db.close()
+
+    def _fill(self, db):
+        db.insert_prompts_bulk(
+            [
+                {"tool_name": "a", "source": "cli", "prompt_text": "Refactor the Parser module"},
+                {"tool_name": "b", "source": "cli", "response_text": "The parser handles café"},
+                {"tool_name": "a", "source": "cli", "prompt_text": SYSTEM_PROMPT + " tokenizer"},
+                {"tool_name": "a", "source": "cli", "prompt_text": None},
+            ]
+        )
+
+    def test_every_word_must_match(self, db):
+        self._fill(db)
+        assert [p["tool_name"] for p in db.search_prompts("PARSER")] == ["b", "a"]
+        assert [p["prompt_text"] for p in db.search_prompts("parser refactor")] == [
+            "Refactor the Parser module"
+        ]
+        assert db.search_prompts("parser tokenizer") == []
+        assert db.search_prompts("cafe")[0]["response_text"] == "The parser handles café"
+        assert db.search_prompts("tokenizer")[0]["prompt_text"] == SYSTEM_PROMPT + " tokenizer"
+        assert db.search_prompts("  ") == []
+
+    def test_filters_and_limit(self, db):
+        self._fill(db)
+        assert [p["tool_name"] for p in db.search_prompts("parser", tool_name="a")] == ["a"]
+        assert len(db.search_prompts("parser", limit=1)) == 1
+
+    def test_only_matching_rows_are_decrypted(self, db, monkeypatch):
+        self._fill(db)
+        real = db._decrypt_text
+        decrypted = []
+        monkeypatch.setattr(db, "_decrypt_text", lambda v: decrypted.append(v) or real(v))
+        db.search_prompts("refactor")
+        assert len(decrypted) == 2  # prompt and (NULL) response of one row
+
+    def test_encrypted_index_holds_no_words(self, db):
+        self._fill(db)
+        conn = sqlite3.connect(str(db.db_path))
+        conn.execute("CREATE VIRTUAL TABLE temp.vocab USING fts5vocab(main, prompt_search, row)")
+        terms = {row[0] for row in conn.execute("SELECT term FROM temp.vocab")}
+        conn.close()
+        assert ("parser" in terms) == (not db.encrypt)
+
+    def test_index_keeps_no_copy_of_the_texts(self, db):
+        self._fill(db)
+        tables = {row[0] for row in _query(db.db_path, "SELECT name FROM sqlite_master")}
+        assert "prompt_search_content" not in tables
+        assert _query(db.db_path, "SELECT terms FROM prompt_search") == [(None,)] * 3
+
+    def test_retention_removes_index_entries(self, db):
+        old = (datetime.now(timezone.utc) - timedelta(days=200)).isoformat()
+        db.insert_prompts_bulk(
+            [{"timestamp": old, "tool_name": "a", "source": "cli", "prompt_text": "parser"}]
+        )
+        self._fill(db)
+        assert db.cleanup() == 1
+        assert len(db.search_prompts("parser")) == 2
+        assert _query(db.db_path, "SELECT COUNT(*) FROM prompt_search") == [(3,)]
+        conn = sqlite3.connect(str(db.db_path))
+        conn.execute("INSERT INTO prompt_search (prompt_search) VALUES ('integrity-check')")
+        conn.close()
+
+    def test_write_behind_rows_are_indexed(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False, write_behind=True)
+        db.insert_prompt(tool_name="a", source="cli", prompt_text="queued parser")
+        db.flush()
+        assert len(db.search_prompts("parser")) == 1
+        db.close()
+
+
+class TestSearchBackfill:
+    def test_existing_rows_indexed_in_batches(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(prompt_db, "_SEARCH_BACKFILL_ROWS", 2)
+        db_path = tmp_path / "test.db"
+        _v1_database(db_path, [datetime.now(timezone.utc).isoformat()] * 5)
+        conn = sqlite3.connect(str(db_path))
+        conn.execute("UPDATE prompts SET prompt_text = 'legacy row ' || id")
+        conn.commit()
+        conn.close()
+
+        db = PromptDB(db_path=db_path, encrypt=False)
+        db.insert_prompt(tool_name="t", source="cli", prompt_text="new row")
+        assert len(db.search_prompts("row")) == 1
+        assert _query(db_path, "SELECT until_id FROM search_backfill") == [(5,)]
+
+        assert db.index_pending(max_rows=3) == 3  # ids 5, 4, 3
+        assert _query(db_path, "SELECT until_id FROM search_backfill") == [(2,)]
+        assert db.cleanup() == 0  # finishes the backfill
+        assert _query(db_path, "SELECT until_id FROM search_backfill") == []
+        assert len(db.search_prompts("row")) == 6
+        assert [p["prompt_text"] for p in db.search_prompts("legacy 3")] == ["legacy row 3"]
+        assert db.index_pending() == 0
+        db.close()
+
+    def test_v6_index_rebuilt_without_content(self, tmp_path):
+        db_path = tmp_path / "test.db"
+        db = PromptDB(db_path=db_path, encrypt=False)
+        db.insert_prompt(tool_name="t", source="cli", prompt_text="old parser")
+        db.close()
+        # A v6 database: the index stored its own copy of every text
+        conn = sqlite3.connect(str(db_path))
+        conn.execute("DROP TABLE prompt_search")
+        conn.execute("CREATE VIRTUAL TABLE prompt_search USING fts5(terms)")
+        conn.execute("INSERT INTO prompt_search (rowid, terms) VALUES (1, 'old parser')")
+        conn.execute("UPDATE schema_version SET version = 6")
+        conn.commit()
+        conn.close()
+
+        db = PromptDB(db_path=db_path, encrypt=False)
+        tables = {row[0] for row in _query(db_path, "SELECT name FROM sqlite_master")}
+        assert "prompt_search_content" not in tables
+        assert _query(db_path, "SELECT until_id FROM search_backfill") == [(1,)]
+        assert db.index_pending() == 1
+        assert [p["prompt_text"] for p in db.search_prompts("parser")] == ["old parser"]
+        db.close()
+
+    def test_fresh_database_needs_no_backfill(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False)
+        db.insert_prompt(tool_name="t", source="cli", prompt_text="hello")
+        assert db.index_pending() == 0
+        db.close()
+        db = PromptDB(db_path=tmp_path / "test.db", encrypt=False)
+        assert db.index_pending() == 0
+        db.close()
@@ -0,0 +1,72 @@
+"""Tests for the token-bucket rate limiter used by the HTTP receivers."""
+
+from __future__ import annotations
+
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+import pytest
+
+from ai_cost_observer.config import AppConfig
+from ai_cost_observer.server import ingest
+from ai_cost_observer.server.http_receiver import create_app
+from ai_cost_observer.server.ingest import EndpointRateLimiter, RateLimiter, retry_after
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(t=1000.0)
+    monkeypatch.setattr(ingest, "time", SimpleNamespace(monotonic=lambda: now.t))
+    return now
+
+
+class TestRateLimiter:
+    def test_burst_then_refill(self, clock):
+        limiter = RateLimiter(max_requests=3, window_seconds=30)  # one token per 10s
+        assert [limiter.acquire("a") for _ in range(3)] == [0.0, 0.0, 0.0]
+        assert limiter.acquire("a") == pytest.approx(10.0)
+        clock.t += 4
+        assert limiter.acquire("a") == pytest.approx(6.0)
+        clock.t += 6
+        assert limiter.acquire("a") == 0.0
+        assert limiter.acquire("b") == 0.0  # clients are independent
+
+    def test_bucket_never_exceeds_burst(self, clock):
+        limiter = RateLimiter(max_requests=2, window_seconds=2)
+        clock.t += 3600
+        assert [limiter.is_allowed("a") for _ in range(3)] == [True, True, False]
+
+    def test_client_table_is_bounded_lru(self, clock):
+        limiter = RateLimiter(max_requests=1, window_seconds=60, max_clients=2)
+        limiter.acquire("a")
+        limiter.acquire("b")
+        assert limiter.acquire("a") > 0  # "a" is now the most recently seen
+        limiter.acquire("c")  # evicts "b"
+        assert list(limiter._buckets) == ["a", "c"]
+        assert limiter.acquire("b") == 0.0  # returns with a full bucket
+
+    def test_retry_after_is_whole_seconds(self):
+        assert retry_after(0.2) == "1"
+        assert retry_after(6.01) == "7"
+
+
+class TestEndpointLimits:
+    def test_per_endpoint_limits_fall_back_to_default(self, clock):
+        limits = EndpointRateLimiter(
+            {
+                "default": {"requests": 1, "window_seconds": 60},
+                "/api/tokens": {"requests": 3},
+            }
+        )
+        assert [limits.acquire("/api/tokens", "a") for _ in range(4)][-1] == pytest.approx(20.0)
+        assert limits.acquire("/metrics/browser", "a") == 0.0
+        assert limits.acquire("/metrics/browser", "a") == pytest.approx(60.0)
+
+    def test_flask_app_sends_retry_after(self, clock):
+        config = AppConfig(http_rate_limits={"default": {"requests": 1, "window_seconds": 5}})
+        client = create_app(config, Mock()).test_client()
+        assert client.post("/api/tokens", json={"events": []}).status_code == 200
+        resp = client.post("/api/tokens", json={"events": []})
+        assert resp.status_code == 429
+        assert resp.headers["Retry-After"] == "5"
+        assert resp.get_json() == {"error": "Rate limit exceeded", "retry_after": 5.0}
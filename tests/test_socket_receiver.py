@@ -0,0 +1,215 @@
+"""Tests for the Unix socket receiver and the lightweight reporter."""
+
+from __future__ import annotations
+
+import os
+import shutil
+import socket
+import stat
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+
+from ai_cost_observer import reporter
+from ai_cost_observer.config import AppConfig, _default_state_dir
+from ai_cost_observer.detectors.shell_history import ShellHistoryParser
+from ai_cost_observer.server import http_receiver
+from ai_cost_observer.server.ingest import IngestHandler
+from ai_cost_observer.server.socket_receiver import SocketReceiver, socket_path
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="needs Unix sockets")
+
+
+def _config(state_dir) -> AppConfig:
+    return AppConfig(
+        state_dir=Path(state_dir),
+        ai_cli_tools=[
+            {"name": "claude-code", "category": "code", "command_patterns": ["claude"]},
+            {"name": "ollama", "category": "local", "command_patterns": ["ollama"]},
+        ],
+    )
+
+
+@pytest.fixture
+def state_dir():
+    # tmp_path can exceed the ~104-byte limit of a Unix socket path
+    path = tempfile.mkdtemp(prefix="aco-", dir="/tmp")
+    yield Path(path)
+    shutil.rmtree(path, ignore_errors=True)
+
+
+@pytest.fixture
+def telemetry():
+    return Mock()
+
+
+@pytest.fixture
+def tracker():
+    return Mock()
+
+
+@pytest.fixture
+def receiver(state_dir, telemetry, tracker):
+    handler = IngestHandler(_config(state_dir), telemetry, lambda: tracker)
+    receiver = SocketReceiver(handler, state_dir / reporter.SOCKET_NAME)
+    receiver.start()
+    yield receiver
+    receiver.stop()
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+class TestSocketReceiver:
+    def test_commands_counted_per_tool(self, receiver, telemetry):
+        events = [
+            reporter.command_event("claude -p 'fix the bug'", "zsh"),
+            reporter.command_event("ls -la", "zsh"),
+            reporter.command_event("git log | claude", "zsh"),
+            reporter.command_event("ollama run llama3", "zsh"),
+        ]
+        assert reporter.send(events, str(receiver.path))
+        _wait_for(lambda: telemetry.cli_command_count.add.call_count == 2)
+        calls = {
+            c.args[1]["cli.name"]: c.args for c in telemetry.cli_command_count.add.call_args_list
+        }
+        assert calls["claude-code"] == (2, {"cli.name": "claude-code", "cli.category": "code"})
+        assert calls["ollama"] == (1, {"cli.name": "ollama", "cli.category": "local"})
+
+    def test_api_intercepts_go_to_tracker(self, receiver, tracker):
+        event = {"type": "api_intercept", "tool": "wrapper", "model": "m", "input_tokens": 7}
+        assert reporter.send([event, {"type": "other"}], str(receiver.path))
+        _wait_for(lambda: tracker.flush_prompts.called)
+        tracker.record_api_intercept.assert_called_once()
+        assert tracker.record_api_intercept.call_args.kwargs["input_tokens"] == 7
+
+    def test_invalid_lines_skipped(self, receiver, telemetry):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(str(receiver.path))
+            sock.sendall(b'not json\n[1]\n{"type": "cli_command", "command": "claude"}\n')
+        _wait_for(lambda: telemetry.cli_command_count.add.called)
+        assert telemetry.cli_command_count.add.call_args.args[0] == 1
+
+    def test_open_connection_flushed_when_idle(self, receiver, telemetry):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(str(receiver.path))
+            sock.sendall(b'{"type": "cli_command", "command": "ollama list"}\n')
+            _wait_for(lambda: telemetry.cli_command_count.add.called)
+
+    def test_socket_private_and_removed_on_stop(self, state_dir, telemetry):
+        path = state_dir / reporter.SOCKET_NAME
+        receiver = SocketReceiver(IngestHandler(_config(state_dir), telemetry), path)
+        receiver.start()
+        assert stat.S_IMODE(path.stat().st_mode) == 0o600
+        receiver.stop()
+        assert not path.exists()
+
+    def test_stale_socket_replaced(self, state_dir, telemetry):
+        path = state_dir / reporter.SOCKET_NAME
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(str(path))
+        stale.close()  # leaves the file behind, with nobody listening
+        receiver = SocketReceiver(IngestHandler(_config(state_dir), telemetry), path)
+        receiver.start()
+        assert reporter.send([reporter.command_event("claude")], str(path))
+        receiver.stop()
+
+    def test_running_agent_not_displaced(self, receiver, telemetry):
+        other = SocketReceiver(
+            IngestHandler(_config(receiver.path.parent), telemetry), receiver.path
+        )
+        with pytest.raises(OSError):
+            other.start()
+        assert receiver.path.exists()
+
+    def test_socket_path_from_config(self, state_dir):
+        config = _config(state_dir)
+        assert socket_path(config) == state_dir / "ingest.sock"
+        config.ingest_socket_path = "/run/user/ingest.sock"
+        assert socket_path(config) == Path("/run/user/ingest.sock")
+        config.ingest_socket_path = ""
+        assert socket_path(config) is None
+
+    def test_start_http_receiver_opens_socket(self, state_dir, telemetry, monkeypatch):
+        config = _config(state_dir)
+        config.http_receiver_port = 0
+        tracker = Mock()
+        monkeypatch.setattr(http_receiver, "_token_tracker", tracker)
+        try:
+            assert http_receiver.start_http_receiver(config, telemetry) is not None
+            event = {"type": "api_intercept", "tool": "t", "model": "m", "id": "e1"}
+            assert reporter.send([event, event], str(state_dir / "ingest.sock"))
+        finally:
+            # Events sent before shutdown are still recorded
+            http_receiver.stop_http_receiver()
+        # Same queue and dedup index as the HTTP endpoints
+        assert tracker.record_api_intercept.call_count == 1
+        assert not (state_dir / "ingest.sock").exists()
+
+
+class TestReporter:
+    def test_main_sends_command_line(self, receiver, telemetry):
+        args = ["--shell", "zsh", "--socket", str(receiver.path), "--", "claude", "-p", "hi"]
+        assert reporter.main(args) == 0
+        _wait_for(lambda: telemetry.cli_command_count.add.called)
+        assert telemetry.cli_command_count.add.call_args.args[1]["cli.name"] == "claude-code"
+
+    def test_main_sends_raw_event(self, receiver, tracker):
+        event = '{"type": "api_intercept", "tool": "t", "model": "m", "output_tokens": 3}'
+        assert reporter.main(["--socket", str(receiver.path), "--event", event]) == 0
+        _wait_for(lambda: tracker.record_api_intercept.called)
+
+    def test_never_fails_without_agent(self, state_dir):
+        missing = str(state_dir / "nobody.sock")
+        assert reporter.send([reporter.command_event("claude")], missing) is False
+        assert reporter.main(["--socket", missing, "claude"]) == 0
+        assert reporter.main(["--socket", missing, "--event", "not json"]) == 0
+        assert reporter.main(["--shell"]) == 0
+        assert reporter.main([]) == 0
+
+    def test_default_socket_in_state_dir(self, monkeypatch):
+        monkeypatch.delenv(reporter.SOCKET_ENV, raising=False)
+        if os.name != "nt":
+            assert Path(reporter.default_socket_path()) == _default_state_dir() / "ingest.sock"
+        monkeypatch.setenv(reporter.SOCKET_ENV, "/tmp/other.sock")
+        assert reporter.default_socket_path() == "/tmp/other.sock"
+
+    def test_send_is_fast(self, receiver):
+        """One event costs a connect and a write, well under a millisecond locally."""
+        events = [reporter.command_event("ls")]
+        timings = []
+        for _ in range(50):
+            start = time.perf_counter()
+            assert reporter.send(events, str(receiver.path))
+            timings.append(time.perf_counter() - start)
+        # Generous bound so a loaded CI machine does not flake
+        assert statistics.median(timings) < 0.005
+
+
+def test_shell_history_skips_hooked_shells(tmp_path):
+    config = _config(tmp_path)
+    config.shell_hooks = ["zsh"]
+    telemetry = Mock()
+    zsh, bash = tmp_path / ".zsh_history", tmp_path / ".bash_history"
+    zsh.write_text("claude -p hi\n", encoding="utf-8")
+    bash.write_text("ollama run llama3\n", encoding="utf-8")
+    parser = ShellHistoryParser(config, telemetry)
+    parser._get_history_files = lambda: [(str(zsh), "zsh"), (str(bash), "bash")]
+
+    parser.scan()
+
+    telemetry.cli_command_count.add.assert_called_once_with(
+        1, {"cli.name": "ollama", "cli.category": "local"}
+    )
+    # The hooked shell's history is still consumed, so removing the hook later does not recount
+    config.shell_hooks = []
+    ShellHistoryParser(config, telemetry).scan()
+    assert telemetry.cli_command_count.add.call_count == 1
@@ -0,0 +1,229 @@
+"""Tests for gzip and NDJSON request bodies on the ingest endpoints."""
+
+from __future__ import annotations
+
+import gzip
+import http.client
+import json
+import socket
+import threading
+from unittest.mock import Mock
+
+import pytest
+from loguru import logger
+
+from ai_cost_observer.config import AppConfig
+from ai_cost_observer.server.async_receiver import AsyncReceiver
+from ai_cost_observer.server.http_receiver import create_app
+from ai_cost_observer.server.ingest import (
+    MAX_EVENTS_PER_REQUEST,
+    MAX_PAYLOAD_BYTES,
+    IngestHandler,
+    _lines,
+)
+
+NDJSON = {"Content-Type": "application/x-ndjson"}
+
+
+def _config():
+    return AppConfig(
+        ai_domains=[{"domain": "chat.example.ai", "category": "chat", "cost_per_hour": 3.6}],
+    )
+
+
+def _intercept(i=0, text=""):
+    return {
+        "type": "api_intercept",
+        "tool": "web",
+        "model": "m",
+        "input_tokens": i,
+        "prompt_text": text,
+    }
+
+
+def _ndjson(events) -> bytes:
+    return b"".join(json.dumps(e).encode() + b"\n" for e in events)
+
+
+@pytest.fixture
+def quiet():
+    """Silence per-event debug logs in the high-volume tests."""
+    logger.disable("ai_cost_observer")
+    yield
+    logger.enable("ai_cost_observer")
+
+
+@pytest.fixture
+def tracker():
+    return Mock()
+
+
+@pytest.fixture
+def handler(tracker):
+    return IngestHandler(_config(), Mock(), lambda: tracker)
+
+
+@pytest.fixture
+def receiver(handler):
+    receiver = AsyncReceiver(handler, port=0, workers=2)
+    receiver.start()
+    yield receiver
+    receiver.stop()
+
+
+def _send_chunked(port, path, chunks, headers) -> tuple[int, dict, socket.socket]:
+    sock = socket.create_connection(("127.0.0.1", port))
+    head = f"POST {path} HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n"
+    head += "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+    sock.sendall(head.encode() + b"\r\n")
+    for chunk in chunks:
+        sock.sendall(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+    sock.sendall(b"0\r\n\r\n")
+    resp = http.client.HTTPResponse(sock)
+    resp.begin()
+    return resp.status, json.loads(resp.read()), sock
+
+
+class TestLines:
+    def test_lines_split_across_chunks(self):
+        assert list(_lines([b'{"a"', b":1}\n{", b'"b":2}\n\n{"c":3}'])) == [
+            b'{"a":1}',
+            b'{"b":2}',
+            b"",
+            b'{"c":3}',
+        ]
+
+
+class TestHandlerPost:
+    def test_gzip_json_document(self, handler, tracker):
+        body = gzip.compress(json.dumps({"events": [_intercept(5)]}).encode())
+        status, result = handler.post("/api/tokens", [body[:10], body[10:]], "", "gzip")
+        assert (status, result) == (200, {"status": "ok", "processed": 1})
+        assert tracker.record_api_intercept.call_args.kwargs["input_tokens"] == 5
+
+    def test_gzip_bomb_rejected(self, handler):
+        body = gzip.compress(b" " * (MAX_PAYLOAD_BYTES + 1))
+        assert handler.post("/api/tokens", [body], "", "gzip")[0] == 413
+
+    def test_invalid_gzip_and_unknown_coding(self, handler):
+        assert handler.post("/api/tokens", [b"not gzip"], "", "gzip")[0] == 400
+        assert handler.post("/api/tokens", [b"{}"], "", "br")[0] == 415
+
+    def test_ndjson_reports_bad_lines(self, handler, tracker):
+        body = _ndjson([_intercept(1)]) + b"not json\n[1]\n\n" + _ndjson([{"type": "other"}])
+        status, result = handler.post("/api/tokens", [body], "application/x-ndjson")
+        assert status == 200
+        assert result["processed"] == 1
+        assert result["received"] == 4
+        assert result["errors"] == [
+            {"line": 2, "error": "Invalid JSON"},
+            {"line": 3, "error": "Event must be a JSON object"},
+        ]
+        assert result["error_count"] == 2
+        assert tracker.record_api_intercept.call_count == 1
+
+    def test_ndjson_all_invalid_is_400(self, handler):
+        status, result = handler.post("/api/tokens", [b"x\ny\n"], "application/ndjson")
+        assert status == 400
+        assert result["error_count"] == 2
+
+    def test_ndjson_backlog_beyond_document_limits(self, handler, tracker, quiet):
+        events = [_intercept(i, "p" * 2000) for i in range(MAX_EVENTS_PER_REQUEST * 6)]
+        body = gzip.compress(_ndjson(events))
+        assert len(_ndjson(events)) > MAX_PAYLOAD_BYTES
+        chunks = [body[i : i + 4096] for i in range(0, len(body), 4096)]
+        status, result = handler.post("/api/tokens", chunks, "application/x-ndjson", "gzip")
+        assert status == 200
+        assert result["processed"] == len(events)
+        assert tracker.record_api_intercept.call_count == len(events)
+        # One prompt flush per group of MAX_EVENTS_PER_REQUEST
+        assert tracker.flush_prompts.call_count == 6
+
+    def test_ndjson_overlong_line_stops_stream(self, handler, tracker, quiet):
+        body = _ndjson([_intercept()] * MAX_EVENTS_PER_REQUEST) + b"x" * (MAX_PAYLOAD_BYTES + 1)
+        status, result = handler.post("/api/tokens", [body], "application/x-ndjson")
+        assert status == 413
+        assert result["consumed"] == MAX_EVENTS_PER_REQUEST
+        assert tracker.record_api_intercept.call_count == MAX_EVENTS_PER_REQUEST
+
+    def test_record_failure_mid_stream_reports_consumed(self, handler, tracker, quiet):
+        calls = iter(range(MAX_EVENTS_PER_REQUEST * 3))
+
+        def record(**_):
+            if next(calls) == MAX_EVENTS_PER_REQUEST:
+                raise RuntimeError("store down")
+
+        tracker.record_api_intercept.side_effect = record
+        body = _ndjson([_intercept()] * (MAX_EVENTS_PER_REQUEST * 2 + 1))
+        status, result = handler.post("/api/tokens", [body], "application/x-ndjson")
+        assert status == 500
+        assert result["processed"] == MAX_EVENTS_PER_REQUEST
+        assert result["consumed"] == MAX_EVENTS_PER_REQUEST
+        assert result["error"] == "Failed to record events"
+
+    def test_queue_full_mid_stream_reports_consumed(self, tracker, quiet):
+        release = threading.Event()
+        tracker.record_api_intercept.side_effect = lambda **_: release.wait(5)
+        handler = IngestHandler(
+            _config(), Mock(), lambda: tracker, queue_size=MAX_EVENTS_PER_REQUEST
+        )
+        body = _ndjson([_intercept()] * (MAX_EVENTS_PER_REQUEST * 2))
+        status, result = handler.post("/api/tokens", [body], "application/x-ndjson")
+        assert status == 503
+        assert result["queued"] == MAX_EVENTS_PER_REQUEST
+        assert result["consumed"] == MAX_EVENTS_PER_REQUEST
+        assert result["retry_after"] > 0
+        release.set()
+        handler.close()
+
+
+class TestFrontEnds:
+    def test_flask_accepts_gzip_ndjson(self, tracker, monkeypatch):
+        monkeypatch.setattr("ai_cost_observer.server.http_receiver._token_tracker", tracker)
+        app = create_app(_config(), Mock())
+        body = gzip.compress(_ndjson([_intercept(1), _intercept(2)]))
+        resp = app.test_client().post(
+            "/api/tokens", data=body, headers={**NDJSON, "Content-Encoding": "gzip"}
+        )
+        assert resp.status_code == 200
+        assert resp.get_json()["processed"] == 2
+        assert tracker.record_api_intercept.call_count == 2
+
+    def test_async_large_ndjson_with_content_length(self, receiver, tracker, quiet):
+        events = [_intercept(i, "p" * 4000) for i in range(300)]
+        body = _ndjson(events)
+        assert len(body) > MAX_PAYLOAD_BYTES
+        conn = http.client.HTTPConnection("127.0.0.1", receiver.port)
+        conn.request("POST", "/api/tokens", body=body, headers=NDJSON)
+        resp = conn.getresponse()
+        assert resp.status == 200
+        assert json.loads(resp.read())["processed"] == 300
+        assert tracker.record_api_intercept.call_count == 300
+        conn.close()
+
+    def test_async_chunked_gzip_ndjson_keeps_connection(self, receiver, tracker, quiet):
+        body = gzip.compress(_ndjson([_intercept(i) for i in range(250)]))
+        chunks = [body[i : i + 100] for i in range(0, len(body), 100)]
+        headers = {**NDJSON, "Content-Encoding": "gzip"}
+        status, result, sock = _send_chunked(receiver.port, "/api/tokens", chunks, headers)
+        with sock:
+            assert (status, result["processed"]) == (200, 250)
+            sock.sendall(b"GET /health HTTP/1.1\r\nHost: x\r\n\r\n")
+            resp = http.client.HTTPResponse(sock)
+            resp.begin()
+            assert resp.status == 200
+
+    def test_async_chunked_json_document(self, receiver):
+        body = json.dumps(
+            {"events": [{"domain": "chat.example.ai", "duration_seconds": 5}]}
+        ).encode()
+        status, result, sock = _send_chunked(
+            receiver.port, "/metrics/browser", [body[:7], body[7:]], {}
+        )
+        sock.close()
+        assert (status, result) == (200, {"status": "ok", "processed": 1})
+
+    def test_async_unsupported_transfer_encoding(self, receiver):
+        with socket.create_connection(("127.0.0.1", receiver.port)) as sock:
+            sock.sendall(b"POST /api/tokens HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: gzip\r\n\r\n")
+            assert sock.recv(1024).startswith(b"HTTP/1.1 501 ")
@@ -18,7 +18,7 @@ class TestTelemetryInstruments:
     def test_telemetry_creates_all_instruments(
         self, mock_resource, mock_reader_cls, mock_provider_cls, mock_metrics
     ):
-        """Verify all 16 metric instruments are created."""
+        """Verify all 21 metric instruments are created."""
         from ai_cost_observer.telemetry import TelemetryManager
 
         mock_exporter = MagicMock()
@@ -48,10 +48,18 @@ class TestTelemetryInstruments:
         assert tm.tokens_output_total is not None
         assert tm.tokens_cost_usd_total is not None
         assert tm.prompt_count_total is not None
+        assert tm.prompt_queue_depth is not None
+        assert tm.prompt_queue_overflow is not None
+        assert tm.prompt_queue_failed is not None
+        assert tm.ingest_queue_depth is not None
+        assert tm.ingest_queue_dropped is not None
 
         # Verify meter was called to create instruments
         # Bug H1: app_running and cli_running are now ObservableGauges
-        assert mock_meter.create_observable_gauge.call_count == 2
+        # + prompt and ingest queue depth
+        assert mock_meter.create_observable_gauge.call_count == 4
+        # prompt queue overflow and failures, ingest queue dropped
+        assert mock_meter.create_observable_counter.call_count == 3
         assert mock_meter.create_counter.call_count == 12
         assert mock_meter.create_gauge.call_count == 2  # cpu, memory (Bug C3: was Histogram)
 
@@ -239,6 +247,48 @@ class TestTelemetryInstruments:
         assert "ai.app.running" not in udc_names, "ai.app.running should NOT be an UpDownCounter"
         assert "ai.cli.running" not in udc_names, "ai.cli.running should NOT be an UpDownCounter"
 
+    @patch("ai_cost_observer.telemetry.metrics")
+    @patch("ai_cost_observer.telemetry.MeterProvider")
+    @patch("ai_cost_observer.telemetry.PeriodicExportingMetricReader")
+    @patch("ai_cost_observer.telemetry.Resource")
+    def test_prompt_queue_observations(
+        self, mock_resource, mock_reader_cls, mock_provider_cls, mock_metrics
+    ):
+        """Prompt queue instruments report nothing until a PromptDB is watched."""
+        from ai_cost_observer.telemetry import TelemetryManager
+
+        mock_provider_cls.return_value.get_meter.return_value = MagicMock()
+        tm = TelemetryManager(AppConfig(), exporter=MagicMock())
+
+        assert list(tm._observe_prompt_queue_depth(None)) == []
+        assert list(tm._observe_prompt_queue_overflow(None)) == []
+        assert list(tm._observe_prompt_queue_failed(None)) == []
+
+        tm.watch_prompt_queue(lambda: {"depth": 7, "overflows": 2, "failed": 1})
+        assert [o.value for o in tm._observe_prompt_queue_depth(None)] == [7]
+        assert [o.value for o in tm._observe_prompt_queue_overflow(None)] == [2]
+        assert [o.value for o in tm._observe_prompt_queue_failed(None)] == [1]
+
+    @patch("ai_cost_observer.telemetry.metrics")
+    @patch("ai_cost_observer.telemetry.MeterProvider")
+    @patch("ai_cost_observer.telemetry.PeriodicExportingMetricReader")
+    @patch("ai_cost_observer.telemetry.Resource")
+    def test_ingest_queue_observations(
+        self, mock_resource, mock_reader_cls, mock_provider_cls, mock_metrics
+    ):
+        """Ingest queue instruments report nothing until the HTTP receiver registers."""
+        from ai_cost_observer.telemetry import TelemetryManager
+
+        mock_provider_cls.return_value.get_meter.return_value = MagicMock()
+        tm = TelemetryManager(AppConfig(), exporter=MagicMock())
+
+        assert list(tm._observe_ingest_queue_depth(None)) == []
+        assert list(tm._observe_ingest_queue_dropped(None)) == []
+
+        tm.watch_ingest_queue(lambda: {"depth": 40, "dropped": 3})
+        assert [o.value for o in tm._observe_ingest_queue_depth(None)] == [40]
+        assert [o.value for o in tm._observe_ingest_queue_dropped(None)] == [3]
+
     @patch.dict("os.environ", {"OTEL_EXPORTER_OTLP_PROTOCOL": "http/json"})
     def test_telemetry_http_exporter_selection(self):
         """Verify HTTP exporter is used when protocol=http/json."""
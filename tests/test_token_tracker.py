@@ -5,6 +5,7 @@ import sqlite3
 from unittest.mock import MagicMock
 
 from ai_cost_observer.config import AppConfig
+from ai_cost_observer.detectors import token_tracker
 from ai_cost_observer.detectors.token_tracker import TokenTracker, estimate_cost
 
 
@@ -336,7 +337,7 @@ class TestTokenTrackerOffsetPersistence:
         telemetry.tokens_input_total.add.assert_not_called()
 
     def test_offsets_state_file_created(self, tmp_path):
-        """Scanning creates a state file in state_dir."""
+        """Scanning persists file offsets to the checkpoint store in state_dir."""
         project_dir = tmp_path / ".claude" / "projects" / "test-project"
         project_dir.mkdir(parents=True)
         state_dir = tmp_path / "state"
@@ -369,10 +370,15 @@ class TestTokenTrackerOffsetPersistence:
         ):
             tracker.scan()
 
-        state_file = state_dir / "token_tracker_state.json"
-        assert state_file.exists()
-        data = json.loads(state_file.read_text())
-        assert "file_offsets" in data
+        state_db = state_dir / "checkpoints.db"
+        assert state_db.exists()
+        conn = sqlite3.connect(str(state_db))
+        rows = conn.execute(
+            "SELECT path, offset FROM file_checkpoints WHERE namespace = 'token_tracker'"
+        ).fetchall()
+        conn.close()
+        assert rows == [(str(jsonl_file), jsonl_file.stat().st_size)]
+        assert not (state_dir / "token_tracker_state.json").exists()
 
     def test_new_data_after_restart_is_processed(self, tmp_path):
         """After restart, new data appended to JSONL is still processed."""
@@ -630,3 +636,202 @@ class TestCodexScannerIncremental:
 
         # Should NOT re-process
         telemetry.tokens_input_total.add.assert_not_called()
+
+
+class TestTokenTrackerBulkWrites:
+    def test_scan_flushes_prompts_once(self, tmp_path):
+        """All usage entries found in a scan are written with one bulk insert."""
+        project_dir = tmp_path / ".claude" / "projects" / "test-project"
+        project_dir.mkdir(parents=True)
+        entries = [
+            {
+                "role": "assistant",
+                "model": "claude-sonnet-4-5",
+                "usage": {"input_tokens": 100 + i, "output_tokens": 50},
+                "content": [{"type": "text", "text": f"answer {i}"}],
+            }
+            for i in range(3)
+        ]
+        (project_dir / "session-bulk.jsonl").write_text(
+            "\n".join(json.dumps(e) for e in entries) + "\n"
+        )
+
+        config = AppConfig()
+        config.token_tracking = {}
+        config.state_dir = tmp_path / "state"
+        prompt_db = MagicMock()
+        tracker = TokenTracker(config, MagicMock(), prompt_db=prompt_db)
+
+        import unittest.mock
+
+        with unittest.mock.patch(
+            "ai_cost_observer.detectors.token_tracker.Path.home", return_value=tmp_path
+        ):
+            tracker.scan()
+
+        prompt_db.insert_prompt.assert_not_called()
+        prompt_db.insert_prompts_bulk.assert_called_once()
+        records = prompt_db.insert_prompts_bulk.call_args[0][0]
+        assert [r["input_tokens"] for r in records] == [100, 101, 102]
+        assert records[0]["response_text"] == "answer 0"
+        assert records[0]["project_path"] == "test-project"
+        assert {r["session_id"] for r in records} == {"session-bulk"}
+
+    def test_api_intercepts_are_buffered_until_flush(self):
+        config = AppConfig()
+        config.token_tracking = {}
+        prompt_db = MagicMock()
+        tracker = TokenTracker(config, MagicMock(), prompt_db=prompt_db)
+
+        for _ in range(3):
+            tracker.record_api_intercept("claude-web", "claude-sonnet-4-5", 10, 5, "hi", "yo")
+        prompt_db.insert_prompts_bulk.assert_not_called()
+
+        prompt_db.insert_prompts_bulk.return_value = 3
+        assert tracker.flush_prompts() == 3
+        prompt_db.insert_prompts_bulk.assert_called_once()
+        assert len(prompt_db.insert_prompts_bulk.call_args[0][0]) == 3
+
+        # Nothing left to flush
+        assert tracker.flush_prompts() == 0
+
+    def test_failed_flush_requeues_batch_once(self):
+        config = AppConfig()
+        config.token_tracking = {}
+        prompt_db = MagicMock()
+        tracker = TokenTracker(config, MagicMock(), prompt_db=prompt_db)
+        tracker.record_api_intercept("claude-web", "claude-sonnet-4-5", 10, 5, "first", "a")
+
+        prompt_db.insert_prompts_bulk.side_effect = sqlite3.OperationalError("disk I/O error")
+        assert tracker.flush_prompts() == 0
+        tracker.record_api_intercept("claude-web", "claude-sonnet-4-5", 20, 5, "second", "b")
+        assert tracker.flush_prompts() == 0
+        batch = prompt_db.insert_prompts_bulk.call_args[0][0]
+        assert [r["prompt_text"] for r in batch] == ["first", "second"]
+
+        # "first" failed twice and is dropped; "second" gets its retry
+        prompt_db.insert_prompts_bulk.side_effect = None
+        prompt_db.insert_prompts_bulk.return_value = 1
+        assert tracker.flush_prompts() == 1
+        batch = prompt_db.insert_prompts_bulk.call_args[0][0]
+        assert [r["prompt_text"] for r in batch] == ["second"]
+        assert tracker.flush_prompts() == 0
+
+    def test_failed_flush_keeps_buffer_bounded(self, monkeypatch):
+        monkeypatch.setattr(token_tracker, "_MAX_PENDING_PROMPTS", 3)
+        config = AppConfig()
+        config.token_tracking = {}
+        prompt_db = MagicMock()
+        tracker = TokenTracker(config, MagicMock(), prompt_db=prompt_db)
+
+        def failing_insert(records, parallel):
+            # Records keep arriving while the write is in progress
+            for i in range(2):
+                tracker.record_api_intercept("claude-web", "m", 1, 1, f"new {i}", "a")
+            raise RuntimeError("boom")
+
+        prompt_db.insert_prompts_bulk.side_effect = failing_insert
+        for i in range(2):
+            tracker.record_api_intercept("claude-web", "m", 1, 1, f"old {i}", "a")
+        tracker.flush_prompts()
+        # The failed batch goes back in front; the oldest record makes room
+        assert [r["prompt_text"] for r in tracker._pending_prompts] == ["old 1", "new 0", "new 1"]
+
+    def test_flush_with_real_db(self, tmp_path):
+        from ai_cost_observer.storage.prompt_db import PromptDB
+
+        config = AppConfig()
+        config.token_tracking = {}
+        db = PromptDB(db_path=tmp_path / "prompts.db", encrypt=False)
+        tracker = TokenTracker(config, MagicMock(), prompt_db=db)
+        tracker.record_api_intercept("chatgpt-web", "gpt-4o", 1000, 500, "q", "a")
+        tracker.flush_prompts()
+
+        rows = db.get_prompts()
+        assert len(rows) == 1
+        assert rows[0]["source"] == "browser"
+        assert rows[0]["estimated_cost_usd"] == estimate_cost("gpt-4o", 1000, 500)
+
+
+class TestCodexReader:
+    def _age(self, path, seconds=60):
+        """Backdate mtime so the stat signature is trusted for skipping."""
+        import os
+        import time
+
+        old = time.time() - seconds
+        os.utime(path, (old, old))
+
+    def _traced_reader(self, codex_db):
+        from ai_cost_observer.detectors.token_tracker import _CodexReader
+
+        reader = _CodexReader(codex_db)
+        statements: list[str] = []
+        reader.read_new(0)
+        reader._conn.set_trace_callback(statements.append)
+        return reader, statements
+
+    def test_unchanged_db_skips_sql(self, tmp_path):
+        codex_db = tmp_path / "codex-dev.db"
+        _create_codex_db(codex_db, [("sess-1", "o3-mini", 500, 200)])
+        self._age(codex_db)
+
+        reader, statements = self._traced_reader(codex_db)
+        assert reader.read_new(1) == []
+        assert statements == []
+
+    def test_schema_cached_between_reads(self, tmp_path):
+        codex_db = tmp_path / "codex-dev.db"
+        _create_codex_db(codex_db, [("sess-1", "o3-mini", 500, 200)])
+
+        reader, statements = self._traced_reader(codex_db)
+        conn = sqlite3.connect(str(codex_db))
+        conn.execute("INSERT INTO sessions VALUES ('sess-2', 'gpt-4o', 300, 150)")
+        conn.commit()
+        conn.close()
+
+        rows = reader.read_new(1)
+        assert [r["id"] for r in rows] == ["sess-2"]
+        assert not any("sqlite_master" in s or "table_info" in s for s in statements)
+
+    def test_schema_change_is_detected(self, tmp_path):
+        codex_db = tmp_path / "codex-dev.db"
+        codex_db.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(codex_db))
+        conn.execute("CREATE TABLE sessions (id TEXT, model TEXT)")
+        conn.commit()
+
+        from ai_cost_observer.detectors.token_tracker import _CodexReader
+
+        reader = _CodexReader(codex_db)
+        assert reader.read_new(0) == []
+
+        conn.execute("ALTER TABLE sessions ADD COLUMN input_tokens INTEGER")
+        conn.execute("INSERT INTO sessions VALUES ('s', 'o3', 42)")
+        conn.commit()
+        conn.close()
+
+        rows = reader.read_new(0)
+        assert len(rows) == 1
+        assert "input_tokens" in reader.columns
+
+    def test_replaced_file_is_reopened(self, tmp_path):
+        codex_db = tmp_path / "codex-dev.db"
+        _create_codex_db(codex_db, [("sess-1", "o3-mini", 500, 200)])
+        self._age(codex_db)
+
+        from ai_cost_observer.detectors.token_tracker import _CodexReader
+
+        reader = _CodexReader(codex_db)
+        assert len(reader.read_new(0)) == 1
+        old_conn = reader._conn
+
+        replacement = tmp_path / "new.db"
+        _create_codex_db(replacement, [("a", "o3", 1, 1), ("b", "o3", 2, 2)])
+        replacement.replace(codex_db)
+        self._age(codex_db)
+
+        rows = reader.read_new(1)
+        assert reader._conn is not old_conn
+        assert [r["id"] for r in rows] == ["b"]
+        reader.close()
@@ -0,0 +1,216 @@
+"""Tests for the in-memory usage aggregate and the /api/usage query endpoints."""
+
+from __future__ import annotations
+
+import http.client
+import json
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from opentelemetry.sdk.metrics.export import MetricExporter, MetricExportResult
+
+from ai_cost_observer.config import AppConfig
+from ai_cost_observer.detectors.token_tracker import TokenTracker
+from ai_cost_observer.server.async_receiver import AsyncReceiver
+from ai_cost_observer.server.http_receiver import create_app
+from ai_cost_observer.server.ingest import IngestHandler
+from ai_cost_observer.server.usage import UsageFeed, UsageRollup, window_start
+from ai_cost_observer.storage.prompt_db import PromptDB
+from ai_cost_observer.storage.usage_aggregate import UsageAggregate
+from ai_cost_observer.telemetry import TelemetryManager
+
+HOUR = 3600
+
+
+class _NullExporter(MetricExporter):
+    def export(self, metrics_data, timeout_millis=10_000, **kwargs):
+        return MetricExportResult.SUCCESS
+
+    def force_flush(self, timeout_millis=10_000):
+        return True
+
+    def shutdown(self, timeout_millis=30_000, **kwargs):
+        pass
+
+
+@pytest.fixture
+def telemetry(tmp_path):
+    tm = TelemetryManager(AppConfig(state_dir=tmp_path), exporter=_NullExporter())
+    yield tm
+    tm.shutdown()
+
+
+@pytest.fixture
+def receiver(telemetry, tmp_path):
+    handler = IngestHandler(AppConfig(state_dir=tmp_path), telemetry)
+    receiver = AsyncReceiver(handler, port=0, usage=UsageFeed(UsageRollup(telemetry)))
+    receiver.start()
+    yield receiver
+    receiver.stop()
+
+
+def _get(port, path):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    conn.request("GET", path)
+    resp = conn.getresponse()
+    body = json.loads(resp.read())
+    conn.close()
+    return resp.status, body, resp
+
+
+class TestUsageAggregate:
+    def test_windows_sum_hourly_buckets(self):
+        usage = UsageAggregate(days=7)
+        now = time.time()
+        usage.add_tokens("claude-code", "opus", "cli", 100, 10, 1.5)
+        usage.add_tokens("claude-code", "haiku", "cli", 50, 5, 0.1, at=now - 2 * HOUR)
+        usage.add_tokens("chatgpt", "gpt-4o", "browser", 20, 2, 0.2, at=now - 3 * 86400)
+        usage.add_cost("apps", "ChatGPT", 0.3)
+        usage.add_cost("browser", "claude.ai", 0.05, at=now - 2 * HOUR)
+
+        recent = usage.usage(now - 3 * HOUR)
+        assert recent["totals"] == {
+            "input_tokens": 150,
+            "output_tokens": 15,
+            "cost_usd": 1.95,
+            "prompts": 2,
+        }
+        assert recent["cost_usd"] == {"tokens": 1.6, "apps": 0.3, "browser": 0.05, "cli": 0.0}
+        assert recent["tools"] == {
+            "claude-code": {
+                "input_tokens": 150,
+                "output_tokens": 15,
+                "cost_usd": 1.6,
+                "prompts": 2,
+            }
+        }
+        assert recent["estimated_cost_usd"]["apps"] == {"ChatGPT": 0.3}
+        assert usage.usage(now - 7 * 86400)["totals"]["input_tokens"] == 170
+
+        models = usage.by_model(now - 7 * 86400)["models"]
+        assert [(m["tool"], m["model"]) for m in models] == [
+            ("claude-code", "opus"),
+            ("chatgpt", "gpt-4o"),
+            ("claude-code", "haiku"),
+        ]
+        assert models[0]["cost_usd"] == 1.5
+
+    def test_old_buckets_dropped(self):
+        usage = UsageAggregate(days=1)
+        now = time.time()
+        usage.add_tokens("t", "m", "cli", 1, 0, 0.0, at=now - 3 * 86400)
+        usage.add_tokens("t", "m", "cli", 2, 0, 0.0, at=now - 2 * 86400)
+        usage.add_tokens("t", "m", "cli", 4, 0, 0.0)
+        usage.add_tokens("t", "m", "cli", 8, 0, 0.0, at=now - 2 * 86400)  # too old: ignored
+        assert usage.usage(0)["totals"]["input_tokens"] == 4
+        assert len(usage._tokens) == 1
+
+    def test_warm_from_prompt_db(self, tmp_path):
+        db = PromptDB(db_path=tmp_path / "prompts.db", encrypt=False)
+        now = datetime.now(timezone.utc)
+        records = [
+            {
+                "timestamp": (now - timedelta(days=days)).isoformat(),
+                "tool_name": "claude-code",
+                "source": "cli",
+                "model_name": "opus",
+                "input_tokens": tokens,
+                "output_tokens": 1,
+                "estimated_cost_usd": 0.5,
+            }
+            for days, tokens in ((0, 10), (1, 20), (1, 40), (30, 1000))
+        ]
+        db.insert_prompts_bulk(records)
+
+        usage = UsageAggregate(days=7)
+        assert usage.warm(db) == 2
+        week = usage.usage(time.time() - 7 * 86400)
+        assert week["totals"] == {
+            "input_tokens": 70,
+            "output_tokens": 3,
+            "cost_usd": 1.5,
+            "prompts": 3,
+        }
+        # Token usage reaches back a week; estimated costs only to startup
+        assert week["since"] < week["estimated_since"] == usage.estimated_since
+        db.close()
+
+    def test_token_tracker_updates_aggregate(self, telemetry, tmp_path):
+        tracker = TokenTracker(AppConfig(state_dir=tmp_path), telemetry)
+        tracker.record_api_intercept("chatgpt", "gpt-4o", 1000, 100)
+        tools = telemetry.usage.usage(time.time() - HOUR)["tools"]
+        assert tools["chatgpt"]["input_tokens"] == 1000
+        assert tools["chatgpt"]["prompts"] == 1
+        tracker.close()
+
+    def test_query_takes_microseconds(self):
+        usage = UsageAggregate(days=7)
+        now = time.time()
+        for hour in range(7 * 24):
+            for model in ("opus", "sonnet", "haiku"):
+                usage.add_tokens("claude-code", model, "cli", 10, 1, 0.01, at=now - hour * HOUR)
+        since = window_start("today", now, 7)
+        timings = []
+        for _ in range(200):
+            start = time.perf_counter()
+            usage.usage(since)
+            timings.append(time.perf_counter() - start)
+        # Generous bound so a loaded CI machine does not flake
+        assert statistics.median(timings) < 0.001
+
+
+class TestWindows:
+    def test_window_start(self):
+        now = time.time()
+        midnight = datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0)
+        assert window_start("today", now, 7) == midnight.timestamp()
+        assert window_start("6h", now, 7) == now - 6 * HOUR
+        assert window_start("7d", now, 7) == now - 7 * 86400
+        for invalid in ("8d", "0h", "week", "-1d", ""):
+            with pytest.raises(ValueError):
+                window_start(invalid, now, 7)
+
+
+class TestQueryEndpoints:
+    def test_usage_endpoints(self, receiver, telemetry):
+        telemetry.usage.add_tokens("claude-code", "opus", "cli", 30, 3, 0.3)
+        telemetry.set_running_cli({"claude-code": {}})
+
+        status, body, resp = _get(receiver.port, "/api/usage")
+        assert status == 200
+        assert resp.getheader("Cache-Control") == "no-store"
+        assert body["window"] == "today"
+        assert body["totals"]["input_tokens"] == 30
+
+        status, body, _ = _get(receiver.port, "/api/usage/by-model?window=24h")
+        assert status == 200
+        assert body["models"][0]["model"] == "opus"
+
+        status, body, _ = _get(receiver.port, "/api/running")
+        assert (status, body) == (200, {"apps": [], "cli": ["claude-code"]})
+
+        status, body, _ = _get(receiver.port, "/api/usage?window=365d")
+        assert status == 400
+        assert "7 days" in body["error"]
+
+    def test_flask_app_matches(self, receiver, telemetry, tmp_path):
+        telemetry.usage.add_cost("browser", "claude.ai", 0.2)
+        client = create_app(
+            AppConfig(state_dir=tmp_path), telemetry, usage=UsageFeed(UsageRollup(telemetry))
+        ).test_client()
+        for path in (
+            "/api/usage?window=2h",
+            "/api/usage/by-model",
+            "/api/running",
+            "/api/usage?window=x",
+        ):
+            flask = client.get(path)
+            status, body, _ = _get(receiver.port, path)
+            assert flask.status_code == status
+            flask_body = flask.get_json()
+            # "until" is the time of each request
+            flask_body.pop("until", None)
+            body.pop("until", None)
+            assert flask_body == body
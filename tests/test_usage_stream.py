@@ -0,0 +1,282 @@
+"""Tests for the live usage rollup and its Server-Sent Events stream."""
+
+from __future__ import annotations
+
+import http.client
+import json
+import threading
+import time
+from unittest.mock import Mock
+
+import pytest
+from opentelemetry.sdk.metrics.export import MetricExporter, MetricExportResult
+
+from ai_cost_observer.config import AppConfig
+from ai_cost_observer.server.async_receiver import AsyncReceiver
+from ai_cost_observer.server.http_receiver import create_app
+from ai_cost_observer.server.ingest import IngestHandler
+from ai_cost_observer.server.usage import (
+    USAGE_STREAM_PATH,
+    UsageFeed,
+    UsageRollup,
+    usage_delta,
+    usage_query,
+)
+from ai_cost_observer.telemetry import TelemetryManager
+
+
+class _NullExporter(MetricExporter):
+    def export(self, metrics_data, timeout_millis=10_000, **kwargs):
+        return MetricExportResult.SUCCESS
+
+    def force_flush(self, timeout_millis=10_000):
+        return True
+
+    def shutdown(self, timeout_millis=30_000, **kwargs):
+        pass
+
+
+@pytest.fixture
+def telemetry():
+    tm = TelemetryManager(AppConfig(), exporter=_NullExporter())
+    yield tm
+    tm.shutdown()
+
+
+@pytest.fixture
+def feed(telemetry):
+    return UsageFeed(UsageRollup(telemetry), interval=0.02)
+
+
+@pytest.fixture
+def receiver(telemetry, feed):
+    receiver = AsyncReceiver(IngestHandler(AppConfig(), telemetry), port=0, usage=feed)
+    receiver.start()
+    yield receiver
+    receiver.stop()
+
+
+def _record_tokens(telemetry, tool, model, input_tokens, output_tokens, cost):
+    telemetry.usage.add_tokens(tool, model, "cli", input_tokens, output_tokens, cost)
+
+
+def _read_event(stream) -> tuple[str | None, dict | None]:
+    """Read one event (or keep-alive comment) from an event stream."""
+    event = data = None
+    while (line := stream.readline()) not in (b"\n", b""):
+        field, _, value = line.decode("utf-8").rstrip("\n").partition(": ")
+        if field == "event":
+            event = value
+        elif field == "data":
+            data = json.loads(value)
+    return event, data
+
+
+def _apply(state: dict, delta: dict) -> None:
+    """Apply a delta as a client does: add numbers, replace everything else."""
+    for key, value in delta.items():
+        if isinstance(value, dict):
+            _apply(state.setdefault(key, {}), value)
+        elif isinstance(value, (int, float)):
+            state[key] = round(state.get(key, 0) + value, 6)
+        else:
+            state[key] = value
+
+
+def _follow(stream, state: dict, condition) -> dict:
+    """Apply usage events from the stream until `condition(state)` holds."""
+    while not condition(state):
+        event, data = _read_event(stream)
+        assert event == "usage"
+        _apply(state, data)
+    return state
+
+
+def _subscribe(port):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    conn.request("GET", USAGE_STREAM_PATH)
+    return conn, conn.getresponse()
+
+
+class TestUsageRollup:
+    def test_snapshot_from_usage_aggregate(self, telemetry):
+        _record_tokens(telemetry, "claude-code", "opus", 100, 20, 0.5)
+        _record_tokens(telemetry, "claude-code", "haiku", 10, 2, 0.01)
+        _record_tokens(telemetry, "claude-code", "haiku", 0, 0, 0.0)
+        telemetry.usage.add_cost("browser", "claude.ai", 0.25)
+        telemetry.set_running_apps({"ChatGPT": {}})
+        telemetry.set_running_cli({"claude-code": {}})
+        telemetry.set_running_wsl({"ollama": {}})
+
+        snapshot = UsageRollup(telemetry).snapshot()
+
+        assert snapshot["totals"] == {
+            "input_tokens": 110,
+            "output_tokens": 22,
+            "cost_usd": 0.76,
+            "prompts": 3,
+        }
+        assert snapshot["cost_usd"] == {"tokens": 0.51, "apps": 0.0, "browser": 0.25, "cli": 0.0}
+        assert snapshot["models"]["claude-code"]["opus"] == {
+            "input_tokens": 100,
+            "output_tokens": 20,
+            "cost_usd": 0.5,
+            "prompts": 1,
+        }
+        assert snapshot["running"] == {"apps": ["ChatGPT"], "cli": ["claude-code", "ollama"]}
+
+    def test_snapshot_matches_usage_query(self, telemetry):
+        # Usage warmed from the database counts as much as usage since startup
+        telemetry.usage.add_tokens("claude-code", "opus", "cli", 7, 1, 0.07, prompts=4)
+        _record_tokens(telemetry, "chatgpt", "gpt-4o", 3, 3, 0.03)
+        snapshot = UsageRollup(telemetry).snapshot()
+        status, body = usage_query(telemetry, "/api/usage", "window=today")
+        assert status == 200
+        assert (snapshot["since"], snapshot["totals"]) == (body["since"], body["totals"])
+
+    def test_delta_keeps_only_changes(self):
+        old = {"totals": {"tokens": 5, "cost": 0.1}, "running": {"cli": ["a"]}, "models": {}}
+        new = {
+            "totals": {"tokens": 8, "cost": 0.1},
+            "running": {"cli": ["a", "b"]},
+            "models": {"t": {"m": {"tokens": 3}}},
+        }
+        assert usage_delta(old, new) == {
+            "totals": {"tokens": 3},
+            "running": {"cli": ["a", "b"]},
+            "models": {"t": {"m": {"tokens": 3}}},
+        }
+        assert usage_delta(new, new) == {}
+
+
+class TestUsageFeed:
+    def test_one_snapshot_per_interval(self):
+        rollup = Mock()
+        rollup.snapshot.return_value = {"n": 0}
+        feed = UsageFeed(rollup, interval=60)
+        for _ in range(100):
+            feed.poll()
+        assert rollup.snapshot.call_count == 1
+
+    def test_new_window_sent_as_snapshot(self):
+        rollup = Mock()
+        feed = UsageFeed(rollup, interval=0)
+        rollup.snapshot.return_value = {"since": 0, "totals": {"cost_usd": 5.0}}
+        seq, snapshot, _ = feed.opening()
+        rollup.snapshot.return_value = {"since": 86400, "totals": {"cost_usd": 0.5}}
+        feed.poll()
+        _, _, message = feed.update(seq, snapshot)
+        assert message.startswith(b"id: 2\nevent: snapshot\n")
+        assert b'"cost_usd":0.5' in message
+
+    def test_lagging_subscriber_gets_one_coalesced_delta(self):
+        rollup = Mock()
+        feed = UsageFeed(rollup, interval=0)
+        rollup.snapshot.return_value = {"n": 0, "running": []}
+        seq, snapshot, _ = feed.opening()
+        for n in (1, 3, 7):
+            rollup.snapshot.return_value = {"n": n, "running": ["x"]}
+            feed.poll()
+
+        up_to_date = feed.update(feed.seq, rollup.snapshot.return_value)
+        assert up_to_date[2] is None
+        # One behind: the event shared by every subscriber
+        assert feed.update(feed.seq - 1, {"n": 3, "running": ["x"]})[2] is feed._state[2]
+
+        seq, snapshot, message = feed.update(seq, snapshot)
+        assert seq == 4
+        assert snapshot == {"n": 7, "running": ["x"]}
+        assert b"event: usage" in message
+        assert b'data: {"n":7,"running":["x"]}' in message
+
+
+class TestUsageStream:
+    def test_snapshot_then_deltas(self, receiver, telemetry):
+        conn, resp = _subscribe(receiver.port)
+        assert resp.status == 200
+        assert resp.getheader("Content-Type") == "text/event-stream"
+        event, data = _read_event(resp.fp)
+        assert event == "snapshot"
+        assert data["totals"]["input_tokens"] == 0
+
+        _record_tokens(telemetry, "claude-code", "opus", 40, 4, 0.2)
+        telemetry.set_running_cli({"claude-code": {}})
+        state = _follow(resp.fp, data, lambda s: s["running"]["cli"] and s["totals"]["cost_usd"])
+        assert state["totals"] == {
+            "input_tokens": 40,
+            "output_tokens": 4,
+            "cost_usd": 0.2,
+            "prompts": 1,
+        }
+        assert state["models"] == {
+            "claude-code": {
+                "opus": {"input_tokens": 40, "output_tokens": 4, "cost_usd": 0.2, "prompts": 1}
+            }
+        }
+        assert state["running"] == {"apps": [], "cli": ["claude-code"]}
+        conn.close()
+
+    def test_subscribers_share_one_poll(self, receiver, telemetry, feed):
+        feed.rollup.snapshot = Mock(wraps=feed.rollup.snapshot)
+        streams = [_subscribe(receiver.port) for _ in range(20)]
+        states = []
+        for _, resp in streams:
+            event, data = _read_event(resp.fp)
+            assert event == "snapshot"
+            states.append(data)
+        start, calls = time.monotonic(), feed.rollup.snapshot.call_count
+
+        _record_tokens(telemetry, "t", "m", 1, 1, 0.01)
+        for (_, resp), state in zip(streams, states):
+            _follow(resp.fp, state, lambda s: s["totals"]["cost_usd"])
+            assert state["models"] == {
+                "t": {"m": {"input_tokens": 1, "output_tokens": 1, "cost_usd": 0.01, "prompts": 1}}
+            }
+        # Polling cost follows the clock, not the number of subscribers
+        ticks = (time.monotonic() - start) / feed.interval
+        assert feed.rollup.snapshot.call_count - calls <= ticks + 2
+        for conn, _ in streams:
+            conn.close()
+
+    def test_polling_stops_without_subscribers(self, receiver, feed):
+        conn, resp = _subscribe(receiver.port)
+        _read_event(resp.fp)
+        resp.close()
+        conn.close()
+        deadline = time.monotonic() + 5
+        while receiver._usage_task is not None:
+            assert time.monotonic() < deadline, "polling did not stop"
+            time.sleep(0.01)
+
+    def test_stop_closes_open_streams(self, telemetry, feed):
+        receiver = AsyncReceiver(IngestHandler(AppConfig(), telemetry), port=0, usage=feed)
+        receiver.start()
+        conn, resp = _subscribe(receiver.port)
+        _read_event(resp.fp)
+        stopper = threading.Thread(target=receiver.stop)
+        stopper.start()
+        stopper.join(5)
+        assert not stopper.is_alive()
+        assert resp.fp.read() == b""
+        conn.close()
+
+    def test_not_served_without_feed(self):
+        receiver = AsyncReceiver(IngestHandler(AppConfig(), Mock()), port=0)
+        receiver.start()
+        try:
+            conn, resp = _subscribe(receiver.port)
+            assert resp.status == 404
+            conn.close()
+        finally:
+            receiver.stop()
+
+    def test_flask_app_serves_stream(self, telemetry, feed):
+        client = create_app(AppConfig(), telemetry, usage=feed).test_client()
+        resp = client.get(USAGE_STREAM_PATH, buffered=False)
+        assert resp.status_code == 200
+        assert resp.mimetype == "text/event-stream"
+        first = next(resp.response)
+        assert b"event: snapshot" in first
+        _record_tokens(telemetry, "t", "m", 2, 0, 0.0)
+        assert b'"input_tokens":2' in next(resp.response)
+        resp.close()